@@ -0,0 +1,423 @@
+""" Host side alarm engine of the BMS HV. Limit and rate of change rules are evaluated on every decoded frame, vectorized over all cells, with hysteresis and debounce. The alarm monitor runs the engines of all packs on its own thread, the readers hand every frame over as soon as they decoded it, so the rules never wait for the rendering nor slow it down
+
+Rules file (YAML):
+    - name: Cell Under Voltage
+      signal: cell_voltage      # see SIGNALS
+      below: 3.0                # or above
+      clear: 3.1                # hysteresis, the alarm clears once the value is back past it
+      set_delay: 0.5            # debounce in seconds, the limit has to be exceeded this long
+      clear_delay: 2.0
+      rate: false               # true limits the change of the signal per second
+      severity: error           # or warning
+"""
+import queue
+import threading
+import time
+import numpy as np
+from console import print_ok, print_error, print_warning
+from formatting import describe_channels, float_to_string_with_precision
+from pack_geometry import DEFAULT_PACK_GEOMETRY
+
+SEVERITY_WARNING = "warning"
+SEVERITY_ERROR = "error"
+SEVERITIES = (SEVERITY_WARNING, SEVERITY_ERROR)
+
+# the change of a signal is measured over at least this long, single frames are too noisy
+RATE_WINDOW_SEC = 1.0
+
+ALARM_QUEUE_SIZE = 256
+ALARM_POLL_SEC = 0.1
+
+ALARM_PRECISION = 3
+
+# signal -> values of a decoded frame and the pack geometry, pack level signals have one value
+SIGNALS = {
+    "current": lambda data, geometry: np.array([data.current], dtype=np.float64),
+    "acc_voltage": lambda data, geometry: np.array(
+        [data.acc_voltage], dtype=np.float64
+    ),
+    "car_voltage": lambda data, geometry: np.array(
+        [data.car_voltage], dtype=np.float64
+    ),
+    "soc": lambda data, geometry: np.asarray(data.soc, dtype=np.float64),
+    # unused channels are NaN, they never pass a limit
+    "cell_voltage": lambda data, geometry: geometry.cells.for_size(
+        data.cell_voltage.size
+    ).masked(data.cell_voltage),
+    "temperature": lambda data, geometry: geometry.temperatures.for_size(
+        data.temperature.size
+    ).masked(data.temperature),
+    # fmax and fmin skip NaN like the zone maps of the session queries
+    "cell_spread": lambda data, geometry: spread(
+        geometry.cells.for_size(data.cell_voltage.size).used_values(data.cell_voltage)
+    ),
+    "temperature_spread": lambda data, geometry: spread(
+        geometry.temperatures.for_size(data.temperature.size).used_values(
+            data.temperature
+        )
+    ),
+}
+
+
+def spread(values):
+    """Returns the difference of the highest and the lowest value as a pack level signal"""
+    return np.array([np.fmax.reduce(values) - np.fmin.reduce(values)], dtype=np.float64)
+
+
+class AlarmRule:
+    """A limit on a signal or on its change per second. It is raised for every channel that is above or below the limit for set_delay seconds and cleared once the channel is back past the clear level for clear_delay seconds"""
+
+    def __init__(
+        self,
+        name,
+        signal,
+        above=None,
+        below=None,
+        clear=None,
+        set_delay=0.0,
+        clear_delay=0.0,
+        rate=False,
+        severity=SEVERITY_WARNING,
+    ):
+        if signal not in SIGNALS:
+            raise ValueError(f"Alarm {name}: unknown signal {signal}")
+        if (above is None) == (below is None):
+            raise ValueError(f"Alarm {name}: expected either above or below")
+        if severity not in SEVERITIES:
+            raise ValueError(f"Alarm {name}: unknown severity {severity}")
+        self.name = name
+        self.signal = signal
+        self.above = above is not None
+        self.limit = float(above if self.above else below)
+        self.clear = self.limit if clear is None else float(clear)
+        if self.clear > self.limit if self.above else self.clear < self.limit:
+            raise ValueError(f"Alarm {name}: clear level is beyond the limit")
+        self.set_delay = float(set_delay)
+        self.clear_delay = float(clear_delay)
+        self.rate = bool(rate)
+        self.severity = severity
+
+
+DEFAULT_RULES = (
+    AlarmRule(
+        "Cell Under Voltage",
+        "cell_voltage",
+        below=3.0,
+        clear=3.1,
+        set_delay=0.5,
+        clear_delay=2.0,
+        severity=SEVERITY_ERROR,
+    ),
+    AlarmRule(
+        "Cell Over Voltage",
+        "cell_voltage",
+        above=4.2,
+        clear=4.15,
+        set_delay=0.5,
+        clear_delay=2.0,
+        severity=SEVERITY_ERROR,
+    ),
+    AlarmRule(
+        "Cell Over Temperature",
+        "temperature",
+        above=60.0,
+        clear=55.0,
+        set_delay=1.0,
+        clear_delay=5.0,
+        severity=SEVERITY_ERROR,
+    ),
+    AlarmRule(
+        "Cell Imbalance",
+        "cell_spread",
+        above=0.1,
+        clear=0.08,
+        set_delay=5.0,
+        clear_delay=5.0,
+    ),
+    AlarmRule(
+        "Cell Voltage Drop",
+        "cell_voltage",
+        below=-0.5,
+        clear=-0.2,
+        clear_delay=2.0,
+        rate=True,
+    ),
+    AlarmRule(
+        "Temperature Rise",
+        "temperature",
+        above=1.0,
+        clear=0.5,
+        set_delay=2.0,
+        clear_delay=5.0,
+        rate=True,
+    ),
+)
+
+
+class AlarmEvent:
+    """An alarm raised or cleared on some channels of a pack"""
+
+    __slots__ = (
+        "pack",
+        "rule",
+        "time",
+        "raised",
+        "channels",
+        "values",
+        "channel_count",
+    )
+
+    def __init__(self, pack, rule, time, raised, channels, values, channel_count):
+        self.pack = pack
+        self.rule = rule
+        self.time = time
+        self.raised = raised
+        self.channels = channels
+        self.values = values
+        self.channel_count = channel_count
+
+
+class RuleState:
+    """Per channel state of one rule, every array has one entry per channel of the signal"""
+
+    def __init__(self):
+        self.active = None
+        # time since which a channel exceeds the limit or is back past the clear level, inf if it does not
+        self.tripped_since = None
+        self.released_since = None
+        self.raised_time = None
+        # nothing is active or pending, the next frame only has to be compared with the limit
+        self.idle = True
+        # values and time the change of a rate rule is measured from
+        self.reference_values = None
+        self.reference_time = None
+
+    def reset(self, channel_count):
+        """Forgets the state, used when the number of channels changes"""
+        self.active = np.zeros(channel_count, dtype=bool)
+        self.tripped_since = np.full(channel_count, np.inf)
+        self.released_since = np.full(channel_count, np.inf)
+        self.raised_time = np.full(channel_count, np.nan)
+        self.idle = True
+
+    def rate(self, values, now):
+        """Returns the change per second over the last RATE_WINDOW_SEC or None while the window is not full"""
+        if self.reference_values is None or len(self.reference_values) != len(values):
+            self.reference_values = values
+            self.reference_time = now
+            return None
+        elapsed = now - self.reference_time
+        if elapsed < RATE_WINDOW_SEC:
+            return None
+        rate = (values - self.reference_values) / elapsed
+        self.reference_values = values
+        self.reference_time = now
+        return rate
+
+    def update(self, rule, values, now):
+        """Applies the values of a frame, returns (raised channels, cleared channels) as boolean masks or None if nothing changed"""
+        if self.active is None or len(self.active) != len(values):
+            self.reset(len(values))
+        tripped = values > rule.limit if rule.above else values < rule.limit
+        if self.idle and not tripped.any():
+            return None
+
+        released = values <= rule.clear if rule.above else values >= rule.clear
+        self.tripped_since = np.where(tripped, np.fmin(self.tripped_since, now), np.inf)
+        self.released_since = np.where(
+            released, np.fmin(self.released_since, now), np.inf
+        )
+        raised = ~self.active & (now - self.tripped_since >= rule.set_delay)
+        cleared = self.active & (now - self.released_since >= rule.clear_delay)
+        self.active = (self.active | raised) & ~cleared
+        self.raised_time[raised] = now
+        self.idle = not self.active.any() and not tripped.any()
+        if not raised.any() and not cleared.any():
+            return None
+        return raised, cleared
+
+
+class AlarmEngine:
+    """Evaluates the alarm rules on the decoded frames of one pack"""
+
+    def __init__(self, pack=None, rules=None, geometry=DEFAULT_PACK_GEOMETRY):
+        self.pack = pack
+        self.geometry = geometry
+        self.rules = list(DEFAULT_RULES if rules is None else rules)
+        self.states = [RuleState() for _ in self.rules]
+
+    def evaluate(self, bms_hv_data, receive_time):
+        """Evaluates every rule on a decoded frame, returns the alarm events it caused"""
+        events = []
+        signals = {}
+        for rule, state in zip(self.rules, self.states):
+            values = signals.get(rule.signal)
+            if values is None:
+                values = signals[rule.signal] = SIGNALS[rule.signal](
+                    bms_hv_data, self.geometry
+                )
+            if rule.rate:
+                values = state.rate(values, receive_time)
+                if values is None:
+                    continue
+            changes = state.update(rule, values, receive_time)
+            if changes is None:
+                continue
+            for raised, mask in zip((True, False), changes):
+                if mask.any():
+                    channels = np.flatnonzero(mask)
+                    events.append(
+                        AlarmEvent(
+                            self.pack,
+                            rule,
+                            receive_time,
+                            raised,
+                            channels,
+                            values[channels],
+                            len(values),
+                        )
+                    )
+        return events
+
+    def active(self):
+        """Returns [(rule, active channels, channel count, time the oldest was raised)] of the active alarms"""
+        alarms = []
+        for rule, state in zip(self.rules, self.states):
+            if state.active is None or not state.active.any():
+                continue
+            channels = np.flatnonzero(state.active)
+            alarms.append(
+                (
+                    rule,
+                    channels,
+                    len(state.active),
+                    float(state.raised_time[channels].min()),
+                )
+            )
+        return alarms
+
+
+def load_rules(path):
+    """Loads alarm rules from a YAML file with a list of rules, PyYAML is only needed for it"""
+    import yaml
+
+    with open(path, encoding="utf-8") as file:
+        try:
+            entries = yaml.safe_load(file)
+        except yaml.YAMLError as error:
+            raise ValueError(f"{path}: {error}") from error
+    if not isinstance(entries, list):
+        raise ValueError(f"{path} is not a list of alarm rules")
+    rules = []
+    for entry in entries:
+        if not isinstance(entry, dict) or "name" not in entry:
+            raise ValueError(f"{path}: every alarm rule needs a name")
+        try:
+            rules.append(AlarmRule(**entry))
+        except TypeError as error:
+            raise ValueError(f"{path}: alarm {entry['name']}: {error}") from error
+    return rules
+
+
+def log_alarm_event(event, geometry=DEFAULT_PACK_GEOMETRY):
+    """Prints an alarm event, raised errors in red and raised warnings in yellow"""
+    rule = event.rule
+    extreme = event.values.max() if rule.above else event.values.min()
+    where = describe_channels(
+        rule.signal, event.channels, event.channel_count, geometry
+    )
+    message = (
+        f"ALARM: {event.pack + ': ' if event.pack else ''}{rule.name} "
+        f"{'raised' if event.raised else 'cleared'}"
+        f"{' on ' + where if where else ''}, "
+        f"{'rate' if rule.rate else 'value'} "
+        f"{float_to_string_with_precision(extreme, ALARM_PRECISION)}"
+    )
+    if not event.raised:
+        print_ok(message)
+    elif rule.severity == SEVERITY_ERROR:
+        print_error(message)
+    else:
+        print_warning(message)
+
+
+def report_alarm_events(events, metrics=None, geometry=DEFAULT_PACK_GEOMETRY):
+    """Logs alarm events and counts them in the metrics"""
+    for event in events:
+        log_alarm_event(event, geometry)
+        if metrics is not None:
+            metrics.count("alarms_raised" if event.raised else "alarms_cleared")
+
+
+class AlarmMonitor:
+    """Runs the alarm engines of several packs on its own thread. Every decoded frame is handed over without blocking and evaluated there, nothing is decoded twice"""
+
+    def __init__(self, rules=None, geometry=DEFAULT_PACK_GEOMETRY):
+        self.rules = rules
+        self.geometry = geometry
+        # called from the monitor thread after alarms were raised or cleared
+        self.on_change = None
+        self.frames_evaluated = 0
+        self.frames_dropped = 0
+        self.evaluation_errors = 0
+        self._engines = {}
+        self._metrics = {}
+        self._queue = queue.Queue(maxsize=ALARM_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._exit_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def add_pack(self, name, metrics=None):
+        """Adds the alarm engine of a pack, alarms are counted in its metrics"""
+        self._engines[name] = AlarmEngine(name, self.rules, self.geometry)
+        self._metrics[name] = metrics
+
+    def start(self):
+        """Starts the monitor thread"""
+        self._thread.start()
+
+    def stop(self):
+        """Stops the monitor thread, queued frames are dropped"""
+        self._exit_event.set()
+        self._thread.join()
+        if self.frames_dropped:
+            print_warning(f"ALARM: Frames not evaluated: {self.frames_dropped}")
+
+    def submit(self, name, bms_hv_data, receive_time):
+        """Queues a decoded frame of a pack, it never blocks the decoding thread"""
+        try:
+            self._queue.put_nowait((name, bms_hv_data, receive_time))
+        except queue.Full:
+            self.frames_dropped += 1
+
+    def active(self, name):
+        """Returns the active alarms of a pack like AlarmEngine.active"""
+        with self._lock:
+            return self._engines[name].active()
+
+    def _run(self):
+        """Monitor loop"""
+        while not self._exit_event.is_set():
+            try:
+                name, bms_hv_data, receive_time = self._queue.get(
+                    timeout=ALARM_POLL_SEC
+                )
+            except queue.Empty:
+                continue
+            try:
+                with self._lock:
+                    events = self._engines[name].evaluate(bms_hv_data, receive_time)
+            # a rule failing on one frame must not stop the alarms of every pack
+            except Exception as error:
+                self.evaluation_errors += 1
+                print_error(f"ALARM: {name}: Failed to evaluate a frame: {error!r}")
+                continue
+            self.frames_evaluated += 1
+            metrics = self._metrics[name]
+            if metrics is not None:
+                metrics.observe("alarm", time.time() - receive_time)
+            if not events:
+                continue
+            report_alarm_events(events, metrics, self.geometry)
+            if self.on_change is not None:
+                self.on_change()
@@ -0,0 +1,253 @@
+""" Tests of the alarm rules, their hysteresis and debounce"""
+import threading
+import time
+import numpy as np
+import pytest
+from alarms import AlarmEngine, AlarmMonitor, AlarmRule, RATE_WINDOW_SEC, load_rules
+from gui_render import RenderThrottle
+from main import decode_on_reader, receive_frames
+from mock_bms_hv.mock_bms import MockBms, encode_json_frame
+from pack_geometry import PackGeometry
+from packs import Pack
+
+UNDER_VOLTAGE = AlarmRule(
+    "Cell Under Voltage",
+    "cell_voltage",
+    below=3.0,
+    clear=3.1,
+    set_delay=0.5,
+    clear_delay=2.0,
+)
+
+
+def frame(cell_voltage=3.6, **cells):
+    """Returns a mock frame with all cells at cell_voltage, cells maps a channel to its voltage"""
+    data = MockBms(seed=0).data()
+    data.cell_voltage = np.full(data.cell_voltage.size, cell_voltage, np.float32)
+    for channel, voltage in cells.items():
+        data.cell_voltage[int(channel[1:])] = voltage
+    return data
+
+
+def run(engine, frames):
+    """Evaluates (time, frame) pairs, returns [(time, raised, channels)] of the events"""
+    return [
+        (now, event.raised, event.channels.tolist())
+        for now, data in frames
+        for event in engine.evaluate(data, now)
+    ]
+
+
+def test_debounce_and_hysteresis():
+    engine = AlarmEngine("Pack", [UNDER_VOLTAGE])
+    low = frame(c3=2.9)
+    recovering = frame(c3=3.05)
+    recovered = frame(c3=3.2)
+    events = run(
+        engine,
+        [
+            (0.0, low),
+            # shorter than set_delay
+            (0.4, low),
+            (0.5, low),
+            (1.0, recovering),
+            # back past the limit but not past the clear level, it stays active
+            (5.0, recovering),
+            (6.0, recovered),
+            (7.9, recovered),
+            (8.0, recovered),
+        ],
+    )
+    assert events == [(0.5, True, [3]), (8.0, False, [3])]
+    assert engine.active() == []
+
+
+def test_short_dips_do_not_raise():
+    engine = AlarmEngine("Pack", [UNDER_VOLTAGE])
+    frames = []
+    for i in range(20):
+        frames.append((i * 0.3, frame(c0=2.9) if i % 2 == 0 else frame()))
+    assert run(engine, frames) == []
+
+
+def test_short_recoveries_do_not_clear():
+    engine = AlarmEngine("Pack", [UNDER_VOLTAGE])
+    frames = [(0.0, frame(c0=2.9)), (1.0, frame(c0=2.9))]
+    for i in range(10):
+        frames.append((2.0 + i, frame(c0=3.2) if i % 2 == 0 else frame(c0=2.95)))
+    assert run(engine, frames) == [(1.0, True, [0])]
+    ((rule, channels, channel_count, raised_time),) = engine.active()
+    assert rule is UNDER_VOLTAGE
+    assert channels.tolist() == [0]
+    assert channel_count == 135
+    assert raised_time == 1.0
+
+
+def test_channels_are_independent():
+    engine = AlarmEngine("Pack", [UNDER_VOLTAGE])
+    events = run(
+        engine,
+        [
+            (0.0, frame(c1=2.9)),
+            (0.3, frame(c1=2.9, c2=2.8)),
+            (0.5, frame(c1=2.9, c2=2.8)),
+            (0.8, frame(c1=2.9, c2=2.8)),
+            (1.0, frame(c2=2.8)),
+            (3.0, frame(c2=2.8)),
+        ],
+    )
+    assert events == [(0.5, True, [1]), (0.8, True, [2]), (3.0, False, [1])]
+    assert engine.active()[0][1].tolist() == [2]
+
+
+def test_above_limit_without_delays():
+    rule = AlarmRule("Cell Over Voltage", "cell_voltage", above=4.2)
+    engine = AlarmEngine("Pack", [rule])
+    events = run(
+        engine,
+        [(0.0, frame(c5=4.3)), (0.1, frame(c5=4.2)), (0.2, frame(c5=4.25))],
+    )
+    assert events == [(0.0, True, [5]), (0.1, False, [5]), (0.2, True, [5])]
+
+
+def test_unused_channels_never_raise():
+    geometry = PackGeometry(unused_cells=[[14, 8]])
+    engine = AlarmEngine("Pack", [UNDER_VOLTAGE], geometry)
+    events = run(
+        engine,
+        [
+            (0.0, frame(c134=0.0)),
+            (1.0, frame(c134=0.0, c0=2.0)),
+            (1.5, frame(c134=0.0, c0=2.0)),
+        ],
+    )
+    assert events == [(1.5, True, [0])]
+
+
+def test_spread():
+    rule = AlarmRule("Cell Imbalance", "cell_spread", above=0.1, clear=0.08)
+    geometry = PackGeometry(unused_cells=[[14, 8]])
+    engine = AlarmEngine("Pack", [rule], geometry)
+    # the unused channel is not part of the spread
+    events = run(
+        engine,
+        [(0.0, frame(c134=0.0)), (1.0, frame(c0=3.75)), (2.0, frame(c0=3.65))],
+    )
+    assert events == [(1.0, True, [0]), (2.0, False, [0])]
+
+
+def test_rate():
+    rule = AlarmRule(
+        "Cell Voltage Drop", "cell_voltage", below=-0.5, clear=-0.2, rate=True
+    )
+    engine = AlarmEngine("Pack", [rule])
+    step = RATE_WINDOW_SEC / 2
+    events = run(
+        engine,
+        [
+            (0.0, frame()),
+            (step, frame(c7=3.0)),
+            # 0.6 V in one window
+            (2 * step, frame(c7=3.0)),
+            (3 * step, frame(c7=3.0)),
+            (4 * step, frame(c7=3.0)),
+        ],
+    )
+    assert events == [(2 * step, True, [7]), (4 * step, False, [7])]
+
+
+def test_channel_count_change_resets_the_state():
+    engine = AlarmEngine("Pack", [UNDER_VOLTAGE])
+    small = frame(c0=2.9)
+    small.cell_voltage = small.cell_voltage[:20]
+    events = run(engine, [(0.0, frame(c0=2.9)), (1.0, frame(c0=2.9)), (2.0, small)])
+    assert events == [(1.0, True, [0])]
+    assert engine.active() == []
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        {"signal": "unknown", "below": 1.0},
+        {"signal": "current"},
+        {"signal": "current", "below": 1.0, "above": 2.0},
+        {"signal": "current", "below": 1.0, "clear": 0.5},
+        {"signal": "current", "above": 1.0, "clear": 1.5},
+        {"signal": "current", "below": 1.0, "severity": "fatal"},
+    ],
+)
+def test_invalid_rules(arguments):
+    with pytest.raises(ValueError):
+        AlarmRule("Rule", **arguments)
+
+
+def test_load_rules(tmp_path):
+    path = tmp_path / "alarms.yaml"
+    path.write_text(
+        "- name: Over Current\n"
+        "  signal: current\n"
+        "  above: 150\n"
+        "  clear: 140\n"
+        "  set_delay: 0.2\n"
+        "  severity: error\n"
+    )
+    (rule,) = load_rules(path)
+    assert (rule.name, rule.signal, rule.above) == ("Over Current", "current", True)
+    assert (rule.limit, rule.clear, rule.set_delay) == (150.0, 140.0, 0.2)
+
+    for text in ("name: x", "- signal: current", "- name: x\n  unknown: 1", "- ["):
+        path.write_text(text)
+        with pytest.raises(ValueError):
+            load_rules(path)
+
+
+def test_monitor_survives_a_frame_that_fails_to_evaluate():
+    monitor = AlarmMonitor([AlarmRule("Low", "cell_voltage", below=3.0)])
+    monitor.add_pack("Pack")
+    changed = threading.Event()
+    monitor.on_change = changed.set
+    monitor.start()
+    broken = frame()
+    broken.cell_voltage = None
+    monitor.submit("Pack", broken, 0.0)
+    monitor.submit("Pack", frame(c3=2.9), 1.0)
+    try:
+        assert changed.wait(5.0)
+    finally:
+        monitor.stop()
+    assert monitor.evaluation_errors == 1
+    assert monitor.frames_evaluated == 1
+    assert [channels.tolist() for _, channels, _, _ in monitor.active("Pack")] == [[3]]
+
+
+def test_alarms_fire_while_the_render_throttle_blocks_drains():
+    monitor = AlarmMonitor([AlarmRule("Low", "cell_voltage", below=3.0)])
+    pack = Pack.for_port("Pack", latest_only=True)
+    monitor.add_pack(pack.name, pack.metrics)
+    decode_on_reader(pack, monitor)
+    changed = threading.Event()
+    monitor.on_change = changed.set
+    throttle = RenderThrottle(0.01)
+    throttle.rendered()
+    monitor.start()
+    try:
+        # the low cell is only in a frame that latest_only drops before the GUI sees it
+        pack.reader.feed(
+            encode_json_frame(frame(c7=2.9)) + encode_json_frame(frame()), 1.0
+        )
+        assert changed.wait(5.0)
+        deadline = time.monotonic() + 5.0
+        while monitor.frames_evaluated < 2 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert not throttle.ready()
+    finally:
+        monitor.stop()
+    # raised by the dropped frame and cleared by the newest one
+    assert pack.metrics.counters["alarms_raised"] == 1
+    assert monitor.frames_evaluated == 2
+    assert pack.reader.frames_dropped == 1
+    assert pack.metrics.counters["frames_decoded"] == 2
+    # the GUI takes the decoded frame without decoding it again
+    newest = receive_frames(pack.reader, pack.metrics, pack.history, None)
+    assert newest[0].cell_voltage.min() == pytest.approx(3.6)
+    assert pack.metrics.counters["frames_decoded"] == 2
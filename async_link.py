@@ -0,0 +1,240 @@
+""" Asyncio core of the serial link. One event loop thread serves any number of ports and auxiliary streams, reads are driven by the loop, keep alive and reconnects are timers and a link stops as soon as it is cancelled"""
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import time
+import serial
+from console import print_ok, print_error, print_warning
+from serial_link import (
+    SERIAL_DATA_IN_FREQ_SEC,
+    SERIAL_READ_POLL_SEC,
+    LINK_ERRORS,
+    ReconnectBackoff,
+)
+from transport import PortRediscovery, open_transport
+
+NO_DATA_WARNING_SEC = SERIAL_DATA_IN_FREQ_SEC + 0.2
+STOP_TIMEOUT_SEC = 2.0
+
+
+def read_available(ser):
+    """Reads what is waiting on the port without blocking"""
+    waiting = ser.in_waiting
+    return ser.read(waiting) if waiting else b""
+
+
+async def wait_readable(ser):
+    """Waits until the port has data, transports without a file descriptor are polled"""
+    loop = asyncio.get_running_loop()
+    try:
+        fileno = ser.fileno()
+        future = loop.create_future()
+        loop.add_reader(fileno, lambda: future.done() or future.set_result(None))
+    # no descriptor, or an event loop without add_reader like the Windows proactor
+    except (AttributeError, NotImplementedError, OSError, serial.SerialException):
+        await asyncio.sleep(SERIAL_READ_POLL_SEC)
+        return
+    try:
+        await future
+    finally:
+        loop.remove_reader(fileno)
+
+
+async def read_link(ser, reader, prefix):
+    """Delivers frames from the port to the reader until the port fails"""
+    read_prefix = f"{prefix}READ: "
+    while True:
+        data = read_available(ser)
+        if data:
+            if reader.feed(data, time.time()):
+                print_ok(f"{read_prefix} New data received from the serial port")
+            continue
+        try:
+            await asyncio.wait_for(wait_readable(ser), NO_DATA_WARNING_SEC)
+        except asyncio.TimeoutError:
+            print_error(f"{read_prefix} Nothing received from the serial port")
+            continue
+        # readable without data means the other end hung up, read raises then
+        if not ser.in_waiting:
+            data = ser.read(1)
+            if data:
+                reader.feed(data, time.time())
+
+
+async def write_link(ser, write_scheduler, submitted):
+    """Writes submitted commands right away and the keep alive message on a timer until the port fails"""
+    loop = asyncio.get_running_loop()
+    next_keep_alive_time = time.monotonic()
+    while True:
+        timeout = next_keep_alive_time - time.monotonic()
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(submitted.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        submitted.clear()
+
+        # write and flush block until the port took the data, they stay off the loop
+        commands = write_scheduler.take_commands()
+        if commands:
+            try:
+                await loop.run_in_executor(
+                    None, write_scheduler.write_commands, ser, commands
+                )
+            except LINK_ERRORS:
+                write_scheduler.requeue(commands)
+                raise
+        if time.monotonic() >= next_keep_alive_time:
+            await loop.run_in_executor(None, write_scheduler.write_keep_alive, ser)
+            next_keep_alive_time = time.monotonic() + write_scheduler.keep_alive_period
+
+
+async def run_link(port, reader, write_scheduler, connected_event, name=None):
+    """Owns one port: connects with fast retries and backoff, follows a re-enumerated USB adapter, reads and writes concurrently and reconnects when the port fails. Runs until it is cancelled"""
+    prefix = f"{name}: " if name else ""
+    link_prefix = f"{prefix}SERIAL LINK: "
+    loop = asyncio.get_running_loop()
+    submitted = asyncio.Event()
+    write_scheduler.on_submit = lambda: loop.call_soon_threadsafe(submitted.set)
+    backoff = ReconnectBackoff()
+    ser = None
+    connected_before = False
+
+    try:
+        try:
+            rediscovery = PortRediscovery(port)
+        except serial.SerialException as error:
+            print_error(f"{link_prefix} {error}")
+            return
+        while ser is None:
+            try:
+                # the USB port lookup reads sysfs, it stays off the loop. Reads never
+                # block the loop, data is read only after the loop reported it
+                ser = await loop.run_in_executor(
+                    None, functools.partial(open_transport, port, timeout=0)
+                )
+            except ValueError as error:
+                print_error(
+                    f"{link_prefix} Serial port: {port} is not supported: {error}"
+                )
+                return
+            except LINK_ERRORS as error:
+                # an in-process transport can be registered later
+                delay = backoff.next_delay()
+                print_error(f"{link_prefix} {error}, retrying in {delay:.2f} s")
+                await asyncio.sleep(delay)
+
+        while True:
+            try:
+                # connecting a socket blocks for up to its timeout, it stays off the loop
+                await loop.run_in_executor(None, ser.open)
+            except LINK_ERRORS:
+                # the port listing reads sysfs, it stays off the loop
+                if await loop.run_in_executor(None, rediscovery.rediscover, ser):
+                    reader.rediscoveries += 1
+                    print_warning(
+                        f"{link_prefix} Serial port: {port} found at {ser.port}"
+                    )
+                    continue
+                delay = backoff.next_delay()
+                print_error(
+                    f"{link_prefix} Serial port: {port} not available, retrying in {delay:.2f} s"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            connected_event.set()
+            backoff.reset()
+            await loop.run_in_executor(None, rediscovery.remember, ser)
+            if connected_before:
+                reader.reconnects += 1
+            connected_before = True
+            print_ok(f"{link_prefix} Serial port: {port} opened")
+
+            tasks = [
+                asyncio.create_task(read_link(ser, reader, prefix)),
+                asyncio.create_task(write_link(ser, write_scheduler, submitted)),
+            ]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()
+            except LINK_ERRORS:
+                print_error(f"{link_prefix} Serial port: {port} disconnected")
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                connected_event.clear()
+                reader.reset()
+                ser.close()
+            await asyncio.sleep(backoff.next_delay())
+    finally:
+        write_scheduler.on_submit = None
+        connected_event.clear()
+        if ser is not None:
+            ser.close()
+
+
+def report_task_error(future):
+    """Logs the exception a link or task ended with, nobody else retrieves it"""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        print_error(f"ASYNC LINK: Task failed: {error!r}")
+
+
+class AsyncLinkRunner:
+    """Runs the asyncio event loop in a background thread. It is the bridge to the GUI thread: links are added and stopped from there, frames reach the GUI through the reader queue and reader.on_frames"""
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._futures = []
+
+    def start(self):
+        """Starts the event loop thread"""
+        self._thread.start()
+
+    def add_link(self, port, reader, write_scheduler, connected_event, name=None):
+        """Starts serving a port, it can be called from any thread"""
+        return self.add_task(
+            run_link(port, reader, write_scheduler, connected_event, name)
+        )
+
+    def add_task(self, coroutine):
+        """Runs an auxiliary coroutine on the loop, it is cancelled by stop()"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        future.add_done_callback(report_task_error)
+        self._futures.append(future)
+        return future
+
+    def stop(self, timeout=STOP_TIMEOUT_SEC):
+        """Cancels all links and tasks, waits until their ports are closed and stops the loop"""
+        if not self._thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result(
+                timeout
+            )
+        except concurrent.futures.TimeoutError:
+            print_warning("ASYNC LINK: Tasks did not stop in time")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _cancel_all(self):
+        """Cancels every task but this one and waits for them"""
+        tasks = [
+            task for task in asyncio.all_tasks() if task is not asyncio.current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _run(self):
+        """Event loop thread"""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
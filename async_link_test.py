@@ -0,0 +1,145 @@
+""" Tests of the asyncio serial link over the in-process transport"""
+import contextlib
+import io
+import threading
+import time
+import uuid
+import pytest
+import serial
+from async_link import AsyncLinkRunner
+from mock_bms_hv.mock_bms import MockBms
+from serial_reader import StreamingReader, drain_queue
+from serial_writer import KEEP_ALIVE_MESSAGE, WriteScheduler
+from transport import QueueTransport
+
+TIMEOUT_SEC = 5.0
+
+
+class FlakyTransport(QueueTransport):
+    """In-process transport that fails like an unplugged port while failing is set, writes can be made slow"""
+
+    failing = False
+    write_delay = 0.0
+    write_threads = ()
+
+    def open(self):
+        """Opens the transport, fails while the port is gone"""
+        if self.failing:
+            raise serial.SerialException("port gone")
+        super().open()
+
+    @property
+    def in_waiting(self):
+        """Bytes waiting, fails while the port is gone"""
+        if self.failing:
+            raise serial.SerialException("port gone")
+        return super().in_waiting
+
+    def write(self, data):
+        """Writes data after write_delay and records the writing thread"""
+        self.write_threads = [*self.write_threads, threading.current_thread()]
+        time.sleep(self.write_delay)
+        return super().write(data)
+
+
+def wait_for(condition, timeout=TIMEOUT_SEC):
+    """Waits until condition() is true, fails the test after timeout"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("condition not met in time")
+        time.sleep(0.005)
+
+
+def received_messages(device):
+    """Returns the messages the device end got, keep alive messages left out"""
+    data = b""
+    while device.in_waiting:
+        data += device.read(device.in_waiting)
+    return data.decode("utf-8").replace(KEEP_ALIVE_MESSAGE, "")
+
+
+@pytest.fixture
+def link():
+    """A link on a queue transport served by a running AsyncLinkRunner, returns (runner, host, device, reader, scheduler, connected event)"""
+    name = f"test-{uuid.uuid4().hex}"
+    host, device = FlakyTransport.pair(name)
+    device.timeout = 0
+    reader = StreamingReader()
+    scheduler = WriteScheduler()
+    connected_event = threading.Event()
+    runner = AsyncLinkRunner()
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner.start()
+        runner.add_link(f"queue://{name}", reader, scheduler, connected_event)
+        assert connected_event.wait(TIMEOUT_SEC)
+        yield runner, host, device, reader, scheduler, connected_event
+        runner.stop()
+
+
+def mock_frame():
+    """Returns a raw JSON frame of a mock BMS"""
+    mock = MockBms(seed=2)
+    mock.step(0.25)
+    return mock.frame()
+
+
+def test_frames_are_read_and_commands_written(link):
+    _, _, device, reader, scheduler, _ = link
+    frame = mock_frame()
+    device.write(frame)
+    wait_for(lambda: reader.frames_received == 1)
+    assert drain_queue(reader.read_queue)[0].data == frame.rstrip(b"\n")
+    scheduler.submit("!C-ON@")
+    wait_for(lambda: "!C-ON@" in received_messages(device))
+
+
+def test_writes_stay_off_the_event_loop(link):
+    runner, host, device, reader, scheduler, _ = link
+    host.write_delay = 0.3
+    scheduler.submit("!C-ON@")
+    wait_for(lambda: host.write_threads)
+    # the loop keeps reading while the command is written
+    device.write(mock_frame())
+    wait_for(lambda: reader.frames_received == 1, timeout=0.25)
+    assert runner._thread not in host.write_threads
+
+
+def test_link_reconnects_and_keeps_failed_commands(link):
+    _, host, device, reader, scheduler, connected_event = link
+    host.failing = True
+    wait_for(lambda: not connected_event.is_set())
+    scheduler.submit("!B-ON@")
+    host.failing = False
+    wait_for(connected_event.is_set)
+    assert reader.reconnects == 1
+    wait_for(lambda: "!B-ON@" in received_messages(device))
+    device.write(mock_frame())
+    wait_for(lambda: reader.frames_received == 1)
+
+
+def test_link_waits_for_a_transport_registered_later():
+    name = f"test-{uuid.uuid4().hex}"
+    connected_event = threading.Event()
+    runner = AsyncLinkRunner()
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner.start()
+        runner.add_link(
+            f"queue://{name}", StreamingReader(), WriteScheduler(), connected_event
+        )
+        time.sleep(0.1)
+        assert not connected_event.is_set()
+        QueueTransport.pair(name)
+        assert connected_event.wait(TIMEOUT_SEC)
+        runner.stop()
+
+
+def test_stop_cancels_the_link_and_closes_the_port(link):
+    runner, host, _, _, scheduler, connected_event = link
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner.stop()
+    assert not host.is_open
+    assert not connected_event.is_set()
+    assert scheduler.on_submit is None
+    # stopping twice is harmless
+    runner.stop()
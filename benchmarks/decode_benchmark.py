@@ -0,0 +1,140 @@
+""" Micro-benchmark of the frame decoder against the previous json.loads + SimpleNamespace + dataclass path. The delta decoder decodes the same alternating mock frames and reuses the arrays that did not change
+
+Usage: python -m benchmarks.decode_benchmark [iterations]
+"""
+import json
+import sys
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from statistics import median
+from types import SimpleNamespace
+import numpy as np
+from delta_decoder import DeltaDecoder
+from frame_decoder import decode_json_frame
+from pack_geometry import DEFAULT_PACK_GEOMETRY
+
+MOCK_FRAME_PATHS = [
+    "mock_bms_hv/serial_data.txt",
+    "mock_bms_hv/serial_data2.txt",
+]
+
+DEFAULT_ITERATIONS = 2000
+
+# the layout the legacy frames were reshaped by
+CELL_VOLTAGE_TABLE_COLUMNS = 15
+
+
+@dataclass
+class LegacyBmsHvData:
+    """Dataclass for BMS HV data as it was decoded before the frame decoder"""
+
+    current: float
+    acc_voltage: float
+    car_voltage: float
+    soc: list[float]
+    cell_voltage: list[float]
+    temperature: list[float]
+    discharge: list[int]
+    balance: int
+    charging: int
+    under_voltage: list[int]
+    over_voltage: list[int]
+    under_temperature: list[int]
+    over_temperature: list[int]
+    over_current: list[int]
+    current_sensor_disconnected: list[int]
+    timestamp: float
+
+
+def decode_legacy(data):
+    """Decodes a frame the way main() used to"""
+    bms_hv_data = json.loads(data, object_hook=lambda d: SimpleNamespace(**d))
+    return LegacyBmsHvData(**bms_hv_data.__dict__)
+
+
+def consume_legacy(data):
+    """Computes the values main() used to display from list based frames"""
+    matrix = np.reshape(np.array(data.cell_voltage), (CELL_VOLTAGE_TABLE_COLUMNS, -1)).T
+    return (
+        max(data.temperature),
+        np.where(matrix == max(data.cell_voltage)),
+        np.where(matrix == min(data.cell_voltage)),
+        min(data.soc),
+        max(data.soc),
+        sum(data.soc) / len(data.soc),
+        median(data.soc),
+    )
+
+
+def consume_frame_decoder(data):
+    """Computes the same values from array based frames"""
+    cells = DEFAULT_PACK_GEOMETRY.cells
+    return (
+        data.temperature.max(),
+        cells.locate(int(data.cell_voltage.argmax())),
+        cells.locate(int(data.cell_voltage.argmin())),
+        data.soc.min(),
+        data.soc.max(),
+        data.soc.mean(),
+        np.median(data.soc),
+    )
+
+
+def frame_size(decode, frame):
+    """Returns the number of bytes allocated for one decoded frame"""
+    tracemalloc.start()
+    data = decode(frame)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def load_mock_frames():
+    """Loads the raw mock frames"""
+    frames = []
+    for path in MOCK_FRAME_PATHS:
+        with open(path, "rb") as file:
+            frames.append(file.read().strip())
+    return frames
+
+
+def best_time(function, frames, iterations):
+    """Returns the best time of function in microseconds per frame"""
+    seconds = min(
+        timeit.repeat(
+            lambda: [function(frame) for frame in frames], number=iterations, repeat=5
+        )
+    )
+    return seconds / (iterations * len(frames)) * 1e6
+
+
+def run(iterations):
+    """Runs the benchmark and returns {name: (decode us, decode + stats us, frame bytes)}"""
+    frames = load_mock_frames()
+    results = {}
+    for name, decode, consume in [
+        ("legacy", decode_legacy, consume_legacy),
+        ("frame_decoder", decode_json_frame, consume_frame_decoder),
+        ("delta_decoder", DeltaDecoder().decode, consume_frame_decoder),
+    ]:
+        results[name] = (
+            best_time(decode, frames, iterations),
+            best_time(lambda frame: consume(decode(frame)), frames, iterations),
+            frame_size(decode, frames[0]),
+        )
+    return results
+
+
+def main():
+    """Main function"""
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    results = run(iterations)
+    print(f"{'':>14}  {'decode':>12}  {'decode+stats':>12}  {'frame size':>10}")
+    for name, (decode, total, size) in results.items():
+        print(f"{name:>14}  {decode:9.1f} us  {total:9.1f} us  {size:8d} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+""" Fault injection test of the framing layer. Mock BMS frames are corrupted with bit flips, dropped bytes, lost delimiters and truncation, the stream is fed to the StreamingReader in random chunks and every frame is decoded on the reader
+
+Usage: python -m benchmarks.link_fault_benchmark [frames] [fault_rate]
+"""
+import queue
+import random
+import sys
+import time
+from delta_decoder import DeltaDecoder
+from mock_bms_hv.mock_bms import MockBms
+from serial_reader import FRAME_DELIMITER, StreamingReader, drain_queue
+from wire_protocol import FrameError
+
+DEFAULT_FRAMES = 5000
+DEFAULT_FAULT_RATE = 0.05
+MAX_CHUNK_SIZE = 512
+FAULTS = ("bit_flip", "dropped_byte", "lost_delimiter", "truncated")
+
+
+def inject_fault(frame, fault, rng):
+    """Returns the frame with the fault applied"""
+    frame = bytearray(frame)
+    if fault == "bit_flip":
+        frame[rng.randrange(len(frame))] ^= 1 << rng.randrange(8)
+    elif fault == "dropped_byte":
+        del frame[rng.randrange(len(frame))]
+    elif fault == "lost_delimiter":
+        if frame.endswith(FRAME_DELIMITER):
+            del frame[-len(FRAME_DELIMITER) :]
+    else:
+        del frame[rng.randrange(len(frame)) :]
+    return bytes(frame)
+
+
+def run(frame_count, fault_rate, binary=False, seed=0):
+    """Returns {name: value} of the counts and the read time per frame"""
+    rng = random.Random(seed)
+    mock = MockBms(seed=seed, binary=binary)
+    stream = bytearray()
+    intact = set()
+    # every frame as it was sent, a fault can leave a frame unchanged
+    originals = set()
+    faults = 0
+    for _ in range(frame_count):
+        mock.step(0.25)
+        frame = mock.frame()
+        originals.add(frame if binary else frame.strip())
+        if rng.random() < fault_rate:
+            frame = inject_fault(frame, rng.choice(FAULTS), rng)
+            faults += 1
+        else:
+            intact.add(frame if binary else frame.strip())
+        stream += frame
+
+    # the frames are decoded on the reading thread like main.decode_on_reader does it
+    reader = StreamingReader(read_queue=queue.Queue())
+    decoder = DeltaDecoder()
+    counts = {"decode_errors": 0, "handed_through": 0}
+
+    def decode(received):
+        """Decode hook of the reader, counts the frames the splitter decoded already"""
+        counts["handed_through"] += received.bms_hv_data is not None
+        try:
+            return decoder.decode(received.data, received.bms_hv_data)
+        except (FrameError, ValueError, TypeError):
+            counts["decode_errors"] += 1
+            return None
+
+    reader.decode = decode
+    decoded = 0
+    intact_decoded = 0
+    corrupt_decoded = 0
+    read_time = 0.0
+    position = 0
+    while position < len(stream):
+        size = rng.randint(1, MAX_CHUNK_SIZE)
+        start = time.perf_counter()
+        reader.feed(bytes(stream[position : position + size]), time.time())
+        read_time += time.perf_counter() - start
+        position += size
+        for received in drain_queue(reader.read_queue):
+            decoded += 1
+            intact_decoded += received.data in intact
+            corrupt_decoded += received.data not in originals
+
+    return {
+        "sent": frame_count,
+        "faults": faults,
+        "decoded": decoded,
+        "lost": frame_count - faults - intact_decoded,
+        # JSON has no checksum, a frame with a corrupted digit or decimal point is still valid
+        "corrupt_decoded": corrupt_decoded,
+        "rejected": reader.frames_rejected,
+        "resyncs": reader.resyncs,
+        "decode_errors": counts["decode_errors"],
+        "handed_through": counts["handed_through"],
+        # split and decode, every frame is parsed once
+        "read_us": read_time / frame_count * 1e6,
+    }
+
+
+def main():
+    """Main function"""
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FRAMES
+    fault_rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_FAULT_RATE
+    for binary in (False, True):
+        result = run(frame_count, fault_rate, binary)
+        print(f"{'binary' if binary else 'json'}, {fault_rate:.0%} faulty frames:")
+        print(
+            f"  sent {result['sent']}, faulty {result['faults']}, decoded {result['decoded']}, "
+            f"intact frames lost {result['lost']}, corrupt frames decoded {result['corrupt_decoded']}"
+            f"{'' if binary else ' (numbers changed, JSON has no checksum)'}"
+        )
+        print(
+            f"  rejected {result['rejected']}, resyncs {result['resyncs']}, "
+            f"corrupt frames failing decode {result['decode_errors']}, "
+            f"decoded by the splitter {result['handed_through']}, "
+            f"read and decode {result['read_us']:.1f} us/frame"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+""" Load test of the serial link without hardware. The Python mock BMS talks to the real asyncio serial link over an in-process transport
+
+Usage: python -m benchmarks.load_benchmark [rate_hz] [seconds]
+"""
+import contextlib
+import io
+import sys
+import threading
+import time
+from async_link import AsyncLinkRunner
+from mock_bms_hv.mock_bms import MockBms, run_mock
+from serial_reader import StreamingReader, drain_queue
+from serial_writer import WriteScheduler
+from transport import QueueTransport
+from wire_protocol import decode_frame
+
+DEFAULT_RATE_HZ = 400.0
+DEFAULT_DURATION_SEC = 5.0
+TRANSPORT_NAME = "load-test"
+DRAIN_SEC = 0.2
+
+
+def run(rate, duration, binary=False):
+    """Returns (frames sent, frames received, frames decoded, frames dropped, commands seen by the mock)"""
+    _, device = QueueTransport.pair(TRANSPORT_NAME)
+    mock = MockBms(seed=0, binary=binary)
+    reader = StreamingReader()
+    scheduler = WriteScheduler()
+    connected_event = threading.Event()
+    exit_event = threading.Event()
+    sent = []
+
+    mock_thread = threading.Thread(
+        target=lambda: sent.append(run_mock(device, mock, rate, exit_event))
+    )
+    link_runner = AsyncLinkRunner()
+
+    decoded = 0
+    # the link logs every frame, that is not what is measured here
+    with contextlib.redirect_stdout(io.StringIO()):
+        link_runner.start()
+        link_runner.add_link(
+            f"queue://{TRANSPORT_NAME}", reader, scheduler, connected_event
+        )
+        # frames sent before the link is open are discarded when it opens
+        connected_event.wait()
+        mock_thread.start()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for frame in drain_queue(reader.read_queue):
+                decode_frame(frame.data)
+                decoded += 1
+            scheduler.submit("!C-ON@", coalesce_key="charging")
+            time.sleep(0.01)
+        exit_event.set()
+        mock_thread.join()
+        # the link reads the last frames before it is cancelled
+        time.sleep(DRAIN_SEC)
+        link_runner.stop()
+        decoded += len(drain_queue(reader.read_queue))
+
+    return (
+        sent[0],
+        reader.frames_received,
+        decoded,
+        reader.frames_dropped,
+        mock.commands_received,
+    )
+
+
+def main():
+    """Main function"""
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RATE_HZ
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_DURATION_SEC
+    for binary in (False, True):
+        sent, received, decoded, dropped, commands = run(rate, duration, binary)
+        print(
+            f"{'binary' if binary else 'json'} at {rate:.0f} Hz for {duration:.0f} s:"
+        )
+        print(
+            f"  sent {sent}, received {received} ({received / duration:.0f} f/s), decoded {decoded}, dropped {dropped}"
+        )
+        print(f"  commands seen by the mock: {commands}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+""" Multi-pack benchmark. Several Python mock BMS run over in-process transports, all links are served by one event loop thread, which also decodes every frame like in main.py. A main thread does what the GUI loop does per render tick: take the decoded frames of every pack, compute the statistics, format the selected pack and the pack summary. The alarm monitor evaluates every decoded frame as soon as it is read
+
+Usage: python -m benchmarks.multi_pack_benchmark [packs] [rate_hz] [seconds]
+"""
+import contextlib
+import io
+import sys
+import threading
+import time
+import numpy as np
+import main as app
+from alarms import AlarmMonitor
+from async_link import AsyncLinkRunner
+from formatting import error_rows, soc_rows
+from mock_bms_hv.mock_bms import MockBms, run_mock
+from packs import MULTI_PACK_HISTORY_CAPACITY, Pack
+from transport import QueueTransport
+
+DEFAULT_PACKS = 8
+DEFAULT_RATE_HZ = 50.0
+DEFAULT_DURATION_SEC = 5.0
+TICK_SEC = 1 / app.GUI_MAX_RENDER_FPS
+DRAIN_SEC = 0.2
+
+
+def render_tick(packs, selected):
+    """The Python side of one render tick"""
+    for pack in packs:
+        newest = app.receive_frames(
+            pack.reader, pack.metrics, pack.history, None, pack.last_frame
+        )
+        if newest is not None:
+            pack.last_frame = (newest[0], newest[2])
+            pack.last_receive_time = newest[1]
+
+    now = time.time()
+    for pack in packs:
+        data, pack_stats = pack.last_frame or (None, None)
+        age = None if pack.last_receive_time is None else now - pack.last_receive_time
+        app.pack_summary_row(
+            pack.name,
+            pack.connected_event.is_set(),
+            data,
+            pack_stats,
+            age,
+            app.PACK_TABLE_PRECISION,
+        )
+    if selected.last_frame is not None:
+        data, pack_stats = selected.last_frame
+        app.CELL_VOLTAGE_FORMATTER.rows(
+            data.cell_voltage, app.DEFAULT_PACK_GEOMETRY.cells, data.discharge
+        )
+        app.TEMPERATURE_FORMATTER.rows(
+            data.temperature, app.DEFAULT_PACK_GEOMETRY.temperatures
+        )
+        soc_rows(pack_stats, app.SOC_TABLE_COLUMNS, app.FLOAT_PRECISION)
+        error_rows(data)
+
+
+def run(pack_count, rate, duration, binary=False):
+    """Returns (frames sent per pack, frames decoded per pack, render tick durations in seconds, packs, alarm monitor)"""
+    exit_event = threading.Event()
+    packs = []
+    mock_threads = []
+    sent = {}
+    runner = AsyncLinkRunner()
+    runner.start()
+    alarm_monitor = AlarmMonitor()
+    for index in range(pack_count):
+        name = f"multi-pack-{index}"
+        _, device = QueueTransport.pair(name)
+        pack = Pack.for_port(name, history_capacity=MULTI_PACK_HISTORY_CAPACITY)
+        packs.append(pack)
+        alarm_monitor.add_pack(name, pack.metrics)
+        app.decode_on_reader(pack, alarm_monitor)
+        mock = MockBms(seed=index, binary=binary)
+        mock_threads.append(
+            threading.Thread(
+                target=lambda index=index, device=device, mock=mock: sent.__setitem__(
+                    index, run_mock(device, mock, rate, exit_event)
+                )
+            )
+        )
+        runner.add_link(
+            f"queue://{name}",
+            pack.reader,
+            pack.write_scheduler,
+            pack.connected_event,
+            name=name.upper(),
+        )
+
+    ticks = []
+    alarm_monitor.start()
+    try:
+        # frames sent before a link is open are discarded when it opens
+        for pack in packs:
+            pack.connected_event.wait()
+        for thread in mock_threads:
+            thread.start()
+        deadline = time.monotonic() + duration
+        next_tick = time.monotonic()
+        while next_tick < deadline:
+            next_tick += TICK_SEC
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            start = time.perf_counter()
+            render_tick(packs, packs[0])
+            ticks.append(time.perf_counter() - start)
+    finally:
+        exit_event.set()
+        for thread in mock_threads:
+            thread.join()
+        # the links read the last frames before they are cancelled
+        time.sleep(DRAIN_SEC)
+        runner.stop()
+        alarm_monitor.stop()
+    # frames still queued when the mocks stopped, the alarm monitor evaluated them when they were read
+    render_tick(packs, packs[0])
+    decoded = [pack.metrics.counters["frames_decoded"] for pack in packs]
+    return (
+        [sent[index] for index in range(pack_count)],
+        decoded,
+        np.array(ticks),
+        packs,
+        alarm_monitor,
+    )
+
+
+def main():
+    """Main function"""
+    pack_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PACKS
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RATE_HZ
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_DURATION_SEC
+    for binary in (False, True):
+        # the links log every connect, that is not what is measured here
+        with contextlib.redirect_stdout(io.StringIO()):
+            sent, decoded, ticks, packs, alarm_monitor = run(
+                pack_count, rate, duration, binary
+            )
+        p50, p99 = np.percentile(ticks, [50, 99]) * 1000
+        print(
+            f"{'binary' if binary else 'json'}: {pack_count} packs at {rate:.0f} Hz for {duration:.0f} s, "
+            f"sent {sum(sent)}, decoded {sum(decoded)}, "
+            f"slowest pack {min(d / s for d, s in zip(decoded, sent)):.1%} decoded"
+        )
+        print(
+            f"  render tick p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {ticks.max() * 1000:.2f} ms, "
+            f"budget {TICK_SEC * 1000:.0f} ms"
+        )
+        alarm = max(
+            pack.metrics.histograms["alarm"].percentile(99) or 0.0 for pack in packs
+        )
+        print(
+            f"  alarms evaluated on {alarm_monitor.frames_evaluated} frames, "
+            f"{alarm_monitor.frames_dropped} dropped, slowest pack p99 {alarm * 1000:g} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
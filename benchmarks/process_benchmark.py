@@ -0,0 +1,136 @@
+""" Compares the GUI loop responsiveness of the in-process pipeline and of the worker process pipeline at a high frame rate. The mock BMS runs in its own process in both cases, the GUI loop is simulated by a main thread that wakes up every tick and displays the newest frame
+
+Usage: python -m benchmarks.process_benchmark [rate_hz] [seconds]
+"""
+import contextlib
+import io
+import multiprocessing
+import sys
+import threading
+import time
+import numpy as np
+from async_link import AsyncLinkRunner
+from mock_bms_hv.mock_bms import MockBms, run_mock
+from formatting import CachedRowFormatter, soc_rows
+from main import FLOAT_PRECISION, SOC_TABLE_COLUMNS
+from pack_geometry import DEFAULT_PACK_GEOMETRY
+from pack_stats import compute_pack_stats
+from serial_reader import StreamingReader, drain_queue
+from serial_writer import WriteScheduler
+from transport import PtyTransport
+from wire_protocol import decode_frame
+from worker_process import WorkerProcess
+
+DEFAULT_RATE_HZ = 1000.0
+DEFAULT_DURATION_SEC = 5.0
+TICK_SEC = 0.005
+CELL_VOLTAGE_FORMATTER = CachedRowFormatter(FLOAT_PRECISION)
+TEMPERATURE_FORMATTER = CachedRowFormatter(FLOAT_PRECISION)
+
+
+def format_frame(data, pack_stats):
+    """The Python side of rendering a frame, the Tk calls are left out"""
+    CELL_VOLTAGE_FORMATTER.rows(
+        data.cell_voltage, DEFAULT_PACK_GEOMETRY.cells, data.discharge
+    )
+    TEMPERATURE_FORMATTER.rows(data.temperature, DEFAULT_PACK_GEOMETRY.temperatures)
+    soc_rows(pack_stats, SOC_TABLE_COLUMNS, FLOAT_PRECISION)
+
+
+def serve_mock(rate, url_queue, exit_event):
+    """Mock BMS process, the pty path is sent back through url_queue"""
+    transport = PtyTransport()
+    url_queue.put(transport.name)
+    run_mock(transport, MockBms(seed=0), rate, exit_event)
+    transport.close()
+
+
+def in_process_pipeline(url, link_runner):
+    """Returns a function displaying the newest frame like main.py does without the worker"""
+    reader = StreamingReader()
+    scheduler = WriteScheduler()
+    link_runner.start()
+    link_runner.add_link(url, reader, scheduler, threading.Event())
+
+    def newest_frame():
+        data = None
+        for received_frame in drain_queue(reader.read_queue):
+            # frames cut by a full pty buffer are dropped like in main.py
+            try:
+                data = decode_frame(received_frame.data)
+            except (TypeError, ValueError):
+                continue
+        if data is None:
+            return False
+        format_frame(data, compute_pack_stats(data, DEFAULT_PACK_GEOMETRY))
+        return True
+
+    return newest_frame, lambda: reader.frames_received
+
+
+def run(rate, duration, worker):
+    """Returns (tick lateness in seconds as an array, frames displayed, frames received)"""
+    mock_exit_event = multiprocessing.Event()
+    url_queue = multiprocessing.Queue()
+    mock_process = multiprocessing.Process(
+        target=serve_mock, args=(rate, url_queue, mock_exit_event)
+    )
+    mock_process.start()
+    url = url_queue.get()
+
+    link_runner = AsyncLinkRunner()
+    if worker:
+        worker_process = WorkerProcess(url)
+        worker_process.start()
+
+        def newest_frame():
+            latest = worker_process.latest()
+            if latest is None:
+                return False
+            format_frame(latest[0], latest[2])
+            return True
+
+        frames_received = lambda: worker_process.frames_received
+    else:
+        newest_frame, frames_received = in_process_pipeline(url, link_runner)
+
+    lateness = []
+    displayed = 0
+    try:
+        deadline = time.monotonic() + duration
+        next_tick = time.monotonic()
+        while next_tick < deadline:
+            next_tick += TICK_SEC
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            lateness.append(time.monotonic() - next_tick)
+            displayed += newest_frame()
+        received = frames_received()
+    finally:
+        if worker:
+            worker_process.stop()
+        else:
+            link_runner.stop()
+        mock_exit_event.set()
+        mock_process.join()
+    return np.array(lateness), displayed, received
+
+
+def main():
+    """Main function"""
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RATE_HZ
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_DURATION_SEC
+    for worker in (False, True):
+        # the links log every frame, that is not what is measured here
+        with contextlib.redirect_stdout(io.StringIO()):
+            lateness, displayed, received = run(rate, duration, worker)
+        p50, p99 = np.percentile(lateness, [50, 99]) * 1000
+        print(
+            f"{'worker process' if worker else 'in-process':>14}: "
+            f"tick lateness p50 {p50:.2f} ms, p99 {p99:.2f} ms, "
+            f"max {lateness.max() * 1000:.2f} ms, "
+            f"frames received {received}, displayed {displayed}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+""" Measures the session queries on a synthetic multi-hour recording: indexing without and with the index file, and the threshold, holder and per minute queries against a full scan
+
+Usage: python -m benchmarks.query_benchmark [hours] [rate_hz]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from frame_decoder import decode_json_frame
+from session_query import Session
+from session_recorder import FILE_EXTENSION, frame_record_dtype, write_header
+from benchmarks.decode_benchmark import load_mock_frames
+
+DEFAULT_HOURS = 2.0
+DEFAULT_RATE_HZ = 20.0
+CHUNK_RECORDS = 65536
+
+# the cells discharge from 4.1 V to 3.4 V, one cell sags below 3.0 V for a few seconds
+CELL_VOLTAGE_RANGE = (4.1, 3.4)
+SAG_THRESHOLD = 3.0
+SAG_SEC = 5.0
+
+
+def write_session(path, hours, rate):
+    """Writes a synthetic session file, returns the number of records"""
+    dtype = frame_record_dtype(decode_json_frame(load_mock_frames()[0]))
+    count = int(hours * 3600 * rate)
+    start_time = time.time() - hours * 3600
+    sag = count // 3
+    rng = np.random.default_rng(0)
+    with open(path, "wb") as file:
+        write_header(file, dtype)
+        for first in range(0, count, CHUNK_RECORDS):
+            index = np.arange(first, min(first + CHUNK_RECORDS, count))
+            records = np.zeros(len(index), dtype=dtype)
+            records["receive_time"] = start_time + index / rate
+            records["timestamp"] = index / rate * 1000
+            progress = (index / count)[:, None]
+            cells = records["cell_voltage"].shape[1]
+            records["cell_voltage"] = (
+                CELL_VOLTAGE_RANGE[0]
+                + (CELL_VOLTAGE_RANGE[1] - CELL_VOLTAGE_RANGE[0]) * progress
+                + rng.normal(0.0, 0.005, (len(index), cells))
+            )
+            in_sag = (index >= sag) & (index < sag + SAG_SEC * rate)
+            records["cell_voltage"][in_sag, cells // 2] = SAG_THRESHOLD - 0.1
+            records["temperature"] = (
+                25.0
+                + 20.0 * progress
+                + rng.normal(0.0, 0.5, (len(index), records["temperature"].shape[1]))
+            )
+            records["current"] = 80.0 + rng.normal(0.0, 5.0, len(index))
+            file.write(records.tobytes())
+    return count
+
+
+def timed(function):
+    """Returns (result, milliseconds)"""
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    """Main function"""
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_HOURS
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RATE_HZ
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark" + FILE_EXTENSION)
+        count = write_session(path, hours, rate)
+        print(
+            f"session: {hours:.1f} h at {rate:.0f} Hz, {count} records, {os.path.getsize(path) / 2**20:.0f} MB"
+        )
+
+        _, cold = timed(lambda: Session(path))
+        session, warm = timed(lambda: Session(path))
+        print(f"index:   {cold:8.1f} ms built, {warm:8.1f} ms from the index file")
+
+        first_time, _ = session.time_range
+        records = session.indexes[0].records
+        for name, query, scan in [
+            (
+                "under",
+                lambda: session.threshold_intervals("cell_voltage", SAG_THRESHOLD),
+                lambda: np.flatnonzero(
+                    (records["cell_voltage"] < SAG_THRESHOLD).any(axis=1)
+                ),
+            ),
+            (
+                "under 10m",
+                lambda: session.threshold_intervals(
+                    "cell_voltage", 4.09, start=first_time, end=first_time + 600
+                ),
+                None,
+            ),
+            ("holder", lambda: session.holder_durations(), None),
+            (
+                "holder 1h",
+                lambda: session.holder_durations(
+                    start=first_time + 100.5, end=first_time + 3700.5
+                ),
+                None,
+            ),
+            (
+                "buckets",
+                lambda: session.bucket_extremes("temperature", 60.0),
+                lambda: records["temperature"].max(axis=1),
+            ),
+        ]:
+            _, elapsed = timed(query)
+            line = (
+                f"{name:>10}: {elapsed:8.1f} ms, "
+                f"{session.blocks_scanned} of {session.block_count} blocks scanned"
+            )
+            if scan is not None:
+                line += f", full scan {timed(scan)[1]:8.1f} ms"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+""" Measures how many frames per second the session recorder can write
+
+Usage: python -m benchmarks.recorder_benchmark [frames]
+"""
+import os
+import sys
+import tempfile
+import time
+from frame_decoder import decode_json_frame
+from session_recorder import (
+    build_records,
+    frame_record_dtype,
+    open_session,
+    session_files,
+    write_header,
+    FILE_EXTENSION,
+)
+from benchmarks.decode_benchmark import load_mock_frames
+
+DEFAULT_FRAMES = 100000
+BATCH_SIZE = 64
+
+
+def run(frame_count):
+    """Returns (frames per second, record size in bytes, memory-mapped scan time in ms)"""
+    frames = [(decode_json_frame(raw), 0.0) for raw in load_mock_frames()]
+    dtype = frame_record_dtype(frames[0][0])
+    batch = [frames[i % len(frames)] for i in range(BATCH_SIZE)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark" + FILE_EXTENSION)
+        start = time.perf_counter()
+        with open(path, "wb") as file:
+            write_header(file, dtype)
+            for _ in range(frame_count // BATCH_SIZE):
+                file.write(build_records(batch, dtype).tobytes())
+                file.flush()
+        elapsed = time.perf_counter() - start
+
+        records = open_session(session_files(directory)[0])
+        start = time.perf_counter()
+        records["cell_voltage"].min()
+        scan = time.perf_counter() - start
+        del records
+
+    written = frame_count // BATCH_SIZE * BATCH_SIZE
+    return written / elapsed, dtype.itemsize, scan * 1000
+
+
+def main():
+    """Main function"""
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FRAMES
+    rate, size, scan = run(frame_count)
+    print(f"write rate:  {rate:10.0f} frames/s")
+    print(f"record size: {size:10d} B ({size * 100 * 3600 / 2**20:.0f} MB/h at 100 Hz)")
+    print(
+        f"mmap scan:   {scan:10.1f} ms for the min cell voltage of {frame_count} frames"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+""" Measures the Tk updates and the Tk time per frame of full window updates against the diff based render layer
+
+The Tk updates are counted on a stand-in window and need no display. The timing needs PySimpleGUI and a display (for example xvfb-run on a headless machine), it is skipped without them.
+
+Usage: python -m benchmarks.render_benchmark [frames]
+"""
+import sys
+import time
+import main
+from frame_decoder import decode_json_frame
+from gui_render import DiffRenderer
+from mock_bms_hv.mock_bms import MockBms
+from pack_stats import compute_pack_stats
+from benchmarks.decode_benchmark import load_mock_frames
+
+DEFAULT_FRAMES = 300
+
+
+class FullRenderer:
+    """Renderer with the DiffRenderer interface that updates every element on every frame"""
+
+    def __init__(self, window):
+        self.window = window
+
+    def begin_frame(self):
+        """Nothing to measure"""
+
+    def end_frame(self):
+        """Nothing to measure"""
+
+    def update_text(self, key, value):
+        """Updates a text element"""
+        self.window[key].update(value)
+
+    def update_table(self, key, rows):
+        """Updates a whole table"""
+        self.window[key].update(values=rows)
+
+
+class CountingElement:
+    """Stand-in for a Text or Table element, every call that would reach Tk is counted"""
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.Widget = self
+        self.DisplayRowNumbers = True
+        self.StartingRowNumber = 0
+        self.tree_ids = []
+        self.Values = []
+
+    def update(self, value=None, values=None):
+        """Element.update. Table.update resets the tags of, detaches and deletes every row and inserts the new ones, a lower bound of its Tk calls is counted"""
+        if values is None:
+            self.counts["calls"] += 1
+            self.counts["cells"] += 1
+            return
+        self.counts["calls"] += 3 * len(self.tree_ids) + len(values)
+        self.counts["cells"] += sum(len(row) for row in values)
+        self.Values = [list(row) for row in values]
+        self.tree_ids = list(range(len(values)))
+
+    def item(self, iid, values):
+        """Treeview.item of a whole row"""
+        self.counts["calls"] += 1
+        self.counts["cells"] += len(values) - self.DisplayRowNumbers
+
+
+class CountingWindow:
+    """Stand-in for the window, its elements count the Tk calls"""
+
+    def __init__(self):
+        self.counts = {"calls": 0, "cells": 0}
+        self._elements = {}
+
+    def __getitem__(self, key):
+        element = self._elements.get(key)
+        if element is None:
+            element = self._elements[key] = CountingElement(self.counts)
+        return element
+
+
+def file_frames():
+    """Same pattern as mock_bms_hv.sh: one frame followed by the other one twice, with their statistics"""
+    first, second = load_mock_frames()
+    frames = []
+    for raw in [first, second, second]:
+        data = decode_json_frame(raw)
+        frames.append((data, compute_pack_stats(data, main.DEFAULT_PACK_GEOMETRY)))
+    return frames
+
+
+def mock_frames(frame_count):
+    """Frames of the Python mock BMS at its nominal rate, every cell drifts a little"""
+    mock = MockBms(seed=0)
+    frames = []
+    for _ in range(frame_count):
+        mock.step(0.25)
+        data = mock.data()
+        frames.append((data, compute_pack_stats(data, main.DEFAULT_PACK_GEOMETRY)))
+    return frames
+
+
+def count_updates(frames, frame_count):
+    """Returns {name: (Tk calls per frame, cells written per frame)} for both renderers"""
+    results = {}
+    for name, renderer_class in [("full", FullRenderer), ("diff", DiffRenderer)]:
+        window = CountingWindow()
+        renderer = renderer_class(window)
+        for i in range(frame_count):
+            main.render_frame(renderer, *frames[i % len(frames)])
+        results[name] = tuple(
+            window.counts[key] / frame_count for key in ("calls", "cells")
+        )
+    return results
+
+
+def run(frame_count):
+    """Returns {name: milliseconds per frame} for both renderers"""
+    window = main.create_window().finalize()
+    frames = file_frames()
+
+    results = {}
+    for name, renderer in [
+        ("full", FullRenderer(window)),
+        ("diff", DiffRenderer(window)),
+    ]:
+        start = time.perf_counter()
+        for i in range(frame_count):
+            data, pack_stats = frames[i % len(frames)]
+            main.render_frame(renderer, data, pack_stats)
+            # let Tk process the redraws, this is what window.read does between frames
+            window.refresh()
+        results[name] = (time.perf_counter() - start) / frame_count * 1000
+    window.close()
+    return results
+
+
+def main_benchmark():
+    """Main function"""
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FRAMES
+    for pattern, frames in [
+        ("mock files", file_frames()),
+        ("mock bms", mock_frames(frame_count)),
+    ]:
+        counts = count_updates(frames, frame_count)
+        print(f"Tk updates per frame, {pattern}:")
+        for name, (calls, cells) in counts.items():
+            print(f"{name:>6}: {calls:7.1f} calls, {cells:7.1f} cells")
+        print(f"{'gain':>6}: {counts['full'][0] / counts['diff'][0]:7.2f}x calls")
+
+    try:
+        results = run(frame_count)
+    # no PySimpleGUI, no Tk or no display
+    except Exception as error:
+        print(f"Tk time skipped: {error}")
+        return
+    for name, milliseconds in results.items():
+        print(f"{name:>6}: {milliseconds:7.3f} ms/frame")
+    print(f"{'gain':>6}: {results['full'] / results['diff']:7.2f}x")
+
+
+if __name__ == "__main__":
+    main_benchmark()
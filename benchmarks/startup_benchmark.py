@@ -0,0 +1,121 @@
+""" Measures the cold start of the BMS HV Utility: the import cost per module (python -X importtime) and the time from process start to the first displayed frame
+
+The first frame is fed straight into the reader, so only startup is measured and not the BMS HV frame period. Without PySimpleGUI or a display the window is left out and the time until the first frame is formatted is reported.
+
+Usage: python -m benchmarks.startup_benchmark [--runs N] [--top N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_RUNS = 5
+DEFAULT_TOP = 15
+TIME_TO_FIRST_FRAME_TARGET_SEC = 1.0
+
+# runs in a fresh interpreter, it prints the time the first frame was on screen
+FIRST_FRAME_SCRIPT = """
+import time
+import main
+from gui_render import DiffRenderer
+from pack_stats import compute_pack_stats
+from serial_reader import StreamingReader, drain_queue
+from formatting import error_rows
+from benchmarks.decode_benchmark import load_mock_frames
+
+try:
+    window = main.create_window().finalize()
+except Exception:
+    window = None
+
+reader = StreamingReader()
+reader.feed(load_mock_frames()[0] + b"\\n", time.time())
+data = main.decode_frame(drain_queue(reader.read_queue)[0].data)
+pack_stats = compute_pack_stats(data, main.DEFAULT_PACK_GEOMETRY)
+if window is not None:
+    main.render_frame(DiffRenderer(window), data, pack_stats)
+    window.refresh()
+else:
+    main.CELL_VOLTAGE_FORMATTER.rows(
+        data.cell_voltage, main.DEFAULT_PACK_GEOMETRY.cells, data.discharge
+    )
+    main.TEMPERATURE_FORMATTER.rows(data.temperature, main.DEFAULT_PACK_GEOMETRY.temperatures)
+    error_rows(data)
+print(time.time(), window is not None)
+"""
+
+
+def package_directory():
+    """The directory main.py is in"""
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """Returns [(cumulative seconds, self seconds, module)] of importing module in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=package_directory(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        # nested imports are indented by two spaces per level after the separator
+        times.append((int(cumulative_us) / 1e6, int(self_us) / 1e6, name[1:].rstrip()))
+    return times
+
+
+def time_to_first_frame():
+    """Returns (seconds from process start to the first frame, True if it was rendered in a window)"""
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_FRAME_SCRIPT],
+        cwd=package_directory(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    first_frame_time, rendered = result.stdout.split()[-2:]
+    return float(first_frame_time) - start, rendered == "True"
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="BMS HV Utility startup benchmark")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP)
+    args = parser.parse_args()
+
+    times = import_times("main")
+    total = max(cumulative for cumulative, _, _ in times)
+    print(f"import main: {total * 1000:.1f} ms, slowest imports of main:")
+    # the direct imports of main are nested one level deep
+    direct = [
+        entry
+        for entry in times
+        if entry[2].startswith("  ") and not entry[2].startswith("    ")
+    ]
+    for cumulative, _, name in sorted(direct, reverse=True)[: args.top]:
+        print(f"  {cumulative * 1000:8.1f} ms  {name.strip()}")
+
+    results = [time_to_first_frame() for _ in range(args.runs)]
+    rendered = results[0][1]
+    first = results[0][0]
+    best = min(seconds for seconds, _ in results)
+    print(
+        f"time to first {'rendered' if rendered else 'formatted (no display)'} frame: "
+        f"first run {first * 1000:.0f} ms, best of {args.runs} {best * 1000:.0f} ms, "
+        f"target {TIME_TO_FIRST_FRAME_TARGET_SEC * 1000:.0f} ms"
+    )
+    return 0 if first <= TIME_TO_FIRST_FRAME_TARGET_SEC else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+""" End-to-end benchmark suite of the BMS HV Utility pipeline
+
+Stages: read (StreamingReader over the in-process transport), decode, stats,
+format (table strings) and render (DiffRenderer + Tk refresh, only with a display).
+For every stage the per frame latency percentiles are reported, the max
+sustainable frame rate follows from the sum of the mean stage times. The Tk
+calls per frame of the DiffRenderer and of full table updates are counted on a
+stand-in window, that needs no display.
+
+Usage:
+    python -m benchmarks.suite [--frames N] [--binary] [--save results.json] [--baseline results.json]
+
+With --baseline the suite exits with 1 when a stage got slower than the allowed regression.
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from formatting import CachedRowFormatter, soc_rows, error_rows
+from main import FLOAT_PRECISION, SOC_TABLE_COLUMNS
+from mock_bms_hv.mock_bms import MockBms
+from pack_geometry import DEFAULT_PACK_GEOMETRY
+from pack_stats import compute_pack_stats
+from serial_reader import StreamingReader, drain_queue
+from transport import QueueTransport
+from wire_protocol import decode_frame
+from benchmarks.decode_benchmark import load_mock_frames
+
+DEFAULT_FRAMES = 2000
+PERCENTILES = (50, 90, 99)
+ALLOWED_REGRESSION = 0.25
+
+CELL_VOLTAGE_FORMATTER = CachedRowFormatter(FLOAT_PRECISION)
+TEMPERATURE_FORMATTER = CachedRowFormatter(FLOAT_PRECISION)
+
+
+def generate_frames(count, binary):
+    """Returns count raw frames, the mock files followed by varying mock BMS frames"""
+    frames = [frame + b"\n" for frame in load_mock_frames()] if not binary else []
+    mock = MockBms(seed=0, binary=binary)
+    mock.balance = 1
+    while len(frames) < count:
+        mock.step(0.25)
+        frames.append(mock.frame())
+    return frames
+
+
+def timed(function, items):
+    """Runs function on every item, returns (results, latencies in seconds)"""
+    results = []
+    latencies = np.empty(len(items))
+    for i, item in enumerate(items):
+        start = time.perf_counter()
+        results.append(function(item))
+        latencies[i] = time.perf_counter() - start
+    return results, latencies
+
+
+def bench_read(raw_frames):
+    """Time from writing a frame into the transport until the reader delivered it"""
+    host, device = QueueTransport.pair()
+    host.open()
+    host.timeout = 0
+    reader = StreamingReader()
+
+    def read(raw):
+        device.write(raw)
+        while not reader.poll(host):
+            pass
+        return drain_queue(reader.read_queue)[0].data
+
+    return timed(read, raw_frames)
+
+
+def bench_render(decoded, stats):
+    """Time of rendering a frame and letting Tk redraw, None without PySimpleGUI or a display"""
+    try:
+        import main
+        from gui_render import DiffRenderer
+
+        window = main.create_window().finalize()
+    # no PySimpleGUI, no Tk or no display
+    except Exception as error:
+        print(f"render stage skipped: {error}")
+        return None
+
+    renderer = DiffRenderer(window)
+
+    def render(item):
+        main.render_frame(renderer, *item)
+        window.refresh()
+
+    _, latencies = timed(render, list(zip(decoded, stats)))
+    window.close()
+    return latencies
+
+
+def count_render_calls(raw_frames):
+    """Returns {renderer: (Tk calls per frame, cells written per frame)} of the diff and the full renderer"""
+    from benchmarks.render_benchmark import count_updates
+
+    frames = []
+    for raw in raw_frames:
+        data = decode_frame(raw)
+        frames.append((data, compute_pack_stats(data, DEFAULT_PACK_GEOMETRY)))
+    return count_updates(frames, len(frames))
+
+
+def format_frame(item):
+    """Builds all table strings of a frame"""
+    data, pack_stats = item
+    return (
+        CELL_VOLTAGE_FORMATTER.rows(
+            data.cell_voltage, DEFAULT_PACK_GEOMETRY.cells, data.discharge
+        ),
+        TEMPERATURE_FORMATTER.rows(
+            data.temperature, DEFAULT_PACK_GEOMETRY.temperatures
+        ),
+        soc_rows(pack_stats, SOC_TABLE_COLUMNS, FLOAT_PRECISION),
+        error_rows(data),
+    )
+
+
+def run(frame_count, binary=False, render=True):
+    """Runs all stages, returns {stage: {"mean": us, "p50": us, ...}}"""
+    raw_frames = generate_frames(frame_count, binary)
+    stages = {}
+
+    received, stages["read"] = bench_read(raw_frames)
+    decoded, stages["decode"] = timed(decode_frame, received)
+    stats, stages["stats"] = timed(
+        lambda data: compute_pack_stats(data, DEFAULT_PACK_GEOMETRY),
+        decoded,
+    )
+    _, stages["format"] = timed(format_frame, list(zip(decoded, stats)))
+    if render:
+        latencies = bench_render(decoded, stats)
+        if latencies is not None:
+            stages["render"] = latencies
+
+    results = {}
+    for stage, latencies in stages.items():
+        microseconds = latencies * 1e6
+        results[stage] = {"mean": float(microseconds.mean())}
+        for percentile in PERCENTILES:
+            results[stage][f"p{percentile}"] = float(
+                np.percentile(microseconds, percentile)
+            )
+        results[stage]["max"] = float(microseconds.max())
+    return results
+
+
+def max_frame_rate(results):
+    """Max sustainable frames per second when every frame goes through every stage"""
+    return 1e6 / sum(stage["mean"] for stage in results.values())
+
+
+def regressions(results, baseline, allowed=ALLOWED_REGRESSION):
+    """Returns the stages whose mean latency grew more than allowed"""
+    return [
+        stage
+        for stage, values in results.items()
+        if stage in baseline
+        and values["mean"] > baseline[stage]["mean"] * (1 + allowed)
+    ]
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="BMS HV Utility benchmark suite")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument(
+        "--binary", action="store_true", help="use binary wire protocol frames"
+    )
+    parser.add_argument(
+        "--no-render", action="store_true", help="skip the Tk render stage"
+    )
+    parser.add_argument("--save", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with saved results")
+    args = parser.parse_args()
+
+    results = run(args.frames, args.binary, not args.no_render)
+
+    header = "".join(
+        f"{name:>10}" for name in ["mean", *[f"p{p}" for p in PERCENTILES], "max"]
+    )
+    print(f"{'stage':<8}{header}   (us)")
+    for stage, values in results.items():
+        print(f"{stage:<8}" + "".join(f"{value:10.1f}" for value in values.values()))
+    print(f"max sustainable rate: {max_frame_rate(results):.0f} frames/s")
+    if not args.no_render:
+        counts = count_render_calls(generate_frames(args.frames, args.binary))
+        for name, (calls, cells) in counts.items():
+            print(f"{name} render: {calls:.1f} Tk calls, {cells:.1f} cells per frame")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            slower = regressions(results, json.load(file))
+        if slower:
+            print(f"regression in: {', '.join(slower)}")
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+""" Compares the JSON and binary wire protocols: frame size, achievable frame rate at a baud rate and decode time
+
+Usage: python -m benchmarks.wire_protocol_benchmark [baud_rate]
+"""
+import sys
+import timeit
+from frame_decoder import decode_json_frame
+from wire_protocol import decode_frame, encode_binary_frame
+from benchmarks.decode_benchmark import load_mock_frames
+
+DEFAULT_BAUD_RATE = 115200
+
+# 8N1: start bit + 8 data bits + stop bit
+BITS_PER_BYTE = 10
+
+ITERATIONS = 2000
+
+
+def run(baud_rate):
+    """Returns {name: (frame bytes, max frames per second, decode us)} for both protocols"""
+    json_frames = [frame + b"\n" for frame in load_mock_frames()]
+    binary_frames = [encode_binary_frame(decode_json_frame(frame)) for frame in json_frames]
+
+    results = {}
+    for name, frames in [("json", json_frames), ("binary", binary_frames)]:
+        size = sum(len(frame) for frame in frames) / len(frames)
+        seconds = min(
+            timeit.repeat(
+                lambda: [decode_frame(frame) for frame in frames],
+                number=ITERATIONS,
+                repeat=5,
+            )
+        )
+        results[name] = (
+            size,
+            baud_rate / BITS_PER_BYTE / size,
+            seconds / (ITERATIONS * len(frames)) * 1e6,
+        )
+    return results
+
+
+def main():
+    """Main function"""
+    baud_rate = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BAUD_RATE
+    results = run(baud_rate)
+    print(f"baud rate: {baud_rate}")
+    print(f"{'':>8}  {'frame size':>10}  {'max rate':>10}  {'decode':>10}")
+    for name, (size, rate, decode) in results.items():
+        print(f"{name:>8}  {size:8.0f} B  {rate:6.1f} f/s  {decode:7.1f} us")
+    print(f"{'gain':>8}  {results['json'][0] / results['binary'][0]:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+""" pytest configuration, the unit tests are the *_test.py modules next to the code they cover"""
+# a PySimpleGUI bar chart demo, not a test, it opens a window when it is imported
+collect_ignore = ["graph_test.py"]
@@ -0,0 +1,23 @@
+""" Colored console messages used by the BMS HV Utility. colorama is imported with the first message so that importing this module costs nothing at startup"""
+
+
+def print_colored(color, msg):
+    """Prints a message in a colorama foreground color"""
+    from colorama import Fore, Style
+
+    print(f"{getattr(Fore, color)}{msg}{Style.RESET_ALL}")
+
+
+def print_ok(msg):
+    """Prints an ok message"""
+    print_colored("GREEN", msg)
+
+
+def print_error(msg):
+    """Prints an error message"""
+    print_colored("RED", msg)
+
+
+def print_warning(msg):
+    """Prints a warning message"""
+    print_colored("YELLOW", msg)
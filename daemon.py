@@ -0,0 +1,225 @@
+""" Headless BMS HV daemon. It owns the serial port, decodes every frame once and serves the frames to any number of viewers over a telemetry socket
+
+Usage:
+    python daemon.py /dev/ttyUSB0 [--listen localhost:5025] [--unix /run/bms_hv.sock] [--record DIR]
+    python main.py socket://localhost:5025        the GUI attaches as a viewer
+
+Viewers receive binary wire protocol frames and may send the regular BMS HV commands, keep alive messages of viewers are not forwarded because the daemon sends its own.
+"""
+import argparse
+import signal
+import threading
+import time
+from alarms import AlarmEngine, load_rules, report_alarm_events
+from async_link import AsyncLinkRunner
+from pack_geometry import DEFAULT_PACK_GEOMETRY, load_geometry
+from console import print_ok, print_error
+from delta_decoder import DeltaDecoder
+from instrumentation import Metrics
+from serial_link import SERIAL_DATA_IN_FREQ_SEC
+from serial_reader import StreamingReader, drain_queue
+from serial_writer import (
+    WriteScheduler,
+    KEEP_ALIVE_MESSAGE,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+)
+from session_recorder import SessionRecorder
+from telemetry_server import TelemetryServer
+from wire_protocol import encode_binary_frame, is_binary_frame
+
+DEFAULT_LISTEN = "localhost:5025"
+STATUS_INTERVAL_SEC = 10.0
+# stop commands are sent before anything else that is pending
+STOP_COMMAND_VALUE = "OF"
+
+
+def parse_address(value):
+    """Parses host:port"""
+    host, _, port = value.rpartition(":")
+    try:
+        return host or "localhost", int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected host:port, got {value}")
+
+
+def parse_args():
+    """Parses the command line arguments"""
+    parser = argparse.ArgumentParser(description="BMS HV daemon")
+    parser.add_argument(
+        "port", help="serial port of the BMS HV or a transport url to read from"
+    )
+    parser.add_argument(
+        "--listen",
+        type=parse_address,
+        default=parse_address(DEFAULT_LISTEN),
+        metavar="HOST:PORT",
+        help=f"TCP address of the telemetry socket (default: {DEFAULT_LISTEN})",
+    )
+    parser.add_argument(
+        "--unix", metavar="PATH", help="also serve the telemetry on a Unix socket"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="record every received frame to session files in DIR",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="periodically dump the instrumentation to FILE, Prometheus text for *.prom and JSON otherwise",
+    )
+    parser.add_argument(
+        "--alarms",
+        metavar="FILE",
+        help="YAML file with the host alarm rules, see alarms.py (default: the built-in rules)",
+    )
+    parser.add_argument(
+        "--geometry",
+        metavar="FILE",
+        help="YAML file with the pack geometry, see pack_geometry.py (default: 15 LTCs with 9 cells and 3 sensors)",
+    )
+    args = parser.parse_args()
+    args.alarm_rules = None
+    if args.alarms is not None:
+        try:
+            args.alarm_rules = load_rules(args.alarms)
+        except (OSError, ValueError) as error:
+            parser.error(f"failed to load the alarm rules: {error}")
+    args.pack_geometry = DEFAULT_PACK_GEOMETRY
+    if args.geometry is not None:
+        try:
+            args.pack_geometry = load_geometry(args.geometry)
+        except (OSError, ValueError) as error:
+            parser.error(f"failed to load the pack geometry: {error}")
+    return args
+
+
+def submit_viewer_command(write_scheduler, message):
+    """Forwards a command of a viewer to the BMS HV"""
+    if message == KEEP_ALIVE_MESSAGE:
+        return
+    group, value = message[1], message[3:5]
+    priority = PRIORITY_HIGH if value == STOP_COMMAND_VALUE else PRIORITY_NORMAL
+    # "!B-FC@" sets the SoC, it must not replace a pending balance command
+    coalesce_key = message if group == "B" and value == "FC" else group
+    write_scheduler.submit(message, priority, coalesce_key)
+
+
+def encode_for_viewers(received_frame, metrics, decoder):
+    """Decodes a received frame once, returns (decoded frame, binary encoding) or (None, None) if it is invalid"""
+    metrics.observe("queue", time.time() - received_frame.timestamp)
+    try:
+        decode_start = time.perf_counter()
+        bms_hv_data = decoder.decode(received_frame.data)
+        decode_sec = time.perf_counter() - decode_start
+    except (TypeError, ValueError) as error:
+        metrics.count(
+            "binary_errors" if is_binary_frame(received_frame.data) else "json_errors"
+        )
+        print_error(f"DAEMON: Invalid frame: {error}")
+        return None, None
+    metrics.count("frames_decoded")
+    metrics.observe("decode", decode_sec)
+    # binary frames are passed on as they are, they were just validated
+    if is_binary_frame(received_frame.data):
+        return bms_hv_data, received_frame.data
+    return bms_hv_data, encode_binary_frame(bms_hv_data)
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    print_ok("Starting daemon...")
+
+    exit_event = threading.Event()
+    connected_event = threading.Event()
+    frames_ready = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: exit_event.set())
+
+    reader = StreamingReader()
+    reader.on_frames = frames_ready.set
+    write_scheduler = WriteScheduler(keep_alive_period=SERIAL_DATA_IN_FREQ_SEC)
+    metrics = Metrics(reader)
+    # unchanged arrays of the JSON frames are not parsed again
+    decoder = DeltaDecoder()
+    alarm_engine = AlarmEngine(rules=args.alarm_rules, geometry=args.pack_geometry)
+
+    servers = [
+        TelemetryServer(
+            args.listen,
+            on_command=lambda message: submit_viewer_command(write_scheduler, message),
+        )
+    ]
+    if args.unix is not None:
+        servers.append(
+            TelemetryServer(
+                args.unix,
+                on_command=lambda message: submit_viewer_command(
+                    write_scheduler, message
+                ),
+            )
+        )
+    for server in servers:
+        server.start()
+
+    recorder = None
+    if args.record is not None:
+        recorder = SessionRecorder(args.record)
+        recorder.start()
+
+    link_runner = AsyncLinkRunner()
+    link_runner.start()
+    link_runner.add_link(args.port, reader, write_scheduler, connected_event)
+
+    next_status_time = time.monotonic() + STATUS_INTERVAL_SEC
+    try:
+        while not exit_event.is_set():
+            if frames_ready.wait(timeout=1.0):
+                frames_ready.clear()
+                for received_frame in drain_queue(reader.read_queue):
+                    bms_hv_data, frame = encode_for_viewers(
+                        received_frame, metrics, decoder
+                    )
+                    if frame is None:
+                        continue
+                    report_alarm_events(
+                        alarm_engine.evaluate(bms_hv_data, received_frame.timestamp),
+                        metrics,
+                        args.pack_geometry,
+                    )
+                    metrics.observe("alarm", time.time() - received_frame.timestamp)
+                    for server in servers:
+                        server.broadcast(frame)
+                    if recorder is not None:
+                        recorder.record(bms_hv_data, received_frame.timestamp)
+
+            if time.monotonic() >= next_status_time:
+                next_status_time = time.monotonic() + STATUS_INTERVAL_SEC
+                print_ok(
+                    f"DAEMON: Viewers: {sum(server.client_count for server in servers)}, "
+                    f"frames received: {reader.frames_received}, "
+                    f"dropped for viewers: {sum(server.frames_dropped for server in servers)}"
+                )
+                if args.metrics is not None:
+                    try:
+                        metrics.dump(args.metrics)
+                    except OSError as error:
+                        print_error(
+                            f"Failed to write metrics to {args.metrics}: {error}"
+                        )
+    except KeyboardInterrupt:
+        pass
+
+    exit_event.set()
+    link_runner.stop()
+    for server in servers:
+        server.stop()
+    if recorder is not None:
+        recorder.stop()
+    print_ok("Exiting...")
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+""" Tests of the frame and command handling of the daemon"""
+import contextlib
+import io
+import pytest
+from daemon import encode_for_viewers, parse_address, submit_viewer_command
+from delta_decoder import DeltaDecoder
+from instrumentation import Metrics
+from mock_bms_hv.mock_bms import MockBms, encode_json_frame
+from serial_reader import ReceivedFrame
+from serial_writer import KEEP_ALIVE_MESSAGE, PRIORITY_HIGH, WriteScheduler
+from wire_protocol import decode_binary_frame, encode_binary_frame
+
+
+def mock_data():
+    """Returns a frame of a mock BMS"""
+    mock = MockBms(seed=5)
+    mock.step(0.25)
+    return mock.data()
+
+
+def test_viewer_commands_are_coalesced_per_group():
+    scheduler = WriteScheduler()
+    submit_viewer_command(scheduler, "!C-ON@")
+    submit_viewer_command(scheduler, "!B-FC@")
+    submit_viewer_command(scheduler, "!B-ON@")
+    submit_viewer_command(scheduler, KEEP_ALIVE_MESSAGE)
+    submit_viewer_command(scheduler, "!C-OF@")
+    commands = scheduler.take_commands()
+    # the stop command replaces the pending start and goes first, setting the SoC is kept
+    messages = [command.message for command in commands]
+    assert messages == ["!C-OF@", "!B-FC@", "!B-ON@"]
+    assert commands[0].priority == PRIORITY_HIGH
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_frames_are_decoded_once_and_sent_binary(binary):
+    data = mock_data()
+    raw = encode_binary_frame(data) if binary else encode_json_frame(data)
+    metrics = Metrics()
+    decoded, encoded = encode_for_viewers(
+        ReceivedFrame(raw, 0.0), metrics, DeltaDecoder()
+    )
+    if binary:
+        assert encoded is raw
+    assert decode_binary_frame(encoded).cell_voltage.size == decoded.cell_voltage.size
+    assert metrics.counters["frames_decoded"] == 1
+    assert metrics.histograms["decode"].total_count == 1
+
+
+def test_invalid_frames_are_counted():
+    metrics = Metrics()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = encode_for_viewers(
+            ReceivedFrame(b'{"current": 1}', 0.0), metrics, DeltaDecoder()
+        )
+    assert result == (None, None)
+    assert metrics.counters["json_errors"] == 1
+    assert metrics.counters["frames_decoded"] == 0
+
+
+def test_parse_address():
+    assert parse_address("example:5025") == ("example", 5025)
+    assert parse_address(":5025") == ("localhost", 5025)
@@ -0,0 +1,153 @@
+""" Delta aware decoding of BMS HV frames. Consecutive frames are nearly identical, so the raw bytes of every array field are compared with those of the previous frame and an unchanged field reuses the previously decoded array. The fields that changed are reported so that the statistics and the rendering can skip work as well"""
+import json
+from frame_decoder import BmsHvData, check_frame_arrays, decode_json_frame
+from wire_protocol import decode_binary_frame, is_binary_frame
+
+ARRAY_FIELDS = ("soc", "cell_voltage", "temperature", "discharge")
+SCALAR_FIELDS = tuple(name for name in BmsHvData.__slots__ if name not in ARRAY_FIELDS)
+ALL_FIELDS = frozenset(BmsHvData.__slots__)
+
+# the arrays are located in the compact JSON the firmware sends, other spellings are left to the JSON parser
+JSON_ARRAY_KEYS = tuple((name, f'"{name}":[') for name in ARRAY_FIELDS)
+# stands in for a cut out array, the rest of the frame is parsed as usual
+JSON_ARRAY_PLACEHOLDER = "0"
+
+
+def same_array(array, previous):
+    """Checks if two arrays have the same dtype, shape and bytes"""
+    # the arrays are a few hundred bytes, copying them is cheaper than comparing memoryviews
+    return (
+        array.dtype == previous.dtype
+        and array.shape == previous.shape
+        and array.tobytes() == previous.tobytes()
+    )
+
+
+def changed_fields(bms_hv_data, previous):
+    """Returns the fields of a frame that differ from a previous frame of the same decoder, arrays it reused are unchanged. Against no previous frame every field changed"""
+    if previous is None:
+        return ALL_FIELDS
+    changed = {
+        name
+        for name in ARRAY_FIELDS
+        if getattr(bms_hv_data, name) is not getattr(previous, name)
+    }
+    changed.update(
+        name
+        for name in SCALAR_FIELDS
+        if getattr(bms_hv_data, name) != getattr(previous, name)
+    )
+    return frozenset(changed)
+
+
+class DeltaDecoder:
+    """Decodes the frames of one link. Array fields whose raw bytes did not change reuse the arrays of the previous frame, changed_fields holds the fields that differ from the previous frame"""
+
+    def __init__(self):
+        self.previous = None
+        self.changed_fields = ALL_FIELDS
+        self.fields_reused = 0
+        # raw JSON substring of every array field of the previous frame
+        self._raw_arrays = {}
+
+    def decode(self, data, decoded=None):
+        """Decodes a binary or JSON frame like wire_protocol.decode_frame and raises the same errors. decoded is the BmsHvData a JSON frame was already decoded into, it is not parsed again then"""
+        if is_binary_frame(data):
+            bms_hv_data = self._decode_binary(data)
+        elif decoded is not None:
+            bms_hv_data = self._reuse_arrays(data.decode("utf-8"), decoded)
+        elif isinstance(data, bytes):
+            bms_hv_data = self._decode_json(data)
+        else:
+            bms_hv_data = decode_json_frame(data)
+            self._raw_arrays = {}
+
+        self.changed_fields = changed_fields(bms_hv_data, self.previous)
+        self.previous = bms_hv_data
+        return bms_hv_data
+
+    def reset(self):
+        """Forgets the previous frame, the next frame is reported as changed in every field"""
+        self.previous = None
+        self.changed_fields = ALL_FIELDS
+        self._raw_arrays = {}
+
+    def _decode_binary(self, data):
+        """Decodes a binary frame, the arrays are views of the frame so only the comparison is saved"""
+        bms_hv_data = decode_binary_frame(data)
+        self._raw_arrays = {}
+        if self.previous is not None:
+            for name in ARRAY_FIELDS:
+                previous_array = getattr(self.previous, name)
+                if same_array(getattr(bms_hv_data, name), previous_array):
+                    setattr(bms_hv_data, name, previous_array)
+                    self.fields_reused += 1
+        return bms_hv_data
+
+    def _decode_json(self, data):
+        """Decodes a JSON frame, the arrays whose substring did not change are cut out before parsing"""
+        text = data.decode("utf-8")
+        spans = self._array_spans(text)
+        raw_arrays = {name: text[start:end] for start, end, name in spans}
+        reused = []
+        if self.previous is not None:
+            reused = [
+                (start, end, name)
+                for start, end, name in spans
+                if self._raw_arrays.get(name) == raw_arrays[name]
+            ]
+        if not reused:
+            bms_hv_data = decode_json_frame(text)
+            self._raw_arrays = raw_arrays
+            return bms_hv_data
+
+        # one parse of the frame without the unchanged arrays
+        parts = []
+        position = 0
+        for start, end, _ in reused:
+            parts.append(text[position:start])
+            parts.append(JSON_ARRAY_PLACEHOLDER)
+            position = end
+        parts.append(text[position:])
+        fields = json.loads("".join(parts))
+        if not isinstance(fields, dict):
+            raise TypeError("BMS HV frame is not a JSON object")
+        for _, _, name in reused:
+            fields[name] = getattr(self.previous, name)
+        self.fields_reused += len(reused)
+        bms_hv_data = check_frame_arrays(BmsHvData(**fields))
+        self._raw_arrays = raw_arrays
+        return bms_hv_data
+
+    def _reuse_arrays(self, text, bms_hv_data):
+        """Puts the arrays of the previous frame into a decoded JSON frame where their substring did not change"""
+        spans = self._array_spans(text)
+        raw_arrays = {name: text[start:end] for start, end, name in spans}
+        if self.previous is not None:
+            for name, raw_array in raw_arrays.items():
+                if self._raw_arrays.get(name) == raw_array:
+                    setattr(bms_hv_data, name, getattr(self.previous, name))
+                    self.fields_reused += 1
+        self._raw_arrays = raw_arrays
+        return bms_hv_data
+
+    @staticmethod
+    def _array_spans(text):
+        """Returns [(start, end, name)] of the flat arrays in text ordered by position, an empty list if any array is not a plain flat one"""
+        spans = []
+        for name, key in JSON_ARRAY_KEYS:
+            start = text.find(key)
+            if start == -1:
+                continue
+            start += len(key) - 1
+            end = text.find("]", start) + 1
+            # nested arrays and repeated keys are for the JSON parser
+            if (
+                end == 0
+                or text.find("[", start + 1, end) != -1
+                or text.find(key, end) != -1
+            ):
+                return []
+            spans.append((start, end, name))
+        spans.sort()
+        return spans
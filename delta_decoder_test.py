@@ -0,0 +1,201 @@
+""" Tests of the delta decoder against the plain frame decoder"""
+import json
+import os
+import numpy as np
+import pytest
+from delta_decoder import ALL_FIELDS, ARRAY_FIELDS, DeltaDecoder
+from frame_decoder import BmsHvData
+from mock_bms_hv.mock_bms import MockBms, encode_json_frame
+from wire_protocol import FrameError, decode_frame, encode_binary_frame
+
+MOCK_FRAME_PATHS = [
+    os.path.join(os.path.dirname(__file__), "mock_bms_hv", name)
+    for name in ("serial_data.txt", "serial_data2.txt")
+]
+
+
+def same_value(value, expected):
+    """Checks if two field values are equal, arrays also in dtype and shape"""
+    if isinstance(expected, np.ndarray):
+        return (
+            value.dtype == expected.dtype
+            and value.shape == expected.shape
+            and value.tobytes() == expected.tobytes()
+        )
+    return value == expected
+
+
+def assert_same_frame(data, expected):
+    """Checks that the delta decoded frame equals the plainly decoded one"""
+    for name in BmsHvData.__slots__:
+        assert same_value(getattr(data, name), getattr(expected, name)), name
+
+
+def changed_fields(data, previous):
+    """Returns the fields of a frame that differ from the previous frame"""
+    return {
+        name
+        for name in BmsHvData.__slots__
+        if not same_value(getattr(data, name), getattr(previous, name))
+    }
+
+
+def mock_frames(count, binary=False, seed=3):
+    """Returns count consecutive frames of a mock BMS, every other frame repeats the state of the one before"""
+    mock = MockBms(seed=seed)
+    mock.balance = 1
+    encode = encode_binary_frame if binary else encode_json_frame
+    frames = []
+    for i in range(count):
+        if i % 2:
+            mock.step(0.25)
+        data = mock.data()
+        # the mock moves every value each step, keep some arrays unchanged like a real pack
+        if i % 3:
+            data.temperature = np.full(data.temperature.size, 25.0, dtype=np.float32)
+        frames.append(encode(data))
+    return frames
+
+
+def mock_file_frames():
+    """Returns the recorded mock frames, one after the other and repeated like mock_bms_hv.sh sends them"""
+    frames = []
+    for path in MOCK_FRAME_PATHS:
+        with open(path, "rb") as file:
+            frames.append(file.read().strip())
+    return [frames[0], frames[1], frames[1], frames[0], frames[0]]
+
+
+def assert_decodes_like_decode_frame(frames, exact=False):
+    """Decodes the frames with a delta decoder and checks every frame and its changed fields. An array that was parsed again is reported as changed, exact expects every unchanged array to be reused"""
+    decoder = DeltaDecoder()
+    previous = None
+    for frame in frames:
+        data = decoder.decode(frame)
+        expected = decode_frame(frame)
+        assert_same_frame(data, expected)
+        if previous is None:
+            assert decoder.changed_fields == ALL_FIELDS
+        else:
+            changed = changed_fields(expected, previous)
+            if exact:
+                assert decoder.changed_fields == changed
+            else:
+                assert decoder.changed_fields >= changed
+                assert decoder.changed_fields - changed <= set(ARRAY_FIELDS)
+        previous = expected
+    return decoder
+
+
+def test_json_frames():
+    decoder = assert_decodes_like_decode_frame(mock_frames(12), exact=True)
+    assert decoder.fields_reused > 0
+
+
+def test_binary_frames():
+    decoder = assert_decodes_like_decode_frame(mock_frames(12, binary=True), exact=True)
+    assert decoder.fields_reused > 0
+
+
+def test_mixed_frames():
+    json_frames = mock_frames(8)
+    binary_frames = mock_frames(8, binary=True)
+    assert_decodes_like_decode_frame(
+        [
+            frame
+            for pair in zip(json_frames, binary_frames, binary_frames)
+            for frame in pair
+        ]
+    )
+
+
+def test_recorded_frames():
+    decoder = assert_decodes_like_decode_frame(mock_file_frames(), exact=True)
+    assert decoder.fields_reused > 0
+
+
+def test_unchanged_arrays_are_reused():
+    frame = mock_frames(1)[0]
+    decoder = DeltaDecoder()
+    first = decoder.decode(frame)
+    second = decoder.decode(frame)
+    for name in ARRAY_FIELDS:
+        assert getattr(second, name) is getattr(first, name)
+    assert decoder.changed_fields == frozenset()
+    assert decoder.fields_reused == len(ARRAY_FIELDS)
+
+
+def test_frames_decoded_elsewhere_are_not_parsed_again():
+    frames = mock_frames(6)
+    decoder = DeltaDecoder()
+    previous = None
+    for frame in frames:
+        decoded = decode_frame(frame)
+        expected = decode_frame(frame)
+        data = decoder.decode(frame, decoded)
+        assert data is decoded
+        assert_same_frame(data, expected)
+        if previous is not None:
+            assert decoder.changed_fields == changed_fields(expected, previous)
+        previous = expected
+    assert decoder.fields_reused > 0
+
+
+def test_str_frames_and_other_spellings():
+    frame = mock_frames(1)[0]
+    # spaces after the separators move the arrays out of reach of the raw comparison
+    spaced = json.dumps(json.loads(frame)).encode("utf-8")
+    assert_decodes_like_decode_frame(
+        [frame, frame.decode("utf-8"), frame, spaced, spaced, frame]
+    )
+
+
+def test_geometry_change():
+    small = MockBms(seed=1, ltc_count=2, cells_per_ltc=4, soc_count=5)
+    large = MockBms(seed=1)
+    assert_decodes_like_decode_frame(
+        [
+            encode_json_frame(small.data()),
+            encode_json_frame(large.data()),
+            encode_binary_frame(small.data()),
+            encode_binary_frame(large.data()),
+        ]
+    )
+
+
+def test_reset():
+    frame = mock_frames(1)[0]
+    decoder = DeltaDecoder()
+    decoder.decode(frame)
+    decoder.reset()
+    decoder.decode(frame)
+    assert decoder.changed_fields == ALL_FIELDS
+    assert decoder.fields_reused == 0
+
+
+@pytest.mark.parametrize(
+    "corrupt, error",
+    [
+        (lambda frame: frame[:-5], json.JSONDecodeError),
+        (lambda frame: frame.replace(b'"balance"', b'"unknown"'), TypeError),
+        (lambda frame: frame.replace(b'"discharge":[', b'"discharge":[0,'), ValueError),
+        (lambda frame: b"[" + frame + b"]", TypeError),
+    ],
+)
+def test_json_errors_after_a_valid_frame(corrupt, error):
+    frame = mock_frames(1)[0].strip()
+    decoder = DeltaDecoder()
+    decoder.decode(frame)
+    with pytest.raises(error):
+        decode_frame(corrupt(frame))
+    with pytest.raises(error):
+        decoder.decode(corrupt(frame))
+    # the next valid frame is still decoded against the last valid one
+    assert_same_frame(decoder.decode(frame), decode_frame(frame))
+
+
+def test_binary_errors():
+    frame = bytearray(mock_frames(1, binary=True)[0])
+    frame[-1] ^= 0xFF
+    with pytest.raises(FrameError):
+        DeltaDecoder().decode(bytes(frame))
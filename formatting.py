@@ -0,0 +1,237 @@
+""" Formatting of BMS HV data into the strings displayed in the GUI tables"""
+import numpy as np
+
+CHANNEL_NAMES = {"cell_voltage": "Cell", "temperature": "Sensor", "soc": "SoC"}
+# channels listed for an alarm, the rest are counted
+ALARM_MAX_CHANNELS = 3
+
+
+def float_to_string_with_precision(value, precision):
+    """Converts a float to a string with the specified precision"""
+    return f"{value:.{precision}f}"
+
+
+def mark_cell_if_discharge(value, is_discharging):
+    """Marks a cell if it is discharging"""
+    return (f"#{value}#") if is_discharging else value
+
+
+# a cache that outgrows this is cleared, unquantized values would otherwise grow it forever
+FORMAT_CACHE_SIZE = 8192
+
+
+def to_rows(values, columns):
+    """Lays out a flat list column after column, value i goes to row i % rows and column i // rows"""
+    row_count = len(values) // columns
+    return [values[row::row_count] for row in range(row_count)]
+
+
+def to_table(values, layout):
+    """Lays out the values of the used channels of a layout in its table, one column per LTC. Unused channels are dashes"""
+    rows = [["-"] * layout.ltc_count for _ in range(layout.row_count)]
+    for (row, column), value in zip(layout.table_cells, values):
+        rows[row][column] = value
+    return rows
+
+
+def soc_rows(pack_stats, columns, precision):
+    """Returns the rows of the SoC table, min, max, avg and median in percent"""
+    return to_rows(
+        [
+            float_to_string_with_precision(v * 100, precision)
+            for v in [
+                pack_stats.soc.minimum,
+                pack_stats.soc.maximum,
+                pack_stats.soc.mean,
+                pack_stats.soc.median,
+            ]
+        ],
+        columns,
+    )
+
+
+class CachedRowFormatter:
+    """Formats a per cell array into the rows of its table, marked values are wrapped in #. The values are quantized to the displayed precision, like the ADC quantizes them, and the strings are cached per quantized value. The rows are preallocated and filled in place"""
+
+    def __init__(self, precision, cache_size=FORMAT_CACHE_SIZE):
+        self.precision = precision
+        self.cache_size = cache_size
+        self.misses = 0
+        self._scale = 10.0**precision
+        self._strings = {}
+        self._marked_strings = {}
+        self._quantized = None
+        self._rows = None
+        self._layout = None
+        # (row list, column) of every used channel
+        self._cells = None
+
+    def rows(self, values, layout, marked=None):
+        """Returns the table rows of an array of values laid out by a ChannelLayout, the strings of truthy marked values are marked. The rows are reused and overwritten by the next call"""
+        layout = layout.for_size(values.size)
+        if layout is not self._layout:
+            self._allocate(layout)
+        if layout.used is not None:
+            values = values.take(layout.used)
+            if marked is not None:
+                marked = marked.take(layout.used)
+        # float64, a float32 product would move values across a rounding boundary
+        np.multiply(values, self._scale, out=self._quantized, dtype=np.float64)
+        np.rint(self._quantized, out=self._quantized)
+        strings = self._strings
+        if marked is None:
+            for (row, column), key in zip(self._cells, self._quantized.tolist()):
+                text = strings.get(key)
+                if text is None:
+                    text = self._format(key)
+                row[column] = text
+            return self._rows
+
+        marked_strings = self._marked_strings
+        for (row, column), key, is_marked in zip(
+            self._cells, self._quantized.tolist(), marked.tolist()
+        ):
+            text = strings.get(key)
+            if text is None:
+                text = self._format(key)
+            if is_marked:
+                marked_text = marked_strings.get(text)
+                if marked_text is None:
+                    marked_text = mark_cell_if_discharge(text, True)
+                    marked_strings[text] = marked_text
+                text = marked_text
+            row[column] = text
+        return self._rows
+
+    def _format(self, key):
+        """Formats a quantized value missing in the cache and caches it"""
+        self.misses += 1
+        # the nearest float to the quantum formats back to the same digits, 0 has no sign
+        text = float_to_string_with_precision(key / self._scale + 0.0, self.precision)
+        # NaN never equals itself, it would be a new key every frame
+        if key == key:
+            if len(self._strings) >= self.cache_size:
+                self._strings.clear()
+                self._marked_strings.clear()
+            self._strings[key] = text
+        return text
+
+    def _allocate(self, layout):
+        """Creates the rows, the cell positions and the quantization buffer of a layout"""
+        self._layout = layout
+        self._quantized = np.empty(len(layout.table_cells), dtype=np.float64)
+        self._rows = to_table([], layout)
+        self._cells = [(self._rows[row], column) for row, column in layout.table_cells]
+
+
+def error_rows(bms_hv_data):
+    """Returns the rows of the error table, inactive errors are shown as dashes"""
+    return [
+        ([e[0], e[2]] if e[1] == 1 else ["-", "-"])
+        for e in [
+            [
+                "Under Voltage",
+                bms_hv_data.under_voltage[0],
+                bms_hv_data.under_voltage[1],
+            ],
+            [
+                "Over Voltage",
+                bms_hv_data.over_voltage[0],
+                bms_hv_data.over_voltage[1],
+            ],
+            [
+                "Under Temperature",
+                bms_hv_data.under_temperature[0],
+                bms_hv_data.under_temperature[1],
+            ],
+            [
+                "Over Temperature",
+                bms_hv_data.over_temperature[0],
+                bms_hv_data.over_temperature[1],
+            ],
+            [
+                "Over Current",
+                bms_hv_data.over_current[0],
+                bms_hv_data.over_current[1],
+            ],
+            [
+                "Current Sensor",
+                bms_hv_data.current_sensor_disconnected[0],
+                "Disconnected",
+            ],
+        ]
+    ]
+
+
+def active_error_count(bms_hv_data):
+    """Returns the number of active errors of a frame"""
+    return sum(
+        int(error[0] == 1)
+        for error in (
+            bms_hv_data.under_voltage,
+            bms_hv_data.over_voltage,
+            bms_hv_data.under_temperature,
+            bms_hv_data.over_temperature,
+            bms_hv_data.over_current,
+            bms_hv_data.current_sensor_disconnected,
+        )
+    )
+
+
+def pack_summary_row(name, connected, bms_hv_data, pack_stats, age, precision):
+    """Returns one row of the pack summary table, a pack without a frame shows dashes"""
+    link = "Connected" if connected else "Disconnected"
+    if bms_hv_data is None:
+        return [name, link] + ["-"] * 7
+    return [
+        name,
+        link,
+        float_to_string_with_precision(bms_hv_data.current, precision),
+        float_to_string_with_precision(pack_stats.cell_voltage.minimum, precision),
+        float_to_string_with_precision(pack_stats.cell_voltage.maximum, precision),
+        float_to_string_with_precision(pack_stats.temperature.maximum, precision),
+        float_to_string_with_precision(pack_stats.soc.mean * 100, precision),
+        str(active_error_count(bms_hv_data)),
+        float_to_string_with_precision(age, 1),
+    ]
+
+
+def channel_name(field, channel, channel_count, geometry):
+    """Returns the name of a channel of a per cell array like the GUI tables show it"""
+    if field not in CHANNEL_NAMES:
+        return field
+    layout = geometry.layouts.get(field)
+    if layout is None:
+        return f"{CHANNEL_NAMES[field]} {channel}"
+    ltc, row = layout.for_size(channel_count).locate(channel)
+    return f"LTC {ltc} {CHANNEL_NAMES[field]} {row}"
+
+
+def describe_channels(signal, channels, channel_count, geometry):
+    """Returns the channels of an alarm as text, pack level signals have no channel names"""
+    if channel_count == 1:
+        return ""
+    names = [
+        channel_name(signal, int(channel), channel_count, geometry)
+        for channel in channels[:ALARM_MAX_CHANNELS]
+    ]
+    if len(channels) > ALARM_MAX_CHANNELS:
+        names.append(f"+{len(channels) - ALARM_MAX_CHANNELS} more")
+    return ", ".join(names)
+
+
+def alarm_rows(alarms, now, row_count, geometry):
+    """Returns the rows of the alarm table for [(pack, rule, channels, channel count, raised time)], alarms that do not fit are counted in the last row"""
+    rows = [
+        [
+            pack,
+            rule.name,
+            describe_channels(rule.signal, channels, channel_count, geometry) or "-",
+            float_to_string_with_precision(now - raised_time, 0),
+        ]
+        for pack, rule, channels, channel_count, raised_time in alarms
+    ]
+    if len(rows) > row_count:
+        hidden = len(rows) - row_count + 1
+        rows = rows[: row_count - 1] + [["-", f"+{hidden} more", "-", "-"]]
+    return rows + [["-"] * 4 for _ in range(row_count - len(rows))]
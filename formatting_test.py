@@ -0,0 +1,172 @@
+""" Tests of the table formatting"""
+import numpy as np
+import pytest
+from formatting import (
+    CachedRowFormatter,
+    alarm_rows,
+    channel_name,
+    float_to_string_with_precision,
+    mark_cell_if_discharge,
+    to_rows,
+    to_table,
+)
+from mock_bms_hv.mock_bms import MockBms
+from pack_geometry import DEFAULT_PACK_GEOMETRY, PackGeometry
+
+GEOMETRIES = [
+    DEFAULT_PACK_GEOMETRY,
+    PackGeometry(unused_cells=[[14, 8], 4], unused_sensors=[[0, 2]]),
+]
+
+
+def cell_voltage_rows(bms_hv_data, layout, precision):
+    """Reference rows of the cell voltage table, every value is formatted on its own"""
+    layout = layout.for_size(bms_hv_data.cell_voltage.size)
+    return to_table(
+        [
+            mark_cell_if_discharge(
+                float_to_string_with_precision(v, precision), is_discharging
+            )
+            for v, is_discharging in zip(
+                layout.used_values(bms_hv_data.cell_voltage).tolist(),
+                layout.used_values(bms_hv_data.discharge).tolist(),
+            )
+        ],
+        layout,
+    )
+
+
+def temperature_rows(bms_hv_data, layout, precision):
+    """Reference rows of the temperature table, every value is formatted on its own"""
+    layout = layout.for_size(bms_hv_data.temperature.size)
+    return to_table(
+        [
+            float_to_string_with_precision(v, precision)
+            for v in layout.used_values(bms_hv_data.temperature).tolist()
+        ],
+        layout,
+    )
+
+
+def mock_frames(count, seed=4):
+    """Returns count consecutive decoded frames of a mock BMS that is balancing"""
+    mock = MockBms(seed=seed)
+    mock.balance = 1
+    frames = []
+    for _ in range(count):
+        mock.step(0.25)
+        frames.append(mock.data())
+    return frames
+
+
+@pytest.mark.parametrize("geometry", GEOMETRIES)
+@pytest.mark.parametrize("precision", [1, 3, 4])
+def test_cached_rows_equal_cell_voltage_rows(geometry, precision):
+    formatter = CachedRowFormatter(precision)
+    for data in mock_frames(10):
+        expected = cell_voltage_rows(data, geometry.cells, precision)
+        rows = formatter.rows(data.cell_voltage, geometry.cells, data.discharge)
+        assert rows == expected
+
+
+@pytest.mark.parametrize("geometry", GEOMETRIES)
+@pytest.mark.parametrize("precision", [0, 2])
+def test_cached_rows_equal_temperature_rows(geometry, precision):
+    formatter = CachedRowFormatter(precision)
+    for data in mock_frames(10):
+        expected = temperature_rows(data, geometry.temperatures, precision)
+        assert formatter.rows(data.temperature, geometry.temperatures) == expected
+
+
+def test_cached_rows_of_special_values():
+    layout = DEFAULT_PACK_GEOMETRY.temperatures
+    values = np.linspace(-1.0, 1.0, layout.size).astype(np.float32)
+    values[:4] = [np.nan, np.inf, -np.inf, 0.004]
+    formatter = CachedRowFormatter(2)
+    data = mock_frames(1)[0]
+    data.temperature = values
+    assert formatter.rows(values, layout) == temperature_rows(data, layout, 2)
+    # NaN is not cached, it would be a new key every frame
+    assert len(formatter._strings) == formatter.misses - 1
+    assert formatter.rows(values, layout) == temperature_rows(data, layout, 2)
+
+
+def test_cached_rows_of_negative_zero():
+    layout = DEFAULT_PACK_GEOMETRY.temperatures
+    values = np.full(layout.size, 0.5, dtype=np.float32)
+    values[:2] = [-0.0, -0.004]
+    rows = CachedRowFormatter(2).rows(values, layout)
+    # unlike the f-string the quantized value has no sign
+    assert [rows[0][0], rows[1][0]] == ["0.00", "0.00"]
+
+
+def test_cached_rows_of_rounding_boundaries():
+    layout = DEFAULT_PACK_GEOMETRY.cells
+    # float32 values next to the halfway points of the displayed digits
+    values = (np.arange(layout.size, dtype=np.float32) + np.float32(3.0005)).astype(
+        np.float32
+    )
+    values = np.concatenate(
+        [
+            np.nextafter(values, np.float32(0)),
+            values,
+            np.nextafter(values, np.float32(9)),
+        ]
+    )
+    formatter = CachedRowFormatter(3)
+    data = mock_frames(1)[0]
+    for start in range(0, len(values), layout.size):
+        data.cell_voltage = values[start : start + layout.size]
+        data.discharge = np.zeros(layout.size, dtype=np.uint8)
+        assert formatter.rows(data.cell_voltage, layout) == cell_voltage_rows(
+            data, layout, 3
+        )
+
+
+def test_cached_rows_are_cached_and_bounded():
+    layout = DEFAULT_PACK_GEOMETRY.cells
+    data = mock_frames(1)[0]
+    formatter = CachedRowFormatter(4)
+    formatter.rows(data.cell_voltage, layout)
+    misses = formatter.misses
+    formatter.rows(data.cell_voltage, layout)
+    assert formatter.misses == misses
+
+    formatter = CachedRowFormatter(4, cache_size=64)
+    rows = formatter.rows(data.cell_voltage, layout, data.discharge)
+    assert len(formatter._strings) <= 64
+    assert rows == cell_voltage_rows(data, layout, 4)
+
+
+def test_cached_rows_of_a_frame_that_does_not_match_the_geometry():
+    geometry = PackGeometry(ltc_count=3, cells_per_ltc=4, unused_cells=[[2, 3]])
+    formatter = CachedRowFormatter(2)
+    for size in (12, 10, 12, 5):
+        data = mock_frames(1)[0]
+        data.cell_voltage = data.cell_voltage[:size]
+        data.discharge = data.discharge[:size]
+        rows = formatter.rows(data.cell_voltage, geometry.cells, data.discharge)
+        assert rows == cell_voltage_rows(data, geometry.cells, 2)
+
+
+def test_to_rows():
+    assert to_rows([1, 2, 3, 4, 5, 6], 2) == [[1, 4], [2, 5], [3, 6]]
+
+
+def test_channel_name():
+    # channel 0 is unused on every LTC, it has no table row
+    geometry = PackGeometry(unused_cells=[0])
+    assert channel_name("cell_voltage", 1, 135, geometry) == "LTC 0 Cell 0"
+    assert channel_name("cell_voltage", 10, 135, geometry) == "LTC 1 Cell 0"
+    assert channel_name("temperature", 4, 45, geometry) == "LTC 1 Sensor 1"
+    assert channel_name("soc", 7, 99, geometry) == "SoC 7"
+    assert channel_name("current", 0, 1, geometry) == "current"
+
+
+def test_alarm_rows_count_the_hidden_alarms():
+    rule = type("Rule", (), {"name": "Cell Under Voltage", "signal": "cell_voltage"})
+    alarms = [("Pack", rule, np.array([i]), 135, 10.0) for i in range(5)]
+    rows = alarm_rows(alarms, 15.0, 3, DEFAULT_PACK_GEOMETRY)
+    assert rows[0] == ["Pack", "Cell Under Voltage", "LTC 0 Cell 0", "5"]
+    assert rows[2] == ["-", "+3 more", "-", "-"]
+    assert alarm_rows([], 0.0, 2, DEFAULT_PACK_GEOMETRY) == [["-"] * 4] * 2
@@ -0,0 +1,137 @@
+""" Decoder for the frames sent by the BMS HV. Frames are decoded straight into NumPy arrays without intermediate objects"""
+import json
+import math
+import numpy as np
+
+VOLTAGE_DTYPE = np.float32
+SOC_DTYPE = np.float32
+TEMPERATURE_DTYPE = np.float32
+DISCHARGE_DTYPE = np.uint8
+
+
+def to_array(values, dtype):
+    """Converts a field of a frame into an array of dtype. A JSON list goes through np.fromiter, which is about twice as fast as np.asarray for a list of numbers, arrays are taken as they are. Raises ValueError for an integer that does not fit dtype"""
+    try:
+        if isinstance(values, list):
+            try:
+                return np.fromiter(values, dtype, len(values))
+            # a nested list, np.asarray makes it an array that check_frame_arrays rejects
+            except (TypeError, ValueError):
+                pass
+        return np.asarray(values, dtype=dtype)
+    except OverflowError as error:
+        raise ValueError(str(error)) from error
+
+
+class BmsHvData:
+    """BMS HV data, the per cell values are stored in typed NumPy arrays"""
+
+    __slots__ = (
+        "current",
+        "acc_voltage",
+        "car_voltage",
+        "soc",
+        "cell_voltage",
+        "temperature",
+        "discharge",
+        "balance",
+        "charging",
+        "under_voltage",
+        "over_voltage",
+        "under_temperature",
+        "over_temperature",
+        "over_current",
+        "current_sensor_disconnected",
+        "timestamp",
+    )
+
+    def __init__(
+        self,
+        current,
+        acc_voltage,
+        car_voltage,
+        soc,
+        cell_voltage,
+        temperature,
+        discharge,
+        balance,
+        charging,
+        under_voltage,
+        over_voltage,
+        under_temperature,
+        over_temperature,
+        over_current,
+        current_sensor_disconnected,
+        timestamp,
+    ):
+        self.current = float(current)
+        self.acc_voltage = float(acc_voltage)
+        self.car_voltage = float(car_voltage)
+        self.soc = to_array(soc, SOC_DTYPE)
+        self.cell_voltage = to_array(cell_voltage, VOLTAGE_DTYPE)
+        self.temperature = to_array(temperature, TEMPERATURE_DTYPE)
+        self.discharge = to_array(discharge, DISCHARGE_DTYPE)
+        self.balance = int(balance)
+        self.charging = int(charging)
+        # error fields are pairs of (flag, value)
+        self.under_voltage = tuple(under_voltage)
+        self.over_voltage = tuple(over_voltage)
+        self.under_temperature = tuple(under_temperature)
+        self.over_temperature = tuple(over_temperature)
+        self.over_current = tuple(over_current)
+        self.current_sensor_disconnected = tuple(current_sensor_disconnected)
+        self.timestamp = float(timestamp)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"BmsHvData({fields})"
+
+
+# error fields of a frame, pairs of (flag, value)
+ERROR_FIELDS = (
+    "under_voltage",
+    "over_voltage",
+    "under_temperature",
+    "over_temperature",
+    "over_current",
+    "current_sensor_disconnected",
+)
+
+
+def check_frame_arrays(data):
+    """Checks that the arrays are flat, the soc, cell and temperature arrays are not empty, every value is finite, there is a discharge flag per cell and every error field is a (flag, value) pair, raises ValueError otherwise. Every decoder runs it, a frame is rejected the same way whatever path decoded it"""
+    for name in ("soc", "cell_voltage", "temperature"):
+        values = getattr(data, name)
+        if values.ndim != 1:
+            raise ValueError(f"BMS HV frame field {name} is not a flat array")
+        # the statistics and the channel layouts need at least one value
+        if not values.size:
+            raise ValueError(f"BMS HV frame field {name} is empty")
+        # the sum is NaN or infinite if any value is, a NaN never trips an alarm and an infinity is a float32 overflow
+        if not math.isfinite(values.sum()):
+            raise ValueError(f"BMS HV frame field {name} is not finite")
+    if data.discharge.ndim != 1:
+        raise ValueError("BMS HV frame field discharge is not a flat array")
+    for name in ("current", "acc_voltage", "car_voltage", "timestamp"):
+        if not math.isfinite(getattr(data, name)):
+            raise ValueError(f"BMS HV frame field {name} is not finite")
+    if data.discharge.size != data.cell_voltage.size:
+        raise ValueError(
+            f"BMS HV frame has {data.discharge.size} discharge flags for {data.cell_voltage.size} cells"
+        )
+    for name in ERROR_FIELDS:
+        if len(getattr(data, name)) != 2:
+            raise ValueError(f"BMS HV frame field {name} is not a (flag, value) pair")
+    return data
+
+
+def decode_json_frame(data):
+    """Decodes a JSON frame (str or bytes) into BmsHvData
+
+    Raises json.decoder.JSONDecodeError for invalid JSON, TypeError if the
+    JSON does not match BmsHvData and ValueError if it fails check_frame_arrays
+    """
+    fields = json.loads(data)
+    if not isinstance(fields, dict):
+        raise TypeError("BMS HV frame is not a JSON object")
+    return check_frame_arrays(BmsHvData(**fields))
@@ -0,0 +1,368 @@
+""" Render layer for the BMS HV Utility window. It keeps the last displayed state and pushes only changed labels, table cells and chart bars to Tk"""
+import threading
+import time
+import numpy as np
+from history import min_max_decimate
+
+
+def set_table_row(element, row_index, row):
+    """Writes one row of a Table element with a single Treeview.item call, the cells of a row mostly change together. It needs the tree_ids, Values, DisplayRowNumbers and StartingRowNumber internals of PySimpleGUI 4, returns False without writing anything when the element lacks them"""
+    try:
+        tree = element.Widget
+        row_id = element.tree_ids[row_index]
+        table_values = element.Values
+        display_row_numbers = element.DisplayRowNumbers
+        starting_row_number = element.StartingRowNumber
+    except (AttributeError, IndexError, TypeError):
+        return False
+    values = list(row)
+    if display_row_numbers:
+        # the row number is the first Treeview column when it is displayed
+        values.insert(0, row_index + starting_row_number)
+    tree.item(row_id, values=values)
+    # Table.get and the row selection events read the rows from Values
+    table_values[row_index] = list(row)
+    return True
+
+
+class DiffRenderer:
+    """Updates window elements only when their displayed value changes"""
+
+    def __init__(self, window):
+        self.window = window
+        self.elements_updated = 0
+        self.cells_updated = 0
+        self.last_frame_render_sec = 0.0
+        self._texts = {}
+        self._tables = {}
+        self._frame_start = None
+
+    def begin_frame(self):
+        """Starts measuring the render time of a frame"""
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Stops measuring the render time of a frame"""
+        if self._frame_start is not None:
+            self.last_frame_render_sec = time.perf_counter() - self._frame_start
+            self._frame_start = None
+
+    def update_text(self, key, value):
+        """Updates a text element if the value differs from the displayed one"""
+        if self._texts.get(key) == value:
+            return False
+        self._texts[key] = value
+        self.window[key].update(value)
+        self.elements_updated += 1
+        return True
+
+    def update_table(self, key, rows):
+        """Updates only the table rows that differ from the displayed ones"""
+        last_rows = self._tables.get(key)
+        element = self.window[key]
+
+        if (
+            last_rows is None
+            or len(last_rows) != len(rows)
+            or any(len(last_row) != len(row) for last_row, row in zip(last_rows, rows))
+        ):
+            return self._replace_table(key, element, rows)
+
+        changed = False
+        for row_index, (last_row, row) in enumerate(zip(last_rows, rows)):
+            if last_row == row:
+                continue
+            if not set_table_row(element, row_index, row):
+                # a PySimpleGUI without the row internals, the whole table is written
+                return self._replace_table(key, element, rows)
+            self.cells_updated += sum(
+                last_value != value for last_value, value in zip(last_row, row)
+            )
+            last_row[:] = row
+            changed = True
+
+        if changed:
+            self.elements_updated += 1
+        return changed
+
+    def _replace_table(self, key, element, rows):
+        """Writes the whole table with Table.update"""
+        element.update(values=rows)
+        self._tables[key] = [list(row) for row in rows]
+        self.elements_updated += 1
+        self.cells_updated += sum(len(row) for row in rows)
+        return True
+
+    def invalidate(self):
+        """Forgets the displayed state so that the next updates repaint everything"""
+        self._texts.clear()
+        self._tables.clear()
+
+
+class GuiWakeup:
+    """Wakes the GUI loop from another thread, repeated wakeups are coalesced until the GUI acknowledges them"""
+
+    def __init__(self, window, event_key):
+        self.window = window
+        self.event_key = event_key
+        self._pending = threading.Event()
+
+    def notify(self):
+        """Posts a wakeup event to the window unless one is already pending"""
+        if not self._pending.is_set():
+            self._pending.set()
+            self.window.write_event_value(self.event_key, None)
+
+    def acknowledge(self):
+        """Called by the GUI loop before it consumes the new data"""
+        self._pending.clear()
+
+
+class RenderThrottle:
+    """Limits the render rate, frames arriving faster are coalesced into the next render"""
+
+    def __init__(self, max_fps):
+        self.min_interval = 1 / max_fps if max_fps else 0.0
+        self._last_render = None
+
+    def ready(self):
+        """Checks if a frame can be rendered now"""
+        return (
+            self._last_render is None
+            or time.monotonic() - self._last_render >= self.min_interval
+        )
+
+    def rendered(self):
+        """Marks that a frame was just rendered"""
+        self._last_render = time.monotonic()
+
+    def timeout_ms(self):
+        """Returns the time in ms until the next render is allowed"""
+        if self._last_render is None:
+            return 0
+        remaining = self._last_render + self.min_interval - time.monotonic()
+        return max(0, int(remaining * 1000) + 1)
+
+
+BAR_STATE_NORMAL = 0
+BAR_STATE_MARKED = 1
+BAR_STATE_MIN = 2
+BAR_STATE_MAX = 3
+
+# fill colors indexed by bar state
+BAR_COLORS = ("#4a7ebb", "#f0a030", "#30a050", "#d04040")
+BAR_CHART_TICKS = 5
+BAR_CHART_MARGIN_LEFT = 45
+BAR_CHART_MARGIN_BOTTOM = 20
+BAR_CHART_MARGIN_TOP = 10
+BAR_CHART_FONT = ("Helvetica", 7)
+
+
+class BarChart:
+    """Bar chart on the Tk canvas of a Graph element. The canvas items are created once, a frame only moves the bars whose pixel height changed and recolors the bars whose state changed"""
+
+    def __init__(self, graph, minimum, maximum, group_starts=None, colors=BAR_COLORS):
+        self.graph = graph
+        self.minimum = minimum
+        self.maximum = maximum
+        # index of the first bar of every labeled group
+        self.group_starts = group_starts
+        self.colors = colors
+        self.items_updated = 0
+        self._bars = None
+        self._x = None
+        self._tops = None
+        self._states = None
+
+    def _create(self, count):
+        """Creates the axis, the group labels and one rectangle per bar"""
+        canvas = self.graph.TKCanvas
+        canvas.delete("all")
+        width, height = self.graph.CanvasSize
+        self._bottom = height - BAR_CHART_MARGIN_BOTTOM
+        self._scale = (self._bottom - BAR_CHART_MARGIN_TOP) / (
+            self.maximum - self.minimum
+        )
+
+        for tick in np.linspace(self.minimum, self.maximum, BAR_CHART_TICKS):
+            y = self._bottom - (tick - self.minimum) * self._scale
+            canvas.create_line(BAR_CHART_MARGIN_LEFT, y, width, y, fill="#dddddd")
+            canvas.create_text(
+                BAR_CHART_MARGIN_LEFT - 4,
+                y,
+                text=f"{tick:g}",
+                anchor="e",
+                font=BAR_CHART_FONT,
+            )
+
+        spacing = (width - BAR_CHART_MARGIN_LEFT) / count
+        left = BAR_CHART_MARGIN_LEFT + np.arange(count) * spacing
+        self._x = np.column_stack((left + spacing * 0.1, left + spacing * 0.9))
+
+        if self.group_starts:
+            starts = [start for start in self.group_starts if start < count]
+            for group, (start, end) in enumerate(zip(starts, starts[1:] + [count])):
+                canvas.create_text(
+                    (left[start] + left[end - 1] + spacing) / 2,
+                    self._bottom + BAR_CHART_MARGIN_BOTTOM / 2,
+                    text=str(group),
+                    font=BAR_CHART_FONT,
+                )
+                if start:
+                    canvas.create_line(
+                        left[start],
+                        BAR_CHART_MARGIN_TOP,
+                        left[start],
+                        height,
+                        fill="#aaaaaa",
+                    )
+
+        self._bars = [
+            canvas.create_rectangle(
+                x0, self._bottom, x1, self._bottom, fill=self.colors[0], width=0
+            )
+            for x0, x1 in self._x.tolist()
+        ]
+        self._tops = np.full(count, self._bottom, dtype=np.int32)
+        self._states = np.zeros(count, dtype=np.uint8)
+
+    def update(self, values, marked=None):
+        """Displays the values, marked bars and the min and max bars are highlighted. Returns True if a canvas item changed"""
+        values = np.asarray(values, dtype=np.float64)
+        if self._bars is None or len(self._bars) != values.size:
+            self._create(values.size)
+        if values.size == 0:
+            return False
+
+        clipped = np.clip(values, self.minimum, self.maximum)
+        tops = np.rint(self._bottom - (clipped - self.minimum) * self._scale).astype(
+            np.int32
+        )
+        states = np.zeros(values.size, dtype=np.uint8)
+        if marked is not None:
+            states[np.asarray(marked, dtype=bool)] = BAR_STATE_MARKED
+        states[values.argmin()] = BAR_STATE_MIN
+        states[values.argmax()] = BAR_STATE_MAX
+
+        canvas = self.graph.TKCanvas
+        moved = np.flatnonzero(tops != self._tops).tolist()
+        for i in moved:
+            x0, x1 = self._x[i]
+            canvas.coords(self._bars[i], x0, tops[i], x1, self._bottom)
+        recolored = np.flatnonzero(states != self._states).tolist()
+        for i in recolored:
+            canvas.itemconfigure(self._bars[i], fill=self.colors[states[i]])
+
+        self._tops = tops
+        self._states = states
+        self.items_updated += len(moved) + len(recolored)
+        return bool(moved or recolored)
+
+    def invalidate(self):
+        """Forgets the canvas items so that the next update recreates them"""
+        self._bars = None
+
+
+TREND_COLORS = ("#4a7ebb", "#d04040", "#30a050", "#f0a030")
+TREND_PANEL_GAP = 8
+
+
+class TrendPlot:
+    """Stacked line plots on the Tk canvas of a Graph element. Every signal is one persistent line item whose points are replaced on update, series are min/max decimated to one bucket per pixel column"""
+
+    def __init__(self, graph, panels):
+        # panels is a list of (title, signal names), each panel gets its own y range
+        self.graph = graph
+        self.panels = panels
+        self._lines = None
+
+    def _create(self):
+        """Creates the panel frames, labels and one line per signal"""
+        canvas = self.graph.TKCanvas
+        canvas.delete("all")
+        width, height = self.graph.CanvasSize
+        self._left = BAR_CHART_MARGIN_LEFT
+        self._right = width - 5
+        panel_height = (
+            height - BAR_CHART_MARGIN_BOTTOM - TREND_PANEL_GAP * len(self.panels)
+        ) / len(self.panels)
+
+        self._lines = {}
+        self._panel_boxes = []
+        self._range_labels = []
+        for i, (title, names) in enumerate(self.panels):
+            top = TREND_PANEL_GAP + i * (panel_height + TREND_PANEL_GAP)
+            bottom = top + panel_height
+            self._panel_boxes.append((top, bottom))
+            canvas.create_rectangle(
+                self._left, top, self._right, bottom, outline="#aaaaaa"
+            )
+            canvas.create_text(
+                self._left + 4, top + 2, text=title, anchor="nw", font=BAR_CHART_FONT
+            )
+            self._range_labels.append(
+                (
+                    canvas.create_text(
+                        self._left - 4, top, anchor="ne", font=BAR_CHART_FONT
+                    ),
+                    canvas.create_text(
+                        self._left - 4, bottom, anchor="se", font=BAR_CHART_FONT
+                    ),
+                )
+            )
+            for name, color in zip(names, TREND_COLORS):
+                self._lines[name] = canvas.create_line(0, 0, 0, 0, fill=color)
+
+        self._time_label = canvas.create_text(
+            self._left, height - 2, anchor="sw", font=BAR_CHART_FONT
+        )
+        canvas.create_text(
+            self._right, height - 2, text="now", anchor="se", font=BAR_CHART_FONT
+        )
+
+    def update(self, times, signals, window_sec):
+        """Plots the signals, a dict of name to series aligned with times, over the last window_sec seconds"""
+        if self._lines is None:
+            self._create()
+        canvas = self.graph.TKCanvas
+        canvas.itemconfigure(self._time_label, text=f"-{window_sec:g} s")
+        if len(times) < 2:
+            for line in self._lines.values():
+                canvas.coords(line, 0, 0, 0, 0)
+            return
+
+        end_time = times[-1]
+        buckets = int(self._right - self._left)
+        x_scale = (self._right - self._left) / window_sec
+        for (_, names), (top, bottom), (max_label, min_label) in zip(
+            self.panels, self._panel_boxes, self._range_labels
+        ):
+            series = {
+                name: min_max_decimate(times, signals[name], buckets)
+                for name in names
+                if name in signals
+            }
+            if not series:
+                continue
+            minimum = min(float(y.min()) for _, y in series.values())
+            maximum = max(float(y.max()) for _, y in series.values())
+            if maximum - minimum < 1e-6:
+                minimum -= 0.5
+                maximum += 0.5
+            y_scale = (bottom - top) / (maximum - minimum)
+            canvas.itemconfigure(max_label, text=f"{maximum:.4g}")
+            canvas.itemconfigure(min_label, text=f"{minimum:.4g}")
+
+            for name in names:
+                if name not in series:
+                    canvas.coords(self._lines[name], 0, 0, 0, 0)
+                    continue
+                x, y = series[name]
+                points = np.empty((len(x), 2))
+                points[:, 0] = self._right - (end_time - x) * x_scale
+                points[:, 1] = bottom - (y - minimum) * y_scale
+                canvas.coords(self._lines[name], points.ravel().tolist())
+
+    def invalidate(self):
+        """Forgets the canvas items so that the next update recreates them"""
+        self._lines = None
@@ -0,0 +1,182 @@
+""" Tests of the render layer, the window elements are stand-ins that record what would reach Tk"""
+import threading
+import types
+import gui_render
+from gui_render import DiffRenderer, GuiWakeup, RenderThrottle, set_table_row
+
+
+class RecordingElement:
+    """Stand-in for a Text or Table element of PySimpleGUI 4, the Treeview calls are recorded"""
+
+    def __init__(self, display_row_numbers=False):
+        self.Widget = self
+        self.DisplayRowNumbers = display_row_numbers
+        self.StartingRowNumber = 1
+        self.tree_ids = []
+        self.Values = []
+        self.updates = []
+        self.items = []
+
+    def update(self, value=None, values=None):
+        """Element.update"""
+        self.updates.append(value if values is None else values)
+        if values is not None:
+            self.Values = [list(row) for row in values]
+            self.tree_ids = [f"I{row}" for row in range(len(values))]
+
+    def item(self, iid, values):
+        """Treeview.item"""
+        self.items.append((iid, values))
+
+
+class PlainElement:
+    """Stand-in for an element of a PySimpleGUI without the Table internals"""
+
+    def __init__(self):
+        self.updates = []
+
+    def update(self, value=None, values=None):
+        """Element.update"""
+        self.updates.append(value if values is None else values)
+
+
+class RecordingWindow(dict):
+    """Stand-in for the window, elements are created on first access"""
+
+    def __init__(self, element_class=RecordingElement):
+        super().__init__()
+        self.element_class = element_class
+
+    def __missing__(self, key):
+        element = self[key] = self.element_class()
+        return element
+
+
+def test_text_is_updated_only_when_it_changes():
+    window = RecordingWindow()
+    renderer = DiffRenderer(window)
+    assert renderer.update_text("current", "1.0")
+    assert not renderer.update_text("current", "1.0")
+    assert renderer.update_text("current", "2.0")
+    assert window["current"].updates == ["1.0", "2.0"]
+    assert renderer.elements_updated == 2
+
+
+def test_only_changed_table_rows_are_written():
+    window = RecordingWindow()
+    renderer = DiffRenderer(window)
+    renderer.update_table("cells", [["a", "b"], ["c", "d"], ["e", "f"]])
+    assert renderer.cells_updated == 6
+    assert not renderer.update_table("cells", [["a", "b"], ["c", "d"], ["e", "f"]])
+    assert renderer.update_table("cells", [["a", "b"], ["c", "x"], ["e", "f"]])
+    table = window["cells"]
+    assert len(table.updates) == 1
+    assert table.items == [("I1", ["c", "x"])]
+    assert table.Values[1] == ["c", "x"]
+    assert renderer.cells_updated == 7
+    # the same value again is not written
+    renderer.update_table("cells", [["a", "b"], ["c", "x"], ["e", "f"]])
+    assert len(table.items) == 1
+
+
+def test_changed_shape_rewrites_the_table():
+    window = RecordingWindow()
+    renderer = DiffRenderer(window)
+    renderer.update_table("cells", [["a", "b"]])
+    renderer.update_table("cells", [["a", "b"], ["c", "d"]])
+    renderer.update_table("cells", [["a", "b", "c"], ["c", "d", "e"]])
+    assert len(window["cells"].updates) == 3
+    assert window["cells"].items == []
+
+
+def test_row_number_is_the_first_column():
+    element = RecordingElement(display_row_numbers=True)
+    element.update(values=[["a"], ["b"]])
+    assert set_table_row(element, 1, ["x"])
+    assert element.items == [("I1", [2, "x"])]
+    assert element.Values == [["a"], ["x"]]
+
+
+def test_table_without_row_internals_falls_back_to_full_updates():
+    element = PlainElement()
+    assert not set_table_row(element, 0, ["x"])
+    assert element.updates == []
+
+    window = RecordingWindow(PlainElement)
+    renderer = DiffRenderer(window)
+    renderer.update_table("cells", [["a"], ["b"]])
+    assert renderer.update_table("cells", [["a"], ["x"]])
+    assert not renderer.update_table("cells", [["a"], ["x"]])
+    assert window["cells"].updates == [[["a"], ["b"]], [["a"], ["x"]]]
+
+
+def test_invalidate_repaints_everything():
+    window = RecordingWindow()
+    renderer = DiffRenderer(window)
+    renderer.update_text("current", "1.0")
+    renderer.update_table("cells", [["a"]])
+    renderer.invalidate()
+    assert renderer.update_text("current", "1.0")
+    assert renderer.update_table("cells", [["a"]])
+    assert len(window["cells"].updates) == 2
+
+
+class EventWindow:
+    """Stand-in for the window, the posted events are recorded"""
+
+    def __init__(self):
+        self.events = []
+
+    def write_event_value(self, key, value):
+        """Window.write_event_value"""
+        self.events.append((key, value))
+
+
+def test_wakeups_are_coalesced_until_acknowledged():
+    window = EventWindow()
+    wakeup = GuiWakeup(window, "-FRAME-")
+    wakeup.notify()
+    wakeup.notify()
+    assert window.events == [("-FRAME-", None)]
+    wakeup.acknowledge()
+    wakeup.notify()
+    assert len(window.events) == 2
+
+
+def test_wakeups_from_many_threads_post_one_event():
+    window = EventWindow()
+    wakeup = GuiWakeup(window, "-FRAME-")
+    threads = [threading.Thread(target=wakeup.notify) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(window.events) >= 1
+    wakeup.acknowledge()
+    events = len(window.events)
+    wakeup.notify()
+    assert len(window.events) == events + 1
+
+
+def test_throttle_limits_the_render_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(
+        gui_render, "time", types.SimpleNamespace(monotonic=lambda: now[0])
+    )
+    throttle = RenderThrottle(20)
+    assert throttle.ready()
+    assert throttle.timeout_ms() == 0
+    throttle.rendered()
+    now[0] += 0.02
+    assert not throttle.ready()
+    assert 30 <= throttle.timeout_ms() <= 31
+    now[0] += 0.031
+    assert throttle.ready()
+    assert throttle.timeout_ms() == 0
+
+
+def test_throttle_without_a_limit_is_always_ready():
+    throttle = RenderThrottle(0)
+    throttle.rendered()
+    assert throttle.ready()
+    assert throttle.timeout_ms() <= 1
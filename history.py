@@ -0,0 +1,120 @@
+""" Time series history of the BMS HV signals. Fixed capacity ring buffers that are filled without allocations and a min/max decimation for plotting"""
+import numpy as np
+
+# 4 hours at the nominal 4 Hz frame rate
+DEFAULT_CAPACITY = 4 * 60 * 60 * 4
+
+SIGNALS = (
+    "current",
+    "min_cell_voltage",
+    "max_cell_voltage",
+    "max_temperature",
+    "soc",
+)
+
+
+class RingBuffer:
+    """Fixed capacity ring buffer of scalars or fixed shape rows backed by one preallocated NumPy array"""
+
+    def __init__(self, capacity, shape=(), dtype=np.float64):
+        self.capacity = capacity
+        self.count = 0
+        self._data = np.zeros((capacity, *shape), dtype=dtype)
+        self._next = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def shape(self):
+        """Shape of one value"""
+        return self._data.shape[1:]
+
+    def append(self, value):
+        """Overwrites the oldest value once the buffer is full"""
+        self._data[self._next] = value
+        self._next += 1
+        if self._next == self.capacity:
+            self._next = 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    def last(self):
+        """Returns the newest value"""
+        if self.count == 0:
+            raise IndexError("empty ring buffer")
+        return self._data[self._next - 1]
+
+    def tail(self, n=None, column=None):
+        """Returns the newest n values oldest first, optionally only one column of row values. It is a view unless the values wrap around the end of the array"""
+        n = self.count if n is None else min(n, self.count)
+        data = self._data if column is None else self._data[:, column]
+        start = self._next - n
+        if start >= 0:
+            return data[start : self._next]
+        return np.concatenate((data[start:], data[: self._next]))
+
+    def clear(self):
+        """Removes all values"""
+        self.count = 0
+        self._next = 0
+
+
+class History:
+    """History of the aggregate signals and of every cell voltage, one row per decoded frame"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.time = RingBuffer(capacity)
+        self.signals = {
+            name: RingBuffer(capacity, dtype=np.float32) for name in SIGNALS
+        }
+        # allocated with the first frame, the cell count is not known before
+        self.cell_voltage = None
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, bms_hv_data, receive_time, pack_stats):
+        """Appends one decoded frame with its pack statistics, the history restarts when the pack geometry changes"""
+        cell_voltage = bms_hv_data.cell_voltage
+        if self.cell_voltage is None or self.cell_voltage.shape != cell_voltage.shape:
+            self.clear()
+            self.cell_voltage = RingBuffer(
+                self.capacity, (cell_voltage.size,), np.float32
+            )
+
+        self.time.append(receive_time)
+        self.signals["current"].append(bms_hv_data.current)
+        # the aggregates leave the unused channels out like the statistics panel
+        self.signals["min_cell_voltage"].append(pack_stats.cell_voltage.minimum)
+        self.signals["max_cell_voltage"].append(pack_stats.cell_voltage.maximum)
+        self.signals["max_temperature"].append(pack_stats.temperature.maximum)
+        self.signals["soc"].append(pack_stats.soc.mean)
+        self.cell_voltage.append(cell_voltage)
+
+    def samples_since(self, start_time):
+        """Returns the number of newest samples received at or after start_time"""
+        times = self.time.tail()
+        return len(times) - int(np.searchsorted(times, start_time, side="left"))
+
+    def clear(self):
+        """Removes all samples"""
+        self.time.clear()
+        for ring_buffer in self.signals.values():
+            ring_buffer.clear()
+        if self.cell_voltage is not None:
+            self.cell_voltage.clear()
+
+
+def min_max_decimate(x, y, buckets):
+    """Reduces a series to the minimum and the maximum of each of buckets equally sized index ranges, peaks survive any reduction"""
+    n = len(y)
+    if n <= 2 * buckets:
+        return x, y
+    starts = np.linspace(0, n, buckets, endpoint=False).astype(np.intp)
+    decimated_x = np.repeat(x[starts], 2)
+    decimated_y = np.empty(2 * buckets, dtype=y.dtype)
+    decimated_y[0::2] = np.minimum.reduceat(y, starts)
+    decimated_y[1::2] = np.maximum.reduceat(y, starts)
+    return decimated_x, decimated_y
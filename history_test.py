@@ -0,0 +1,46 @@
+""" Tests of the signal history"""
+import numpy as np
+import pytest
+from history import History, RingBuffer, min_max_decimate
+from mock_bms_hv.mock_bms import MockBms
+from pack_geometry import PackGeometry
+from pack_stats import compute_pack_stats
+
+
+def test_aggregates_leave_the_unused_channels_out():
+    geometry = PackGeometry(unused_cells=[[14, 8]], unused_sensors=[[0, 2]])
+    data = MockBms(seed=6).data()
+    data.cell_voltage[134] = 0.0
+    data.temperature[2] = 99.0
+    pack_stats = compute_pack_stats(data, geometry)
+    history = History(capacity=4)
+    history.append(data, 1.0, pack_stats)
+
+    used = np.delete(data.cell_voltage, 134)
+    assert history.signals["min_cell_voltage"].last() == np.float32(used.min())
+    assert history.signals["max_cell_voltage"].last() == np.float32(used.max())
+    assert history.signals["max_temperature"].last() == np.float32(
+        np.delete(data.temperature, 2).max()
+    )
+    assert history.signals["soc"].last() == pytest.approx(data.soc.mean())
+    np.testing.assert_array_equal(history.cell_voltage.last(), data.cell_voltage)
+
+
+def test_ring_buffer_wraps_around():
+    ring_buffer = RingBuffer(3)
+    for value in range(5):
+        ring_buffer.append(value)
+    assert len(ring_buffer) == 3
+    np.testing.assert_array_equal(ring_buffer.tail(), [2, 3, 4])
+    np.testing.assert_array_equal(ring_buffer.tail(2), [3, 4])
+
+
+def test_min_max_decimate_keeps_the_peaks():
+    x = np.arange(100.0)
+    y = np.zeros(100)
+    y[37] = 5.0
+    y[81] = -5.0
+    decimated_x, decimated_y = min_max_decimate(x, y, 10)
+    assert len(decimated_x) == len(decimated_y) == 20
+    assert decimated_y.max() == 5.0
+    assert decimated_y.min() == -5.0
@@ -0,0 +1,215 @@
+""" Hot path instrumentation of the BMS HV Utility. Rolling latency histograms and counters that are cheap enough to stay on in production"""
+import bisect
+import json
+import os
+import time
+
+# bucket upper bounds in seconds, the last bucket catches everything above
+LATENCY_BUCKETS_SEC = (
+    0.00001,
+    0.00002,
+    0.00005,
+    0.0001,
+    0.0002,
+    0.0005,
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+)
+
+ROLLING_WINDOW_SEC = 60.0
+
+PROMETHEUS_PREFIX = "bms_hv_"
+
+
+class LatencyHistogram:
+    """Fixed bucket latency histogram over a rolling window, the previous window is kept for reporting
+
+    Cumulative totals that never reset are kept next to the window for the Prometheus export
+    """
+
+    def __init__(self, window_sec=ROLLING_WINDOW_SEC):
+        self.window_sec = window_sec
+        self._window_start = time.monotonic()
+        self._counts = [0] * (len(LATENCY_BUCKETS_SEC) + 1)
+        self._previous_counts = list(self._counts)
+        self._sum = 0.0
+        self._previous_sum = 0.0
+        self._max = 0.0
+        self._previous_max = 0.0
+        self.total_counts = list(self._counts)
+        self.total_sum = 0.0
+        self.total_count = 0
+
+    @property
+    def max(self):
+        """Returns the maximum of the previous and the current window"""
+        return max(self._previous_max, self._max)
+
+    def observe(self, seconds):
+        """Adds one latency sample"""
+        now = time.monotonic()
+        if now - self._window_start >= self.window_sec:
+            self._rotate(now)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_SEC, seconds)
+        self._counts[bucket] += 1
+        self._sum += seconds
+        self.total_counts[bucket] += 1
+        self.total_sum += seconds
+        self.total_count += 1
+        if seconds > self._max:
+            self._max = seconds
+
+    def _rotate(self, now):
+        """Starts a new window"""
+        self._previous_counts = self._counts
+        self._previous_sum = self._sum
+        self._previous_max = self._max
+        self._counts = [0] * len(self._counts)
+        self._sum = 0.0
+        self._max = 0.0
+        self._window_start = now
+
+    def counts(self):
+        """Returns the bucket counts of the previous and the current window"""
+        return [a + b for a, b in zip(self._previous_counts, self._counts)]
+
+    def percentile(self, percentile):
+        """Returns the upper bound of the bucket holding the percentile or None without samples"""
+        counts = self.counts()
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = total * percentile / 100
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_SEC, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        """Returns the histogram as a dict"""
+        counts = self.counts()
+        total = sum(counts)
+        bounds = [str(bound) for bound in LATENCY_BUCKETS_SEC] + ["+Inf"]
+        return {
+            "count": total,
+            "mean": (self._previous_sum + self._sum) / total if total else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": dict(zip(bounds, counts)),
+            "total": {
+                "count": self.total_count,
+                "sum": self.total_sum,
+                "buckets": dict(zip(bounds, self.total_counts)),
+            },
+        }
+
+
+class Metrics:
+    """Per frame latency histograms and event counters of the whole pipeline"""
+
+    HISTOGRAMS = (
+        # receive timestamp until the frame is taken from the queue
+        "queue",
+        # duration of decoding one frame
+        "decode",
+        # duration of rendering one frame
+        "render",
+        # receive timestamp until the frame is on screen
+        "end_to_end",
+        # receive timestamp until the alarm rules were evaluated on the frame
+        "alarm",
+    )
+    COUNTERS = (
+        "frames_decoded",
+        "frames_rendered",
+        "json_errors",
+        "binary_errors",
+        "type_errors",
+        "alarms_raised",
+        "alarms_cleared",
+    )
+
+    def __init__(self, reader=None):
+        self.reader = reader
+        self.start_time = time.time()
+        self.histograms = {name: LatencyHistogram() for name in self.HISTOGRAMS}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def observe(self, name, seconds):
+        """Adds a latency sample to a histogram"""
+        self.histograms[name].observe(seconds)
+
+    def count(self, name, increment=1):
+        """Increments a counter"""
+        self.counters[name] += increment
+
+    def snapshot(self):
+        """Returns all metrics as a dict"""
+        counters = dict(self.counters)
+        if self.reader is not None:
+            counters["frames_received"] = self.reader.frames_received
+            counters["frames_dropped"] = self.reader.frames_dropped
+            counters["queue_full"] = self.reader.queue_full_events
+            counters["frames_rejected"] = self.reader.frames_rejected
+            counters["resyncs"] = self.reader.resyncs
+            counters["reconnects"] = self.reader.reconnects
+            counters["rediscoveries"] = self.reader.rediscoveries
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.start_time,
+            "counters": counters,
+            "latency": {
+                name: histogram.snapshot()
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+    def dump(self, path):
+        """Writes the metrics to path, as Prometheus text for *.prom files and as JSON otherwise"""
+        snapshot = self.snapshot()
+        if path.endswith(".prom"):
+            text = prometheus_text(snapshot)
+        else:
+            text = json.dumps(snapshot, indent=2)
+        # readers never see a half written file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temporary_path, path)
+
+
+def prometheus_text(snapshot):
+    """Formats a metrics snapshot in the Prometheus text exposition format
+
+    The histograms are exported from the cumulative totals, the rolling window
+    counts go down when the window rotates and would break rate()
+    """
+    lines = []
+    for name, value in snapshot["counters"].items():
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name}_total counter")
+        lines.append(f"{PROMETHEUS_PREFIX}{name}_total {value}")
+    for name, histogram in snapshot["latency"].items():
+        metric = f"{PROMETHEUS_PREFIX}{name}_latency_seconds"
+        total = histogram["total"]
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in total["buckets"].items():
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum {total['sum']}")
+        lines.append(f"{metric}_count {total['count']}")
+    return "\n".join(lines) + "\n"
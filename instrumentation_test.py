@@ -0,0 +1,154 @@
+""" Tests of the latency histograms, the counters and the Prometheus export"""
+import json
+import types
+import pytest
+import instrumentation
+from instrumentation import (
+    LATENCY_BUCKETS_SEC,
+    LatencyHistogram,
+    Metrics,
+    prometheus_text,
+)
+
+
+class FakeClock:
+    """Stand-in for the time module with a monotonic clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        """time.monotonic"""
+        return self.now
+
+    def time(self):
+        """time.time"""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the instrumentation module"""
+    fake = FakeClock()
+    monkeypatch.setattr(instrumentation, "time", fake)
+    return fake
+
+
+def test_samples_go_to_the_bucket_of_their_upper_bound():
+    histogram = LatencyHistogram()
+    histogram.observe(0.00001)
+    histogram.observe(0.0003)
+    histogram.observe(60.0)
+    counts = histogram.counts()
+    assert counts[0] == 1
+    assert counts[LATENCY_BUCKETS_SEC.index(0.0005)] == 1
+    assert counts[-1] == 1
+    assert histogram.max == 60.0
+
+
+def test_percentiles_are_bucket_upper_bounds():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    for _ in range(98):
+        histogram.observe(0.0015)
+    histogram.observe(0.015)
+    histogram.observe(0.15)
+    assert histogram.percentile(50) == 0.002
+    assert histogram.percentile(99) == 0.02
+    assert histogram.percentile(100) == 0.2
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["p90"] == 0.002
+    assert snapshot["mean"] == pytest.approx((98 * 0.0015 + 0.165) / 100)
+
+
+def test_percentile_above_the_last_bucket_is_the_max():
+    histogram = LatencyHistogram()
+    histogram.observe(7.5)
+    assert histogram.percentile(99) == 7.5
+
+
+def test_rolling_window_keeps_the_previous_window(clock):
+    histogram = LatencyHistogram(window_sec=10)
+    histogram.observe(0.5)
+    clock.now += 10
+    histogram.observe(0.001)
+    # the previous window still counts
+    assert sum(histogram.counts()) == 2
+    assert histogram.max == 0.5
+    clock.now += 10
+    histogram.observe(0.001)
+    assert sum(histogram.counts()) == 2
+    assert histogram.max == 0.001
+    # the totals never rotate
+    assert histogram.total_count == 3
+    assert histogram.total_sum == pytest.approx(0.502)
+
+
+def test_metrics_snapshot_includes_the_reader_counters(clock):
+    reader = types.SimpleNamespace(
+        frames_received=10,
+        frames_dropped=2,
+        queue_full_events=1,
+        frames_rejected=3,
+        resyncs=4,
+        reconnects=5,
+        rediscoveries=6,
+    )
+    metrics = Metrics(reader)
+    metrics.count("frames_decoded")
+    metrics.count("json_errors", 2)
+    metrics.observe("decode", 0.0001)
+    clock.now += 5
+    snapshot = metrics.snapshot()
+    assert snapshot["uptime"] == 5
+    assert snapshot["counters"]["frames_decoded"] == 1
+    assert snapshot["counters"]["json_errors"] == 2
+    assert snapshot["counters"]["frames_received"] == 10
+    assert snapshot["counters"]["rediscoveries"] == 6
+    assert snapshot["latency"]["decode"]["count"] == 1
+    assert set(snapshot["latency"]) == set(Metrics.HISTOGRAMS)
+
+
+def test_prometheus_histograms_are_cumulative_totals(clock):
+    metrics = Metrics()
+    metrics.count("frames_decoded", 3)
+    metrics.observe("decode", 0.00001)
+    metrics.observe("decode", 0.003)
+    # the window rotates twice, the exported histogram must not go down
+    clock.now += 2 * instrumentation.ROLLING_WINDOW_SEC
+    metrics.observe("decode", 0.003)
+    clock.now += 2 * instrumentation.ROLLING_WINDOW_SEC
+    metrics.observe("decode", 10.0)
+    lines = prometheus_text(metrics.snapshot()).splitlines()
+    assert "# TYPE bms_hv_frames_decoded_total counter" in lines
+    assert "bms_hv_frames_decoded_total 3" in lines
+    assert "# TYPE bms_hv_decode_latency_seconds histogram" in lines
+    assert 'bms_hv_decode_latency_seconds_bucket{le="1e-05"} 1' in lines
+    assert 'bms_hv_decode_latency_seconds_bucket{le="0.005"} 3' in lines
+    assert 'bms_hv_decode_latency_seconds_bucket{le="5.0"} 3' in lines
+    assert 'bms_hv_decode_latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "bms_hv_decode_latency_seconds_count 4" in lines
+    assert "bms_hv_queue_latency_seconds_count 0" in lines
+    buckets = [
+        int(line.rsplit(" ", 1)[1])
+        for line in lines
+        if line.startswith("bms_hv_decode_latency_seconds_bucket")
+    ]
+    assert buckets == sorted(buckets)
+    assert len(buckets) == len(LATENCY_BUCKETS_SEC) + 1
+
+
+@pytest.mark.parametrize("name", ["metrics.json", "metrics.prom"])
+def test_dump_writes_json_or_prometheus_text(tmp_path, name):
+    metrics = Metrics()
+    metrics.count("frames_rendered")
+    path = tmp_path / name
+    metrics.dump(str(path))
+    text = path.read_text(encoding="utf-8")
+    if name.endswith(".prom"):
+        assert "bms_hv_frames_rendered_total 1" in text
+    else:
+        assert json.loads(text)["counters"]["frames_rendered"] == 1
+    # the temporary file is renamed over the dump
+    assert [file.name for file in tmp_path.iterdir()] == [name]
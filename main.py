@@ -1,31 +1,48 @@
 """ This is the main file for the BMS HV Utility. It is used to display the data from the BMS HV and to change its settings"""
+import argparse
+import functools
 import json
-from types import SimpleNamespace
-from dataclasses import dataclass
-import queue
+import os
 import threading
-import sys
 import time
-from statistics import median
-import PySimpleGUI as sg
-import serial
-from colorama import Fore, Style
-import numpy as np
-
-sg.theme("Material2")
-sg.set_options(font=("Helvetica", 11))
+from gui_render import BarChart, DiffRenderer, GuiWakeup, RenderThrottle, TrendPlot
+from pack_geometry import DEFAULT_PACK_GEOMETRY
+from pack_stats import compute_pack_stats
+from wire_protocol import ERROR_FIELDS, FrameError, decode_frame
+from console import print_ok, print_error
+from formatting import (
+    CachedRowFormatter,
+    alarm_rows,
+    float_to_string_with_precision,
+    soc_rows,
+    error_rows,
+    pack_summary_row,
+)
+from serial_reader import drain_queue
+from serial_writer import PRIORITY_HIGH, PRIORITY_NORMAL
+from async_link import AsyncLinkRunner
+from delta_decoder import ALL_FIELDS, changed_fields
+from packs import (
+    MULTI_PACK_HISTORY_CAPACITY,
+    Pack,
+    pack_path,
+    pack_slug,
+    parse_pack_ports,
+)
 
 IMAGE_PATH = "putm_logo.png"
 
-SERIAL_DATA_IN_FREQ_SEC = 0.250
-
-STANDARD_TEXT_WIDTH = 9
+# when set only the newest frame is delivered to the GUI, older ones are counted as dropped
+SERIAL_READ_LATEST_ONLY = False
 
-CELL_VOLTAGE_TABLE_COLUMNS = 15
-CELL_VOLTAGE_TABLE_ROWS = 9
+# the GUI is woken up by the serial task, the timeout only refreshes the status labels
+GUI_IDLE_TIMEOUT_MS = 1000
+# frames arriving faster than this are coalesced, only the newest one is rendered
+GUI_MAX_RENDER_FPS = 20
+# the diagnostics panel and the metrics file are refreshed this often
+METRICS_INTERVAL_SEC = 1.0
 
-TEMPERATURE_TABLE_COLUMNS = 15
-TEMPERATURE_TABLE_ROWS = 3
+STANDARD_TEXT_WIDTH = 9
 
 ERROR_TABLE_COLUMNS = 2
 ERROR_TABLE_ROWS = 6
@@ -33,10 +50,79 @@ ERROR_TABLE_ROWS = 6
 SOC_TABLE_COLUMNS = 4
 SOC_TABLE_ROWS = 1
 
+ALARM_TABLE_HEADINGS = ["Pack", "Alarm", "Channels", "Active [s]"]
+ALARM_TABLE_ROWS = 4
+
 FLOAT_PRECISION = 4
 
+# the formatted strings are cached per value and the table rows are reused by every frame
+CELL_VOLTAGE_FORMATTER = CachedRowFormatter(FLOAT_PRECISION)
+TEMPERATURE_FORMATTER = CachedRowFormatter(FLOAT_PRECISION)
+
+CHART_SIZE = (900, 360)
+CELL_VOLTAGE_CHART_RANGE = (2.8, 4.3)
+TEMPERATURE_CHART_RANGE = (0.0, 70.0)
+
+TREND_WINDOWS = {"1 min": 60, "10 min": 600, "1 h": 3600, "All": None}
+TREND_DEFAULT_WINDOW = "10 min"
+TREND_NO_CELL = "-"
+
+
+def trend_cells(layout):
+    """Returns {name: channel} of the used cells, named by LTC and row like in the cell voltage table"""
+    names = {}
+    for channel in range(layout.size) if layout.used is None else layout.used:
+        ltc, row = layout.locate(int(channel))
+        names[f"LTC {ltc} Cell {row}"] = int(channel)
+    return names
+
+
+TREND_CELLS = trend_cells(DEFAULT_PACK_GEOMETRY.cells)
+TREND_PANELS = [
+    ("Current [A]", ["current"]),
+    (
+        "Cell Voltage Min/Max/Selected [V]",
+        ["min_cell_voltage", "max_cell_voltage", "cell"],
+    ),
+    ("Max Temperature [°C]", ["max_temperature"]),
+    ("SoC Avg", ["soc"]),
+]
+
+PACK_TABLE_HEADINGS = [
+    "Pack",
+    "Link",
+    "Current [A]",
+    "Min Cell [V]",
+    "Max Cell [V]",
+    "Max Temp [°C]",
+    "SoC Avg [%]",
+    "Errors",
+    "Age [s]",
+]
+PACK_TABLE_PRECISION = 3
+
+# fields displayed by the cell voltage table and chart
+CELL_FIELDS = ("cell_voltage", "discharge")
+
+EVENT_NEW_FRAME = "-NEW-FRAME-"
+EVENT_ALARM = "-ALARM-"
+
+KEY_PACK = "-PACK-"
 KEY_CONNECTION_STATUS = "-CONNECTION-STATUS-"
 KEY_TIMESTAMP = "-TIMESTAMP-"
+KEY_DROPPED_FRAMES = "-DROPPED-FRAMES-"
+KEY_COMMAND_LATENCY = "-COMMAND-LATENCY-"
+
+KEY_DIAG_FRAMES_RECEIVED = "-DIAG-FRAMES-RECEIVED-"
+KEY_DIAG_QUEUE_FULL = "-DIAG-QUEUE-FULL-"
+KEY_DIAG_FRAME_ERRORS = "-DIAG-FRAME-ERRORS-"
+KEY_DIAG_RESYNCS = "-DIAG-RESYNCS-"
+KEY_DIAG_RECONNECTS = "-DIAG-RECONNECTS-"
+KEY_DIAG_QUEUE_LATENCY = "-DIAG-QUEUE-LATENCY-"
+KEY_DIAG_DECODE_LATENCY = "-DIAG-DECODE-LATENCY-"
+KEY_DIAG_RENDER_LATENCY = "-DIAG-RENDER-LATENCY-"
+KEY_DIAG_END_TO_END_LATENCY = "-DIAG-END-TO-END-LATENCY-"
+KEY_DIAG_ALARM_LATENCY = "-DIAG-ALARM-LATENCY-"
 
 KEY_CELL_MAX_VOLTAGE = "-MAX-VOLTAGE-"
 KEY_CELL_MAX_VOLTAGE_LTC = "-MAX-VOLTAGE-LTC-"
@@ -46,6 +132,9 @@ KEY_CELL_MIN_VOLTAGE = "-MIN-VOLTAGE-"
 KEY_CELL_MIN_VOLTAGE_LTC = "-MIN-VOLTAGE-LTC-"
 KEY_CELL_MIN_VOLTAGE_CELL = "-MIN-VOLTAGE-CELL-"
 
+KEY_CELL_VOLTAGE_SPREAD = "-VOLTAGE-SPREAD-"
+KEY_CELL_VOLTAGE_STD = "-VOLTAGE-STD-"
+
 KEY_MAX_TEMPERATURE = "-MAX-TEMPERATURE-"
 KEY_CURRENT = "-CURRENT-"
 KEY_ACC_VOLTAGE = "-ACC-VOLTAGE-"
@@ -54,553 +143,1138 @@ KEY_SOC = "-SOC-"
 KEY_CELL_VOLTAGE = "-CELL-VOLTAGE-"
 KEY_TEMPERATURE = "-TEMPERATURE-"
 KEY_ERROR = "-CELL-ERRORS-"
+KEY_ALARMS = "-ALARMS-"
 KEY_CHARGING_STATUS = "-CHARGING-STATUS-"
 KEY_BALANCE_STATUS = "-BALANCE-STATUS-"
 
-
-@dataclass
-class BmsHvData:
-    """Dataclass for BMS HV data"""
-
-    current: float
-    acc_voltage: float
-    car_voltage: float
-    soc: list[float]
-    cell_voltage: list[float]
-    temperature: list[float]
-    discharge: list[int]
-    balance: int
-    charging: int
-    under_voltage: list[int]
-    over_voltage: list[int]
-    under_temperature: list[int]
-    over_temperature: list[int]
-    over_current: list[int]
-    current_sensor_disconnected: list[int]
-    timestamp: float
-
-
-basic_info = [
-    [
-        sg.Text("Connection Status: "),
-        sg.Text("-", size=(12, 1), key=KEY_CONNECTION_STATUS, justification="l"),
-    ],
-    [
-        sg.Text("Timestamp:"),
-        sg.Text("-", auto_size_text=True, key=KEY_TIMESTAMP),
-        sg.Text("s"),
-    ],
-    [
-        sg.Text("Current:"),
-        sg.Text("-", auto_size_text=True, key=KEY_CURRENT),
-        sg.Text("A"),
-    ],
-    # [
-    #     sg.Text("Acc Voltage:"),
-    #     sg.Text("-", auto_size_text=True, key=KEY_ACC_VOLTAGE),
-    #     sg.Text("V"),
-    # ],
-    # [
-    #     sg.Text("Car Voltage:"),
-    #     sg.Text("-", auto_size_text=True, key=KEY_CAR_VOLTAGE),
-    #     sg.Text("V"),
-    # ],
-    [
-        sg.Text("Charging Status:"),
-        sg.Text("-", auto_size_text=True, key=KEY_CHARGING_STATUS),
-    ],
-    [
-        sg.Text("Balance Status:"),
-        sg.Text("-", auto_size_text=True, key=KEY_BALANCE_STATUS),
-    ],
-]
-
-cell_voltage = [
-    [
-        sg.Table(
-            values=[
-                ["-" for i in range(CELL_VOLTAGE_TABLE_COLUMNS)]
-                for j in range(CELL_VOLTAGE_TABLE_ROWS)
+KEY_TABS = "-TABS-"
+KEY_TAB_TABLES = "-TAB-TABLES-"
+KEY_TAB_CELL_VOLTAGE_CHART = "-TAB-CELL-VOLTAGE-CHART-"
+KEY_TAB_TEMPERATURE_CHART = "-TAB-TEMPERATURE-CHART-"
+KEY_CELL_VOLTAGE_CHART = "-CELL-VOLTAGE-CHART-"
+KEY_TEMPERATURE_CHART = "-TEMPERATURE-CHART-"
+KEY_TAB_TRENDS = "-TAB-TRENDS-"
+KEY_TREND_PLOT = "-TREND-PLOT-"
+KEY_TREND_WINDOW = "-TREND-WINDOW-"
+KEY_TREND_CELL = "-TREND-CELL-"
+KEY_TAB_PACKS = "-TAB-PACKS-"
+KEY_PACKS = "-PACKS-"
+
+# button -> (message, priority, coalesce key), commands with the same key replace each other
+COMMANDS = {
+    "Full Battery Soc": ("!B-FC@", PRIORITY_NORMAL, "full_battery_soc"),
+    "Start Charging": ("!C-ON@", PRIORITY_NORMAL, "charging"),
+    "Stop Charging": ("!C-OF@", PRIORITY_HIGH, "charging"),
+    "Start Balance": ("!B-ON@", PRIORITY_NORMAL, "balance"),
+    "Stop Balance": ("!B-OF@", PRIORITY_HIGH, "balance"),
+    "Set Charge Current to 1A": ("!I-1A@", PRIORITY_NORMAL, "charge_current"),
+    "Set Charge Current to 2A": ("!I-2A@", PRIORITY_NORMAL, "charge_current"),
+    "Set Charge Current to 4A": ("!I-4A@", PRIORITY_NORMAL, "charge_current"),
+    "Set Charge Current to 8A": ("!I-8A@", PRIORITY_NORMAL, "charge_current"),
+    "Set Charge Current to 12A": ("!I-12@", PRIORITY_NORMAL, "charge_current"),
+}
+
+
+def create_window(pack_names=None, geometry=DEFAULT_PACK_GEOMETRY):
+    """Builds the main window, PySimpleGUI is imported only here and in main so that importing this module creates no Tk state. With several pack names it gets a pack selector and a pack summary tab"""
+    import PySimpleGUI as sg
+
+    sg.theme("Material2")
+    sg.set_options(font=("Helvetica", 11))
+
+    multi_pack = pack_names is not None and len(pack_names) > 1
+
+    basic_info = [
+        [
+            sg.Text("Connection Status: "),
+            sg.Text("-", size=(12, 1), key=KEY_CONNECTION_STATUS, justification="l"),
+        ],
+        [
+            sg.Text("Timestamp:"),
+            sg.Text("-", auto_size_text=True, key=KEY_TIMESTAMP),
+            sg.Text("s"),
+        ],
+        [
+            sg.Text("Dropped Frames:"),
+            sg.Text("0", auto_size_text=True, key=KEY_DROPPED_FRAMES),
+        ],
+        [
+            sg.Text("Command Latency:"),
+            sg.Text("-", auto_size_text=True, key=KEY_COMMAND_LATENCY),
+            sg.Text("ms"),
+        ],
+        [
+            sg.Text("Current:"),
+            sg.Text("-", auto_size_text=True, key=KEY_CURRENT),
+            sg.Text("A"),
+        ],
+        # [
+        #     sg.Text("Acc Voltage:"),
+        #     sg.Text("-", auto_size_text=True, key=KEY_ACC_VOLTAGE),
+        #     sg.Text("V"),
+        # ],
+        # [
+        #     sg.Text("Car Voltage:"),
+        #     sg.Text("-", auto_size_text=True, key=KEY_CAR_VOLTAGE),
+        #     sg.Text("V"),
+        # ],
+        [
+            sg.Text("Charging Status:"),
+            sg.Text("-", auto_size_text=True, key=KEY_CHARGING_STATUS),
+        ],
+        [
+            sg.Text("Balance Status:"),
+            sg.Text("-", auto_size_text=True, key=KEY_BALANCE_STATUS),
+        ],
+    ]
+    if multi_pack:
+        # the views and the commands follow the selected pack
+        basic_info.insert(
+            0,
+            [
+                sg.Text("Pack:"),
+                sg.Combo(
+                    list(pack_names),
+                    default_value=pack_names[0],
+                    readonly=True,
+                    enable_events=True,
+                    key=KEY_PACK,
+                ),
             ],
-            headings=[f"LTC {j}" for j in range(CELL_VOLTAGE_TABLE_COLUMNS)],
-            select_mode=sg.TABLE_SELECT_MODE_NONE,
-            display_row_numbers=True,
-            auto_size_columns=False,
-            justification="center",
-            num_rows=CELL_VOLTAGE_TABLE_ROWS,
-            enable_events=False,
-            hide_vertical_scroll=True,
-            key=KEY_CELL_VOLTAGE,
-            def_col_width=STANDARD_TEXT_WIDTH,
         )
-    ],
-    [
-        sg.Text("Max Voltage:"),
-        sg.Text("-", key=KEY_CELL_MAX_VOLTAGE, justification="l"),
-        sg.Text("V"),
-        sg.Text("LTC:"),
-        sg.Text("-", key=KEY_CELL_MAX_VOLTAGE_LTC, justification="l"),
-        sg.Text("Cell:"),
-        sg.Text("-", key=KEY_CELL_MAX_VOLTAGE_CELL, justification="l"),
-    ],
-    [
-        sg.Text("Min Voltage:"),
-        sg.Text("-", key=KEY_CELL_MIN_VOLTAGE, justification="l"),
-        sg.Text("V"),
-        sg.Text("LTC:"),
-        sg.Text("-", key=KEY_CELL_MIN_VOLTAGE_LTC, justification="l"),
-        sg.Text("Cell:"),
-        sg.Text("-", key=KEY_CELL_MIN_VOLTAGE_CELL, justification="l"),
-    ],
-]
 
-temperature = [
-    [
-        sg.Table(
-            values=[
-                ["-" for i in range(TEMPERATURE_TABLE_COLUMNS)]
-                for j in range(TEMPERATURE_TABLE_ROWS)
-            ],
-            headings=[f"Col {j+1}" for j in range(TEMPERATURE_TABLE_COLUMNS)],
-            select_mode=sg.TABLE_SELECT_MODE_NONE,
-            display_row_numbers=True,
-            auto_size_columns=False,
-            justification="center",
-            num_rows=TEMPERATURE_TABLE_ROWS,
-            enable_events=False,
-            hide_vertical_scroll=True,
-            key=KEY_TEMPERATURE,
-            def_col_width=STANDARD_TEXT_WIDTH,
-        )
-    ],
-    [
-        sg.Text("Max Temp:"),
-        sg.Text("-", key=KEY_MAX_TEMPERATURE, justification="L"),
-        sg.Text("°C"),
-    ],
-]
+    cell_voltage = [
+        [
+            sg.Table(
+                values=[
+                    ["-" for i in range(geometry.ltc_count)]
+                    for j in range(geometry.cells.row_count)
+                ],
+                headings=[f"LTC {j}" for j in range(geometry.ltc_count)],
+                select_mode=sg.TABLE_SELECT_MODE_NONE,
+                display_row_numbers=True,
+                auto_size_columns=False,
+                justification="center",
+                num_rows=geometry.cells.row_count,
+                enable_events=False,
+                hide_vertical_scroll=True,
+                key=KEY_CELL_VOLTAGE,
+                def_col_width=STANDARD_TEXT_WIDTH,
+            )
+        ],
+        [
+            sg.Text("Max Voltage:"),
+            sg.Text("-", key=KEY_CELL_MAX_VOLTAGE, justification="l"),
+            sg.Text("V"),
+            sg.Text("LTC:"),
+            sg.Text("-", key=KEY_CELL_MAX_VOLTAGE_LTC, justification="l"),
+            sg.Text("Cell:"),
+            sg.Text("-", key=KEY_CELL_MAX_VOLTAGE_CELL, justification="l"),
+        ],
+        [
+            sg.Text("Min Voltage:"),
+            sg.Text("-", key=KEY_CELL_MIN_VOLTAGE, justification="l"),
+            sg.Text("V"),
+            sg.Text("LTC:"),
+            sg.Text("-", key=KEY_CELL_MIN_VOLTAGE_LTC, justification="l"),
+            sg.Text("Cell:"),
+            sg.Text("-", key=KEY_CELL_MIN_VOLTAGE_CELL, justification="l"),
+        ],
+        [
+            sg.Text("Spread:"),
+            sg.Text("-", key=KEY_CELL_VOLTAGE_SPREAD, justification="l"),
+            sg.Text("V"),
+            sg.Text("Std Dev:"),
+            sg.Text("-", key=KEY_CELL_VOLTAGE_STD, justification="l"),
+            sg.Text("V"),
+        ],
+    ]
 
-error = [
-    [
-        sg.Table(
-            values=[
-                ["-" for i in range(ERROR_TABLE_COLUMNS)]
-                for j in range(ERROR_TABLE_ROWS)
-            ],
-            headings=["Error", "Value"],
-            select_mode=sg.TABLE_SELECT_MODE_NONE,
-            display_row_numbers=False,
-            auto_size_columns=False,
-            justification="r",
-            num_rows=ERROR_TABLE_ROWS,
-            enable_events=False,
-            hide_vertical_scroll=True,
-            key=KEY_ERROR,
-            def_col_width=14,
-        )
+    temperature = [
+        [
+            sg.Table(
+                values=[
+                    ["-" for i in range(geometry.ltc_count)]
+                    for j in range(geometry.temperatures.row_count)
+                ],
+                headings=[f"LTC {j}" for j in range(geometry.ltc_count)],
+                select_mode=sg.TABLE_SELECT_MODE_NONE,
+                display_row_numbers=True,
+                auto_size_columns=False,
+                justification="center",
+                num_rows=geometry.temperatures.row_count,
+                enable_events=False,
+                hide_vertical_scroll=True,
+                key=KEY_TEMPERATURE,
+                def_col_width=STANDARD_TEXT_WIDTH,
+            )
+        ],
+        [
+            sg.Text("Max Temp:"),
+            sg.Text("-", key=KEY_MAX_TEMPERATURE, justification="L"),
+            sg.Text("°C"),
+        ],
     ]
-]
 
-soc = [
-    [
-        sg.Table(
-            values=[
-                ["-" for i in range(SOC_TABLE_COLUMNS)] for j in range(SOC_TABLE_ROWS)
-            ],
-            headings=[
-                "Min",
-                "Max",
-                "Avg",
-                "Median",
-            ],
-            select_mode=sg.TABLE_SELECT_MODE_NONE,
-            display_row_numbers=False,
-            auto_size_columns=False,
-            justification="c",
-            num_rows=SOC_TABLE_ROWS,
-            enable_events=False,
-            hide_vertical_scroll=True,
-            key=KEY_SOC,
-            def_col_width=STANDARD_TEXT_WIDTH,
-        )
+    error = [
+        [
+            sg.Table(
+                values=[
+                    ["-" for i in range(ERROR_TABLE_COLUMNS)]
+                    for j in range(ERROR_TABLE_ROWS)
+                ],
+                headings=["Error", "Value"],
+                select_mode=sg.TABLE_SELECT_MODE_NONE,
+                display_row_numbers=False,
+                auto_size_columns=False,
+                justification="r",
+                num_rows=ERROR_TABLE_ROWS,
+                enable_events=False,
+                hide_vertical_scroll=True,
+                key=KEY_ERROR,
+                def_col_width=14,
+            )
+        ]
     ]
-]
 
+    alarms = [
+        [
+            sg.Table(
+                values=[
+                    ["-" for i in range(len(ALARM_TABLE_HEADINGS))]
+                    for j in range(ALARM_TABLE_ROWS)
+                ],
+                headings=ALARM_TABLE_HEADINGS,
+                select_mode=sg.TABLE_SELECT_MODE_NONE,
+                display_row_numbers=False,
+                auto_size_columns=False,
+                justification="r",
+                num_rows=ALARM_TABLE_ROWS,
+                enable_events=False,
+                hide_vertical_scroll=True,
+                key=KEY_ALARMS,
+                col_widths=[STANDARD_TEXT_WIDTH, 20, 28, STANDARD_TEXT_WIDTH],
+            )
+        ]
+    ]
 
-charge_control = [
-    [sg.Button("Full Battery Soc")],
-    [sg.Button("Start Charging")],
-    [sg.Button("Stop Charging")],
-    [sg.Button("Start Balance")],
-    [sg.Button("Stop Balance")],
-    [sg.Button("Set Charge Current to 1A")],
-    [sg.Button("Set Charge Current to 2A")],
-    [sg.Button("Set Charge Current to 4A")],
-    [sg.Button("Set Charge Current to 8A")],
-    [sg.Button("Set Charge Current to 12A")],
-]
+    soc = [
+        [
+            sg.Table(
+                values=[
+                    ["-" for i in range(SOC_TABLE_COLUMNS)]
+                    for j in range(SOC_TABLE_ROWS)
+                ],
+                headings=[
+                    "Min",
+                    "Max",
+                    "Avg",
+                    "Median",
+                ],
+                select_mode=sg.TABLE_SELECT_MODE_NONE,
+                display_row_numbers=False,
+                auto_size_columns=False,
+                justification="c",
+                num_rows=SOC_TABLE_ROWS,
+                enable_events=False,
+                hide_vertical_scroll=True,
+                key=KEY_SOC,
+                def_col_width=STANDARD_TEXT_WIDTH,
+            )
+        ]
+    ]
 
-exit_button = [[sg.Button("Exit")]]
+    charge_control = [
+        [sg.Button("Full Battery Soc")],
+        [sg.Button("Start Charging")],
+        [sg.Button("Stop Charging")],
+        [sg.Button("Start Balance")],
+        [sg.Button("Stop Balance")],
+        [sg.Button("Set Charge Current to 1A")],
+        [sg.Button("Set Charge Current to 2A")],
+        [sg.Button("Set Charge Current to 4A")],
+        [sg.Button("Set Charge Current to 8A")],
+        [sg.Button("Set Charge Current to 12A")],
+    ]
 
-image = sg.Image(IMAGE_PATH)
+    diagnostics = [
+        [
+            sg.Text("Frames Received:"),
+            sg.Text("0", auto_size_text=True, key=KEY_DIAG_FRAMES_RECEIVED),
+        ],
+        [
+            sg.Text("Queue Full:"),
+            sg.Text("0", auto_size_text=True, key=KEY_DIAG_QUEUE_FULL),
+        ],
+        [
+            sg.Text("Frame Errors:"),
+            sg.Text("0", auto_size_text=True, key=KEY_DIAG_FRAME_ERRORS),
+        ],
+        [
+            sg.Text("Resyncs:"),
+            sg.Text("0", auto_size_text=True, key=KEY_DIAG_RESYNCS),
+        ],
+        [
+            sg.Text("Reconnects:"),
+            sg.Text("0", auto_size_text=True, key=KEY_DIAG_RECONNECTS),
+        ],
+        [
+            sg.Text("Queue p50/p99:"),
+            sg.Text("-", auto_size_text=True, key=KEY_DIAG_QUEUE_LATENCY),
+            sg.Text("ms"),
+        ],
+        [
+            sg.Text("Decode p50/p99:"),
+            sg.Text("-", auto_size_text=True, key=KEY_DIAG_DECODE_LATENCY),
+            sg.Text("ms"),
+        ],
+        [
+            sg.Text("Render p50/p99:"),
+            sg.Text("-", auto_size_text=True, key=KEY_DIAG_RENDER_LATENCY),
+            sg.Text("ms"),
+        ],
+        [
+            sg.Text("End to End p50/p99:"),
+            sg.Text("-", auto_size_text=True, key=KEY_DIAG_END_TO_END_LATENCY),
+            sg.Text("ms"),
+        ],
+        [
+            sg.Text("Alarm p50/p99:"),
+            sg.Text("-", auto_size_text=True, key=KEY_DIAG_ALARM_LATENCY),
+            sg.Text("ms"),
+        ],
+    ]
 
-frame_basic_info = sg.Frame("Basic Info", basic_info)
-frame_charge_control = sg.Frame("Charge control", charge_control)
-frame_exit_button = sg.Frame("Exit", exit_button)
+    exit_button = [[sg.Button("Exit")]]
+
+    image = sg.Image(IMAGE_PATH)
+
+    frame_basic_info = sg.Frame("Basic Info", basic_info)
+    frame_charge_control = sg.Frame("Charge control", charge_control)
+    frame_diagnostics = sg.Frame("Diagnostics", diagnostics)
+    frame_exit_button = sg.Frame("Exit", exit_button)
+
+    frame_cell_voltage = sg.Frame("Cell Voltages", cell_voltage)
+    frame_temperature = sg.Frame("Temperatures", temperature)
+    frame_error = sg.Frame("Errors", error)
+    frame_soc = sg.Frame("Soc", soc)
+    frame_alarms = sg.Frame("Alarms", alarms)
+
+    column_left = sg.Column(
+        [
+            [frame_basic_info],
+            [frame_charge_control],
+            [frame_diagnostics],
+            [frame_exit_button],
+        ],
+        element_justification="l",
+        vertical_alignment="top",
+    )
+    tab_tables = sg.Tab(
+        "Tables",
+        [
+            [frame_cell_voltage],
+            [frame_temperature],
+            [frame_soc],
+            [frame_error, frame_alarms],
+        ],
+        key=KEY_TAB_TABLES,
+    )
+    # chart coordinates are canvas pixels, the bars are drawn on the Tk canvas directly
+    tab_cell_voltage_chart = sg.Tab(
+        "Cell Voltage Chart",
+        [
+            [
+                sg.Graph(
+                    CHART_SIZE,
+                    (0, CHART_SIZE[1]),
+                    (CHART_SIZE[0], 0),
+                    background_color="white",
+                    key=KEY_CELL_VOLTAGE_CHART,
+                )
+            ]
+        ],
+        key=KEY_TAB_CELL_VOLTAGE_CHART,
+    )
+    tab_temperature_chart = sg.Tab(
+        "Temperature Chart",
+        [
+            [
+                sg.Graph(
+                    CHART_SIZE,
+                    (0, CHART_SIZE[1]),
+                    (CHART_SIZE[0], 0),
+                    background_color="white",
+                    key=KEY_TEMPERATURE_CHART,
+                )
+            ]
+        ],
+        key=KEY_TAB_TEMPERATURE_CHART,
+    )
 
-frame_cell_voltage = sg.Frame("Cell Voltages", cell_voltage)
-frame_temperature = sg.Frame("Temperatures", temperature)
-frame_error = sg.Frame("Errors", error)
-frame_soc = sg.Frame("Soc", soc)
+    tab_trends = sg.Tab(
+        "Trends",
+        [
+            [
+                sg.Text("Window:"),
+                sg.Combo(
+                    list(TREND_WINDOWS),
+                    default_value=TREND_DEFAULT_WINDOW,
+                    readonly=True,
+                    enable_events=True,
+                    key=KEY_TREND_WINDOW,
+                ),
+                sg.Text("Cell:"),
+                sg.Combo(
+                    [TREND_NO_CELL, *trend_cells(geometry.cells)],
+                    default_value=TREND_NO_CELL,
+                    readonly=True,
+                    enable_events=True,
+                    key=KEY_TREND_CELL,
+                ),
+            ],
+            [
+                sg.Graph(
+                    CHART_SIZE,
+                    (0, CHART_SIZE[1]),
+                    (CHART_SIZE[0], 0),
+                    background_color="white",
+                    key=KEY_TREND_PLOT,
+                )
+            ],
+        ],
+        key=KEY_TAB_TRENDS,
+    )
 
-column_left = sg.Column(
-    [[frame_basic_info], [frame_charge_control], [frame_exit_button]],
-    element_justification="l",
-    vertical_alignment="top",
-)
-column_right = sg.Column(
-    [[frame_cell_voltage], [frame_temperature], [frame_soc], [frame_error]],
-    element_justification="l",
-    vertical_alignment="top",
-)
+    tabs = [tab_tables, tab_cell_voltage_chart, tab_temperature_chart, tab_trends]
+    if multi_pack:
+        # one row per pack, selecting a row drills down into the other tabs
+        tab_packs = sg.Tab(
+            "Packs",
+            [
+                [
+                    sg.Table(
+                        values=[
+                            [name] + ["-" for i in range(len(PACK_TABLE_HEADINGS) - 1)]
+                            for name in pack_names
+                        ],
+                        headings=PACK_TABLE_HEADINGS,
+                        select_mode=sg.TABLE_SELECT_MODE_BROWSE,
+                        display_row_numbers=False,
+                        auto_size_columns=False,
+                        justification="center",
+                        num_rows=len(pack_names),
+                        enable_events=True,
+                        hide_vertical_scroll=True,
+                        key=KEY_PACKS,
+                        def_col_width=STANDARD_TEXT_WIDTH + 2,
+                    )
+                ]
+            ],
+            key=KEY_TAB_PACKS,
+        )
+        tabs.insert(0, tab_packs)
+
+    column_right = sg.Column(
+        [
+            [
+                sg.TabGroup(
+                    [tabs],
+                    key=KEY_TABS,
+                    enable_events=True,
+                )
+            ]
+        ],
+        element_justification="l",
+        vertical_alignment="top",
+    )
 
-layout = [
-    [image],
-    [column_left, sg.VerticalSeparator(pad=None), column_right],
-]
-window = sg.Window("BMS HV Utility", layout, element_justification="c")
+    layout = [
+        [image],
+        [column_left, sg.VerticalSeparator(pad=None), column_right],
+    ]
+    return sg.Window("BMS HV Utility", layout, element_justification="c")
 
 
-def float_to_string_with_precision(value, precision):
-    """Converts a float to a string with the specified precision"""
-    return f"{value:.{precision}f}"
+def create_charts(window, geometry=DEFAULT_PACK_GEOMETRY):
+    """Creates the bar charts of the chart tabs, the window has to be finalized. The bars are the used channels grouped by LTC"""
+    return {
+        KEY_TAB_CELL_VOLTAGE_CHART: BarChart(
+            window[KEY_CELL_VOLTAGE_CHART],
+            *CELL_VOLTAGE_CHART_RANGE,
+            group_starts=geometry.cells.ltc_starts.tolist(),
+        ),
+        KEY_TAB_TEMPERATURE_CHART: BarChart(
+            window[KEY_TEMPERATURE_CHART],
+            *TEMPERATURE_CHART_RANGE,
+            group_starts=geometry.temperatures.ltc_starts.tolist(),
+        ),
+    }
+
+
+def receive_frames(
+    reader,
+    metrics,
+    history,
+    recorder,
+    previous=None,
+    geometry=DEFAULT_PACK_GEOMETRY,
+):
+    """Records and computes the statistics of every queued frame, returns (newest frame, receive time, pack statistics, changed fields) or None. The frames come decoded from the reader, see decode_on_reader, without a decode hook on the reader they are decoded here
+
+    The changed fields are those that differ from previous, the (frame, pack statistics) taken before, and the statistics of the unchanged arrays are reused. Frames the reader dropped cannot hide a change, the arrays are compared by identity with those of the previous frame taken
+    """
+    newest = None
+    previous_data, previous_stats = previous or (None, None)
+    changed = set()
+    for received_frame in drain_queue(reader.read_queue):
+        metrics.observe("queue", time.time() - received_frame.timestamp)
+        bms_hv_data = received_frame.bms_hv_data
+        if reader.decode is None:
+            bms_hv_data = decode_received_frame(received_frame, metrics)
+            if bms_hv_data is None:
+                continue
+        frame_changed_fields = changed_fields(bms_hv_data, previous_data)
+        changed |= frame_changed_fields
+        # the history plots the same statistics the panel shows
+        previous_stats = compute_pack_stats(
+            bms_hv_data,
+            geometry,
+            previous_stats,
+            frame_changed_fields,
+        )
+        previous_data = bms_hv_data
+        newest = (bms_hv_data, received_frame.timestamp, previous_stats)
+        history.append(*newest)
+        if recorder is not None:
+            recorder.record(bms_hv_data, received_frame.timestamp)
 
+    if newest is None:
+        return None
+    return (*newest, changed)
 
-def mark_cell_if_discharge(value, is_discharging):
-    """Marks a cell if it is discharging"""
-    return (f"#{value}#") if is_discharging else value
 
+def decode_on_reader(pack, alarm_monitor=None):
+    """Makes the reader of a pack decode every frame on the reading thread with the delta decoder of the pack, receive_frames takes them decoded. The alarm monitor gets every decoded frame right there, also those the read queue drops later"""
+    pack.reader.decode = functools.partial(
+        decode_received_frame, metrics=pack.metrics, decoder=pack.decoder
+    )
+    if alarm_monitor is not None:
+        pack.reader.on_decoded = functools.partial(alarm_monitor.submit, pack.name)
+
+
+def render_trends(trend_plot, history, values, trend_cells=TREND_CELLS):
+    """Plots the history over the selected window"""
+    window_sec = TREND_WINDOWS[values[KEY_TREND_WINDOW]]
+    if not len(history):
+        # a pack without frames clears the lines of the previous one
+        trend_plot.update(history.time.tail(), {}, window_sec or 1.0)
+        return
+    if window_sec is None:
+        samples = len(history)
+    else:
+        samples = history.samples_since(history.time.last() - window_sec)
+    times = history.time.tail(samples)
+    signals = {
+        name: ring_buffer.tail(samples) for name, ring_buffer in history.signals.items()
+    }
+    cell = trend_cells.get(values[KEY_TREND_CELL])
+    if cell is not None and cell < history.cell_voltage.shape[0]:
+        signals["cell"] = history.cell_voltage.tail(samples, cell)
+    if window_sec is None:
+        window_sec = max(times[-1] - times[0], 1.0)
+    trend_plot.update(times, signals, window_sec)
+
+
+def render_frame(
+    renderer,
+    bms_hv_data,
+    pack_stats,
+    charts=None,
+    active_tab=None,
+    changed_fields=ALL_FIELDS,
+    geometry=DEFAULT_PACK_GEOMETRY,
+):
+    """Displays a decoded frame and its statistics, only the chart of the active tab is drawn. Tables and charts whose fields did not change since the last displayed frame are skipped"""
+    renderer.begin_frame()
+    cells_changed = not changed_fields.isdisjoint(CELL_FIELDS)
+    temperatures_changed = "temperature" in changed_fields
+
+    # BASIC INFO
+    renderer.update_text(
+        KEY_TIMESTAMP,
+        float_to_string_with_precision((bms_hv_data.timestamp / 1000), 3),
+    )
+    renderer.update_text(
+        KEY_MAX_TEMPERATURE,
+        float_to_string_with_precision(pack_stats.temperature.maximum, FLOAT_PRECISION),
+    )
+    renderer.update_text(
+        KEY_CURRENT,
+        float_to_string_with_precision(bms_hv_data.current, FLOAT_PRECISION),
+    )
+    # window[KEY_ACC_VOLTAGE].update(
+    #     float_to_string_with_precision(bms_hv_data.acc_voltage, FLOAT_PRECISION)
+    # )
+    # window[KEY_CAR_VOLTAGE].update(
+    #     float_to_string_with_precision(bms_hv_data.car_voltage, FLOAT_PRECISION)
+    # )
+    renderer.update_text(KEY_CHARGING_STATUS, "On" if bms_hv_data.charging else "Off")
+    renderer.update_text(KEY_BALANCE_STATUS, "On" if bms_hv_data.balance else "Off")
+
+    # CELL VOLTAGE TABLE
+    if cells_changed:
+        renderer.update_table(
+            KEY_CELL_VOLTAGE,
+            CELL_VOLTAGE_FORMATTER.rows(
+                bms_hv_data.cell_voltage, geometry.cells, bms_hv_data.discharge
+            ),
+        )
+    renderer.update_text(
+        KEY_CELL_MAX_VOLTAGE,
+        float_to_string_with_precision(
+            pack_stats.cell_voltage.maximum, FLOAT_PRECISION
+        ),
+    )
+    renderer.update_text(KEY_CELL_MAX_VOLTAGE_LTC, pack_stats.max_voltage_ltc)
+    renderer.update_text(KEY_CELL_MAX_VOLTAGE_CELL, pack_stats.max_voltage_cell)
+
+    renderer.update_text(
+        KEY_CELL_MIN_VOLTAGE,
+        float_to_string_with_precision(
+            pack_stats.cell_voltage.minimum, FLOAT_PRECISION
+        ),
+    )
+    renderer.update_text(KEY_CELL_MIN_VOLTAGE_LTC, pack_stats.min_voltage_ltc)
+    renderer.update_text(KEY_CELL_MIN_VOLTAGE_CELL, pack_stats.min_voltage_cell)
+
+    renderer.update_text(
+        KEY_CELL_VOLTAGE_SPREAD,
+        float_to_string_with_precision(pack_stats.cell_voltage.spread, FLOAT_PRECISION),
+    )
+    renderer.update_text(
+        KEY_CELL_VOLTAGE_STD,
+        float_to_string_with_precision(pack_stats.cell_voltage.std, FLOAT_PRECISION),
+    )
 
-def print_ok(msg):
-    """Prints an ok message"""
-    print(f"{Fore.GREEN}{msg}{Style.RESET_ALL}")
+    # TEMPERATURE TABLE
+    if temperatures_changed:
+        renderer.update_table(
+            KEY_TEMPERATURE,
+            TEMPERATURE_FORMATTER.rows(bms_hv_data.temperature, geometry.temperatures),
+        )
 
+    # SOC TABLE
+    if "soc" in changed_fields:
+        renderer.update_table(
+            KEY_SOC, soc_rows(pack_stats, SOC_TABLE_COLUMNS, FLOAT_PRECISION)
+        )
 
-def print_error(msg):
-    """Prints an error message"""
-    print(f"{Fore.RED}{msg}{Style.RESET_ALL}")
+    # ERROR TABLE
+    if not changed_fields.isdisjoint(ERROR_FIELDS):
+        renderer.update_table(KEY_ERROR, error_rows(bms_hv_data))
+
+    # CHARTS
+    if charts is not None:
+        if active_tab == KEY_TAB_CELL_VOLTAGE_CHART and cells_changed:
+            cells = geometry.cells.for_size(len(bms_hv_data.cell_voltage))
+            charts[active_tab].update(
+                cells.used_values(bms_hv_data.cell_voltage),
+                cells.used_values(bms_hv_data.discharge),
+            )
+        elif active_tab == KEY_TAB_TEMPERATURE_CHART and temperatures_changed:
+            temperatures = geometry.temperatures.for_size(len(bms_hv_data.temperature))
+            charts[active_tab].update(temperatures.used_values(bms_hv_data.temperature))
+    renderer.end_frame()
+
+
+def render_no_frame(renderer, charts, geometry=DEFAULT_PACK_GEOMETRY):
+    """Clears the frame views, for a selected pack that has not sent a frame yet"""
+    for key in (
+        KEY_TIMESTAMP,
+        KEY_MAX_TEMPERATURE,
+        KEY_CURRENT,
+        KEY_CHARGING_STATUS,
+        KEY_BALANCE_STATUS,
+        KEY_CELL_MAX_VOLTAGE,
+        KEY_CELL_MAX_VOLTAGE_LTC,
+        KEY_CELL_MAX_VOLTAGE_CELL,
+        KEY_CELL_MIN_VOLTAGE,
+        KEY_CELL_MIN_VOLTAGE_LTC,
+        KEY_CELL_MIN_VOLTAGE_CELL,
+        KEY_CELL_VOLTAGE_SPREAD,
+        KEY_CELL_VOLTAGE_STD,
+    ):
+        renderer.update_text(key, "-")
+    for key, columns, rows in (
+        (KEY_CELL_VOLTAGE, geometry.ltc_count, geometry.cells.row_count),
+        (KEY_TEMPERATURE, geometry.ltc_count, geometry.temperatures.row_count),
+        (KEY_SOC, SOC_TABLE_COLUMNS, SOC_TABLE_ROWS),
+        (KEY_ERROR, ERROR_TABLE_COLUMNS, ERROR_TABLE_ROWS),
+    ):
+        renderer.update_table(key, [["-"] * columns for _ in range(rows)])
+    for chart in charts.values():
+        chart.graph.TKCanvas.delete("all")
+        chart.invalidate()
+
+
+def render_pack_summary(renderer, packs, now):
+    """Displays one summary row per pack"""
+    rows = []
+    for pack in packs:
+        data, pack_stats = pack.last_frame or (None, None)
+        age = None if pack.last_receive_time is None else now - pack.last_receive_time
+        rows.append(
+            pack_summary_row(
+                pack.name,
+                pack.connected_event.is_set(),
+                data,
+                pack_stats,
+                age,
+                PACK_TABLE_PRECISION,
+            )
+        )
+    renderer.update_table(KEY_PACKS, rows)
 
 
-def print_warning(msg):
-    """Prints a warning message"""
-    print(f"{Fore.YELLOW}{msg}{Style.RESET_ALL}")
+def render_alarms(renderer, alarm_source, packs, now, geometry=DEFAULT_PACK_GEOMETRY):
+    """Displays the active host alarms of every pack, alarm_source is the alarm monitor or the worker process"""
+    alarms = [
+        (pack.name, *alarm)
+        for pack in packs
+        for alarm in alarm_source.active(pack.name)
+    ]
+    renderer.update_table(
+        KEY_ALARMS,
+        alarm_rows(alarms, now, ALARM_TABLE_ROWS, geometry),
+    )
 
 
-def to_matrix(l, columns):
-    """Converts a list to a matrix with the specified number of columns"""
-    matrix = np.reshape(np.array(l), (columns, -1)).T
-    return matrix
+def decode_received_frame(received_frame, metrics, decoder=None):
+    """Decodes a received frame, returns None if the frame is invalid. A frame the splitter decoded already is not parsed again"""
+    try:
+        decode_start = time.perf_counter()
+        if decoder is not None:
+            bms_hv_data = decoder.decode(
+                received_frame.data, received_frame.bms_hv_data
+            )
+        elif received_frame.bms_hv_data is not None:
+            bms_hv_data = received_frame.bms_hv_data
+        else:
+            bms_hv_data = decode_frame(received_frame.data)
+        metrics.observe("decode", time.perf_counter() - decode_start)
+        metrics.count("frames_decoded")
+        return bms_hv_data
+
+    except FrameError as error:
+        metrics.count("binary_errors")
+        print_error(f"Invalid binary frame: {error}")
+
+    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+        metrics.count("json_errors")
+        print_error(f"Invalid JSON: {received_frame.data}")
+
+    except (TypeError, ValueError):
+        metrics.count("type_errors")
+        print_error(f"Received JSON is not of type BmsHvData: {received_frame.data}")
+
+    return None
+
+
+def latency_to_string(histogram):
+    """Formats the p50/p99 of a latency histogram in ms"""
+    p50 = histogram.percentile(50)
+    p99 = histogram.percentile(99)
+    if p50 is None:
+        return "-"
+    return f"{p50 * 1000:g}/{p99 * 1000:g}"
+
+
+def render_diagnostics(renderer, metrics):
+    """Displays the instrumentation counters and latencies"""
+    counters = metrics.snapshot()["counters"]
+    renderer.update_text(KEY_DIAG_FRAMES_RECEIVED, counters["frames_received"])
+    renderer.update_text(KEY_DIAG_QUEUE_FULL, counters["queue_full"])
+    renderer.update_text(
+        KEY_DIAG_FRAME_ERRORS,
+        counters["frames_rejected"]
+        + counters["json_errors"]
+        + counters["binary_errors"]
+        + counters["type_errors"],
+    )
+    renderer.update_text(KEY_DIAG_RESYNCS, counters["resyncs"])
+    renderer.update_text(KEY_DIAG_RECONNECTS, counters["reconnects"])
+    renderer.update_text(
+        KEY_DIAG_QUEUE_LATENCY, latency_to_string(metrics.histograms["queue"])
+    )
+    renderer.update_text(
+        KEY_DIAG_DECODE_LATENCY, latency_to_string(metrics.histograms["decode"])
+    )
+    renderer.update_text(
+        KEY_DIAG_RENDER_LATENCY, latency_to_string(metrics.histograms["render"])
+    )
+    renderer.update_text(
+        KEY_DIAG_END_TO_END_LATENCY,
+        latency_to_string(metrics.histograms["end_to_end"]),
+    )
+    renderer.update_text(
+        KEY_DIAG_ALARM_LATENCY, latency_to_string(metrics.histograms["alarm"])
+    )
 
 
-def send_message_to_write_queue(write_queue, message):
-    """This function is used to send a message to the write queue"""
+def parse_args():
+    """Parses the command line arguments"""
+    parser = argparse.ArgumentParser(description="BMS HV Utility")
+    parser.add_argument(
+        "ports",
+        nargs="*",
+        metavar="port",
+        help="serial port of the BMS HV or a transport url, for example socket://localhost:5025 of daemon.py "
+        "or usb://VID:PID[/SERIAL] for a USB serial adapter wherever it enumerates. Several ports monitor several packs, a port can be named as NAME=PORT",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="record every received frame to session files in DIR, one subdirectory per pack with several packs",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="replay a session file, a session directory or a JSONL file instead of reading the serial port",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay speed multiplier, 0 replays as fast as possible (default: 1)",
+    )
+    parser.add_argument(
+        "--loop", action="store_true", help="restart the replay when it ends"
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="periodically dump the instrumentation to FILE, Prometheus text for *.prom and JSON otherwise, "
+        "one file per pack with several packs",
+    )
+    parser.add_argument(
+        "--process",
+        action="store_true",
+        help="read, decode and compute the statistics in a worker process",
+    )
+    parser.add_argument(
+        "--alarms",
+        metavar="FILE",
+        help="YAML file with the host alarm rules, see alarms.py (default: the built-in rules)",
+    )
+    parser.add_argument(
+        "--geometry",
+        metavar="FILE",
+        help="YAML file with the pack geometry, see pack_geometry.py (default: 15 LTCs with 9 cells and 3 sensors)",
+    )
+    args = parser.parse_args()
+    if (not args.ports) == (args.replay is None):
+        parser.error("either serial ports or --replay is required")
+    if args.process and args.replay is not None:
+        parser.error("--process can not be combined with --replay")
+    if args.process and len(args.ports) > 1:
+        parser.error("--process supports a single port")
     try:
-        write_queue.put_nowait(message)
-    except queue.Full:
-        print_error("The write queue is full, the message will be discarded")
-
-
-def serial_task(port, read_queue, write_queue, connected_event, exit_event):
-    """This function is used to read data from and to write data to the serial port"""
-    serial_task_prefix = "SERIAL TASK: "
-    write_prefix = "WRITE: "
-    read_prefix = "READ: "
-    keep_alive_prefix = "KEEP_ALIVE: "
-    keep_alive_message = "!C-CC@"
-
-    ser = serial.Serial()
-    ser.port = port
-    # this value has to be bigger than frequency of sending data from BMS HV
-    ser.timeout = SERIAL_DATA_IN_FREQ_SEC + 0.2
-
-    while not ser.is_open:
-        if exit_event.is_set():
-            return
+        args.packs = parse_pack_ports(args.ports) if args.ports else [("BMS HV", None)]
+    except ValueError as error:
+        parser.error(str(error))
+    args.alarm_rules = None
+    if args.alarms is not None:
+        from alarms import load_rules
+
         try:
-            ser.open()
-            connected_event.set()
-            print_ok(f"{serial_task_prefix} Serial port: {port} opened")
-        except serial.serialutil.SerialException:
-            print_error(f"{serial_task_prefix} Serial port: {port} not available")
-            time.sleep(1)
-            continue
+            args.alarm_rules = load_rules(args.alarms)
+        except (OSError, ValueError) as error:
+            parser.error(f"failed to load the alarm rules: {error}")
+    args.pack_geometry = DEFAULT_PACK_GEOMETRY
+    if args.geometry is not None:
+        from pack_geometry import load_geometry
 
-    while True:
-        if exit_event.is_set():
-            ser.close()
-            return
         try:
-            print_ok("-------------------------------------------------------")
-
-            # Keep alive
-            ser.write(keep_alive_message.encode("utf-8"))
-            print_ok(f"{keep_alive_prefix} Keep alive message sent to the serial port")
-
-            # Write data
-            try:
-                data = write_queue.get_nowait()
-                ser.write(data.encode("utf-8"))
-                print_ok(f"{write_prefix} New data sent to the serial port: {data}")
-            except queue.Empty:
-                print_warning(f"{write_prefix} Nothing to send to the serial port")
-
-            # Read data
-            try:
-                ser.reset_input_buffer()
-                ser.readline()
-                line = ser.readline().decode("utf-8")
-                if line == "":
-                    print_error(f"{read_prefix} Nothing received from the serial port")
-                    continue
-                read_queue.put_nowait(line)
-                print_ok(f"{read_prefix} New data received from the serial port")
-            except queue.Full:
-                print_warning(f"{read_prefix} Read queue is full")
-
-        except serial.serialutil.SerialException:
-            connected_event.clear()
-            print_error(f"{serial_task_prefix} Serial port: {port} disconnected")
-            while True:
-                if exit_event.is_set():
-                    return
-                try:
-                    ser.open()
-                    connected_event.set()
-                    break
-                except serial.serialutil.SerialException:
-                    print_error(
-                        f"{serial_task_prefix} Failed to reopen serial port: {port}"
-                    )
-                    time.sleep(1)
-                    continue
+            args.pack_geometry = load_geometry(args.geometry)
+        except (OSError, ValueError) as error:
+            parser.error(f"failed to load the pack geometry: {error}")
+    return args
 
 
 def main():
     """Main function"""
-    if len(sys.argv) != 2:
-        print_error("Usage: python main.py <serial_port>")
-        sys.exit(1)
+    args = parse_args()
+    import PySimpleGUI as sg
 
     print_ok("Starting...")
 
-    serial_task_connected_event = threading.Event()
     main_exit_event = threading.Event()
+    multi_pack = len(args.packs) > 1
+    geometry = args.pack_geometry
+    cells = trend_cells(geometry.cells)
+
+    worker = None
+    if args.process:
+        from worker_process import WorkerProcess
+
+        # started before Tk exists, the worker records every frame itself
+        worker = WorkerProcess(
+            args.ports[0],
+            geometry,
+            record_directory=args.record,
+            alarm_rules=args.alarm_rules,
+        )
+        worker.start()
+        packs = [Pack(args.packs[0][0], worker, worker, worker.connected_event)]
+    else:
+        # every pack keeps the history of every cell, several packs keep less of it
+        packs = [
+            Pack.for_port(
+                name,
+                SERIAL_READ_LATEST_ONLY,
+                MULTI_PACK_HISTORY_CAPACITY if multi_pack else None,
+            )
+            for name, _ in args.packs
+        ]
+    selected = packs[0]
+
+    # the window has to exist before the serial task can post events to it
+    window = create_window([pack.name for pack in packs], geometry).finalize()
+    frame_wakeup = GuiWakeup(window, EVENT_NEW_FRAME)
+    render_throttle = RenderThrottle(GUI_MAX_RENDER_FPS)
+    for pack in packs:
+        pack.reader.on_frames = frame_wakeup.notify
+
+    # the frames are decoded on the reading thread, the alarm rules see every one of them on their own thread
+    # right away, however long the GUI takes to drain the queue. The worker process evaluates them itself
+    alarm_monitor = None
+    alarm_source = worker
+    alarm_wakeup = GuiWakeup(window, EVENT_ALARM)
+    if worker is None:
+        from alarms import AlarmMonitor
+
+        alarm_monitor = alarm_source = AlarmMonitor(args.alarm_rules, geometry)
+        alarm_monitor.on_change = alarm_wakeup.notify
+        for pack in packs:
+            alarm_monitor.add_pack(pack.name, pack.metrics)
+            decode_on_reader(pack, alarm_monitor)
+        alarm_monitor.start()
+
+    replay_thread = None
+    link_runner = None
+    if args.replay is not None:
+        from replay import replay_task
+
+        replay_thread = threading.Thread(
+            target=replay_task,
+            args=(
+                args.replay,
+                selected.reader,
+                selected.connected_event,
+                main_exit_event,
+                args.speed,
+                args.loop,
+            ),
+            daemon=True,
+        )
+        replay_thread.start()
+    elif worker is None:
+        # all serial links run on one event loop thread, they are cancelled promptly on exit
+        link_runner = AsyncLinkRunner()
+        link_runner.start()
+        for pack, (_, port) in zip(packs, args.packs):
+            link_runner.add_link(
+                port,
+                pack.reader,
+                pack.write_scheduler,
+                pack.connected_event,
+                name=pack.name.upper() if multi_pack else None,
+            )
 
-    bms_hv_read_queue = queue.Queue(maxsize=1)
-    bms_hv_write_queue = queue.Queue(maxsize=1)
-
-    serial_task_thread = threading.Thread(
-        target=serial_task,
-        args=(
-            sys.argv[1],
-            bms_hv_read_queue,
-            bms_hv_write_queue,
-            serial_task_connected_event,
-            main_exit_event,
-        ),
-        daemon=True,
-    )
-    serial_task_thread.start()
-
-    while True:
-        event, values = window.read(timeout=500)
-
-        if serial_task_connected_event.is_set():
-            window[KEY_CONNECTION_STATUS].update("Connected")
-        else:
-            window[KEY_CONNECTION_STATUS].update("Disconnected")
-
-        if event == sg.WINDOW_CLOSED or event == "Exit":
-            break
-        
-        elif event == "Full Battery Soc":
-            send_message_to_write_queue(bms_hv_write_queue, "!B-FC@")
-
-        elif event == "Start Charging":
-            send_message_to_write_queue(bms_hv_write_queue, "!C-ON@")
+    if args.record is not None and worker is None:
+        from session_recorder import SessionRecorder
 
-        elif event == "Stop Charging":
-            send_message_to_write_queue(bms_hv_write_queue, "!C-OF@")
+        for pack in packs:
+            pack.recorder = SessionRecorder(
+                os.path.join(args.record, pack_slug(pack.name))
+                if multi_pack
+                else args.record
+            )
+            pack.recorder.start()
 
-        elif event == "Start Balance":
-            send_message_to_write_queue(bms_hv_write_queue, "!B-ON@")
+    renderer = DiffRenderer(window)
+    charts = create_charts(window, geometry)
+    trend_plot = TrendPlot(window[KEY_TREND_PLOT], TREND_PANELS)
+    next_metrics_time = time.monotonic()
+    frames_pending = False
 
-        elif event == "Stop Balance":
-            send_message_to_write_queue(bms_hv_write_queue, "!B-OF@")
+    while True:
+        event, values = window.read(
+            timeout=render_throttle.timeout_ms()
+            if frames_pending
+            else GUI_IDLE_TIMEOUT_MS
+        )
 
-        elif event == "Set Charge Current to 1A":
-            send_message_to_write_queue(bms_hv_write_queue, "!I-1A@")
+        if event == EVENT_NEW_FRAME:
+            frame_wakeup.acknowledge()
+            frames_pending = True
 
-        elif event == "Set Charge Current to 2A":
-            send_message_to_write_queue(bms_hv_write_queue, "!I-2A@")
+        if event == EVENT_ALARM:
+            alarm_wakeup.acknowledge()
+            render_alarms(renderer, alarm_source, packs, time.time(), geometry)
 
-        elif event == "Set Charge Current to 4A":
-            send_message_to_write_queue(bms_hv_write_queue, "!I-4A@")
+        if event == sg.WINDOW_CLOSED or event == "Exit":
+            break
 
-        elif event == "Set Charge Current to 8A":
-            send_message_to_write_queue(bms_hv_write_queue, "!I-8A@")
+        elif event in (KEY_PACK, KEY_PACKS):
+            if event == KEY_PACK:
+                index = [pack.name for pack in packs].index(values[KEY_PACK])
+            elif values[KEY_PACKS]:
+                index = values[KEY_PACKS][0]
+                window[KEY_PACK].update(value=packs[index].name)
+                # selecting a summary row drills down into the tables of the pack
+                window[KEY_TAB_TABLES].select()
+                values[KEY_TABS] = KEY_TAB_TABLES
+            else:
+                index = packs.index(selected)
+            if packs[index] is not selected:
+                selected = packs[index]
+                if selected.last_frame is None:
+                    render_no_frame(renderer, charts, geometry)
+                else:
+                    render_frame(
+                        renderer,
+                        *selected.last_frame,
+                        charts,
+                        values[KEY_TABS],
+                        geometry=geometry,
+                    )
+                selected.changed_fields.clear()
+                if values[KEY_TABS] == KEY_TAB_TRENDS:
+                    render_trends(trend_plot, selected.history, values, cells)
+                next_metrics_time = time.monotonic()
+
+        elif event == KEY_TABS and selected.last_frame is not None:
+            # a chart that was hidden is brought up to date right away
+            render_frame(
+                renderer,
+                *selected.last_frame,
+                charts,
+                values[KEY_TABS],
+                geometry=geometry,
+            )
+            selected.changed_fields.clear()
+            if values[KEY_TABS] == KEY_TAB_TRENDS:
+                render_trends(trend_plot, selected.history, values, cells)
 
-        elif event == "Set Charge Current to 12A":
-            send_message_to_write_queue(bms_hv_write_queue, "!I-12@")
+        elif event in (KEY_TREND_WINDOW, KEY_TREND_CELL):
+            render_trends(trend_plot, selected.history, values, cells)
 
-        if not bms_hv_read_queue.empty():
-            bms_hv_data_json = bms_hv_read_queue.get()
-            try:
-                bms_hv_data = json.loads(
-                    bms_hv_data_json, object_hook=lambda d: SimpleNamespace(**d)
-                )
-                bms_hv_data = BmsHvData(**bms_hv_data.__dict__)
+        elif event in COMMANDS:
+            message, priority, coalesce_key = COMMANDS[event]
+            selected.write_scheduler.submit(message, priority, coalesce_key)
 
-            except json.decoder.JSONDecodeError:
-                print_error(f"Invalid JSON: {bms_hv_data_json}")
-                continue
+        if selected.connected_event.is_set():
+            renderer.update_text(KEY_CONNECTION_STATUS, "Connected")
+        else:
+            renderer.update_text(KEY_CONNECTION_STATUS, "Disconnected")
+
+        last_latency = selected.write_scheduler.last_latency()
+        renderer.update_text(
+            KEY_COMMAND_LATENCY,
+            "-"
+            if last_latency is None
+            else float_to_string_with_precision(last_latency * 1000, 1),
+        )
+        renderer.update_text(KEY_DROPPED_FRAMES, selected.reader.frames_dropped)
+
+        if time.monotonic() >= next_metrics_time:
+            next_metrics_time = time.monotonic() + METRICS_INTERVAL_SEC
+            if worker is not None:
+                worker.update_metrics(selected.metrics)
+            render_diagnostics(renderer, selected.metrics)
+            render_alarms(renderer, alarm_source, packs, time.time(), geometry)
+            if multi_pack:
+                render_pack_summary(renderer, packs, time.time())
+            if args.metrics is not None:
+                for pack in packs:
+                    path = (
+                        pack_path(args.metrics, pack.name)
+                        if multi_pack
+                        else args.metrics
+                    )
+                    try:
+                        pack.metrics.dump(path)
+                    except OSError as error:
+                        print_error(f"Failed to write metrics to {path}: {error}")
 
-            except TypeError:
-                print_error(
-                    f"Received JSON is not of type BmsHvData: {bms_hv_data_json}"
+        if not frames_pending or not render_throttle.ready():
+            continue
+        frames_pending = False
+        render_throttle.rendered()
+
+        # every frame of every pack is decoded and recorded, only the newest one of the selected pack is displayed
+        selected_newest = None
+        for pack in packs:
+            if worker is not None:
+                # the history only sees the frames that are displayed
+                newest = worker.latest()
+                if newest is not None:
+                    pack.history.append(*newest)
+                    newest = (*newest, ALL_FIELDS)
+                    # the alarm state comes with the frame
+                    render_alarms(renderer, worker, packs, time.time(), geometry)
+            else:
+                newest = receive_frames(
+                    pack.reader,
+                    pack.metrics,
+                    pack.history,
+                    pack.recorder,
+                    pack.last_frame,
+                    geometry,
                 )
+            if newest is None:
                 continue
-
-            # BASIC INFO
-            window[KEY_TIMESTAMP].update(
-                float_to_string_with_precision((bms_hv_data.timestamp / 1000), 3)
-            )
-            window[KEY_MAX_TEMPERATURE].update(
-                float_to_string_with_precision(
-                    max(bms_hv_data.temperature), FLOAT_PRECISION
-                )
-            )
-            window[KEY_CURRENT].update(
-                float_to_string_with_precision(bms_hv_data.current, FLOAT_PRECISION)
-            )
-            # window[KEY_ACC_VOLTAGE].update(
-            #     float_to_string_with_precision(bms_hv_data.acc_voltage, FLOAT_PRECISION)
-            # )
-            # window[KEY_CAR_VOLTAGE].update(
-            #     float_to_string_with_precision(bms_hv_data.car_voltage, FLOAT_PRECISION)
-            # )
-            window[KEY_CHARGING_STATUS].update("On" if bms_hv_data.charging else "Off")
-            window[KEY_BALANCE_STATUS].update("On" if bms_hv_data.balance else "Off")
-
-            # CELL VOLTAGE TABLE
-            window[KEY_CELL_VOLTAGE].update(
-                values=to_matrix(
-                    [
-                        [
-                            mark_cell_if_discharge(
-                                float_to_string_with_precision(v, FLOAT_PRECISION),
-                                bms_hv_data.discharge[i],
-                            )
-                            for i, v in enumerate(bms_hv_data.cell_voltage)
-                        ]
-                    ],
-                    CELL_VOLTAGE_TABLE_COLUMNS,
-                ).tolist()
-            )
-            window[KEY_CELL_MAX_VOLTAGE].update(
-                float_to_string_with_precision(
-                    max(bms_hv_data.cell_voltage), FLOAT_PRECISION
-                )
-            )
-            max_cell_num, max_ltc_num = np.where(
-                to_matrix(bms_hv_data.cell_voltage, CELL_VOLTAGE_TABLE_COLUMNS)
-                == max(bms_hv_data.cell_voltage)
-            )
-            window[KEY_CELL_MAX_VOLTAGE_LTC].update(max_ltc_num[0])
-            window[KEY_CELL_MAX_VOLTAGE_CELL].update(max_cell_num[0])
-
-            window[KEY_CELL_MIN_VOLTAGE].update(
-                float_to_string_with_precision(
-                    min(bms_hv_data.cell_voltage), FLOAT_PRECISION
-                )
-            )
-            min_cell_num, min_ltc_num = np.where(
-                to_matrix(bms_hv_data.cell_voltage, CELL_VOLTAGE_TABLE_COLUMNS)
-                == min(bms_hv_data.cell_voltage)
-            )
-            window[KEY_CELL_MIN_VOLTAGE_LTC].update(min_ltc_num[0])
-            window[KEY_CELL_MIN_VOLTAGE_CELL].update(min_cell_num[0])
-
-            # TEMPERATURE TABLE
-            window[KEY_TEMPERATURE].update(
-                values=to_matrix(
-                    [
-                        float_to_string_with_precision(v, FLOAT_PRECISION)
-                        for v in bms_hv_data.temperature
-                    ],
-                    TEMPERATURE_TABLE_COLUMNS,
-                ).tolist()
-            )
-
-            # SOC TABLE
-            window[KEY_SOC].update(
-                values=to_matrix(
-                    [
-                        [
-                            float_to_string_with_precision(v * 100, FLOAT_PRECISION)
-                            for v in [
-                                min(bms_hv_data.soc),
-                                max(bms_hv_data.soc),
-                                sum(bms_hv_data.soc) / len(bms_hv_data.soc),
-                                median(bms_hv_data.soc),
-                            ]
-                        ]
-                    ],
-                    SOC_TABLE_COLUMNS,
-                ).tolist()
-            )
-
-            errors = [
-                ([e[0], e[2]] if e[1] == 1 else ["-", "-"])
-                for e in [
-                    [
-                        "Under Voltage",
-                        bms_hv_data.under_voltage[0],
-                        bms_hv_data.under_voltage[1],
-                    ],
-                    [
-                        "Over Voltage",
-                        bms_hv_data.over_voltage[0],
-                        bms_hv_data.over_voltage[1],
-                    ],
-                    [
-                        "Under Temperature",
-                        bms_hv_data.under_temperature[0],
-                        bms_hv_data.under_temperature[1],
-                    ],
-                    [
-                        "Over Temperature",
-                        bms_hv_data.over_temperature[0],
-                        bms_hv_data.over_temperature[1],
-                    ],
-                    [
-                        "Over Current",
-                        bms_hv_data.over_current[0],
-                        bms_hv_data.over_current[1],
-                    ],
-                    [
-                        "Current Sensor",
-                        bms_hv_data.current_sensor_disconnected[0],
-                        "Disconnected",
-                    ],
-                ]
-            ]
-
-            # ERROR TABLE
-            window[KEY_ERROR].update(values=errors)
+            pack.last_frame = (newest[0], newest[2])
+            pack.last_receive_time = newest[1]
+            pack.changed_fields |= newest[3]
+            if pack is selected:
+                selected_newest = newest
+        if multi_pack:
+            render_pack_summary(renderer, packs, time.time())
+        if selected_newest is None:
+            continue
+        bms_hv_data, bms_hv_data_receive_time, pack_stats, _ = selected_newest
+
+        render_frame(
+            renderer,
+            bms_hv_data,
+            pack_stats,
+            charts,
+            values[KEY_TABS],
+            selected.changed_fields,
+            geometry,
+        )
+        selected.changed_fields.clear()
+        if values[KEY_TABS] == KEY_TAB_TRENDS:
+            render_trends(trend_plot, selected.history, values, cells)
+        selected.metrics.count("frames_rendered")
+        selected.metrics.observe("render", renderer.last_frame_render_sec)
+        selected.metrics.observe("end_to_end", time.time() - bms_hv_data_receive_time)
 
     main_exit_event.set()
-    serial_task_thread.join()
+    if worker is not None:
+        worker.stop()
+    elif link_runner is not None:
+        link_runner.stop()
+    else:
+        replay_thread.join()
+    if alarm_monitor is not None:
+        alarm_monitor.stop()
+    for pack in packs:
+        if pack.recorder is not None:
+            pack.recorder.stop()
 
     window.close()
     print_ok("Exiting...")
@@ -0,0 +1,75 @@
+""" Tests of the frame handling of the GUI loop, no window is created"""
+import contextlib
+import io
+import numpy as np
+from delta_decoder import ALL_FIELDS
+from main import decode_on_reader, receive_frames
+from mock_bms_hv.mock_bms import MockBms, encode_json_frame
+from packs import Pack
+
+
+def mock_data(seed=4):
+    """Returns a frame of a mock BMS"""
+    mock = MockBms(seed=seed)
+    mock.step(0.25)
+    return mock.data()
+
+
+def invalid_frame(data):
+    """Returns a frame of data that splits like a valid one and fails to decode, a discharge flag does not fit uint8"""
+    return encode_json_frame(data).replace(b'"discharge":[0', b'"discharge":[300', 1)
+
+
+def take(pack):
+    """Does what the GUI loop does with the queued frames of a pack, returns the changed fields"""
+    newest = receive_frames(
+        pack.reader, pack.metrics, pack.history, None, pack.last_frame
+    )
+    pack.last_frame = (newest[0], newest[2])
+    return newest[3]
+
+
+def test_change_in_a_dropped_frame_is_not_lost():
+    pack = Pack.for_port("Pack", latest_only=True)
+    decode_on_reader(pack)
+    data = mock_data()
+    pack.reader.feed(encode_json_frame(data), 1.0)
+    assert take(pack) == ALL_FIELDS
+    first_stats = pack.last_frame[1]
+
+    # the soc changes in a frame the GUI never sees, the newest frame has the same soc
+    data.soc = data.soc + np.float32(0.01)
+    dropped = encode_json_frame(data)
+    data.current += 1.0
+    pack.reader.feed(dropped + encode_json_frame(data), 2.0)
+    assert take(pack) == {"soc", "current"}
+    # the statistics of the unchanged arrays are reused
+    assert pack.last_frame[1].cell_voltage is first_stats.cell_voltage
+    assert pack.last_frame[1].soc is not first_stats.soc
+    assert len(pack.history) == 2
+
+
+def test_frames_not_decoded_by_the_reader_are_decoded_here():
+    pack = Pack.for_port("Pack")
+    data = mock_data()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pack.reader.feed(encode_json_frame(data) + invalid_frame(data), 1.0)
+        newest = receive_frames(pack.reader, pack.metrics, pack.history, None)
+    assert newest[0].cell_voltage.size == data.cell_voltage.size
+    assert newest[3] == ALL_FIELDS
+    assert pack.metrics.counters["frames_decoded"] == 1
+    assert pack.metrics.counters["type_errors"] == 1
+    assert pack.metrics.histograms["queue"].total_count == 2
+
+
+def test_invalid_frames_are_dropped_on_the_reader():
+    pack = Pack.for_port("Pack")
+    decode_on_reader(pack)
+    data = mock_data()
+    with contextlib.redirect_stdout(io.StringIO()):
+        frames = encode_json_frame(data) + invalid_frame(data)
+        assert pack.reader.feed(frames, 1.0) == 1
+    assert pack.metrics.counters["type_errors"] == 1
+    assert pack.metrics.counters["frames_decoded"] == 1
+    assert receive_frames(pack.reader, pack.metrics, pack.history, None) is not None
+    assert pack.metrics.counters["frames_decoded"] == 1
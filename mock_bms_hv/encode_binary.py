@@ -0,0 +1,24 @@
+""" Converts JSON mock frames into binary wire protocol frames that can be sent with mock_bms_hv.sh
+
+Usage: python -m mock_bms_hv.encode_binary <input.txt> <output.bin>
+"""
+import sys
+from frame_decoder import decode_json_frame
+from wire_protocol import encode_binary_frame
+
+
+def main():
+    """Main function"""
+    if len(sys.argv) != 3:
+        print("Usage: python -m mock_bms_hv.encode_binary <input.txt> <output.bin>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "rb") as file:
+        frame = encode_binary_frame(decode_json_frame(file.read()))
+    with open(sys.argv[2], "wb") as file:
+        file.write(frame)
+    print(f"{sys.argv[2]}: {len(frame)} B")
+
+
+if __name__ == "__main__":
+    main()
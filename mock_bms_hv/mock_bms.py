@@ -0,0 +1,277 @@
+""" Python mock of the BMS HV. It generates varying frames at a configurable rate and reacts to the commands sent by the GUI
+
+Usage:
+    python -m mock_bms_hv.mock_bms --pty [--rate 4]              prints the pty path for main.py
+    python -m mock_bms_hv.mock_bms --tcp 5000 [--rate 4]         main.py socket://localhost:5000
+"""
+import argparse
+import re
+import threading
+import time
+import numpy as np
+from frame_decoder import BmsHvData
+from wire_protocol import encode_binary_frame
+from transport import PtyTransport, TcpServerTransport
+
+LTC_COUNT = 15
+CELLS_PER_LTC = 9
+TEMPERATURES_PER_LTC = 3
+SOC_COUNT = 99
+
+DEFAULT_RATE_HZ = 4.0
+
+NOMINAL_CELL_VOLTAGE = 3.6
+MIN_CELL_VOLTAGE = 3.0
+MAX_CELL_VOLTAGE = 4.2
+AMBIENT_TEMPERATURE = 25.0
+MAX_TEMPERATURE = 60.0
+MAX_CURRENT = 200.0
+CELL_CAPACITY_AS = 3.0 * 3600
+
+# the charger is switched off when no keep alive arrives for this long
+KEEP_ALIVE_TIMEOUT_SEC = 1.0
+BALANCE_THRESHOLD_V = 0.005
+
+COMMAND_PATTERN = re.compile(rb"!([A-Z])-([A-Z0-9]{2})@")
+CHARGE_CURRENTS = {b"1A": 1.0, b"2A": 2.0, b"4A": 4.0, b"8A": 8.0, b"12": 12.0}
+
+
+class MockBms:
+    """Simulated BMS HV state"""
+
+    def __init__(
+        self,
+        ltc_count=LTC_COUNT,
+        cells_per_ltc=CELLS_PER_LTC,
+        temperatures_per_ltc=TEMPERATURES_PER_LTC,
+        soc_count=SOC_COUNT,
+        seed=None,
+        error_rate=0.0,
+        binary=False,
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.error_rate = error_rate
+        self.binary = binary
+        cell_count = ltc_count * cells_per_ltc
+        self.cell_voltage = NOMINAL_CELL_VOLTAGE + self.rng.normal(0, 0.01, cell_count)
+        self.temperature = AMBIENT_TEMPERATURE + self.rng.normal(
+            0, 0.5, ltc_count * temperatures_per_ltc
+        )
+        self.soc = np.clip(0.5 + self.rng.normal(0, 0.01, soc_count), 0, 1)
+        self.discharge = np.zeros(cell_count, dtype=np.uint8)
+        self.current = 0.0
+        self.charging = 0
+        self.balance = 0
+        self.charge_current = 1.0
+        self.start_time = time.monotonic()
+        self.last_keep_alive = None
+        self.commands_received = {}
+        self._command_buffer = b""
+
+    def handle(self, data):
+        """Handles the bytes received from the GUI"""
+        self._command_buffer += data
+        end = 0
+        for match in COMMAND_PATTERN.finditer(self._command_buffer):
+            self._command(match.group(1), match.group(2))
+            end = match.end()
+        # keep a possibly incomplete command, drop everything before it
+        tail = self._command_buffer[end:]
+        start = tail.rfind(b"!")
+        self._command_buffer = tail[start:] if start != -1 else b""
+
+    def _command(self, group, value):
+        """Applies one command"""
+        command = f"!{group.decode()}-{value.decode()}@"
+        self.commands_received[command] = self.commands_received.get(command, 0) + 1
+        if group == b"C" and value == b"CC":
+            self.last_keep_alive = time.monotonic()
+        elif group == b"C":
+            self.charging = int(value == b"ON")
+        elif group == b"B" and value == b"FC":
+            self.soc[:] = 1.0
+        elif group == b"B":
+            self.balance = int(value == b"ON")
+        elif group == b"I" and value in CHARGE_CURRENTS:
+            self.charge_current = CHARGE_CURRENTS[value]
+
+    def step(self, dt):
+        """Advances the simulation by dt seconds"""
+        now = time.monotonic()
+        if self.charging and (
+            self.last_keep_alive is None
+            or now - self.last_keep_alive > KEEP_ALIVE_TIMEOUT_SEC
+        ):
+            self.charging = 0
+
+        target_current = (
+            self.charge_current if self.charging else self.rng.normal(-20, 30)
+        )
+        self.current += (target_current - self.current) * min(1.0, dt * 2)
+        self.current = float(np.clip(self.current, -MAX_CURRENT, MAX_CURRENT))
+
+        # positive current charges the cells
+        self.cell_voltage += self.current * dt * 2e-5 + self.rng.normal(
+            0, 0.0005, self.cell_voltage.size
+        )
+        if self.balance:
+            self.discharge = (
+                self.cell_voltage > self.cell_voltage.min() + BALANCE_THRESHOLD_V
+            ).astype(np.uint8)
+            self.discharge &= (self.rng.random(self.discharge.size) < 0.9).astype(
+                np.uint8
+            )
+            self.cell_voltage -= self.discharge * dt * 1e-4
+        else:
+            self.discharge[:] = 0
+        np.clip(
+            self.cell_voltage,
+            MIN_CELL_VOLTAGE - 0.2,
+            MAX_CELL_VOLTAGE + 0.1,
+            out=self.cell_voltage,
+        )
+
+        self.temperature += (
+            (AMBIENT_TEMPERATURE - self.temperature) * dt * 0.01
+            + abs(self.current) * dt * 0.002
+            + self.rng.normal(0, 0.02, self.temperature.size)
+        )
+        self.soc = np.clip(self.soc + self.current * dt / CELL_CAPACITY_AS, 0, 1)
+
+    def data(self):
+        """Returns the current state as BmsHvData"""
+        return BmsHvData(
+            self.current,
+            self.cell_voltage.sum(),
+            self.cell_voltage.sum() - self.rng.random(),
+            self.soc,
+            self.cell_voltage,
+            self.temperature,
+            self.discharge,
+            self.balance,
+            self.charging,
+            self._error(
+                self.cell_voltage.min() < MIN_CELL_VOLTAGE, self.cell_voltage.min()
+            ),
+            self._error(
+                self.cell_voltage.max() > MAX_CELL_VOLTAGE, self.cell_voltage.max()
+            ),
+            self._error(self.temperature.min() < 0, self.temperature.min()),
+            self._error(
+                self.temperature.max() > MAX_TEMPERATURE, self.temperature.max()
+            ),
+            self._error(abs(self.current) > MAX_CURRENT * 0.95, self.current),
+            self._error(False, 1),
+            (time.monotonic() - self.start_time) * 1000,
+        )
+
+    def _error(self, active, value):
+        """Returns a (flag, value) error pair, random errors are injected with error_rate"""
+        active = active or self.rng.random() < self.error_rate
+        return (int(active), round(float(value), 4))
+
+    def frame(self):
+        """Returns the current state encoded as the BMS HV sends it"""
+        data = self.data()
+        if self.binary:
+            return encode_binary_frame(data)
+        return encode_json_frame(data)
+
+
+def format_array(values, precision):
+    """Formats an array like the BMS HV firmware"""
+    return ",".join(f"{v:.{precision}f}" for v in values.tolist())
+
+
+def encode_json_frame(data):
+    """Encodes BmsHvData into a newline terminated JSON frame"""
+    return (
+        f'{{"current":{data.current:.4f},"acc_voltage":{data.acc_voltage:.4f},'
+        f'"car_voltage":{data.car_voltage:.4f},"soc":[{format_array(data.soc, 4)}],'
+        f'"cell_voltage":[{format_array(data.cell_voltage, 4)}],'
+        f'"temperature":[{format_array(data.temperature, 4)}],'
+        f'"discharge":[{",".join(map(str, data.discharge.tolist()))}],'
+        f'"balance":{data.balance},"charging":{data.charging},'
+        f'"under_voltage":[{data.under_voltage[0]},{data.under_voltage[1]}],'
+        f'"over_voltage":[{data.over_voltage[0]},{data.over_voltage[1]}],'
+        f'"under_temperature":[{data.under_temperature[0]},{data.under_temperature[1]}],'
+        f'"over_temperature":[{data.over_temperature[0]},{data.over_temperature[1]}],'
+        f'"over_current":[{data.over_current[0]},{data.over_current[1]}],'
+        f'"current_sensor_disconnected":[{data.current_sensor_disconnected[0]},'
+        f"{data.current_sensor_disconnected[1]}],"
+        f'"timestamp":{data.timestamp:.1f}}}\n'
+    ).encode("utf-8")
+
+
+def run_mock(transport, mock, rate, exit_event):
+    """Sends frames at rate Hz over the transport and handles incoming commands until exit_event is set"""
+    period = 1 / rate
+    next_frame_time = time.monotonic()
+    last_step_time = next_frame_time
+    frames_sent = 0
+    while not exit_event.is_set():
+        transport.timeout = max(0.0, next_frame_time - time.monotonic())
+        data = transport.read(4096)
+        if data:
+            mock.handle(data)
+        now = time.monotonic()
+        if now < next_frame_time:
+            continue
+        mock.step(now - last_step_time)
+        last_step_time = now
+        transport.write(mock.frame())
+        frames_sent += 1
+        # skip missed slots instead of bursting when the host can not keep up
+        next_frame_time = max(next_frame_time + period, now - period)
+    return frames_sent
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="BMS HV mock")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--pty", action="store_true", help="serve on a pseudo-terminal")
+    source.add_argument("--tcp", type=int, metavar="PORT", help="serve on a TCP port")
+    parser.add_argument(
+        "--rate", type=float, default=DEFAULT_RATE_HZ, help="frames per second"
+    )
+    parser.add_argument(
+        "--binary", action="store_true", help="send binary wire protocol frames"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="probability of a random error bit per frame",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument(
+        "--ltcs",
+        type=int,
+        default=LTC_COUNT,
+        help=f"number of LTCs of the simulated pack, main.py needs a matching --geometry (default: {LTC_COUNT})",
+    )
+    args = parser.parse_args()
+
+    if args.pty:
+        transport = PtyTransport()
+        print(f"Mock BMS HV on {transport.name}")
+    else:
+        transport = TcpServerTransport("localhost", args.tcp)
+        print(f"Mock BMS HV on socket://localhost:{args.tcp}")
+
+    mock = MockBms(
+        args.ltcs, seed=args.seed, error_rate=args.error_rate, binary=args.binary
+    )
+    exit_event = threading.Event()
+    try:
+        run_mock(transport, mock, args.rate, exit_event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.close()
+        print(f"Commands received: {mock.commands_received}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+""" Geometry of a BMS HV pack: how the flat cell voltage and temperature arrays of a frame map to the LTCs and their channels. The index maps are computed once per geometry, the per frame code only gathers through them and never reshapes
+
+Geometry file (YAML):
+    ltc_count: 15
+    cells_per_ltc: 9
+    sensors_per_ltc: 3
+    soc_count: 99
+    # channels that are not connected, a number is the channel on every LTC, [LTC, channel] a single one
+    unused_cells: [[14, 8]]
+    unused_sensors: []
+
+The arrays are laid out LTC after LTC, the unused channels are sent but left out of the tables, the charts, the statistics and the alarms.
+"""
+import numpy as np
+
+DEFAULT_LTC_COUNT = 15
+DEFAULT_CELLS_PER_LTC = 9
+DEFAULT_SENSORS_PER_LTC = 3
+DEFAULT_SOC_COUNT = 99
+
+
+class ChannelLayout:
+    """Index maps of one per channel array. The table has one column per LTC and one row per channel that is used on any LTC"""
+
+    def __init__(self, ltc_count, channels_per_ltc, unused=()):
+        self.ltc_count = ltc_count
+        self.channels_per_ltc = channels_per_ltc
+        self.size = ltc_count * channels_per_ltc
+        unused_mask = np.zeros((ltc_count, channels_per_ltc), dtype=bool)
+        for ltc, channel in unused:
+            unused_mask[ltc, channel] = True
+        if unused_mask.all(axis=1).any():
+            raise ValueError("every LTC needs at least one used channel")
+
+        # channels unused on every LTC get no table row
+        row_channels = np.flatnonzero(~unused_mask.all(axis=0))
+        channel_rows = np.full(channels_per_ltc, -1)
+        channel_rows[row_channels] = np.arange(len(row_channels))
+        self.row_count = len(row_channels)
+
+        flat_unused = unused_mask.ravel()
+        used = np.flatnonzero(~flat_unused)
+        self.unused = np.flatnonzero(flat_unused)
+        # None when every channel is used, the arrays are then taken as they are
+        self.used = used if len(self.unused) else None
+        # LTC and table row of every channel, plain lists make a lookup one index
+        self.ltc = np.repeat(np.arange(ltc_count), channels_per_ltc)
+        rows = np.tile(channel_rows, ltc_count)
+        self._positions = list(zip(self.ltc.tolist(), rows.tolist()))
+        # (row, column) of every used channel in the order of used_values
+        self.table_cells = list(zip(rows[used].tolist(), self.ltc[used].tolist()))
+        # offset of the first used channel of every LTC in used_values
+        self.ltc_starts = np.searchsorted(self.ltc[used], np.arange(ltc_count))
+        self._resized = {}
+
+    def locate(self, channel):
+        """Returns (LTC, table row) of a channel"""
+        return self._positions[channel]
+
+    def used_values(self, values):
+        """Returns the values of the used channels"""
+        return values if self.used is None else values.take(self.used)
+
+    def masked(self, values):
+        """Returns the values as float64 with NaN for the unused channels"""
+        values = np.array(values, dtype=np.float64)
+        # the layout of a resized frame pads its last LTC with unused channels past the end
+        values[self.unused[self.unused < values.size]] = np.nan
+        return values
+
+    def for_size(self, size):
+        """Returns the layout of an array of size values. A frame that does not match the geometry is laid out over as many LTCs of the same size as it fills"""
+        if size == self.size:
+            return self
+        layout = self._resized.get(size)
+        if layout is None:
+            ltc_count = max(1, -(-size // self.channels_per_ltc))
+            unused = [
+                divmod(channel, self.channels_per_ltc)
+                for channel in range(size, ltc_count * self.channels_per_ltc)
+            ]
+            layout = self._resized[size] = ChannelLayout(
+                ltc_count, self.channels_per_ltc, unused
+            )
+        return layout
+
+
+class PackGeometry:
+    """LTC count, channels per LTC and unused channels of a pack with the index maps of its cell voltage and temperature arrays"""
+
+    def __init__(
+        self,
+        ltc_count=DEFAULT_LTC_COUNT,
+        cells_per_ltc=DEFAULT_CELLS_PER_LTC,
+        sensors_per_ltc=DEFAULT_SENSORS_PER_LTC,
+        soc_count=DEFAULT_SOC_COUNT,
+        unused_cells=(),
+        unused_sensors=(),
+    ):
+        for name, value in (
+            ("ltc_count", ltc_count),
+            ("cells_per_ltc", cells_per_ltc),
+            ("sensors_per_ltc", sensors_per_ltc),
+            ("soc_count", soc_count),
+        ):
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(f"{name} has to be a positive integer")
+        self.ltc_count = ltc_count
+        self.soc_count = soc_count
+        self.cells = ChannelLayout(
+            ltc_count,
+            cells_per_ltc,
+            parse_channels(unused_cells, ltc_count, cells_per_ltc, "unused_cells"),
+        )
+        self.temperatures = ChannelLayout(
+            ltc_count,
+            sensors_per_ltc,
+            parse_channels(
+                unused_sensors, ltc_count, sensors_per_ltc, "unused_sensors"
+            ),
+        )
+        # layouts of the per channel fields of a frame
+        self.layouts = {
+            "cell_voltage": self.cells,
+            "temperature": self.temperatures,
+        }
+
+    @property
+    def array_sizes(self):
+        """(soc, cell, temperature) count of a frame"""
+        return self.soc_count, self.cells.size, self.temperatures.size
+
+
+def parse_channels(entries, ltc_count, channels_per_ltc, name):
+    """Returns [(LTC, channel)] of a list of channels, a number is the channel on every LTC"""
+    channels = []
+    for entry in entries:
+        if isinstance(entry, int):
+            pairs = [(ltc, entry) for ltc in range(ltc_count)]
+        elif (
+            isinstance(entry, (list, tuple))
+            and len(entry) == 2
+            and all(isinstance(value, int) for value in entry)
+        ):
+            pairs = [tuple(entry)]
+        else:
+            raise ValueError(
+                f"{name}: {entry!r} is neither a channel nor [LTC, channel]"
+            )
+        for ltc, channel in pairs:
+            if not (0 <= ltc < ltc_count and 0 <= channel < channels_per_ltc):
+                raise ValueError(f"{name}: {entry!r} is outside of the pack")
+        channels += pairs
+    return channels
+
+
+def load_geometry(path):
+    """Loads a pack geometry from a YAML file, PyYAML is only needed for it"""
+    import yaml
+
+    with open(path, encoding="utf-8") as file:
+        try:
+            entries = yaml.safe_load(file)
+        except yaml.YAMLError as error:
+            raise ValueError(f"{path}: {error}") from error
+    if not isinstance(entries, dict):
+        raise ValueError(f"{path} is not a mapping of geometry settings")
+    try:
+        return PackGeometry(**entries)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"{path}: {error}") from error
+
+
+DEFAULT_PACK_GEOMETRY = PackGeometry()
@@ -0,0 +1,117 @@
+""" Tests of the pack geometry and its index maps"""
+import numpy as np
+import pytest
+from pack_geometry import (
+    DEFAULT_PACK_GEOMETRY,
+    ChannelLayout,
+    PackGeometry,
+    load_geometry,
+)
+
+
+def write_geometry(tmp_path, text):
+    """Writes a geometry file, returns its path"""
+    path = tmp_path / "pack.yaml"
+    path.write_text(text)
+    return path
+
+
+def test_load_geometry(tmp_path):
+    path = write_geometry(
+        tmp_path,
+        "ltc_count: 4\n"
+        "cells_per_ltc: 6\n"
+        "sensors_per_ltc: 2\n"
+        "soc_count: 24\n"
+        "# channel 5 is not connected on any LTC\n"
+        "unused_cells: [5, [3, 0]]\n"
+        "unused_sensors: [[1, 1]]\n",
+    )
+    geometry = load_geometry(path)
+    assert geometry.ltc_count == 4
+    assert geometry.array_sizes == (24, 24, 8)
+    assert geometry.cells.unused.tolist() == [5, 11, 17, 18, 23]
+    assert geometry.temperatures.unused.tolist() == [3]
+    # the channel unused on every LTC has no table row
+    assert geometry.cells.row_count == 5
+    assert geometry.temperatures.row_count == 2
+    assert geometry.layouts == {
+        "cell_voltage": geometry.cells,
+        "temperature": geometry.temperatures,
+    }
+
+
+def test_load_geometry_defaults(tmp_path):
+    geometry = load_geometry(write_geometry(tmp_path, "ltc_count: 15\n"))
+    assert geometry.array_sizes == DEFAULT_PACK_GEOMETRY.array_sizes
+    assert geometry.cells.used is None
+    assert len(geometry.cells.unused) == 0
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "- 15\n",
+        "ltc_count: 0\n",
+        "ltc_count: 2.5\n",
+        "cells_per_ltc: -1\n",
+        "unknown: 1\n",
+        "unused_cells: [9]\n",
+        "unused_cells: [[15, 0]]\n",
+        "unused_cells: [[0, 1, 2]]\n",
+        "unused_cells: [x]\n",
+        "cells_per_ltc: 2\nunused_cells: [0, 1]\n",
+        "ltc_count: [\n",
+    ],
+)
+def test_invalid_geometry_files(tmp_path, text):
+    with pytest.raises(ValueError, match="pack.yaml"):
+        load_geometry(write_geometry(tmp_path, text))
+
+
+def test_table_cells_and_locate():
+    layout = ChannelLayout(3, 4, unused=[(0, 1), (1, 1), (2, 1), (2, 3)])
+    values = np.arange(12, dtype=np.float32)
+    assert layout.row_count == 3
+    assert layout.used_values(values).tolist() == [0, 2, 3, 4, 6, 7, 8, 10]
+    # (row, column) in the order of used_values, one column per LTC
+    assert layout.table_cells == [
+        (0, 0),
+        (1, 0),
+        (2, 0),
+        (0, 1),
+        (1, 1),
+        (2, 1),
+        (0, 2),
+        (1, 2),
+    ]
+    assert layout.locate(6) == (1, 1)
+    assert layout.locate(8) == (2, 0)
+    assert layout.ltc_starts.tolist() == [0, 3, 6]
+    masked = layout.masked(values)
+    assert np.isnan(masked[[1, 5, 9, 11]]).all()
+    assert masked.dtype == np.float64
+    assert np.array_equal(np.delete(masked, [1, 5, 9, 11]), layout.used_values(values))
+
+
+def test_every_channel_of_an_ltc_unused():
+    with pytest.raises(ValueError):
+        ChannelLayout(2, 2, unused=[(1, 0), (1, 1)])
+
+
+@pytest.mark.parametrize("size", [1, 8, 9, 20, 135, 140])
+def test_frame_that_does_not_match_the_geometry(size):
+    layout = DEFAULT_PACK_GEOMETRY.cells.for_size(size)
+    values = np.arange(size, dtype=np.float32)
+    assert layout.size >= size
+    assert layout.channels_per_ltc == 9
+    assert len(layout.table_cells) == size
+    assert layout.used_values(values).tolist() == values.tolist()
+    assert not np.isnan(layout.masked(values)).any()
+    assert DEFAULT_PACK_GEOMETRY.cells.for_size(size) is layout
+
+
+def test_same_size_is_the_geometry_layout():
+    geometry = PackGeometry(unused_cells=[[14, 8]])
+    assert geometry.cells.for_size(135) is geometry.cells
+    assert len(geometry.cells.table_cells) == 134
@@ -0,0 +1,142 @@
+""" Per frame pack statistics. All statistics of a frame are computed once here and read by the GUI and the loggers"""
+import math
+import numpy as np
+
+
+class ArrayStats:
+    """Statistics of one per cell array"""
+
+    __slots__ = (
+        "minimum",
+        "maximum",
+        "argmin",
+        "argmax",
+        "mean",
+        "median",
+        "spread",
+        "std",
+    )
+
+    def __init__(self, values, used=None):
+        # only the used channels count, argmin and argmax are channels of the whole array
+        if used is not None:
+            values = values.take(used)
+        # one sort gives min, max and median, the sorted copy is reused for the moments
+        order = values.argsort(kind="stable")
+        sorted_values = values[order].astype(np.float64)
+        size = sorted_values.size
+        # the stable sort keeps tied values in channel order, the first of them is taken like argmin and argmax do
+        extremes = order[[0, sorted_values.searchsorted(sorted_values[-1])]]
+        if used is not None:
+            extremes = used[extremes]
+        self.argmin = int(extremes[0])
+        self.argmax = int(extremes[1])
+        self.minimum = float(sorted_values[0])
+        self.maximum = float(sorted_values[-1])
+        middle = size // 2
+        if size % 2:
+            self.median = float(sorted_values[middle])
+        else:
+            self.median = float(sorted_values[middle - 1 : middle + 1].mean())
+        self.mean = float(sorted_values.sum()) / size
+        deviation = sorted_values - self.mean
+        self.std = math.sqrt(float(deviation.dot(deviation)) / size)
+        self.spread = self.maximum - self.minimum
+
+
+class PackStats:
+    """Statistics of the cell voltages, temperatures and SoC of one frame"""
+
+    __slots__ = (
+        "cell_voltage",
+        "temperature",
+        "soc",
+        "max_voltage_ltc",
+        "max_voltage_cell",
+        "min_voltage_ltc",
+        "min_voltage_cell",
+        "max_temperature_ltc",
+        "max_temperature_sensor",
+    )
+
+    def __init__(
+        self,
+        cell_voltage,
+        temperature,
+        soc,
+        geometry,
+        reused=None,
+    ):
+        # reused maps array names to the ArrayStats of an identical array
+        reused = reused or {}
+        cells = geometry.cells.for_size(cell_voltage.size)
+        temperatures = geometry.temperatures.for_size(temperature.size)
+        self.cell_voltage = reused.get("cell_voltage") or ArrayStats(
+            cell_voltage, cells.used
+        )
+        self.temperature = reused.get("temperature") or ArrayStats(
+            temperature, temperatures.used
+        )
+        self.soc = reused.get("soc") or ArrayStats(soc)
+        locate_extremes(self, cells, temperatures)
+
+
+def locate_extremes(pack_stats, cells, temperatures):
+    """Sets the LTC and table row of the extreme cells and sensors"""
+    pack_stats.max_voltage_ltc, pack_stats.max_voltage_cell = cells.locate(
+        pack_stats.cell_voltage.argmax
+    )
+    pack_stats.min_voltage_ltc, pack_stats.min_voltage_cell = cells.locate(
+        pack_stats.cell_voltage.argmin
+    )
+    (
+        pack_stats.max_temperature_ltc,
+        pack_stats.max_temperature_sensor,
+    ) = temperatures.locate(pack_stats.temperature.argmax)
+
+
+def compute_pack_stats(data, geometry, previous=None, changed_fields=None):
+    """Computes all pack statistics of a decoded frame. Given the statistics of the previous frame and the fields changed since, the statistics of the unchanged arrays are reused"""
+    reused = None
+    if previous is not None and changed_fields is not None:
+        reused = {
+            name: getattr(previous, name)
+            for name in STATS_ARRAYS
+            if name not in changed_fields
+        }
+    return PackStats(
+        data.cell_voltage,
+        data.temperature,
+        data.soc,
+        geometry,
+        reused,
+    )
+
+
+# order of the rows written by pack_stats_to_array
+STATS_ARRAYS = ("cell_voltage", "temperature", "soc")
+
+
+def pack_stats_to_array(pack_stats, out):
+    """Writes the array statistics into a (len(STATS_ARRAYS), len(ArrayStats.__slots__)) float array"""
+    for row, name in zip(out, STATS_ARRAYS):
+        array_stats = getattr(pack_stats, name)
+        row[:] = [getattr(array_stats, field) for field in ArrayStats.__slots__]
+
+
+def pack_stats_from_array(rows, data, geometry):
+    """Rebuilds the pack statistics written by pack_stats_to_array without recomputing them"""
+    pack_stats = PackStats.__new__(PackStats)
+    for row, name in zip(rows.tolist(), STATS_ARRAYS):
+        array_stats = ArrayStats.__new__(ArrayStats)
+        for field, value in zip(ArrayStats.__slots__, row):
+            setattr(array_stats, field, value)
+        array_stats.argmin = int(array_stats.argmin)
+        array_stats.argmax = int(array_stats.argmax)
+        setattr(pack_stats, name, array_stats)
+    locate_extremes(
+        pack_stats,
+        geometry.cells.for_size(data.cell_voltage.size),
+        geometry.temperatures.for_size(data.temperature.size),
+    )
+    return pack_stats
@@ -0,0 +1,104 @@
+""" Tests of the per frame pack statistics"""
+import numpy as np
+import pytest
+from mock_bms_hv.mock_bms import MockBms
+from pack_geometry import DEFAULT_PACK_GEOMETRY, PackGeometry
+from pack_stats import (
+    STATS_ARRAYS,
+    ArrayStats,
+    compute_pack_stats,
+    pack_stats_from_array,
+    pack_stats_to_array,
+)
+
+
+def mock_data(seed=7):
+    """Returns a frame of a mock BMS"""
+    mock = MockBms(seed=seed)
+    mock.step(0.25)
+    return mock.data()
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 8])
+def test_array_stats_match_numpy(size):
+    values = np.random.default_rng(size).normal(3.7, 0.05, size).astype(np.float32)
+    stats = ArrayStats(values)
+    assert stats.minimum == values.min()
+    assert stats.maximum == values.max()
+    assert stats.argmin == values.argmin()
+    assert stats.argmax == values.argmax()
+    assert stats.mean == pytest.approx(values.astype(np.float64).mean())
+    assert stats.median == pytest.approx(np.median(values.astype(np.float64)))
+    assert stats.std == pytest.approx(values.astype(np.float64).std())
+    assert stats.spread == pytest.approx(stats.maximum - stats.minimum)
+
+
+def test_tied_extremes_are_the_first_channels():
+    values = np.array([3.7, 4.1, 3.5, 4.1, 3.5, 4.1], dtype=np.float32)
+    stats = ArrayStats(values)
+    assert stats.argmin == 2
+    assert stats.argmax == 1
+    # only the used channels count, the first used one of the tied channels is taken
+    stats = ArrayStats(values, np.array([0, 2, 3, 4, 5]))
+    assert stats.argmin == 2
+    assert stats.argmax == 3
+
+
+def test_tied_extreme_cells_are_located_like_the_table_shows_them():
+    data = mock_data()
+    data.cell_voltage[:] = 3.7
+    data.cell_voltage[[40, 12, 100]] = 4.1
+    data.cell_voltage[[130, 5]] = 3.2
+    pack_stats = compute_pack_stats(data, DEFAULT_PACK_GEOMETRY)
+    cells = DEFAULT_PACK_GEOMETRY.cells
+    assert (pack_stats.max_voltage_ltc, pack_stats.max_voltage_cell) == cells.locate(12)
+    assert (pack_stats.min_voltage_ltc, pack_stats.min_voltage_cell) == cells.locate(5)
+
+
+def test_unused_channels_are_left_out():
+    geometry = PackGeometry(unused_cells=[[14, 8], [0, 0]], unused_sensors=[2])
+    data = mock_data()
+    data.cell_voltage[134] = 9.0
+    data.cell_voltage[0] = 0.0
+    data.temperature[2] = 99.0
+    pack_stats = compute_pack_stats(data, geometry)
+    used = np.delete(data.cell_voltage, [0, 134])
+    assert pack_stats.cell_voltage.maximum == used.max()
+    assert pack_stats.cell_voltage.minimum == used.min()
+    assert pack_stats.cell_voltage.argmax not in (0, 134)
+    assert pack_stats.temperature.maximum < 99.0
+    assert pack_stats.max_temperature_sensor != 2
+
+
+def test_unchanged_arrays_reuse_the_previous_statistics():
+    data = mock_data()
+    previous = compute_pack_stats(data, DEFAULT_PACK_GEOMETRY)
+    data.temperature = data.temperature + 1.0
+    pack_stats = compute_pack_stats(
+        data, DEFAULT_PACK_GEOMETRY, previous, {"temperature"}
+    )
+    assert pack_stats.cell_voltage is previous.cell_voltage
+    assert pack_stats.soc is previous.soc
+    assert pack_stats.temperature.maximum == pytest.approx(
+        previous.temperature.maximum + 1.0
+    )
+    # without the changed fields nothing is reused
+    assert (
+        compute_pack_stats(data, DEFAULT_PACK_GEOMETRY, previous).soc
+        is not previous.soc
+    )
+
+
+def test_array_round_trip():
+    data = mock_data()
+    pack_stats = compute_pack_stats(data, DEFAULT_PACK_GEOMETRY)
+    rows = np.zeros((len(STATS_ARRAYS), len(ArrayStats.__slots__)))
+    pack_stats_to_array(pack_stats, rows)
+    restored = pack_stats_from_array(rows, data, DEFAULT_PACK_GEOMETRY)
+    for name in STATS_ARRAYS:
+        for field in ArrayStats.__slots__:
+            assert getattr(getattr(restored, name), field) == getattr(
+                getattr(pack_stats, name), field
+            ), (name, field)
+    for name in ("max_voltage_ltc", "max_voltage_cell", "max_temperature_sensor"):
+        assert getattr(restored, name) == getattr(pack_stats, name)
@@ -0,0 +1,75 @@
+""" Several BMS HV packs monitored from one process. Every pack has its own link, reader, write scheduler, history and metrics, the decoding, the statistics and the rendering are shared and the GUI shows one selected pack in detail"""
+import os
+import threading
+from delta_decoder import DeltaDecoder
+from history import History
+from instrumentation import Metrics
+from serial_reader import StreamingReader
+from serial_writer import WriteScheduler
+from serial_link import SERIAL_DATA_IN_FREQ_SEC
+
+# 1 hour at the nominal 4 Hz frame rate, the history of every cell is kept for every pack
+MULTI_PACK_HISTORY_CAPACITY = 60 * 60 * 4
+
+PACK_NAME_SEPARATOR = "="
+
+
+class Pack:
+    """Link state, history and the newest frame of one monitored pack"""
+
+    def __init__(
+        self, name, reader, write_scheduler, connected_event, history_capacity=None
+    ):
+        self.name = name
+        self.reader = reader
+        self.write_scheduler = write_scheduler
+        self.connected_event = connected_event
+        self.history = (
+            History() if history_capacity is None else History(history_capacity)
+        )
+        self.metrics = Metrics(reader)
+        self.recorder = None
+        self.decoder = DeltaDecoder()
+        # (decoded frame, pack statistics) of the newest frame
+        self.last_frame = None
+        self.last_receive_time = None
+        # fields changed since the newest frame of the pack was displayed
+        self.changed_fields = set()
+
+    @classmethod
+    def for_port(cls, name, latest_only=False, history_capacity=None):
+        """Creates a pack with a streaming reader and a write scheduler, the link is added by the caller"""
+        return cls(
+            name,
+            StreamingReader(latest_only=latest_only),
+            WriteScheduler(keep_alive_period=SERIAL_DATA_IN_FREQ_SEC),
+            threading.Event(),
+            history_capacity,
+        )
+
+
+def parse_pack_ports(ports):
+    """Returns [(pack name, port)] for ports given as PORT or NAME=PORT, unnamed packs are numbered"""
+    packs = []
+    for index, port in enumerate(ports):
+        name, separator, url = port.partition(PACK_NAME_SEPARATOR)
+        # a transport url never has the separator before its scheme
+        if separator and name and "://" not in name and os.sep not in name:
+            packs.append((name, url))
+        else:
+            packs.append((f"Pack {index + 1}", port))
+    names = [name for name, _ in packs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Pack names are not unique: {', '.join(names)}")
+    return packs
+
+
+def pack_slug(name):
+    """Returns the pack name as a file name"""
+    return "".join(c if c.isalnum() else "_" for c in name.lower())
+
+
+def pack_path(path, name):
+    """Returns path with the pack name inserted before the extension, for the per pack metrics files"""
+    root, extension = os.path.splitext(path)
+    return f"{root}-{pack_slug(name)}{extension}"
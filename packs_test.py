@@ -0,0 +1,144 @@
+""" Tests of the pack naming and of several packs served by one link runner"""
+import contextlib
+import io
+import os
+import time
+import uuid
+import pytest
+from async_link import AsyncLinkRunner
+from main import KEY_PACKS, decode_on_reader, receive_frames, render_pack_summary
+from mock_bms_hv.mock_bms import MockBms
+from packs import Pack, pack_path, pack_slug, parse_pack_ports
+from serial_writer import KEEP_ALIVE_MESSAGE
+from transport import QueueTransport
+
+TIMEOUT_SEC = 5.0
+
+
+class RecordingRenderer:
+    """Stand-in for the DiffRenderer that keeps the rows of every table"""
+
+    def __init__(self):
+        self.tables = {}
+
+    def update_table(self, key, rows):
+        """Keeps the rows of the table"""
+        self.tables[key] = rows
+
+
+def wait_for(condition, timeout=TIMEOUT_SEC):
+    """Waits until condition() is true, fails the test after timeout"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("condition not met in time")
+        time.sleep(0.005)
+
+
+def test_unnamed_packs_are_numbered():
+    assert parse_pack_ports(["COM3", "/dev/ttyUSB0"]) == [
+        ("Pack 1", "COM3"),
+        ("Pack 2", "/dev/ttyUSB0"),
+    ]
+
+
+def test_named_packs():
+    assert parse_pack_ports(["Front=COM3", "socket://host:7000", "Rear=tcp://x:1"]) == [
+        ("Front", "COM3"),
+        ("Pack 2", "socket://host:7000"),
+        ("Rear", "tcp://x:1"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "port",
+    [
+        "socket://host:7000?a=b",
+        f"{os.sep}dev{os.sep}serial{os.sep}by-id{os.sep}usb=1",
+        "=COM3",
+    ],
+)
+def test_separator_that_does_not_name_a_pack(port):
+    assert parse_pack_ports([port]) == [("Pack 1", port)]
+
+
+def test_pack_names_are_unique():
+    with pytest.raises(ValueError, match="not unique"):
+        parse_pack_ports(["A=COM3", "A=COM4"])
+
+
+def test_pack_path():
+    assert pack_slug("Front Pack-2") == "front_pack_2"
+    assert pack_path("metrics.prom", "Front Pack") == "metrics-front_pack.prom"
+    assert pack_path("metrics", "Rear") == "metrics-rear"
+
+
+def test_packs_do_not_share_state():
+    first, second = Pack.for_port("A"), Pack.for_port("B", history_capacity=10)
+    assert first.reader is not second.reader
+    assert first.write_scheduler is not second.write_scheduler
+    assert first.metrics is not second.metrics
+    assert first.decoder is not second.decoder
+    assert first.history is not second.history
+    assert second.history.capacity == 10
+
+
+def test_every_pack_gets_its_own_frames_and_commands():
+    names = ["Front", "Rear"]
+    devices = {}
+    packs = [Pack.for_port(name) for name in names]
+    runner = AsyncLinkRunner()
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner.start()
+        try:
+            for pack in packs:
+                transport_name = f"test-{uuid.uuid4().hex}"
+                _, devices[pack.name] = QueueTransport.pair(transport_name)
+                devices[pack.name].timeout = 0
+                decode_on_reader(pack)
+                runner.add_link(
+                    f"queue://{transport_name}",
+                    pack.reader,
+                    pack.write_scheduler,
+                    pack.connected_event,
+                )
+            for pack in packs:
+                assert pack.connected_event.wait(TIMEOUT_SEC)
+
+            mocks = {"Front": MockBms(seed=1), "Rear": MockBms(seed=2, ltc_count=2)}
+            for name, mock in mocks.items():
+                mock.step(0.25)
+                devices[name].write(mock.frame())
+            for pack in packs:
+                wait_for(lambda: pack.reader.frames_received == 1)
+                data, receive_time, pack_stats, _ = receive_frames(
+                    pack.reader, pack.metrics, pack.history, None
+                )
+                sent = mocks[pack.name].data()
+                assert data.cell_voltage.size == sent.cell_voltage.size
+                assert data.current == pytest.approx(sent.current, abs=1e-3)
+                pack.last_frame = (data, pack_stats)
+                pack.last_receive_time = receive_time
+
+            packs[1].write_scheduler.submit("!C-ON@")
+            received = b""
+            device = devices["Rear"]
+            deadline = time.monotonic() + TIMEOUT_SEC
+            while b"!C-ON@" not in received and time.monotonic() < deadline:
+                received += device.read(device.in_waiting or 1)
+            assert b"!C-ON@" in received
+            front = devices["Front"]
+            assert b"!C-ON@" not in front.read(front.in_waiting).replace(
+                KEEP_ALIVE_MESSAGE.encode(), b""
+            )
+        finally:
+            runner.stop()
+
+    renderer = RecordingRenderer()
+    render_pack_summary(renderer, packs, packs[0].last_receive_time + 2.0)
+    rows = renderer.tables[KEY_PACKS]
+    assert [row[:2] for row in rows] == [
+        ["Front", "Disconnected"],
+        ["Rear", "Disconnected"],
+    ]
+    assert rows[0][-1] == "2.0"
@@ -0,0 +1,107 @@
+""" Offline replay of recorded sessions. It stands in for the serial task and feeds the frames to the same decode, stats and render pipeline"""
+import os
+import time
+from console import print_ok, print_error
+from session_recorder import (
+    FILE_EXTENSION,
+    open_session,
+    record_to_frame,
+    session_files,
+)
+from wire_protocol import encode_binary_frame
+
+# the BMS HV timestamp is in milliseconds
+BMS_TIMESTAMP_SCALE = 0.001
+
+
+def session_source(sessions):
+    """Yields (frame bytes, time in seconds) from opened session record arrays"""
+    for records in sessions:
+        for record in records:
+            yield encode_binary_frame(record_to_frame(record)), float(
+                record["receive_time"]
+            )
+
+
+def jsonl_source(file):
+    """Yields (frame bytes, time in seconds) from an opened file with one JSON frame per line, timed by the BMS timestamp"""
+    with file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                timestamp = float(
+                    line.split(b'"timestamp":', 1)[1].split(b",", 1)[0].rstrip(b"}")
+                )
+            except (IndexError, ValueError):
+                timestamp = None
+            yield line, None if timestamp is None else timestamp * BMS_TIMESTAMP_SCALE
+
+
+def open_replay_source(path):
+    """Opens a session file, a session directory or a JSONL file and returns its frame source
+
+    The files are opened here so that a missing or malformed file raises
+    OSError or ValueError before the first frame is read
+    """
+    if os.path.isdir(path) or path.endswith(FILE_EXTENSION):
+        paths = session_files(path) if os.path.isdir(path) else [path]
+        if not paths:
+            raise ValueError(f"no {FILE_EXTENSION} files in {path}")
+        return session_source([open_session(session_path) for session_path in paths])
+    return jsonl_source(open(path, "rb"))
+
+
+def replay_task(path, reader, connected_event, exit_event, speed=1.0, loop=False):
+    """Feeds recorded frames to the reader with their original timing divided by speed, speed 0 replays as fast as possible"""
+    replay_prefix = "REPLAY: "
+    connected_event.set()
+    print_ok(f"{replay_prefix} Replaying {path} at {speed or 'max'}x")
+
+    frames_replayed = 0
+    start = time.perf_counter()
+    while True:
+        first_frame_time = None
+        replay_start = time.perf_counter()
+        pass_frames = 0
+        try:
+            source = open_replay_source(path)
+        except (OSError, ValueError) as error:
+            print_error(f"{replay_prefix} Can not open {path}: {error}")
+            connected_event.clear()
+            return frames_replayed
+
+        for data, frame_time in source:
+            if exit_event.is_set():
+                connected_event.clear()
+                return frames_replayed
+
+            if speed and frame_time is not None:
+                if first_frame_time is None:
+                    first_frame_time = frame_time
+                delay = (frame_time - first_frame_time) / speed - (
+                    time.perf_counter() - replay_start
+                )
+                if delay > 0 and exit_event.wait(timeout=delay):
+                    connected_event.clear()
+                    return frames_replayed
+
+            # JSON frames are newline terminated on the wire
+            reader.feed(data if data[:1] != b"{" else data + b"\n", time.time())
+            frames_replayed += 1
+            pass_frames += 1
+
+        if not loop:
+            break
+        if not pass_frames:
+            print_error(f"{replay_prefix} {path} has no frames, not looping")
+            break
+
+    elapsed = time.perf_counter() - start
+    print_ok(
+        f"{replay_prefix} {frames_replayed} frames replayed in {elapsed:.2f} s "
+        f"({frames_replayed / elapsed if elapsed else 0:.0f} frames/s)"
+    )
+    connected_event.clear()
+    return frames_replayed
@@ -0,0 +1,47 @@
+""" Serial link settings of the BMS HV Utility and the reconnect backoff of async_link"""
+import serial
+
+SERIAL_DATA_IN_FREQ_SEC = 0.250
+SERIAL_READ_POLL_SEC = 0.02
+
+# errors of a port that went away, the link reconnects after them
+LINK_ERRORS = (serial.SerialException, OSError)
+
+# a short glitch is retried right away, a re-enumerating adapter takes a few hundred ms
+RECONNECT_FAST_RETRIES = 3
+RECONNECT_FAST_RETRY_SEC = 0.02
+RECONNECT_BACKOFF_MIN_SEC = 0.05
+# keeps the recovery below a second once the port is back
+RECONNECT_BACKOFF_MAX_SEC = 0.5
+
+
+class ReconnectBackoff:
+    """Reconnect delay, a few fast retries and then exponential up to the maximum. It starts over after a successful connect"""
+
+    def __init__(
+        self,
+        fast_retries=RECONNECT_FAST_RETRIES,
+        fast_delay=RECONNECT_FAST_RETRY_SEC,
+        minimum=RECONNECT_BACKOFF_MIN_SEC,
+        maximum=RECONNECT_BACKOFF_MAX_SEC,
+    ):
+        self.fast_retries = fast_retries
+        self.fast_delay = fast_delay
+        self.minimum = minimum
+        self.maximum = maximum
+        self.attempts = 0
+        self.delay = minimum
+
+    def next_delay(self):
+        """Returns the delay before the next attempt, after the fast retries it doubles the following one"""
+        self.attempts += 1
+        if self.attempts <= self.fast_retries:
+            return self.fast_delay
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.maximum)
+        return delay
+
+    def reset(self):
+        """Starts over with the fast retries"""
+        self.attempts = 0
+        self.delay = self.minimum
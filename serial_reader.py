@@ -0,0 +1,287 @@
+""" Streaming frame reader for the BMS HV serial link. It splits the incoming byte stream into frames, optionally decodes them on the reading thread and hands them over to the GUI"""
+import queue
+import time
+from dataclasses import dataclass
+from frame_decoder import decode_json_frame
+from wire_protocol import MAGIC, check_frame_crc, check_frame_header, frame_length
+
+FRAME_DELIMITER = b"\n"
+JSON_FRAME_START = b'{"'
+JSON_FRAME_END = b"}"
+# removed from a JSON frame to get its layout: the keys, the array lengths and the shape of
+# every number. A corrupted key letter, sign, decimal point or separator changes it
+JSON_DIGITS = b"0123456789"
+# maps the digits to 0 and every other byte to x, a digit run starts at every x0
+JSON_DIGIT_RUNS = bytes(
+    ord("0") if byte in JSON_DIGITS else ord("x") for byte in range(256)
+)
+
+# a single JSON frame from the BMS HV is a few KB, anything bigger is garbage
+MAX_FRAME_SIZE = 64 * 1024
+
+READ_QUEUE_SIZE = 32
+
+# layouts of the last valid JSON frames, the sign of the current flips between two of them
+JSON_LAYOUT_CACHE_SIZE = 4
+
+
+@dataclass
+class ReceivedFrame:
+    """Dataclass for a raw frame with its host receive timestamp and the frame decoded from it, None if it was not decoded yet"""
+
+    data: bytes
+    timestamp: float
+    bms_hv_data: object = None
+
+
+class FrameSplitter:
+    """Incrementally splits a byte stream into delimiter separated JSON frames and length prefixed binary frames. Frames with a broken structure, layout or CRC are rejected here and the splitter resynchronizes on the next frame start. JSON has no checksum, a frame with a corrupted digit or a lost decimal point still reaches the decoder"""
+
+    def __init__(self, delimiter=FRAME_DELIMITER, max_frame_size=MAX_FRAME_SIZE):
+        self.delimiter = delimiter
+        self.max_frame_size = max_frame_size
+        self.overflows = 0
+        # times the splitter lost the frame boundaries and skipped bytes to find the next one
+        self.resyncs = 0
+        # JSON lines that failed the structural checks and binary frames with an invalid header
+        self.corrupt_frames = 0
+        self.crc_errors = 0
+        self._buffer = bytearray()
+        self._search_start = 0
+        # the stream is joined at an arbitrary byte, the first partial frame is not an error
+        self._in_sync = False
+        self._json_layouts = []
+
+    def feed(self, data):
+        """Adds data to the internal buffer and returns all complete and valid frames"""
+        return [frame for frame, _ in self.split(data)]
+
+    def split(self, data):
+        """Like feed, returns [(frame, decoded frame)]. A JSON frame of an unseen layout was decoded to check it, that BmsHvData is handed through so it is not decoded twice, the decoded frame of every other frame is None"""
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        start = 0
+        while start < len(buffer):
+            if buffer.startswith(MAGIC, start):
+                valid = check_frame_header(buffer, start)
+                if valid is None:
+                    break
+                length = frame_length(buffer, start)
+                if not valid or length > self.max_frame_size:
+                    self.corrupt_frames += 1
+                    start = self._resync(start + 1)
+                    continue
+                if len(buffer) - start < length:
+                    break
+                if not check_frame_crc(buffer, start, length):
+                    self.crc_errors += 1
+                    # a lost byte moves the next frame into this one, search it from here
+                    start = self._resync(start + 1)
+                    continue
+                frames.append((bytes(buffer[start : start + length]), None))
+                self._in_sync = True
+                start += length
+                continue
+
+            search_start = max(start, self._search_start)
+            end = buffer.find(self.delimiter, search_start)
+            # JSON is plain text, a binary frame start ends the line early
+            magic = buffer.find(MAGIC, search_start, len(buffer) if end == -1 else end)
+            if magic != -1:
+                if buffer[start:magic].strip():
+                    self._lose_sync()
+                start = magic
+                continue
+            if end == -1:
+                break
+            frame = self._check_json(bytes(buffer[start:end]).strip())
+            if frame is not None:
+                frames.append(frame)
+            start = end + len(self.delimiter)
+
+        if start:
+            del buffer[:start]
+
+        if len(buffer) > self.max_frame_size:
+            self.overflows += 1
+            self._lose_sync()
+            buffer.clear()
+
+        # the delimiter and the magic can not be in the part of the buffer that was already searched
+        self._search_start = max(
+            0, len(buffer) - max(len(MAGIC), len(self.delimiter)) + 1
+        )
+        if buffer.startswith(MAGIC):
+            self._search_start = 0
+        return frames
+
+    def reset(self):
+        """Drops any partially received frame"""
+        self._buffer.clear()
+        self._search_start = 0
+        self._in_sync = False
+
+    def _check_json(self, frame):
+        """Returns (JSON frame, decoded frame or None) if the frame is structurally valid, otherwise None. A lost delimiter merges the rest of a frame into the next one, the complete last frame is kept"""
+        if not frame:
+            return None
+        # the frames are flat objects, a second opening can only be the start of another frame
+        frame_start = frame.rfind(JSON_FRAME_START)
+        if frame_start > 0:
+            self._lose_sync()
+            frame = frame[frame_start:]
+        if frame_start != -1 and frame.endswith(JSON_FRAME_END) and frame.isascii():
+            valid, bms_hv_data = self._check_json_layout(frame)
+            if valid:
+                self._in_sync = True
+                return frame, bms_hv_data
+        if self._in_sync:
+            self.corrupt_frames += 1
+        return None
+
+    def _check_json_layout(self, frame):
+        """Checks that the frame has the layout of the previous frames, a corrupted byte changes it unless it turns a digit into another one. Returns (valid, the frame decoded to check a new layout or None)"""
+        # a number that lost all of its digits keeps the rest of the layout, the digit runs are counted
+        layout = (
+            frame.translate(None, JSON_DIGITS),
+            frame.translate(JSON_DIGIT_RUNS).count(b"x0"),
+        )
+        if layout in self._json_layouts:
+            return True, None
+        # the layout changes with the BMS configuration, signs, exponents and non-finite values,
+        # a frame with a new one is taken only if it decodes into BmsHvData with consistent arrays
+        try:
+            bms_hv_data = decode_json_frame(frame)
+        except (TypeError, ValueError):
+            return False, None
+        self._json_layouts.insert(0, layout)
+        del self._json_layouts[JSON_LAYOUT_CACHE_SIZE:]
+        return True, bms_hv_data
+
+    def _resync(self, position):
+        """Counts the lost frame boundary and returns the next position where a frame can start"""
+        self._lose_sync()
+        buffer = self._buffer
+        magic = buffer.find(MAGIC, position)
+        delimiter = buffer.find(self.delimiter, position)
+        if delimiter != -1 and (magic == -1 or delimiter < magic):
+            return delimiter + len(self.delimiter)
+        if magic != -1:
+            return magic
+        # keep a trailing first magic byte, the rest of it may still arrive
+        return len(buffer) - 1 if buffer.endswith(MAGIC[:1]) else len(buffer)
+
+    def _lose_sync(self):
+        """Counts one resync until the next valid frame"""
+        if self._in_sync:
+            self.resyncs += 1
+        self._in_sync = False
+
+
+class StreamingReader:
+    """Reads all bytes from the serial port and delivers complete frames to the read queue"""
+
+    def __init__(self, read_queue=None, latest_only=False):
+        self.read_queue = (
+            read_queue
+            if read_queue is not None
+            else queue.Queue(maxsize=1 if latest_only else READ_QUEUE_SIZE)
+        )
+        self.latest_only = latest_only
+        # called from the reading thread with every ReceivedFrame, returns the decoded frame or None to drop it.
+        # A frame the splitter decoded already comes with its bms_hv_data set
+        self.decode = None
+        # called from the reading thread with every decoded frame and its receive time, before the queue drops any
+        self.on_decoded = None
+        # called from the reading thread after new frames were queued
+        self.on_frames = None
+        self.splitter = FrameSplitter()
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.queue_full_events = 0
+        # counted by the task that owns the port
+        self.reconnects = 0
+        self.rediscoveries = 0
+
+    @property
+    def resyncs(self):
+        """Times the frame boundaries were lost in the byte stream"""
+        return self.splitter.resyncs
+
+    @property
+    def frames_rejected(self):
+        """Corrupt frames that were dropped before decoding"""
+        return self.splitter.corrupt_frames + self.splitter.crc_errors
+
+    def poll(self, ser):
+        """Reads everything that is waiting on the serial port, returns the number of delivered frames"""
+        data = ser.read(max(1, ser.in_waiting))
+        if not data:
+            return 0
+        return self.feed(data, time.time())
+
+    def feed(self, data, timestamp):
+        """Splits the data into frames, decodes them with the decode hook and delivers them, returns the number of delivered frames"""
+        frames = self.splitter.split(data)
+        if not frames:
+            return 0
+
+        self.frames_received += len(frames)
+        frames = [
+            ReceivedFrame(frame, timestamp, bms_hv_data)
+            for frame, bms_hv_data in frames
+        ]
+        if self.decode is not None:
+            frames = self._decode(frames)
+            if not frames:
+                return 0
+        if self.latest_only:
+            self.frames_dropped += len(frames) - 1
+            frames = frames[-1:]
+
+        for frame in frames:
+            self._put(frame)
+        if self.on_frames is not None:
+            self.on_frames()
+        return len(frames)
+
+    def reset(self):
+        """Drops any partially received frame, used after reconnecting"""
+        self.splitter.reset()
+
+    def _decode(self, frames):
+        """Decodes the frames, returns those that decoded. Every decoded frame goes to on_decoded, also those latest_only or a full queue drop"""
+        decoded = []
+        for frame in frames:
+            frame.bms_hv_data = self.decode(frame)
+            if frame.bms_hv_data is None:
+                continue
+            decoded.append(frame)
+            if self.on_decoded is not None:
+                self.on_decoded(frame.bms_hv_data, frame.timestamp)
+        return decoded
+
+    def _put(self, frame):
+        """Puts the frame into the read queue, the oldest frame is dropped if the queue is full"""
+        while True:
+            try:
+                self.read_queue.put_nowait(frame)
+                return
+            except queue.Full:
+                self.queue_full_events += 1
+                try:
+                    self.read_queue.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+
+
+def drain_queue(read_queue):
+    """Returns all frames that are currently waiting in the read queue"""
+    frames = []
+    while True:
+        try:
+            frames.append(read_queue.get_nowait())
+        except queue.Empty:
+            return frames
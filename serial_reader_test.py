@@ -0,0 +1,283 @@
+""" Tests of the frame splitter and the streaming reader"""
+import queue
+import random
+import numpy as np
+import pytest
+from frame_decoder import decode_json_frame
+from mock_bms_hv.mock_bms import MockBms, encode_json_frame
+from serial_reader import FrameSplitter, StreamingReader, drain_queue
+from wire_protocol import encode_binary_frame
+
+
+def mock_stream(count, binary_every=0, seed=5, **kwargs):
+    """Returns count frames of a mock BMS, every binary_every-th one binary"""
+    mock = MockBms(seed=seed, **kwargs)
+    frames = []
+    for i in range(count):
+        mock.step(0.25)
+        binary = binary_every and i % binary_every == binary_every - 1
+        frames.append(
+            (encode_binary_frame if binary else encode_json_frame)(mock.data())
+        )
+    return frames
+
+
+def expected_frames(frames):
+    """Returns the frames like the splitter delivers them, JSON without the delimiter"""
+    return [frame.strip() if frame.startswith(b"{") else frame for frame in frames]
+
+
+def feed_all(splitter, data, chunk_size):
+    """Feeds data in chunks, returns all delivered frames"""
+    frames = []
+    for start in range(0, len(data), chunk_size):
+        frames += splitter.feed(data[start : start + chunk_size])
+    return frames
+
+
+def test_frames_in_any_chunking():
+    frames = mock_stream(9, binary_every=3)
+    stream = b"".join(frames)
+    for chunk_size in (1, 2, 7, 100, 4096, len(stream)):
+        splitter = FrameSplitter()
+        assert feed_all(splitter, stream, chunk_size) == expected_frames(frames)
+        assert splitter.resyncs == 0
+        assert splitter.corrupt_frames == 0
+        assert splitter.crc_errors == 0
+
+
+def test_join_in_the_middle_of_a_frame():
+    frames = mock_stream(4, binary_every=2)
+    for cut in (1, 50, len(frames[0]) - 1):
+        splitter = FrameSplitter()
+        delivered = splitter.feed(b"".join(frames)[cut:])
+        assert delivered == expected_frames(frames[1:])
+        # the first partial frame is not a lost boundary
+        assert splitter.resyncs == 0
+        assert splitter.corrupt_frames == 0
+
+
+def test_lost_delimiter_keeps_the_complete_frame():
+    frames = mock_stream(3)
+    stream = frames[0][:-40] + frames[1] + frames[2]
+    splitter = FrameSplitter()
+    splitter.feed(frames[0])
+    assert splitter.feed(stream) == expected_frames(frames[1:])
+    assert splitter.resyncs == 1
+
+
+def test_corrupted_json_frame_is_dropped():
+    frames = mock_stream(4)
+    corrupted = frames[1].replace(b'"balance"', b'"bal\x07nce"', 1)
+    splitter = FrameSplitter()
+    delivered = splitter.feed(frames[0] + corrupted + frames[2] + frames[3])
+    assert delivered == expected_frames([frames[0], frames[2], frames[3]])
+    assert splitter.corrupt_frames == 1
+
+
+def test_lost_byte_in_json_frame_changes_the_layout():
+    frames = mock_stream(3)
+    position = frames[1].index(b"],") + 1
+    corrupted = frames[1][:position] + frames[1][position + 1 :]
+    splitter = FrameSplitter()
+    delivered = splitter.feed(frames[0] + corrupted + frames[2])
+    assert delivered == expected_frames([frames[0], frames[2]])
+    assert splitter.corrupt_frames == 1
+
+
+def test_corrupted_binary_frame_resyncs():
+    frames = mock_stream(6, binary_every=1)
+    for position in (10, len(frames[2]) // 2, len(frames[2]) - 1):
+        corrupted = bytearray(frames[2])
+        corrupted[position] ^= 0x40
+        splitter = FrameSplitter()
+        stream = b"".join(frames[:2]) + corrupted + b"".join(frames[3:])
+        delivered = feed_all(splitter, stream, 64)
+        assert delivered == frames[:2] + frames[3:]
+        assert splitter.crc_errors == 1
+        assert splitter.resyncs == 1
+
+
+def test_lost_byte_in_binary_frame_resyncs():
+    frames = mock_stream(5, binary_every=1)
+    stream = (
+        b"".join(frames[:2]) + frames[2][:30] + frames[2][31:] + b"".join(frames[3:])
+    )
+    splitter = FrameSplitter()
+    assert feed_all(splitter, stream, 32) == frames[:2] + frames[3:]
+    assert splitter.resyncs == 1
+
+
+def test_invalid_binary_header_resyncs():
+    frames = mock_stream(3, binary_every=2)
+    # a length that does not match the array counts
+    corrupted = bytearray(frames[1])
+    corrupted[3] ^= 0x01
+    splitter = FrameSplitter()
+    delivered = splitter.feed(frames[0] + bytes(corrupted) + frames[2])
+    assert delivered == expected_frames([frames[0], frames[2]])
+    assert splitter.corrupt_frames == 1
+
+
+def test_geometry_change_is_accepted():
+    small = mock_stream(2, ltc_count=2, cells_per_ltc=4, soc_count=5)
+    large = mock_stream(2)
+    splitter = FrameSplitter()
+    frames = small + large + small
+    assert splitter.feed(b"".join(frames)) == expected_frames(frames)
+    assert splitter.corrupt_frames == 0
+
+
+def test_exponents_are_accepted_and_non_finite_values_rejected():
+    mock = MockBms(seed=2)
+    frames = []
+    for current, temperature in (
+        (1.5, 25.0),
+        (1e-05, 25.0),
+        (-2e10, 25.0),
+        (1.5, float("nan")),
+        (1.5, float("inf")),
+    ):
+        data = mock.data()
+        data.temperature = np.full(data.temperature.size, temperature, np.float32)
+        frame = encode_json_frame(data).decode("utf-8")
+        frames.append(
+            frame.replace(f'"current":{data.current:.4f}', f'"current":{current!r}')
+            .replace("nan", "NaN")
+            .replace("inf", "Infinity")
+            .encode("utf-8")
+        )
+    splitter = FrameSplitter()
+    assert splitter.feed(b"".join(frames)) == expected_frames(frames[:3])
+    assert splitter.corrupt_frames == 2
+
+
+def test_undecodable_layout_change_is_rejected():
+    frames = mock_stream(3)
+    unknown = frames[1].replace(b'"balance"', b'"unknown"', 1)
+    splitter = FrameSplitter()
+    delivered = splitter.feed(frames[0] + unknown + frames[2])
+    assert delivered == expected_frames([frames[0], frames[2]])
+    assert splitter.corrupt_frames == 1
+
+
+@pytest.mark.parametrize(
+    "old, new",
+    [
+        # letters of a key that are also in numbers
+        (b'"current"', b'"currnt"'),
+        (b'"balance"', b'"balanNe"'),
+        # a number that lost its digits before the decimal point or all of them
+        (b'"soc":[0.', b'"soc":[.'),
+        (b'"discharge":[0,', b'"discharge":[,'),
+        # a digit turned into another number character
+        (b'"soc":[0.', b'"soc":[..'),
+        (b'"soc":[0.', b'"soc":[-.'),
+        (b'"soc":[0.', b'"soc":[e.'),
+    ],
+)
+def test_corrupted_number_or_key_is_rejected(old, new):
+    frames = mock_stream(3)
+    corrupted = frames[1].replace(old, new, 1)
+    assert corrupted != frames[1]
+    splitter = FrameSplitter()
+    delivered = splitter.feed(frames[0] + corrupted + frames[2])
+    assert delivered == expected_frames([frames[0], frames[2]])
+    assert splitter.corrupt_frames == 1
+
+
+def test_delivered_json_frames_decode_after_a_lost_or_replaced_byte():
+    frames = mock_stream(2)
+    rng = random.Random(3)
+    splitter = FrameSplitter()
+    splitter.feed(frames[0])
+    for position in range(len(frames[1]) - 1):
+        lost = frames[1][:position] + frames[1][position + 1 :]
+        # a digit turned into another digit or an exponent is a valid frame, only binary frames carry a CRC
+        replaced = bytearray(frames[1])
+        replaced[position] = rng.choice(b'.-+,:[]{}" x')
+        for corrupted in (lost, bytes(replaced)):
+            for frame in splitter.feed(corrupted + frames[0]):
+                decode_json_frame(frame)
+
+
+def test_frames_decoded_to_check_a_new_layout_are_handed_through():
+    frames = mock_stream(4, binary_every=4)
+    splitter = FrameSplitter()
+    split = splitter.split(b"".join(frames[:2]) + frames[0] + frames[3])
+    assert [frame for frame, _ in split] == expected_frames(
+        frames[:2] + [frames[0], frames[3]]
+    )
+    data = split[0][1]
+    np.testing.assert_array_equal(
+        data.cell_voltage, decode_json_frame(frames[0]).cell_voltage
+    )
+    # the layout was seen before and binary frames are not decoded by the splitter
+    assert [data for _, data in split[2:]] == [None, None]
+
+
+def test_overflow_drops_the_buffer():
+    frames = mock_stream(2)
+    splitter = FrameSplitter(max_frame_size=1024)
+    assert splitter.feed(b"x" * 2048) == []
+    assert splitter.overflows == 1
+    splitter.max_frame_size = 64 * 1024
+    # the garbage is gone, the next frame starts a line
+    assert splitter.feed(b"".join(frames)) == expected_frames(frames)
+
+
+def test_reader_drops_the_oldest_frame():
+    frames = mock_stream(5)
+    reader = StreamingReader(read_queue=queue.Queue(maxsize=2))
+    assert reader.feed(b"".join(frames), 12.0) == 5
+    delivered = drain_queue(reader.read_queue)
+    assert [frame.data for frame in delivered] == expected_frames(frames[-2:])
+    assert all(frame.timestamp == 12.0 for frame in delivered)
+    assert reader.frames_received == 5
+    assert reader.frames_dropped == 3
+
+
+def test_reader_latest_only_keeps_the_newest_frame():
+    frames = mock_stream(3)
+    reader = StreamingReader(latest_only=True)
+    assert reader.feed(b"".join(frames), 1.0) == 1
+    delivered = drain_queue(reader.read_queue)
+    assert [frame.data for frame in delivered] == expected_frames(frames[-1:])
+    assert reader.frames_dropped == 2
+
+
+def test_reader_decodes_every_frame_before_dropping_any():
+    frames = mock_stream(4)
+    reader = StreamingReader(latest_only=True)
+    decoded = []
+    reader.decode = lambda frame: decode_json_frame(frame.data)
+    reader.on_decoded = lambda data, timestamp: decoded.append((data, timestamp))
+    assert reader.feed(b"".join(frames), 3.0) == 1
+    assert len(decoded) == 4
+    assert all(timestamp == 3.0 for _, timestamp in decoded)
+    (delivered,) = drain_queue(reader.read_queue)
+    assert delivered.bms_hv_data is decoded[-1][0]
+
+
+def test_decode_hook_gets_the_frame_the_splitter_decoded():
+    frames = mock_stream(2)
+    reader = StreamingReader()
+    handed_through = []
+    reader.decode = lambda frame: handed_through.append(frame.bms_hv_data) or 1
+    reader.feed(b"".join(frames), 1.0)
+    assert handed_through[0] is not None
+
+
+def test_frames_the_decode_hook_drops_are_not_delivered():
+    frames = mock_stream(3)
+    reader = StreamingReader()
+    reader.decode = lambda frame: None if frame.data == frames[1].rstrip() else 1
+    notified = []
+    reader.on_frames = lambda: notified.append(1)
+    assert reader.feed(b"".join(frames), 1.0) == 2
+    assert reader.feed(frames[1], 2.0) == 0
+    assert [frame.data for frame in drain_queue(reader.read_queue)] == (
+        expected_frames([frames[0], frames[2]])
+    )
+    assert reader.frames_received == 4
+    assert notified == [1]
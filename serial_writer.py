@@ -0,0 +1,95 @@
+""" Writer scheduler for the BMS HV serial link. It sends keep alive messages on a fixed timer and flushes commands as soon as they are submitted"""
+import itertools
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from console import print_ok
+
+KEEP_ALIVE_MESSAGE = "!C-CC@"
+KEEP_ALIVE_PERIOD_SEC = 0.250
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+LATENCY_HISTORY_SIZE = 100
+
+WRITE_PREFIX = "WRITE: "
+KEEP_ALIVE_PREFIX = "KEEP_ALIVE: "
+
+
+@dataclass(order=True)
+class Command:
+    """Dataclass for a command waiting to be sent to the BMS HV"""
+
+    priority: int
+    sequence: int
+    message: str = field(compare=False)
+    coalesce_key: str = field(compare=False)
+    submit_time: float = field(compare=False)
+
+
+class WriteScheduler:
+    """Sends queued commands immediately and keep alive messages on a fixed timer"""
+
+    def __init__(
+        self,
+        keep_alive_message=KEEP_ALIVE_MESSAGE,
+        keep_alive_period=KEEP_ALIVE_PERIOD_SEC,
+    ):
+        self.keep_alive_message = keep_alive_message
+        self.keep_alive_period = keep_alive_period
+        self.latencies = deque(maxlen=LATENCY_HISTORY_SIZE)
+        self.commands_coalesced = 0
+        # called from the submitting thread after a command was queued
+        self.on_submit = None
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, message, priority=PRIORITY_NORMAL, coalesce_key=None):
+        """Queues a command, a pending command with the same coalesce key is replaced"""
+        sequence = next(self._sequence)
+        key = coalesce_key if coalesce_key is not None else f"#{sequence}"
+        with self._lock:
+            if key in self._pending:
+                self.commands_coalesced += 1
+            self._pending[key] = Command(
+                priority, sequence, message, key, time.monotonic()
+            )
+        if self.on_submit is not None:
+            self.on_submit()
+
+    def last_latency(self):
+        """Returns the send latency of the last command in seconds or None"""
+        return self.latencies[-1] if self.latencies else None
+
+    def take_commands(self):
+        """Removes and returns the pending commands, highest priority first"""
+        with self._lock:
+            commands = sorted(self._pending.values())
+            self._pending.clear()
+        return commands
+
+    def requeue(self, commands):
+        """Puts back commands that could not be written, a newer command with the same coalesce key wins"""
+        with self._lock:
+            for command in commands:
+                self._pending.setdefault(command.coalesce_key, command)
+
+    def write_commands(self, ser, commands):
+        """Writes the commands and records their latency"""
+        for command in commands:
+            ser.write(command.message.encode("utf-8"))
+            ser.flush()
+            latency = time.monotonic() - command.submit_time
+            self.latencies.append(latency)
+            print_ok(
+                f"{WRITE_PREFIX} New data sent to the serial port: "
+                f"{command.message} ({latency * 1000:.1f} ms)"
+            )
+
+    def write_keep_alive(self, ser):
+        """Writes the keep alive message"""
+        ser.write(self.keep_alive_message.encode("utf-8"))
+        print_ok(f"{KEEP_ALIVE_PREFIX} Keep alive message sent to the serial port")
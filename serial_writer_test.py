@@ -0,0 +1,98 @@
+""" Tests of the write scheduler"""
+import contextlib
+import io
+from serial_writer import (
+    KEEP_ALIVE_MESSAGE,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    WriteScheduler,
+)
+
+
+class RecordingPort:
+    """Stand-in for a serial port that keeps everything written to it"""
+
+    def __init__(self):
+        self.written = []
+        self.flushes = 0
+
+    def write(self, data):
+        """Serial.write"""
+        self.written.append(data)
+        return len(data)
+
+    def flush(self):
+        """Serial.flush"""
+        self.flushes += 1
+
+
+def messages(commands):
+    """Returns the messages of commands"""
+    return [command.message for command in commands]
+
+
+def test_commands_are_taken_by_priority_then_in_order():
+    scheduler = WriteScheduler()
+    scheduler.submit("!C-ON@")
+    scheduler.submit("!B-ON@")
+    scheduler.submit("!C-OF@", PRIORITY_HIGH)
+    assert messages(scheduler.take_commands()) == ["!C-OF@", "!C-ON@", "!B-ON@"]
+    assert scheduler.take_commands() == []
+
+
+def test_newer_command_with_the_same_key_replaces_the_pending_one():
+    scheduler = WriteScheduler()
+    scheduler.submit("!C-ON@", coalesce_key="C")
+    scheduler.submit("!B-ON@", coalesce_key="B")
+    scheduler.submit("!C-OF@", PRIORITY_NORMAL, coalesce_key="C")
+    assert messages(scheduler.take_commands()) == ["!B-ON@", "!C-OF@"]
+    assert scheduler.commands_coalesced == 1
+
+
+def test_commands_without_a_key_are_never_coalesced():
+    scheduler = WriteScheduler()
+    for _ in range(3):
+        scheduler.submit("!B-FC@")
+    assert messages(scheduler.take_commands()) == ["!B-FC@"] * 3
+    assert scheduler.commands_coalesced == 0
+
+
+def test_requeued_commands_lose_to_newer_ones():
+    scheduler = WriteScheduler()
+    scheduler.submit("!C-ON@", coalesce_key="C")
+    scheduler.submit("!B-ON@", coalesce_key="B")
+    failed = scheduler.take_commands()
+    scheduler.submit("!C-OF@", coalesce_key="C")
+    scheduler.requeue(failed)
+    assert messages(scheduler.take_commands()) == ["!B-ON@", "!C-OF@"]
+
+
+def test_on_submit_is_called_after_the_command_is_queued():
+    scheduler = WriteScheduler()
+    pending = []
+    scheduler.on_submit = lambda: pending.extend(scheduler.take_commands())
+    scheduler.submit("!C-ON@")
+    assert messages(pending) == ["!C-ON@"]
+
+
+def test_written_commands_record_their_latency():
+    scheduler = WriteScheduler()
+    port = RecordingPort()
+    assert scheduler.last_latency() is None
+    scheduler.submit("!C-ON@")
+    scheduler.submit("!B-ON@")
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.write_commands(port, scheduler.take_commands())
+    assert port.written == [b"!C-ON@", b"!B-ON@"]
+    assert port.flushes == 2
+    assert len(scheduler.latencies) == 2
+    assert scheduler.last_latency() == scheduler.latencies[-1] >= 0
+
+
+def test_keep_alive_message():
+    scheduler = WriteScheduler()
+    port = RecordingPort()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.write_keep_alive(port)
+    assert port.written == [KEEP_ALIVE_MESSAGE.encode("utf-8")]
+    assert scheduler.last_latency() is None
@@ -0,0 +1,608 @@
+""" Indexed queries over recorded sessions. Every session file gets zone maps, the time range and the min/max of the indexed fields per block of records, which are kept next to it in an index file. Threshold and time range queries only scan the blocks whose zone maps can match, with vectorized NumPy scans inside the blocks
+
+Usage: python session_query.py SESSION {info,under,over,holder,buckets} [options]
+"""
+import argparse
+import os
+import sys
+import time
+import zipfile
+import numpy as np
+from console import print_ok, print_error, print_warning
+from formatting import channel_name
+from pack_geometry import DEFAULT_PACK_GEOMETRY, load_geometry
+from session_recorder import open_session, read_header, session_files
+
+# 2.56 s at 100 Hz, 64 s at the nominal 4 Hz
+BLOCK_RECORDS = 256
+# blocks scanned at once, bounds the temporary arrays of a scan
+SCAN_BLOCKS = 256
+
+INDEX_EXTENSION = ".bmsidx"
+INDEX_VERSION = 2
+
+INDEXED_FIELDS = (
+    "current",
+    "acc_voltage",
+    "car_voltage",
+    "soc",
+    "cell_voltage",
+    "temperature",
+)
+
+# the seconds every channel held the lowest and the highest value are summed per block for these fields
+HOLDER_FIELDS = ("cell_voltage", "temperature")
+
+# a longer gap between two records is a disconnect, it is not counted as time holding the extreme
+MAX_SAMPLE_GAP_SEC = 1.0
+
+
+def unused_channels(geometry, field, channel_count):
+    """Returns the unused channels of a field with channel_count channels, empty for the fields without a layout"""
+    layout = None if geometry is None else geometry.layouts.get(field)
+    if layout is None:
+        return np.empty(0, dtype=np.intp)
+    unused = layout.for_size(channel_count).unused
+    return unused[unused < channel_count]
+
+
+def channel_values(records, field, geometry=None):
+    """Returns the values of a field as a (records, channels) view, scalar fields have one channel
+
+    With a geometry the unused channels are NaN in a copy, so that they are
+    skipped by the zone maps and the scans like by the statistics and alarms
+    """
+    values = records[field]
+    values = values.reshape(len(values), -1)
+    unused = unused_channels(geometry, field, values.shape[1])
+    if len(unused):
+        values = values.copy()
+        values[:, unused] = np.nan
+    return values
+
+
+def time_mask(times, start=None, end=None):
+    """Returns the mask of the times within [start, end], None is unbounded"""
+    mask = np.ones(len(times), dtype=bool)
+    if start is not None:
+        mask &= times >= start
+    if end is not None:
+        mask &= times <= end
+    return mask
+
+
+def runs(mask):
+    """Returns [(first, end)] of the runs of True in a mask"""
+    edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    return list(
+        zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist())
+    )
+
+
+def hold_name(field, lowest):
+    """Returns the name of the holds of a field in the index file"""
+    return f"held_{'min' if lowest else 'max'}_{field}"
+
+
+def index_path(path):
+    """Returns the path of the index file of a session file"""
+    return os.path.splitext(path)[0] + INDEX_EXTENSION
+
+
+class SessionIndex:
+    """Memory-mapped records of one session file and their zone maps per block of records, the unused channels of the geometry are left out"""
+
+    def __init__(
+        self,
+        path,
+        block_records=BLOCK_RECORDS,
+        cache=True,
+        geometry=DEFAULT_PACK_GEOMETRY,
+    ):
+        self.path = path
+        self.block_records = block_records
+        self.geometry = geometry
+        self.records = open_session(path)
+        self.created = float(read_header(path)[2].get("created", 0.0))
+        self.block_start = np.empty(0)
+        self.block_end = np.empty(0)
+        self.minimum = {field: np.empty(0) for field in INDEXED_FIELDS}
+        self.maximum = {field: np.empty(0) for field in INDEXED_FIELDS}
+        # (field, lowest): (blocks, channels) seconds every channel held the extreme
+        self.holds = {
+            (field, lowest): np.empty((0, self.channel_count(field)))
+            for field in HOLDER_FIELDS
+            for lowest in (True, False)
+        }
+
+        first_block = self._load() if cache else 0
+        if first_block < self.block_count:
+            self._build(first_block)
+            if cache:
+                self._save()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def block_count(self):
+        """Number of blocks, the last one can be incomplete"""
+        return -(-len(self.records) // self.block_records)
+
+    def channel_count(self, field):
+        """Number of channels of a field"""
+        return int(np.prod(self.records.dtype[field].shape))
+
+    def unused(self, field):
+        """Returns the unused channels of a field"""
+        return unused_channels(self.geometry, field, self.channel_count(field))
+
+    def values(self, records, field):
+        """Returns the values of a field as (records, channels) with the unused channels NaN"""
+        return channel_values(records, field, self.geometry)
+
+    def record_range(self, first_block, end_block):
+        """Returns the (first, end) records of a range of blocks"""
+        return first_block * self.block_records, min(
+            end_block * self.block_records, len(self.records)
+        )
+
+    def time_blocks(self, start=None, end=None):
+        """Returns the mask of the blocks that overlap [start, end]"""
+        mask = np.ones(self.block_count, dtype=bool)
+        if start is not None:
+            mask &= self.block_end >= start
+        if end is not None:
+            mask &= self.block_start <= end
+        return mask
+
+    def inside_blocks(self, start=None, end=None):
+        """Returns the mask of the blocks that lie entirely within [start, end]"""
+        mask = np.ones(self.block_count, dtype=bool)
+        if start is not None:
+            mask &= self.block_start >= start
+        if end is not None:
+            mask &= self.block_end <= end
+        return mask
+
+    def chunks(self, mask):
+        """Yields (first, end) record ranges of at most SCAN_BLOCKS blocks covering the blocks in a mask"""
+        for first_block, end_block in runs(mask):
+            for chunk_block in range(first_block, end_block, SCAN_BLOCKS):
+                yield self.record_range(
+                    chunk_block, min(chunk_block + SCAN_BLOCKS, end_block)
+                )
+
+    def held(self, first, last, start=None, end=None):
+        """Returns the seconds every record of a range holds until the next one is received, 0 outside [start, end]"""
+        times = self.records["receive_time"][first : last + 1]
+        held = np.diff(times)
+        if len(held) < last - first:
+            held = np.append(held, 0.0)
+        held = np.clip(held, 0.0, MAX_SAMPLE_GAP_SEC)
+        held[~time_mask(times[: last - first], start, end)] = 0.0
+        return held
+
+    def channel_holds(self, first, last, field, lowest, start=None, end=None):
+        """Returns the (blocks, channels) seconds every channel held the lowest or highest value of a field in a block aligned range"""
+        values = self.values(self.records[first:last], field)
+        # NaN never holds the extreme
+        fill = np.inf if lowest else -np.inf
+        values = np.where(np.isnan(values), fill, values)
+        channel = values.argmin(axis=1) if lowest else values.argmax(axis=1)
+        channels = values.shape[1]
+        blocks = -(-(last - first) // self.block_records)
+        block = np.arange(last - first) // self.block_records
+        return np.bincount(
+            block * channels + channel,
+            weights=self.held(first, last, start, end),
+            minlength=blocks * channels,
+        ).reshape(blocks, channels)
+
+    def _build(self, first_block):
+        """Computes the zone maps from first_block on, the blocks before it are kept"""
+        block_start = [self.block_start[:first_block]]
+        block_end = [self.block_end[:first_block]]
+        minimum = {
+            field: [self.minimum[field][:first_block]] for field in INDEXED_FIELDS
+        }
+        maximum = {
+            field: [self.maximum[field][:first_block]] for field in INDEXED_FIELDS
+        }
+        holds = {key: [value[:first_block]] for key, value in self.holds.items()}
+        mask = np.zeros(self.block_count, dtype=bool)
+        mask[first_block:] = True
+        for first, end in self.chunks(mask):
+            records = self.records[first:end]
+            offsets = np.arange(0, len(records), self.block_records)
+            times = records["receive_time"]
+            block_start.append(np.fmin.reduceat(times, offsets))
+            block_end.append(np.fmax.reduceat(times, offsets))
+            # fmin and fmax skip NaN, a block is only NaN if all of its values are
+            for field in INDEXED_FIELDS:
+                values = self.values(records, field)
+                minimum[field].append(
+                    np.fmin.reduceat(np.fmin.reduce(values, axis=1), offsets)
+                )
+                maximum[field].append(
+                    np.fmax.reduceat(np.fmax.reduce(values, axis=1), offsets)
+                )
+            for field, lowest in holds:
+                holds[field, lowest].append(
+                    self.channel_holds(first, end, field, lowest)
+                )
+        self.block_start = np.concatenate(block_start).astype(np.float64)
+        self.block_end = np.concatenate(block_end).astype(np.float64)
+        for field in INDEXED_FIELDS:
+            self.minimum[field] = np.concatenate(minimum[field]).astype(np.float64)
+            self.maximum[field] = np.concatenate(maximum[field]).astype(np.float64)
+        for key, value in holds.items():
+            self.holds[key] = np.concatenate(value)
+
+    def _load(self):
+        """Takes over the complete blocks of the index file, returns the number of blocks loaded"""
+        try:
+            with np.load(index_path(self.path)) as index:
+                record_count = int(index["record_count"])
+                if (
+                    int(index["version"]) != INDEX_VERSION
+                    or int(index["block_records"]) != self.block_records
+                    or int(index["itemsize"]) != self.records.dtype.itemsize
+                    or float(index["created"]) != self.created
+                    or record_count > len(self.records)
+                    or any(
+                        not np.array_equal(index[f"unused_{field}"], self.unused(field))
+                        for field in HOLDER_FIELDS
+                    )
+                ):
+                    return 0
+                # the last block grows while the session is recorded and the last record of
+                # a complete block only holds until the next record once that is written
+                if record_count == len(self.records):
+                    blocks = record_count // self.block_records
+                else:
+                    blocks = (record_count - 1) // self.block_records
+                self.block_start = index["block_start"][:blocks]
+                self.block_end = index["block_end"][:blocks]
+                for field in INDEXED_FIELDS:
+                    self.minimum[field] = index[f"min_{field}"][:blocks]
+                    self.maximum[field] = index[f"max_{field}"][:blocks]
+                for field, lowest in self.holds:
+                    self.holds[field, lowest] = index[hold_name(field, lowest)][:blocks]
+                return blocks
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return 0
+
+    def _save(self):
+        """Writes the index file, a session without a writable directory is indexed every time"""
+        path = index_path(self.path)
+        arrays = {
+            "version": INDEX_VERSION,
+            "block_records": self.block_records,
+            "itemsize": self.records.dtype.itemsize,
+            "created": self.created,
+            "record_count": len(self.records),
+            "block_start": self.block_start,
+            "block_end": self.block_end,
+        }
+        for field in HOLDER_FIELDS:
+            arrays[f"unused_{field}"] = self.unused(field)
+        for field in INDEXED_FIELDS:
+            arrays[f"min_{field}"] = self.minimum[field]
+            arrays[f"max_{field}"] = self.maximum[field]
+        for (field, lowest), value in self.holds.items():
+            arrays[hold_name(field, lowest)] = value
+        try:
+            with open(path + ".tmp", "wb") as file:
+                np.savez(file, **arrays)
+            os.replace(path + ".tmp", path)
+        except OSError as error:
+            print_warning(f"QUERY: Failed to write {path}: {error}")
+
+
+class Session:
+    """Queries over a session file or a directory of session files, times are receive times in seconds"""
+
+    def __init__(
+        self,
+        path,
+        block_records=BLOCK_RECORDS,
+        cache=True,
+        geometry=DEFAULT_PACK_GEOMETRY,
+    ):
+        paths = session_files(path) if os.path.isdir(path) else [path]
+        if not paths:
+            raise ValueError(f"No session files in {path}")
+        self.geometry = geometry
+        self.indexes = [
+            SessionIndex(p, block_records, cache, geometry) for p in paths
+        ]
+        # blocks scanned by the last query, the other blocks were skipped by their zone maps
+        self.blocks_scanned = 0
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes)
+
+    @property
+    def block_count(self):
+        """Number of blocks of all session files"""
+        return sum(index.block_count for index in self.indexes)
+
+    @property
+    def time_range(self):
+        """Returns (first, last) receive time, (None, None) for an empty session"""
+        starts = [
+            index.block_start.min() for index in self.indexes if index.block_count
+        ]
+        ends = [index.block_end.max() for index in self.indexes if index.block_count]
+        if not starts:
+            return None, None
+        return float(min(starts)), float(max(ends))
+
+    def records_between(self, start=None, end=None):
+        """Returns a copy of the records received within [start, end]"""
+        self.blocks_scanned = 0
+        parts = []
+        for index in self.indexes:
+            for first, last in index.chunks(index.time_blocks(start, end)):
+                self.blocks_scanned += -(-(last - first) // index.block_records)
+                records = index.records[first:last]
+                parts.append(records[time_mask(records["receive_time"], start, end)])
+        if not parts:
+            return np.empty(0, dtype=self.indexes[0].records.dtype)
+        # files of different pack geometries cannot be joined
+        if len({part.dtype for part in parts}) > 1:
+            raise ValueError("The session files have different pack geometries")
+        return np.concatenate(parts)
+
+    def threshold_intervals(self, field, threshold, below=True, start=None, end=None):
+        """Returns [(start time, end time, extreme value, channel of the extreme)] of the intervals in which any channel of a field is below or above a threshold"""
+        self.blocks_scanned = 0
+        intervals = []
+        for index in self.indexes:
+            if below:
+                candidates = index.minimum[field] < threshold
+            else:
+                candidates = index.maximum[field] > threshold
+            candidates &= index.time_blocks(start, end)
+            # the runs of candidate blocks are scanned whole, an interval never crosses a skipped block
+            for first_block, end_block in runs(candidates):
+                self.blocks_scanned += end_block - first_block
+                first, end_record = index.record_range(first_block, end_block)
+                records = index.records[first:end_record]
+                values = index.values(records, field)
+                times = records["receive_time"]
+                hits = values < threshold if below else values > threshold
+                hit = hits.any(axis=1) & time_mask(times, start, end)
+                for a, b in runs(hit):
+                    window = values[a:b]
+                    flat = np.nanargmin(window) if below else np.nanargmax(window)
+                    row, channel = divmod(int(flat), window.shape[1])
+                    intervals.append(
+                        (
+                            float(times[a]),
+                            float(times[b - 1]),
+                            float(window[row, channel]),
+                            channel,
+                        )
+                    )
+        return intervals
+
+    def holder_durations(
+        self,
+        field="cell_voltage",
+        geometry=None,
+        lowest=True,
+        start=None,
+        end=None,
+    ):
+        """Returns the seconds every LTC held the lowest or highest value of a field, by default of the LTCs of the session geometry"""
+        geometry = geometry or self.geometry
+        self.blocks_scanned = 0
+        durations = np.zeros(geometry.ltc_count)
+        for index in self.indexes:
+            # the blocks within the time range are answered by the index
+            if (field, lowest) in index.holds:
+                covered = index.inside_blocks(start, end)
+                holds = index.holds[field, lowest][covered].sum(axis=0)
+            else:
+                covered = np.zeros(index.block_count, dtype=bool)
+                holds = np.zeros(index.channel_count(field))
+            scan = index.time_blocks(start, end) & ~covered
+            self.blocks_scanned += int(scan.sum())
+            for first, last in index.chunks(scan):
+                holds += index.channel_holds(
+                    first, last, field, lowest, start, end
+                ).sum(axis=0)
+            ltc = geometry.layouts[field].for_size(len(holds)).ltc
+            durations += np.bincount(ltc, weights=holds, minlength=len(durations))[
+                : len(durations)
+            ]
+        return durations
+
+    def bucket_extremes(
+        self, field="temperature", bucket_sec=60.0, lowest=False, start=None, end=None
+    ):
+        """Returns (bucket start times, values) of the highest or lowest value of a field per time bucket"""
+        self.blocks_scanned = 0
+        reduce = np.fmin if lowest else np.fmax
+        keys = []
+        extremes = []
+        for index in self.indexes:
+            zones = index.minimum[field] if lowest else index.maximum[field]
+            first_bucket = np.floor(index.block_start / bucket_sec)
+            # a block within one bucket and the time range is answered by its zone map
+            covered = (first_bucket == np.floor(index.block_end / bucket_sec)) & (
+                index.inside_blocks(start, end)
+            )
+            keys.append(first_bucket[covered])
+            extremes.append(zones[covered])
+            scan = index.time_blocks(start, end) & ~covered
+            self.blocks_scanned += int(scan.sum())
+            for first, last in index.chunks(scan):
+                records = index.records[first:last]
+                times = records["receive_time"]
+                mask = time_mask(times, start, end)
+                keys.append(np.floor(times[mask] / bucket_sec))
+                extremes.append(
+                    reduce.reduce(index.values(records, field), axis=1)[mask]
+                )
+        keys = np.concatenate(keys)
+        extremes = np.concatenate(extremes).astype(np.float64)
+        if not len(keys):
+            return np.empty(0), np.empty(0)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return keys[starts] * bucket_sec, reduce.reduceat(extremes[order], starts)
+
+
+def format_time(seconds):
+    """Formats a receive time as local date and time with milliseconds"""
+    return (
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
+        + f".{int(seconds * 1000) % 1000:03d}"
+    )
+
+
+def parse_args():
+    """Parses the command line arguments"""
+    parser = argparse.ArgumentParser(description="BMS HV session queries")
+    parser.add_argument("session", help="session file or directory of session files")
+    parser.add_argument(
+        "--from",
+        dest="start",
+        type=float,
+        metavar="SEC",
+        help="only query records received SEC seconds after the session start or later",
+    )
+    parser.add_argument(
+        "--to",
+        dest="end",
+        type=float,
+        metavar="SEC",
+        help="only query records received up to SEC seconds after the session start",
+    )
+    parser.add_argument(
+        "--geometry",
+        metavar="FILE",
+        help="YAML file with the pack geometry the arrays are laid out by, see pack_geometry.py (default: 15 LTCs with 9 cells and 3 sensors)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="index the session files without reading or writing the index files",
+    )
+    subparsers = parser.add_subparsers(dest="query", required=True)
+    subparsers.add_parser("info", help="records, time range and blocks of the session")
+    for name, description in (
+        ("under", "when any channel went under a value"),
+        ("over", "when any channel went over a value"),
+    ):
+        subparser = subparsers.add_parser(name, help=description)
+        subparser.add_argument("value", type=float)
+        subparser.add_argument(
+            "--field",
+            default="cell_voltage",
+            choices=INDEXED_FIELDS,
+            help="default: cell_voltage",
+        )
+    subparser = subparsers.add_parser(
+        "holder", help="how long every LTC held the min (or max) value"
+    )
+    subparser.add_argument("--max", action="store_true", help="the max value instead")
+    subparser.add_argument(
+        "--field",
+        default="cell_voltage",
+        choices=("cell_voltage", "temperature"),
+        help="default: cell_voltage",
+    )
+    subparser = subparsers.add_parser(
+        "buckets", help="max (or min) value per time bucket"
+    )
+    subparser.add_argument("--min", action="store_true", help="the min value instead")
+    subparser.add_argument(
+        "--field",
+        default="temperature",
+        choices=INDEXED_FIELDS,
+        help="default: temperature",
+    )
+    subparser.add_argument(
+        "--seconds", type=float, default=60.0, help="bucket length (default: 60)"
+    )
+    args = parser.parse_args()
+    args.pack_geometry = DEFAULT_PACK_GEOMETRY
+    if args.geometry is not None:
+        try:
+            args.pack_geometry = load_geometry(args.geometry)
+        except (OSError, ValueError) as error:
+            parser.error(f"failed to load the pack geometry: {error}")
+    return args
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+    start_time = time.perf_counter()
+    try:
+        session = Session(
+            args.session, cache=not args.no_cache, geometry=args.pack_geometry
+        )
+    except (OSError, ValueError) as error:
+        print_error(f"QUERY: Failed to open {args.session}: {error}")
+        return 1
+    index_sec = time.perf_counter() - start_time
+
+    first_time, last_time = session.time_range
+    if first_time is None:
+        print_warning(f"QUERY: {args.session} has no records")
+        return 0
+    start = None if args.start is None else first_time + args.start
+    end = None if args.end is None else first_time + args.end
+
+    start_time = time.perf_counter()
+    if args.query == "info":
+        print(f"files:   {len(session.indexes)}")
+        print(f"records: {len(session)}")
+        print(
+            f"time:    {format_time(first_time)} - {format_time(last_time)} ({last_time - first_time:.1f} s)"
+        )
+        print(f"blocks:  {session.block_count} of {BLOCK_RECORDS} records")
+    elif args.query in ("under", "over"):
+        channel_count = int(np.prod(session.indexes[0].records.dtype[args.field].shape))
+        intervals = session.threshold_intervals(
+            args.field, args.value, args.query == "under", start, end
+        )
+        for interval_start, interval_end, value, channel in intervals:
+            print(
+                f"{format_time(interval_start)} - {format_time(interval_end)} "
+                f"({interval_end - interval_start:8.2f} s)  "
+                f"{'min' if args.query == 'under' else 'max'} {value:.4f} "
+                f"{channel_name(args.field, channel, channel_count, args.pack_geometry)}"
+            )
+        print(f"{len(intervals)} intervals {args.query} {args.value}")
+    elif args.query == "holder":
+        durations = session.holder_durations(
+            args.field, args.pack_geometry, not args.max, start, end
+        )
+        for ltc in np.argsort(durations)[::-1]:
+            print(
+                f"LTC {ltc:2d}  {durations[ltc]:10.1f} s  {durations[ltc] / max(durations.sum(), 1e-9):6.1%}"
+            )
+    else:
+        bucket_times, values = session.bucket_extremes(
+            args.field, args.seconds, args.min, start, end
+        )
+        for bucket_time, value in zip(bucket_times, values):
+            print(f"{format_time(bucket_time)}  {value:.4f}")
+    query_sec = time.perf_counter() - start_time
+
+    print_ok(
+        f"QUERY: Indexed in {index_sec * 1000:.1f} ms, queried in {query_sec * 1000:.1f} ms, "
+        f"{session.blocks_scanned} of {session.block_count} blocks scanned"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+""" Tests of the indexed session queries against brute force scans of all records"""
+import os
+import numpy as np
+import pytest
+from mock_bms_hv.mock_bms import MockBms
+from pack_geometry import PackGeometry
+from session_query import MAX_SAMPLE_GAP_SEC, Session, index_path, runs
+from session_recorder import build_records, frame_record_dtype, write_header
+
+BLOCK_RECORDS = 16
+
+GEOMETRY = PackGeometry(unused_cells=[[14, 8]], unused_sensors=[1])
+UNUSED_CELL = 134
+
+
+def mock_records(count, start_time, seed):
+    """Returns count records of a mock BMS with dips, spikes, gaps and a disconnected cell"""
+    mock = MockBms(seed=seed)
+    rng = np.random.default_rng(seed)
+    frames = []
+    receive_time = start_time
+    for i in range(count):
+        mock.step(0.25)
+        data = mock.data()
+        data.cell_voltage[UNUSED_CELL] = 0.0
+        if i % 37 < 5:
+            data.cell_voltage[rng.integers(0, UNUSED_CELL)] = 2.8 + 0.01 * (i % 37)
+        if i % 53 < 3:
+            data.temperature[rng.integers(0, data.temperature.size)] = 70.0 + i % 53
+        receive_time += 2.5 if i % 97 == 96 else 0.25
+        frames.append((data, receive_time))
+    return build_records(frames, frame_record_dtype(frames[0][0]))
+
+
+def write_session(path, records):
+    """Writes records to a session file"""
+    with open(path, "wb") as file:
+        write_header(file, records.dtype)
+        file.write(records.tobytes())
+
+
+@pytest.fixture(name="session_dir")
+def fixture_session_dir(tmp_path):
+    """Directory with two session files"""
+    write_session(tmp_path / "bms_hv_1.bmsrec", mock_records(500, 1000.0, 1))
+    write_session(tmp_path / "bms_hv_2.bmsrec", mock_records(300, 2000.0, 2))
+    return tmp_path
+
+
+def all_records(session_dir):
+    """Returns the records of every session file, one array per file"""
+    return [index.records for index in Session(session_dir, cache=False).indexes]
+
+
+def masked(records, field):
+    """Returns (records, channels) values of a field with the unused channels NaN"""
+    values = np.array(records[field], dtype=np.float64).reshape(len(records), -1)
+    layout = GEOMETRY.layouts.get(field)
+    if layout is not None:
+        values[:, layout.unused] = np.nan
+    return values
+
+
+def in_range(times, start, end):
+    """Brute force time range mask"""
+    return (times >= (-np.inf if start is None else start)) & (
+        times <= (np.inf if end is None else end)
+    )
+
+
+def brute_intervals(files, field, threshold, below, start, end):
+    """Threshold intervals by scanning every record"""
+    intervals = []
+    for records in files:
+        values = masked(records, field)
+        times = records["receive_time"]
+        hits = (values < threshold) if below else (values > threshold)
+        hit = hits.any(axis=1) & in_range(times, start, end)
+        for a, b in runs(hit):
+            window = values[a:b]
+            flat = np.nanargmin(window) if below else np.nanargmax(window)
+            row, channel = divmod(int(flat), window.shape[1])
+            intervals.append(
+                (
+                    float(times[a]),
+                    float(times[b - 1]),
+                    float(window[row, channel]),
+                    channel,
+                )
+            )
+    return intervals
+
+
+def brute_holder_durations(files, field, lowest, start, end):
+    """Seconds every LTC held the extreme by scanning every record"""
+    layout = GEOMETRY.layouts[field]
+    durations = np.zeros(GEOMETRY.ltc_count)
+    for records in files:
+        times = records["receive_time"]
+        held = np.clip(np.append(np.diff(times), 0.0), 0.0, MAX_SAMPLE_GAP_SEC)
+        held[~in_range(times, start, end)] = 0.0
+        values = masked(records, field)
+        values = np.where(np.isnan(values), np.inf if lowest else -np.inf, values)
+        channels = values.argmin(axis=1) if lowest else values.argmax(axis=1)
+        for channel, seconds in zip(channels, held):
+            durations[layout.ltc[channel]] += seconds
+    return durations
+
+
+def brute_bucket_extremes(files, field, bucket_sec, lowest, start, end):
+    """Extreme of a field per time bucket by scanning every record"""
+    buckets = {}
+    for records in files:
+        values = masked(records, field)
+        for time, row in zip(records["receive_time"], values):
+            if not in_range(np.array([time]), start, end)[0]:
+                continue
+            extreme = np.nanmin(row) if lowest else np.nanmax(row)
+            key = np.floor(time / bucket_sec) * bucket_sec
+            previous = buckets.get(key, extreme)
+            buckets[key] = min(previous, extreme) if lowest else max(previous, extreme)
+    keys = sorted(buckets)
+    return np.array(keys), np.array([buckets[key] for key in keys])
+
+
+TIME_RANGES = [(None, None), (1010.0, 1090.0), (1050.3, 2030.0), (None, 1003.3)]
+
+
+@pytest.mark.parametrize("start, end", TIME_RANGES)
+@pytest.mark.parametrize(
+    "field, threshold, below",
+    [
+        ("cell_voltage", 3.0, True),
+        ("cell_voltage", 2.0, True),
+        ("temperature", 65.0, False),
+        ("current", 0.0, False),
+    ],
+)
+def test_threshold_intervals(session_dir, field, threshold, below, start, end):
+    session = Session(session_dir, BLOCK_RECORDS, geometry=GEOMETRY)
+    intervals = session.threshold_intervals(field, threshold, below, start, end)
+    expected = brute_intervals(
+        all_records(session_dir), field, threshold, below, start, end
+    )
+    assert intervals == pytest.approx(expected)
+    assert session.blocks_scanned <= session.block_count
+
+
+def test_unused_channels_are_left_out(session_dir):
+    session = Session(session_dir, BLOCK_RECORDS, geometry=GEOMETRY)
+    assert all(
+        channel != UNUSED_CELL
+        for _, _, _, channel in session.threshold_intervals("cell_voltage", 3.0)
+    )
+    # the disconnected cell is at 0 V in every record
+    assert session.threshold_intervals("cell_voltage", 2.0) == []
+    assert session.blocks_scanned == 0
+
+
+@pytest.mark.parametrize("start, end", TIME_RANGES)
+@pytest.mark.parametrize(
+    "field, lowest",
+    [("cell_voltage", True), ("cell_voltage", False), ("temperature", False)],
+)
+def test_holder_durations(session_dir, field, lowest, start, end):
+    session = Session(session_dir, BLOCK_RECORDS, geometry=GEOMETRY)
+    durations = session.holder_durations(field, lowest=lowest, start=start, end=end)
+    expected = brute_holder_durations(
+        all_records(session_dir), field, lowest, start, end
+    )
+    np.testing.assert_allclose(durations, expected)
+
+
+@pytest.mark.parametrize("start, end", TIME_RANGES)
+@pytest.mark.parametrize("bucket_sec", [1.0, 10.0, 300.0])
+@pytest.mark.parametrize(
+    "field, lowest", [("temperature", False), ("cell_voltage", True)]
+)
+def test_bucket_extremes(session_dir, field, lowest, bucket_sec, start, end):
+    session = Session(session_dir, BLOCK_RECORDS, geometry=GEOMETRY)
+    keys, extremes = session.bucket_extremes(field, bucket_sec, lowest, start, end)
+    expected_keys, expected = brute_bucket_extremes(
+        all_records(session_dir), field, bucket_sec, lowest, start, end
+    )
+    np.testing.assert_allclose(keys, expected_keys)
+    np.testing.assert_allclose(extremes, expected)
+
+
+@pytest.mark.parametrize("start, end", TIME_RANGES)
+def test_records_between(session_dir, start, end):
+    session = Session(session_dir, BLOCK_RECORDS, geometry=GEOMETRY)
+    records = session.records_between(start, end)
+    expected = np.concatenate(
+        [r[in_range(r["receive_time"], start, end)] for r in all_records(session_dir)]
+    )
+    assert records.tobytes() == expected.tobytes()
+
+
+def test_time_range(session_dir):
+    session = Session(session_dir, BLOCK_RECORDS, geometry=GEOMETRY)
+    files = all_records(session_dir)
+    assert session.time_range == (
+        float(files[0]["receive_time"][0]),
+        float(files[1]["receive_time"][-1]),
+    )
+    assert len(session) == 800
+
+
+def test_cached_index_is_reused_and_extended(tmp_path):
+    path = tmp_path / "bms_hv.bmsrec"
+    records = mock_records(400, 1000.0, 3)
+    write_session(path, records[:250])
+    first = Session(path, BLOCK_RECORDS, geometry=GEOMETRY)
+    assert os.path.exists(index_path(str(path)))
+    # the session is still recorded, the index is extended from its last complete block
+    with open(path, "ab") as file:
+        file.write(records[250:].tobytes())
+    cached = Session(path, BLOCK_RECORDS, geometry=GEOMETRY)
+    fresh = Session(path, BLOCK_RECORDS, cache=False, geometry=GEOMETRY)
+    assert first.block_count < cached.block_count == fresh.block_count
+    (cached_index,), (fresh_index,) = cached.indexes, fresh.indexes
+    np.testing.assert_array_equal(cached_index.block_start, fresh_index.block_start)
+    for field in ("cell_voltage", "temperature", "current"):
+        np.testing.assert_array_equal(
+            cached_index.minimum[field], fresh_index.minimum[field]
+        )
+        np.testing.assert_array_equal(
+            cached_index.maximum[field], fresh_index.maximum[field]
+        )
+    for key, holds in fresh_index.holds.items():
+        np.testing.assert_allclose(cached_index.holds[key], holds)
+
+
+def test_index_of_another_geometry_is_rebuilt(tmp_path):
+    path = tmp_path / "bms_hv.bmsrec"
+    write_session(path, mock_records(100, 1000.0, 4))
+    everything = Session(path, BLOCK_RECORDS, geometry=PackGeometry())
+    assert everything.threshold_intervals("cell_voltage", 2.0) != []
+    masked_session = Session(path, BLOCK_RECORDS, geometry=GEOMETRY)
+    assert masked_session.threshold_intervals("cell_voltage", 2.0) == []
+    assert Session(path, BLOCK_RECORDS).threshold_intervals("cell_voltage", 2.0) != []
+
+
+def test_empty_directory(tmp_path):
+    with pytest.raises(ValueError):
+        Session(tmp_path)
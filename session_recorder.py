@@ -0,0 +1,286 @@
+""" Session recorder for BMS HV frames. Every frame is appended as a fixed size record to a binary file that can be opened memory-mapped
+
+File layout:
+    magic       8 B     b"BMSREC\\x00\\x01"
+    header size 4 B     little-endian u32, size of the JSON header including padding
+    header      JSON    {"descr": NumPy record dtype description, "created": unix time}
+    records     fixed size records, the last one can be incomplete if the recorder was killed
+"""
+import functools
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import numpy as np
+from console import print_ok, print_error, print_warning
+from frame_decoder import BmsHvData
+from wire_protocol import ERROR_FIELDS
+
+MAGIC = b"BMSREC\x00\x01"
+HEADER_SIZE = struct.Struct("<I")
+# records start on an aligned offset so that the memory map can be read without copies
+HEADER_ALIGNMENT = 64
+
+FILE_EXTENSION = ".bmsrec"
+
+DEFAULT_MAX_FILE_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_FILE_SEC = 60 * 60
+
+RECORD_QUEUE_SIZE = 4096
+FLUSH_INTERVAL_SEC = 1.0
+
+
+@functools.lru_cache(maxsize=None)
+def record_dtype(soc_count, cell_count, temperature_count):
+    """Returns the NumPy record dtype for a pack with the given geometry"""
+    return np.dtype(
+        [
+            ("receive_time", "<f8"),
+            ("timestamp", "<f8"),
+            ("current", "<f4"),
+            ("acc_voltage", "<f4"),
+            ("car_voltage", "<f4"),
+            ("balance", "u1"),
+            ("charging", "u1"),
+            ("error_flags", "u1", (len(ERROR_FIELDS),)),
+            ("error_values", "<f4", (len(ERROR_FIELDS),)),
+            ("soc", "<f4", (soc_count,)),
+            ("cell_voltage", "<f4", (cell_count,)),
+            ("temperature", "<f4", (temperature_count,)),
+            ("discharge", "u1", (cell_count,)),
+        ]
+    )
+
+
+def frame_record_dtype(data):
+    """Returns the record dtype matching the geometry of a decoded frame"""
+    return record_dtype(data.soc.size, data.cell_voltage.size, data.temperature.size)
+
+
+def build_records(frames, dtype):
+    """Builds a record array from a list of (decoded frame, receive time) column by column"""
+    records = np.zeros(len(frames), dtype=dtype)
+    fill_records(records, frames)
+    return records
+
+
+def fill_records(records, frames):
+    """Fills an existing record array from a list of (decoded frame, receive time) column by column"""
+    records["receive_time"] = [receive_time for _, receive_time in frames]
+    for name in (
+        "timestamp",
+        "current",
+        "acc_voltage",
+        "car_voltage",
+        "balance",
+        "charging",
+    ):
+        records[name] = [getattr(data, name) for data, _ in frames]
+    for i, name in enumerate(ERROR_FIELDS):
+        records["error_flags"][:, i] = [getattr(data, name)[0] for data, _ in frames]
+        records["error_values"][:, i] = [getattr(data, name)[1] for data, _ in frames]
+    for name in ("soc", "cell_voltage", "temperature", "discharge"):
+        records[name] = [getattr(data, name) for data, _ in frames]
+
+
+def write_header(file, dtype):
+    """Writes the file header, returns the offset of the first record"""
+    header = json.dumps(
+        {"descr": dtype.descr, "created": time.time()}, separators=(",", ":")
+    ).encode("utf-8")
+    offset = len(MAGIC) + HEADER_SIZE.size + len(header)
+    padding = -offset % HEADER_ALIGNMENT
+    header += b" " * padding
+    file.write(MAGIC + HEADER_SIZE.pack(len(header)) + header)
+    return offset + padding
+
+
+def read_header(path):
+    """Reads the file header, returns (record dtype, offset of the first record, header dict)"""
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a BMS HV session file")
+        (size,) = HEADER_SIZE.unpack(file.read(HEADER_SIZE.size))
+        header = json.loads(file.read(size))
+    descr = [
+        tuple(field) if len(field) == 2 else (field[0], field[1], tuple(field[2]))
+        for field in header["descr"]
+    ]
+    return np.dtype(descr), len(MAGIC) + HEADER_SIZE.size + size, header
+
+
+def open_session(path):
+    """Opens a session file memory-mapped, returns a read-only record array"""
+    dtype, offset, _ = read_header(path)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def session_files(directory):
+    """Returns the session files in a directory, oldest first"""
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(FILE_EXTENSION)
+    )
+
+
+class SessionRecorder:
+    """Appends decoded frames to rotating session files from a background thread"""
+
+    def __init__(
+        self,
+        directory,
+        max_file_bytes=DEFAULT_MAX_FILE_BYTES,
+        max_file_sec=DEFAULT_MAX_FILE_SEC,
+    ):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_file_sec = max_file_sec
+        self.frames_recorded = 0
+        self.frames_dropped = 0
+        self.path = None
+        self._queue = queue.Queue(maxsize=RECORD_QUEUE_SIZE)
+        self._file = None
+        self._dtype = None
+        self._file_start_time = 0.0
+        self._exit_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Starts the writer thread"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+
+    def stop(self):
+        """Writes the remaining frames and closes the current file"""
+        self._exit_event.set()
+        self._thread.join()
+        if self.frames_dropped:
+            print_warning(f"RECORDER: Frames dropped: {self.frames_dropped}")
+
+    def record(self, data, receive_time):
+        """Queues a decoded frame for writing, it never blocks the caller"""
+        try:
+            self._queue.put_nowait((data, receive_time))
+        except queue.Full:
+            self.frames_dropped += 1
+
+    def _run(self):
+        """Writer loop, frames are written in batches"""
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=FLUSH_INTERVAL_SEC))
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    self._write(batch)
+                except OSError as error:
+                    self.frames_dropped += len(batch)
+                    print_error(f"RECORDER: Failed to write {self.path}: {error}")
+                    self._close()
+
+            if self._exit_event.is_set() and self._queue.empty():
+                self._close()
+                return
+
+    def _write(self, batch):
+        """Writes a batch of frames, a new file is started when the geometry changes or the file is full"""
+        # the records are built before anything is written, a malformed frame never leaves a partial batch
+        segments = []
+        start = 0
+        while start < len(batch):
+            dtype = frame_record_dtype(batch[start][0])
+            end = start + 1
+            while end < len(batch) and frame_record_dtype(batch[end][0]) == dtype:
+                end += 1
+            segments.append((dtype, self._build(batch[start:end], dtype)))
+            start = end
+
+        for dtype, records in segments:
+            if not len(records):
+                continue
+            if self._needs_rotation(dtype):
+                self._rotate(dtype)
+            self._file.write(records.tobytes())
+            self.frames_recorded += len(records)
+        if self._file is not None:
+            self._file.flush()
+
+    def _build(self, frames, dtype):
+        """Builds the records of frames of one geometry, a malformed frame is logged and skipped"""
+        try:
+            return build_records(frames, dtype)
+        except (TypeError, ValueError):
+            pass
+        valid = []
+        for frame in frames:
+            try:
+                build_records([frame], dtype)
+            except (TypeError, ValueError) as error:
+                self.frames_dropped += 1
+                print_error(f"RECORDER: Skipped a malformed frame: {error}")
+                continue
+            valid.append(frame)
+        return build_records(valid, dtype)
+
+    def _needs_rotation(self, dtype):
+        """Checks if the next records have to go to a new file"""
+        return (
+            self._file is None
+            or dtype != self._dtype
+            or self._file.tell() >= self.max_file_bytes
+            or time.time() - self._file_start_time >= self.max_file_sec
+        )
+
+    def _rotate(self, dtype):
+        """Closes the current file and starts a new one"""
+        self._close()
+        self._file_start_time = time.time()
+        name = time.strftime("bms_hv_%Y%m%d_%H%M%S", time.localtime())
+        path = os.path.join(self.directory, name + FILE_EXTENSION)
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{name}_{suffix}{FILE_EXTENSION}")
+            suffix += 1
+        self._file = open(path, "wb")
+        self._dtype = dtype
+        self.path = path
+        write_header(self._file, dtype)
+        print_ok(f"RECORDER: Recording to {path}")
+
+    def _close(self):
+        """Closes the current file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def record_to_frame(record):
+    """Converts a session record back into decoded BMS HV data"""
+    errors = [
+        (int(flag), float(value))
+        for flag, value in zip(record["error_flags"], record["error_values"])
+    ]
+    return BmsHvData(
+        record["current"],
+        record["acc_voltage"],
+        record["car_voltage"],
+        record["soc"],
+        record["cell_voltage"],
+        record["temperature"],
+        record["discharge"],
+        record["balance"],
+        record["charging"],
+        *errors,
+        record["timestamp"],
+    )
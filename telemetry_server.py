@@ -0,0 +1,227 @@
+""" Telemetry socket of the BMS HV daemon. Every connected viewer gets the same encoded frames, a slow viewer loses its oldest unsent frames instead of holding up the others"""
+import os
+import re
+import selectors
+import socket
+import threading
+from collections import deque
+from console import print_ok, print_warning
+
+CLIENT_QUEUE_FRAMES = 16
+CLIENT_RECV_SIZE = 4096
+# commands longer than this without a terminator are garbage
+MAX_COMMAND_BUFFER = 256
+SELECT_TIMEOUT_SEC = 0.5
+
+COMMAND_PATTERN = re.compile(rb"![A-Z]-[A-Z0-9]{2}@")
+
+
+class TelemetryClient:
+    """One connected viewer"""
+
+    def __init__(self, client_socket, address, queue_size):
+        self.socket = client_socket
+        self.address = address
+        self.frames = deque()
+        self.queue_size = queue_size
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        # the rest of a partially sent frame, it is never dropped to keep the stream framed
+        self._pending = b""
+        self._commands = b""
+
+
+class TelemetryServer:
+    """Serves encoded frames to any number of viewers on a TCP address or a Unix socket path and passes their commands on"""
+
+    def __init__(self, address, on_command=None, client_queue_size=CLIENT_QUEUE_FRAMES):
+        # (host, port) for TCP, a path for a Unix socket
+        self.address = address
+        self.on_command = on_command
+        self.client_queue_size = client_queue_size
+        self.clients_served = 0
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._exit_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._server = None
+        self._wakeup_receive, self._wakeup_send = socket.socketpair()
+
+    def start(self):
+        """Starts listening"""
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(self.address)
+            self._server.listen()
+        else:
+            self._server = socket.create_server(self.address)
+            # an ephemeral port is resolved for the log and the tests
+            self.address = self._server.getsockname()[:2]
+        self._server.setblocking(False)
+        self._wakeup_receive.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_receive, selectors.EVENT_READ)
+        self._thread.start()
+        print_ok(f"TELEMETRY: Listening on {self.url}")
+
+    def stop(self):
+        """Disconnects all viewers and stops listening"""
+        self._exit_event.set()
+        self._wakeup()
+        self._thread.join()
+        for client in list(self._clients.values()):
+            self._disconnect(client)
+        self._selector.close()
+        self._server.close()
+        self._wakeup_receive.close()
+        self._wakeup_send.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    @property
+    def url(self):
+        """Transport url a viewer connects to"""
+        if isinstance(self.address, str):
+            return f"unix://{self.address}"
+        return f"socket://{self.address[0]}:{self.address[1]}"
+
+    @property
+    def client_count(self):
+        """Number of connected viewers"""
+        return len(self._clients)
+
+    @property
+    def frames_dropped(self):
+        """Frames dropped for the connected viewers"""
+        with self._lock:
+            return sum(client.frames_dropped for client in self._clients.values())
+
+    def broadcast(self, frame):
+        """Queues an encoded frame for every viewer, it never blocks on a slow viewer"""
+        with self._lock:
+            if not self._clients:
+                return
+            for client in self._clients.values():
+                if len(client.frames) >= client.queue_size:
+                    client.frames.popleft()
+                    client.frames_dropped += 1
+                client.frames.append(frame)
+        self._wakeup()
+
+    def _wakeup(self):
+        """Wakes the server thread"""
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            # a full wakeup socket already wakes the thread
+            pass
+
+    def _run(self):
+        """Server loop, it accepts viewers, sends their frames and reads their commands"""
+        while not self._exit_event.is_set():
+            for key, events in self._selector.select(SELECT_TIMEOUT_SEC):
+                if key.fileobj is self._server:
+                    self._accept()
+                elif key.fileobj is self._wakeup_receive:
+                    self._drain_wakeups()
+                else:
+                    client = key.data
+                    if events & selectors.EVENT_READ:
+                        self._receive(client)
+                    if events & selectors.EVENT_WRITE and client.socket.fileno() != -1:
+                        self._send(client)
+
+            # write interest only while there is something to send
+            for client in list(self._clients.values()):
+                self._send(client)
+                if client.socket.fileno() == -1:
+                    continue
+                events = selectors.EVENT_READ
+                if client._pending or client.frames:
+                    events |= selectors.EVENT_WRITE
+                if self._selector.get_key(client.socket).events != events:
+                    self._selector.modify(client.socket, events, client)
+
+    def _accept(self):
+        """Accepts a waiting viewer"""
+        try:
+            client_socket, address = self._server.accept()
+        except (BlockingIOError, OSError):
+            return
+        client_socket.setblocking(False)
+        client = TelemetryClient(client_socket, address, self.client_queue_size)
+        with self._lock:
+            self._clients[client_socket.fileno()] = client
+        self._selector.register(client_socket, selectors.EVENT_READ, client)
+        self.clients_served += 1
+        print_ok(f"TELEMETRY: Viewer connected: {address or 'unix socket'}")
+
+    def _drain_wakeups(self):
+        """Empties the wakeup socket"""
+        try:
+            while self._wakeup_receive.recv(CLIENT_RECV_SIZE):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _send(self, client):
+        """Sends queued frames until the socket buffer of the viewer is full"""
+        while True:
+            if not client._pending:
+                with self._lock:
+                    if not client.frames:
+                        return
+                    client._pending = memoryview(client.frames.popleft())
+            try:
+                sent = client.socket.send(client._pending)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._disconnect(client)
+                return
+            client._pending = client._pending[sent:]
+            if client._pending:
+                return
+            client.frames_sent += 1
+
+    def _receive(self, client):
+        """Reads the commands of a viewer"""
+        try:
+            data = client.socket.recv(CLIENT_RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._disconnect(client)
+            return
+
+        client._commands += data
+        end = 0
+        for match in COMMAND_PATTERN.finditer(client._commands):
+            end = match.end()
+            if self.on_command is not None:
+                self.on_command(match.group().decode("ascii"))
+        client._commands = client._commands[end:][-MAX_COMMAND_BUFFER:]
+
+    def _disconnect(self, client):
+        """Closes a viewer connection"""
+        with self._lock:
+            if self._clients.pop(client.socket.fileno(), None) is None:
+                return
+        self._selector.unregister(client.socket)
+        client.socket.close()
+        if client.frames_dropped:
+            print_warning(
+                f"TELEMETRY: Viewer {client.address or 'unix socket'} disconnected, "
+                f"frames sent: {client.frames_sent}, dropped: {client.frames_dropped}"
+            )
+        else:
+            print_ok(
+                f"TELEMETRY: Viewer {client.address or 'unix socket'} disconnected, "
+                f"frames sent: {client.frames_sent}"
+            )
@@ -0,0 +1,146 @@
+""" Tests of the telemetry socket fan-out, the viewers are plain sockets on localhost"""
+import socket
+import threading
+import time
+import pytest
+from telemetry_server import TelemetryServer
+
+FRAME_SIZE = 65536
+TIMEOUT_SEC = 5.0
+
+
+def wait_for(condition, timeout=TIMEOUT_SEC):
+    """Waits until condition() is true, fails the test after timeout"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("condition not met in time")
+        time.sleep(0.005)
+
+
+def receive_exactly(viewer, size):
+    """Reads size bytes from a viewer socket"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = viewer.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+@pytest.fixture
+def server():
+    """Telemetry server on an ephemeral localhost port, commands are collected in server.commands"""
+    commands = []
+    server = TelemetryServer(("localhost", 0), commands.append, client_queue_size=4)
+    server.commands = commands
+    server.start()
+    yield server
+    server.stop()
+
+
+def connect(server, receive_buffer=None):
+    """Connects a viewer and waits until the server accepted it"""
+    viewer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if receive_buffer is not None:
+        viewer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    viewer.settimeout(TIMEOUT_SEC)
+    clients = server.clients_served
+    viewer.connect(server.address)
+    wait_for(lambda: server.clients_served > clients)
+    return viewer
+
+
+def test_every_viewer_gets_every_frame(server):
+    viewers = [connect(server) for _ in range(3)]
+    frames = [bytes([i]) * 100 for i in range(10)]
+    for frame in frames:
+        server.broadcast(frame)
+        for viewer in viewers:
+            assert receive_exactly(viewer, len(frame)) == frame
+    assert server.frames_dropped == 0
+    for viewer in viewers:
+        viewer.close()
+
+
+def test_slow_viewer_loses_frames_without_holding_up_the_others(server):
+    slow = connect(server, receive_buffer=4096)
+    fast = connect(server)
+    frame_count = 200
+    for i in range(frame_count):
+        frame = i.to_bytes(4, "little") * (FRAME_SIZE // 4)
+        server.broadcast(frame)
+        # the fast viewer keeps up, every frame arrives whole and in order
+        assert receive_exactly(fast, FRAME_SIZE) == frame
+    # the socket buffers of the slow viewer hold a few frames, its queue 4 more
+    assert server.frames_dropped > frame_count // 2
+    assert server.client_count == 2
+
+    # what the slow viewer gets is still framed, the oldest frames are the ones dropped
+    fast.close()
+    received = []
+    while len(received) < frame_count:
+        try:
+            frame = receive_exactly(slow, FRAME_SIZE)
+        except socket.timeout:
+            break
+        assert len(set(frame[i : i + 4] for i in range(0, FRAME_SIZE, 4))) == 1
+        received.append(int.from_bytes(frame[:4], "little"))
+        if received[-1] == frame_count - 1:
+            break
+    assert received == sorted(received)
+    assert received[-1] == frame_count - 1
+    assert len(received) < frame_count
+    slow.close()
+
+
+def test_viewer_commands_are_passed_on(server):
+    viewer = connect(server)
+    viewer.sendall(b"!C-ON@garbage!B-")
+    viewer.sendall(b"FC@!X")
+    wait_for(lambda: len(server.commands) == 2)
+    assert server.commands == ["!C-ON@", "!B-FC@"]
+    viewer.close()
+
+
+def test_disconnected_viewer_is_removed(server):
+    viewer = connect(server)
+    other = connect(server)
+    viewer.close()
+    wait_for(lambda: server.client_count == 1)
+    server.broadcast(b"frame")
+    assert receive_exactly(other, 5) == b"frame"
+    other.close()
+
+
+def test_unix_socket(tmp_path):
+    path = str(tmp_path / "telemetry.sock")
+    server = TelemetryServer(path)
+    server.start()
+    try:
+        assert server.url == f"unix://{path}"
+        viewer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        viewer.settimeout(TIMEOUT_SEC)
+        viewer.connect(path)
+        wait_for(lambda: server.client_count == 1)
+        server.broadcast(b"frame")
+        assert receive_exactly(viewer, 5) == b"frame"
+        viewer.close()
+    finally:
+        server.stop()
+
+
+def test_broadcast_from_many_threads(server):
+    viewer = connect(server)
+    threads = [
+        threading.Thread(target=server.broadcast, args=(bytes([i]) * 8,))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    frames = {receive_exactly(viewer, 8) for _ in range(4)}
+    assert frames == {bytes([i]) * 8 for i in range(4)}
+    viewer.close()
@@ -0,0 +1,390 @@
+""" Transports for the BMS HV link. All of them behave like a pyserial port so that the serial link does not care where the bytes come from
+
+Supported urls:
+    /dev/ttyUSB0, COM3          serial port
+    /dev/pts/3                  pseudo-terminal, for example from mock_bms_hv.mock_bms --pty
+    socket://localhost:5000     TCP, for example the telemetry socket of daemon.py
+    unix:///run/bms_hv.sock     Unix domain socket of daemon.py
+    queue://name                in-process queue registered with QueueTransport.pair
+    usb://0403:6001/A50285BI    USB serial adapter by VID:PID and optional serial number, wherever it enumerated
+"""
+import os
+import queue
+import select
+import socket
+import threading
+import urllib.parse
+import serial
+
+QUEUE_URL_PREFIX = "queue://"
+TCP_URL_PREFIX = "socket://"
+UNIX_URL_PREFIX = "unix://"
+USB_URL_PREFIX = "usb://"
+
+SOCKET_CONNECT_TIMEOUT_SEC = 2.0
+SOCKET_RECV_SIZE = 65536
+
+_queue_transports = {}
+_queue_transports_lock = threading.Lock()
+
+
+def open_transport(url, timeout=None):
+    """Returns a closed pyserial like transport for the url, call open() on it"""
+    if url.startswith(QUEUE_URL_PREFIX):
+        with _queue_transports_lock:
+            transport = _queue_transports.get(url[len(QUEUE_URL_PREFIX) :])
+        if transport is None:
+            raise serial.SerialException(f"No in-process transport registered: {url}")
+    elif url.startswith((TCP_URL_PREFIX, UNIX_URL_PREFIX)):
+        transport = SocketTransport(url)
+    elif url.startswith(USB_URL_PREFIX):
+        # open() fails until the adapter is plugged in, PortRediscovery finds it then
+        transport = serial.Serial()
+        transport.port = find_usb_port(*parse_usb_url(url))
+    else:
+        transport = serial.serial_for_url(url, do_not_open=True)
+    transport.timeout = timeout
+    return transport
+
+
+def parse_usb_url(url):
+    """Returns (vid, pid, serial number or None) of a usb:// url"""
+    ids, _, serial_number = url[len(USB_URL_PREFIX) :].partition("/")
+    try:
+        vid, pid = (int(value, 16) for value in ids.split(":"))
+    except ValueError as error:
+        raise serial.SerialException(
+            f"Invalid USB url, expected usb://VID:PID[/SERIAL]: {url}"
+        ) from error
+    return vid, pid, serial_number or None
+
+
+def list_usb_ports():
+    """Returns the serial ports that belong to USB devices"""
+    # the port listing is only needed to find USB adapters
+    from serial.tools import list_ports
+
+    return [port for port in list_ports.comports() if port.vid is not None]
+
+
+def usb_identity(device):
+    """Returns (vid, pid, serial number) of the USB serial adapter at the device path or None"""
+    path = os.path.realpath(device)
+    for port in list_usb_ports():
+        if os.path.realpath(port.device) == path:
+            return port.vid, port.pid, port.serial_number
+    return None
+
+
+def find_usb_port(vid, pid, serial_number=None):
+    """Returns the device path of the USB serial adapter or None if it is not connected"""
+    for port in list_usb_ports():
+        if (
+            port.vid == vid
+            and port.pid == pid
+            and serial_number in (None, port.serial_number)
+        ):
+            return port.device
+    return None
+
+
+class PortRediscovery:
+    """Finds a USB serial adapter again after it re-enumerated under another device path. The adapter is identified by the usb:// url or by the VID/PID/serial number of the port it was first opened on"""
+
+    def __init__(self, url):
+        self.identity = parse_usb_url(url) if url.startswith(USB_URL_PREFIX) else None
+
+    def remember(self, transport):
+        """Records the identity of the opened port, called after every successful open"""
+        port = getattr(transport, "port", None)
+        if self.identity is None and isinstance(port, str):
+            self.identity = usb_identity(port)
+
+    def rediscover(self, transport):
+        """Points a transport that failed to open to the current device path of its adapter, returns True if the path changed"""
+        if self.identity is None:
+            return False
+        device = find_usb_port(*self.identity)
+        if device is None or device == transport.port:
+            return False
+        transport.port = device
+        return True
+
+
+class QueueTransport:
+    """One end of an in-process byte pipe with the pyserial interface"""
+
+    def __init__(self, rx_queue, tx_queue):
+        self.timeout = None
+        self.is_open = False
+        self._rx_queue = rx_queue
+        self._tx_queue = tx_queue
+        self._buffer = bytearray()
+
+    @classmethod
+    def pair(cls, name=None):
+        """Creates (host end, device end), the host end is registered as queue://name"""
+        host_to_device = queue.Queue()
+        device_to_host = queue.Queue()
+        host = cls(device_to_host, host_to_device)
+        device = cls(host_to_device, device_to_host)
+        device.is_open = True
+        if name is not None:
+            with _queue_transports_lock:
+                _queue_transports[name] = host
+        return host, device
+
+    def open(self):
+        """Opens the transport"""
+        self.is_open = True
+
+    def close(self):
+        """Closes the transport"""
+        self.is_open = False
+
+    @property
+    def in_waiting(self):
+        """Number of bytes that can be read without blocking"""
+        self._check_open()
+        self._collect(block=False)
+        return len(self._buffer)
+
+    def read(self, size=1):
+        """Reads up to size bytes, waits at most timeout seconds for the first byte"""
+        self._check_open()
+        if not self._buffer:
+            self._collect(block=True)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def write(self, data):
+        """Writes data to the other end"""
+        self._check_open()
+        self._tx_queue.put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        """Nothing is buffered on the write side"""
+
+    def reset_input_buffer(self):
+        """Drops all received data"""
+        self._collect(block=False)
+        self._buffer.clear()
+
+    def _collect(self, block):
+        """Moves received chunks into the read buffer"""
+        try:
+            self._buffer += self._rx_queue.get(block=block, timeout=self.timeout)
+            while True:
+                self._buffer += self._rx_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _check_open(self):
+        """Raises the pyserial exception for a closed port"""
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+
+
+class SocketTransport:
+    """Client end of a TCP or Unix stream socket with the pyserial interface. pyserial's socket:// reports at most one waiting byte, this one buffers everything that arrived so a frame is read at once"""
+
+    def __init__(self, url):
+        self.url = url
+        self.timeout = None
+        self.is_open = False
+        self._socket = None
+        self._buffer = bytearray()
+
+    def open(self):
+        """Connects to the socket"""
+        try:
+            if self.url.startswith(UNIX_URL_PREFIX):
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.settimeout(SOCKET_CONNECT_TIMEOUT_SEC)
+                self._socket.connect(self.url[len(UNIX_URL_PREFIX) :])
+            else:
+                address = urllib.parse.urlsplit(self.url)
+                self._socket = socket.create_connection(
+                    (address.hostname, address.port), SOCKET_CONNECT_TIMEOUT_SEC
+                )
+        except (OSError, ValueError) as error:
+            self._socket = None
+            raise serial.SerialException(f"Could not connect to {self.url}: {error}")
+        self._socket.setblocking(False)
+        self._buffer.clear()
+        self.is_open = True
+
+    def close(self):
+        """Closes the socket"""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self.is_open = False
+
+    @property
+    def in_waiting(self):
+        """Number of bytes that can be read without blocking"""
+        self._check_open()
+        self._collect()
+        return len(self._buffer)
+
+    def fileno(self):
+        """File descriptor of the socket, for event loops"""
+        self._check_open()
+        return self._socket.fileno()
+
+    def read(self, size=1):
+        """Reads up to size bytes, waits at most timeout seconds for the first byte"""
+        self._check_open()
+        if not self._buffer:
+            readable, _, _ = select.select([self._socket], [], [], self.timeout)
+            if readable:
+                self._collect()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def write(self, data):
+        """Writes all of data"""
+        self._check_open()
+        try:
+            self._socket.setblocking(True)
+            self._socket.sendall(data)
+        except OSError as error:
+            raise serial.SerialException(f"{self.url}: {error}") from error
+        finally:
+            self._socket.setblocking(False)
+        return len(data)
+
+    def flush(self):
+        """Nothing is buffered on the write side"""
+
+    def reset_input_buffer(self):
+        """Drops all received data"""
+        self._collect()
+        self._buffer.clear()
+
+    def _collect(self):
+        """Moves everything the socket has received into the read buffer"""
+        while True:
+            try:
+                data = self._socket.recv(SOCKET_RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as error:
+                raise serial.SerialException(f"{self.url}: {error}") from error
+            if not data:
+                raise serial.SerialException(f"{self.url}: connection closed")
+            self._buffer += data
+
+    def _check_open(self):
+        """Raises the pyserial exception for a closed port"""
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+
+
+class PtyTransport:
+    """Master end of a pseudo-terminal, the slave end path can be opened as a serial port"""
+
+    def __init__(self):
+        # the pty module is only available on Unix
+        import pty
+        import tty
+
+        self.timeout = None
+        self._master, slave = pty.openpty()
+        # the slave end is kept open so that reads do not fail between clients
+        self._slave = slave
+        tty.setraw(self._master)
+        tty.setraw(slave)
+        # nobody may be reading the slave end, writes must not block then
+        os.set_blocking(self._master, False)
+        self.name = os.ttyname(slave)
+        self.is_open = True
+
+    def read(self, size=1):
+        """Reads up to size bytes, waits at most timeout seconds"""
+        readable, _, _ = select.select([self._master], [], [], self.timeout)
+        if not readable:
+            return b""
+        try:
+            return os.read(self._master, size)
+        except OSError as error:
+            raise serial.SerialException(str(error)) from error
+
+    def write(self, data):
+        """Writes data to the slave end, data that does not fit into the pty buffer is discarded"""
+        try:
+            return os.write(self._master, data)
+        except BlockingIOError:
+            return 0
+        except OSError as error:
+            raise serial.SerialException(str(error)) from error
+
+    def close(self):
+        """Closes both ends"""
+        if self.is_open:
+            os.close(self._master)
+            os.close(self._slave)
+            self.is_open = False
+
+
+class TcpServerTransport:
+    """Listening TCP socket that serves one client at a time, clients connect with socket://host:port"""
+
+    def __init__(self, host, port):
+        self.timeout = None
+        self._server = socket.create_server((host, port), reuse_port=False)
+        self._client = None
+        self.address = self._server.getsockname()
+        self.is_open = True
+
+    def read(self, size=1):
+        """Reads up to size bytes from the current client, accepts a client first if there is none"""
+        if self._client is None and not self._accept():
+            return b""
+        readable, _, _ = select.select([self._client], [], [], self.timeout)
+        if not readable:
+            return b""
+        try:
+            data = self._client.recv(size)
+        except OSError:
+            data = b""
+        if not data:
+            self._drop_client()
+        return data
+
+    def write(self, data):
+        """Writes data to the current client, the data is discarded without a client"""
+        if self._client is None and not self._accept(timeout=0):
+            return 0
+        try:
+            self._client.sendall(data)
+        except OSError:
+            self._drop_client()
+            return 0
+        return len(data)
+
+    def close(self):
+        """Closes the client and the listening socket"""
+        self._drop_client()
+        self._server.close()
+        self.is_open = False
+
+    def _accept(self, timeout=None):
+        """Accepts a waiting client, returns True if there is one"""
+        readable, _, _ = select.select(
+            [self._server], [], [], self.timeout if timeout is None else timeout
+        )
+        if not readable:
+            return False
+        self._client, _ = self._server.accept()
+        return True
+
+    def _drop_client(self):
+        """Closes the current client"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -0,0 +1,188 @@
+""" Compact binary wire protocol for BMS HV frames. It is an optional replacement for the JSON frames and both can be mixed on one link
+
+Frame layout (little-endian):
+    magic       2 B     0xAA 0x55
+    version     1 B
+    length      2 B     payload length
+    payload     length B
+    crc         4 B     CRC-32 of version, length and payload
+
+Payload layout:
+    header      current f32, acc_voltage f32, car_voltage f32, timestamp f64,
+                balance u8, charging u8, soc count u16, cell count u16, temperature count u16
+    errors      6 x (flag u8, value f32) in BmsHvData order
+    soc         f32[soc count]
+    cell_voltage f32[cell count]
+    temperature f32[temperature count]
+    discharge   bit packed, ceil(cell count / 8) B
+"""
+import struct
+import zlib
+import numpy as np
+from frame_decoder import (
+    ERROR_FIELDS,
+    BmsHvData,
+    check_frame_arrays,
+    decode_json_frame,
+)
+
+MAGIC = b"\xaa\x55"
+VERSION = 1
+
+FRAME_HEADER = struct.Struct("<2sBH")
+FRAME_CRC = struct.Struct("<I")
+PAYLOAD_HEADER = struct.Struct("<fffdBBHHH")
+PAYLOAD_ERRORS = struct.Struct("<" + "Bf" * 6)
+
+FRAME_OVERHEAD = FRAME_HEADER.size + FRAME_CRC.size
+
+FLOAT_ARRAY_DTYPE = np.dtype("<f4")
+
+
+class FrameError(ValueError):
+    """Raised when a binary frame is malformed or fails the CRC check"""
+
+
+def is_binary_frame(data):
+    """Checks if the frame starts with the binary frame magic"""
+    return data[: len(MAGIC)] == MAGIC
+
+
+def frame_length(buffer, start=0):
+    """Returns the total length of the binary frame starting at start or None if the header is incomplete"""
+    if len(buffer) - start < FRAME_HEADER.size:
+        return None
+    _, _, length = FRAME_HEADER.unpack_from(buffer, start)
+    return FRAME_HEADER.size + length + FRAME_CRC.size
+
+
+def payload_length(soc_count, cell_count, temperature_count):
+    """Returns the payload length of a frame with the given geometry"""
+    return (
+        PAYLOAD_HEADER.size
+        + PAYLOAD_ERRORS.size
+        + (soc_count + cell_count + temperature_count) * FLOAT_ARRAY_DTYPE.itemsize
+        + (cell_count + 7) // 8
+    )
+
+
+def check_frame_header(buffer, start=0):
+    """Checks the header of the binary frame at start before the rest of it arrived, the length has to match the array counts of the payload header. Returns None while the headers are incomplete"""
+    if len(buffer) - start < FRAME_HEADER.size + PAYLOAD_HEADER.size:
+        return None
+    _, version, length = FRAME_HEADER.unpack_from(buffer, start)
+    counts = PAYLOAD_HEADER.unpack_from(buffer, start + FRAME_HEADER.size)[-3:]
+    return version == VERSION and length == payload_length(*counts)
+
+
+def check_frame_crc(buffer, start, length):
+    """Checks the CRC of the complete binary frame of length bytes at start"""
+    crc_offset = start + length - FRAME_CRC.size
+    (crc,) = FRAME_CRC.unpack_from(buffer, crc_offset)
+    # the CRC covers version, length and payload, the view is released so a bytearray can still grow
+    with memoryview(buffer) as view:
+        return zlib.crc32(view[start + len(MAGIC) : crc_offset]) == crc
+
+
+def encode_binary_frame(data):
+    """Encodes BmsHvData into a binary frame"""
+    soc = np.asarray(data.soc, dtype=FLOAT_ARRAY_DTYPE)
+    cell_voltage = np.asarray(data.cell_voltage, dtype=FLOAT_ARRAY_DTYPE)
+    temperature = np.asarray(data.temperature, dtype=FLOAT_ARRAY_DTYPE)
+    errors = []
+    for name in ERROR_FIELDS:
+        flag, value = getattr(data, name)
+        errors += [int(flag), float(value)]
+
+    payload = b"".join(
+        [
+            PAYLOAD_HEADER.pack(
+                data.current,
+                data.acc_voltage,
+                data.car_voltage,
+                data.timestamp,
+                data.balance,
+                data.charging,
+                soc.size,
+                cell_voltage.size,
+                temperature.size,
+            ),
+            PAYLOAD_ERRORS.pack(*errors),
+            soc.tobytes(),
+            cell_voltage.tobytes(),
+            temperature.tobytes(),
+            np.packbits(np.asarray(data.discharge, dtype=np.uint8) != 0).tobytes(),
+        ]
+    )
+    header = FRAME_HEADER.pack(MAGIC, VERSION, len(payload))
+    crc = zlib.crc32(payload, zlib.crc32(header[len(MAGIC) :]))
+    return header + payload + FRAME_CRC.pack(crc)
+
+
+def decode_binary_frame(data):
+    """Decodes a binary frame into BmsHvData, raises FrameError for malformed frames"""
+    if len(data) < FRAME_OVERHEAD or not is_binary_frame(data):
+        raise FrameError("Not a binary frame")
+    _, version, length = FRAME_HEADER.unpack_from(data)
+    if version != VERSION:
+        raise FrameError(f"Unsupported binary frame version: {version}")
+    if len(data) != FRAME_OVERHEAD + length:
+        raise FrameError("Binary frame length mismatch")
+
+    if not check_frame_crc(data, 0, len(data)):
+        raise FrameError("Binary frame CRC mismatch")
+    payload = memoryview(data)[FRAME_HEADER.size : FRAME_HEADER.size + length]
+
+    try:
+        (
+            current,
+            acc_voltage,
+            car_voltage,
+            timestamp,
+            balance,
+            charging,
+            soc_count,
+            cell_count,
+            temperature_count,
+        ) = PAYLOAD_HEADER.unpack_from(payload)
+        if not (soc_count and cell_count and temperature_count):
+            raise FrameError("Binary frame has an empty array")
+        errors = PAYLOAD_ERRORS.unpack_from(payload, PAYLOAD_HEADER.size)
+        offset = PAYLOAD_HEADER.size + PAYLOAD_ERRORS.size
+        arrays = []
+        for count in (soc_count, cell_count, temperature_count):
+            arrays.append(
+                np.frombuffer(payload, dtype=FLOAT_ARRAY_DTYPE, count=count, offset=offset)
+            )
+            offset += count * FLOAT_ARRAY_DTYPE.itemsize
+        discharge = np.unpackbits(
+            np.frombuffer(payload, dtype=np.uint8, count=(cell_count + 7) // 8, offset=offset)
+        )[:cell_count]
+    except (struct.error, ValueError) as error:
+        raise FrameError(f"Binary frame payload is truncated: {error}") from error
+
+    data = BmsHvData(
+        current,
+        acc_voltage,
+        car_voltage,
+        arrays[0],
+        arrays[1],
+        arrays[2],
+        discharge,
+        balance,
+        charging,
+        *zip(errors[::2], errors[1::2]),
+        timestamp,
+    )
+    # the CRC only shows that the frame arrived as it was sent, the values are checked like those of a JSON frame
+    try:
+        return check_frame_arrays(data)
+    except ValueError as error:
+        raise FrameError(f"Binary frame is invalid: {error}") from error
+
+
+def decode_frame(data):
+    """Decodes a binary or JSON frame, the format is detected from the first bytes"""
+    if is_binary_frame(data):
+        return decode_binary_frame(data)
+    return decode_json_frame(data)
@@ -0,0 +1,174 @@
+""" Tests of the binary wire protocol and the frame array checks"""
+import json
+import numpy as np
+import pytest
+from delta_decoder import DeltaDecoder
+from frame_decoder import BmsHvData, decode_json_frame
+from mock_bms_hv.mock_bms import MockBms, encode_json_frame
+from wire_protocol import (
+    FRAME_HEADER,
+    FrameError,
+    check_frame_crc,
+    check_frame_header,
+    decode_binary_frame,
+    decode_frame,
+    encode_binary_frame,
+    frame_length,
+)
+
+
+def assert_same_frame(data, expected):
+    """Checks that two decoded frames hold the same values"""
+    for name in BmsHvData.__slots__:
+        value, expected_value = getattr(data, name), getattr(expected, name)
+        if isinstance(value, np.ndarray):
+            np.testing.assert_array_equal(value, expected_value, err_msg=name)
+        else:
+            assert value == pytest.approx(expected_value), name
+
+
+def mock_data(seed=1, **kwargs):
+    """Returns a frame of a mock BMS"""
+    mock = MockBms(seed=seed, **kwargs)
+    mock.balance = 1
+    mock.step(0.25)
+    return mock.data()
+
+
+def test_binary_frame_round_trip():
+    data = mock_data()
+    frame = encode_binary_frame(data)
+    # the arrays are float32 in BmsHvData already, only the scalars are rounded on the wire
+    for name in ("current", "acc_voltage", "car_voltage"):
+        setattr(data, name, float(np.float32(getattr(data, name))))
+    assert_same_frame(decode_binary_frame(frame), data)
+    assert frame_length(frame) == len(frame)
+    assert check_frame_header(frame) is True
+    assert check_frame_crc(frame, 0, len(frame))
+
+
+def test_binary_frame_round_trip_odd_geometry():
+    data = mock_data(ltc_count=2, cells_per_ltc=5, temperatures_per_ltc=1, soc_count=3)
+    decoded = decode_binary_frame(encode_binary_frame(data))
+    assert decoded.cell_voltage.size == 10
+    assert decoded.discharge.size == 10
+    assert decoded.temperature.size == 2
+    assert decoded.soc.size == 3
+
+
+def test_decode_frame_detects_the_format():
+    data = mock_data()
+    binary = decode_frame(encode_binary_frame(data))
+    text = decode_frame(encode_json_frame(data))
+    np.testing.assert_allclose(binary.cell_voltage, text.cell_voltage, atol=1e-4)
+    assert binary.timestamp == pytest.approx(text.timestamp, abs=0.1)
+
+
+@pytest.mark.parametrize("position", [2, 3, 10, 40, -5, -1])
+def test_corrupted_byte_fails_the_crc(position):
+    frame = bytearray(encode_binary_frame(mock_data()))
+    frame[position] ^= 0x01
+    assert not check_frame_crc(frame, 0, len(frame))
+    with pytest.raises(FrameError):
+        decode_binary_frame(bytes(frame))
+
+
+def test_crc_of_a_frame_inside_a_buffer():
+    frame = encode_binary_frame(mock_data())
+    buffer = bytearray(b"garbage" + frame + b"{}\n")
+    assert check_frame_crc(buffer, 7, len(frame))
+    # the view is released, the buffer can still grow
+    buffer += b"more"
+
+
+def test_malformed_binary_frames():
+    frame = encode_binary_frame(mock_data())
+    with pytest.raises(FrameError, match="Not a binary frame"):
+        decode_binary_frame(b"{}")
+    with pytest.raises(FrameError, match="length mismatch"):
+        decode_binary_frame(frame[:-1])
+    wrong_version = bytearray(frame)
+    wrong_version[2] += 1
+    with pytest.raises(FrameError, match="version"):
+        decode_binary_frame(bytes(wrong_version))
+    assert check_frame_header(wrong_version) is False
+    assert check_frame_header(frame[: FRAME_HEADER.size]) is None
+    empty = mock_data()
+    empty.temperature = empty.temperature[:0]
+    with pytest.raises(FrameError, match="empty"):
+        decode_binary_frame(encode_binary_frame(empty))
+
+
+@pytest.mark.parametrize(
+    "field, value, message",
+    [
+        ("discharge", [0, 1], "discharge flags"),
+        ("over_current", [0, 1.0, 2.0], "pair"),
+        ("soc", [[0.5, 0.5]], "flat"),
+        ("cell_voltage", 3.6, "flat"),
+        ("soc", [], "empty"),
+        ("cell_voltage", [], "empty"),
+        ("temperature", [], "empty"),
+        ("temperature", [25.0, float("nan")], "finite"),
+        ("cell_voltage", [3.6, float("inf")], "finite"),
+        ("current", float("-inf"), "finite"),
+        ("discharge", [-1, 0], "out of bounds"),
+    ],
+)
+@pytest.mark.parametrize("separators", [(", ", ": "), (",", ":")])
+def test_json_frame_arrays_are_checked(field, value, message, separators):
+    fields = json.loads(encode_json_frame(mock_data()))
+    fields[field] = value
+    with pytest.raises(ValueError, match=message):
+        decode_json_frame(json.dumps(fields, separators=separators))
+
+
+@pytest.mark.parametrize("flag_on, flag_off", [(1, 0), (True, False), (1.0, 0)])
+def test_json_frame_matches_the_plain_conversion(flag_on, flag_off):
+    fields = json.loads(encode_json_frame(mock_data()))
+    cell_count = len(fields["cell_voltage"])
+    fields["discharge"] = [flag_on, flag_off, flag_off] * (cell_count // 3)
+    data = decode_json_frame(json.dumps(fields).encode())
+    for name, dtype in (
+        ("soc", np.float32),
+        ("cell_voltage", np.float32),
+        ("temperature", np.float32),
+        ("discharge", np.uint8),
+    ):
+        expected = np.asarray(fields[name], dtype=dtype)
+        np.testing.assert_array_equal(getattr(data, name), expected, err_msg=name)
+        assert getattr(data, name).dtype == expected.dtype, name
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("soc", []),
+        ("temperature", [float("nan")] * 45),
+        ("cell_voltage", [float("inf")] * 135),
+        ("current", float("inf")),
+    ],
+)
+def test_every_decoder_rejects_the_same_frames(field, value):
+    valid = encode_json_frame(mock_data())
+    fields = json.loads(valid)
+    fields[field] = value
+    frame = json.dumps(fields).encode()
+    with pytest.raises(ValueError):
+        decode_json_frame(frame)
+    # the delta decoder reuses the arrays that did not change since the valid frame
+    decoder = DeltaDecoder()
+    decoder.decode(valid)
+    with pytest.raises(ValueError):
+        decoder.decode(frame)
+    with pytest.raises(FrameError):
+        decode_binary_frame(encode_binary_frame(BmsHvData(**fields)))
+
+
+def test_json_frame_that_is_not_bms_hv_data():
+    fields = json.loads(encode_json_frame(mock_data()))
+    with pytest.raises(TypeError):
+        decode_json_frame("[1, 2]")
+    fields["unknown"] = fields.pop("balance")
+    with pytest.raises(TypeError):
+        decode_json_frame(json.dumps(fields))
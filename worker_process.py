@@ -0,0 +1,515 @@
+""" Optional worker process of the BMS HV Utility. Serial I/O, decoding and statistics run outside of the GUI process, the newest decoded frame is handed over through a shared memory double buffer
+
+Shared memory layout:
+    header      sequence of the newest frame, the worker counters, the latest alarm latencies and the buffer holding the slots
+    slot 0, 1   frame record, pack statistics and alarm state, frame n is written to slot n % 2
+
+Each slot carries the sequence of the frame it holds and is set to 0 while it is written. A reader copies the slot and accepts the copy only if the slot sequence is the same before and after, nothing is pickled.
+
+The slots are sized for the array sizes of the frames. When a frame does not fit them, the worker moves the slots to a new shared memory buffer of its own and names it in the header, the header stays where it is.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from console import print_ok, print_error
+from pack_geometry import DEFAULT_PACK_GEOMETRY
+from pack_stats import (
+    STATS_ARRAYS,
+    ArrayStats,
+    compute_pack_stats,
+    pack_stats_from_array,
+    pack_stats_to_array,
+)
+from serial_link import SERIAL_DATA_IN_FREQ_SEC
+from serial_reader import StreamingReader, drain_queue
+from serial_writer import WriteScheduler, PRIORITY_NORMAL
+from session_recorder import (
+    SessionRecorder,
+    fill_records,
+    record_dtype,
+    record_to_frame,
+)
+from delta_decoder import DeltaDecoder
+from alarms import DEFAULT_RULES, AlarmEngine, report_alarm_events
+from async_link import AsyncLinkRunner
+from wire_protocol import is_binary_frame
+
+# alarm latencies kept for the GUI, it collects them at least once per metrics interval
+ALARM_LATENCY_HISTORY = 1024
+# counters of the worker pipeline that are shown in the metrics of the GUI
+METRICS_COUNTERS = (
+    "frames_decoded",
+    "json_errors",
+    "binary_errors",
+    "alarms_raised",
+    "alarms_cleared",
+)
+SHM_NAME_SIZE = 64
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("sequence", "<u8"),
+        ("frames_received", "<u8"),
+        ("frames_dropped", "<u8"),
+        ("queue_full_events", "<u8"),
+        ("frames_rejected", "<u8"),
+        ("resyncs", "<u8"),
+        ("reconnects", "<u8"),
+        ("rediscoveries", "<u8"),
+        *((name, "<u8") for name in METRICS_COUNTERS),
+        # NaN until the first command was sent
+        ("command_latency", "<f8"),
+        # latency n is at n % ALARM_LATENCY_HISTORY
+        ("alarm_latency_count", "<u8"),
+        ("alarm_latency", "<f8", (ALARM_LATENCY_HISTORY,)),
+        # shared memory holding the slots and the array sizes of its frames, empty while it is this one
+        ("frame_buffer", f"S{SHM_NAME_SIZE}"),
+        ("frame_sizes", "<u4", (3,)),
+    ]
+)
+SLOT_COUNT = 2
+
+WORKER_POLL_SEC = 0.1
+WORKER_JOIN_TIMEOUT_SEC = 5.0
+# a read is retried this often when the worker overwrites the slot during the copy
+READ_RETRIES = 3
+
+
+def slot_dtype(soc_count, cell_count, temperature_count, rule_count):
+    """Returns the dtype of one shared memory slot"""
+    # every alarm signal has as many channels as one of the arrays or a single one
+    channel_count = max(soc_count, cell_count, temperature_count, 1)
+    return np.dtype(
+        [
+            ("sequence", "<u8"),
+            ("record", record_dtype(soc_count, cell_count, temperature_count)),
+            ("stats", "<f8", (len(STATS_ARRAYS), len(ArrayStats.__slots__))),
+            # per rule: active channels, channel count of the signal and time the oldest was raised
+            ("alarm_active", "u1", (rule_count, channel_count)),
+            ("alarm_channels", "<u4", (rule_count,)),
+            ("alarm_raised_time", "<f8", (rule_count,)),
+        ]
+    )
+
+
+def alarm_state_to_slot(alarm_engine, slot):
+    """Writes the active alarms of every rule into a slot"""
+    capacity = slot["alarm_active"].shape[-1]
+    for i, state in enumerate(alarm_engine.states):
+        active = state.active
+        # a rule that was not evaluated since the geometry changed has no state yet
+        if active is None or len(active) > capacity:
+            slot["alarm_channels"][i] = 0
+            continue
+        slot["alarm_active"][i, : len(active)] = active
+        slot["alarm_channels"][i] = len(active)
+        slot["alarm_raised_time"][i] = (
+            state.raised_time[active].min() if active.any() else np.nan
+        )
+
+
+class SharedFrameBuffer:
+    """Double buffer of decoded frames in shared memory, written by one process and read by another"""
+
+    def __init__(self, array_sizes, rule_count=len(DEFAULT_RULES), name=None):
+        # soc, cell and temperature count of the frames
+        self.array_sizes = tuple(array_sizes)
+        self.rule_count = rule_count
+        self.slot_dtype = slot_dtype(*self.array_sizes, rule_count)
+        size = HEADER_DTYPE.itemsize + SLOT_COUNT * self.slot_dtype.itemsize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        self.slots = np.ndarray(
+            SLOT_COUNT,
+            dtype=self.slot_dtype,
+            buffer=self.shm.buf,
+            offset=HEADER_DTYPE.itemsize,
+        )
+        if self.owner:
+            self.header["command_latency"] = np.nan
+
+    def publish(self, data, receive_time, pack_stats, alarm_engine, header=None):
+        """Writes a frame into the slot the reader does not hold and makes it the newest one. The sequence is counted in header, by default the header of this buffer"""
+        header = self.header if header is None else header
+        sequence = int(header["sequence"]) + 1
+        slot = self.slots[sequence % SLOT_COUNT : sequence % SLOT_COUNT + 1]
+        slot["sequence"] = 0
+        fill_records(slot["record"], [(data, receive_time)])
+        pack_stats_to_array(pack_stats, slot["stats"][0])
+        alarm_state_to_slot(alarm_engine, slot[0])
+        slot["sequence"] = sequence
+        header["sequence"] = sequence
+
+    def read(self, out, sequence):
+        """Copies the newest frame into out, a slot_dtype array of one element. Returns False if the frame is overwritten while it is copied"""
+        slot = self.slots[sequence % SLOT_COUNT]
+        if slot["sequence"] != sequence:
+            return False
+        np.copyto(out, slot)
+        return slot["sequence"] == sequence
+
+    def close(self):
+        """Unmaps the shared memory, the owner also removes it"""
+        # the arrays hold exports of the buffer, they have to go first
+        self.header = None
+        self.slots = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def worker_main(
+    port,
+    shm_name,
+    geometry,
+    record_directory,
+    connected_event,
+    exit_event,
+    new_frame_event,
+    commands,
+    alarm_rules=None,
+):
+    """Entry point of the worker process"""
+    worker_prefix = "WORKER: "
+    alarm_engine = AlarmEngine(rules=alarm_rules, geometry=geometry)
+    buffer = SharedFrameBuffer(
+        geometry.array_sizes, len(alarm_engine.rules), name=shm_name
+    )
+    frames_ready = threading.Event()
+    reader = StreamingReader()
+    reader.on_frames = frames_ready.set
+    scheduler = WriteScheduler(keep_alive_period=SERIAL_DATA_IN_FREQ_SEC)
+
+    link_runner = AsyncLinkRunner()
+    link_runner.start()
+    link_runner.add_link(port, reader, scheduler, connected_event)
+    command_thread = threading.Thread(
+        target=forward_commands, args=(commands, scheduler, exit_event), daemon=True
+    )
+    command_thread.start()
+
+    recorder = None
+    if record_directory is not None:
+        recorder = SessionRecorder(record_directory)
+        recorder.start()
+
+    print_ok(f"{worker_prefix} Started, shared memory: {shm_name}")
+    header = buffer.header
+    decoder = DeltaDecoder()
+    # the buffer holding the slots, a frame that does not fit it moves them to a new one
+    frame_buffer = buffer
+    # statistics of the last published frame and the fields changed since
+    pack_stats = None
+    changed_fields = set()
+    while not exit_event.is_set():
+        if frames_ready.wait(WORKER_POLL_SEC):
+            frames_ready.clear()
+
+            # every frame is decoded, recorded and evaluated by the alarm rules, only the newest one is published
+            newest = None
+            for received_frame in drain_queue(reader.read_queue):
+                try:
+                    data = decoder.decode(received_frame.data)
+                except (TypeError, ValueError):
+                    if is_binary_frame(received_frame.data):
+                        header["binary_errors"] += 1
+                    else:
+                        header["json_errors"] += 1
+                    continue
+                header["frames_decoded"] += 1
+                changed_fields |= decoder.changed_fields
+                newest = (data, received_frame.timestamp)
+                if recorder is not None:
+                    recorder.record(data, received_frame.timestamp)
+                events = alarm_engine.evaluate(data, received_frame.timestamp)
+                record_alarm_latency(header, time.time() - received_frame.timestamp)
+                if events:
+                    report_alarm_events(events, geometry=geometry)
+                    raised = sum(event.raised for event in events)
+                    header["alarms_raised"] += raised
+                    header["alarms_cleared"] += len(events) - raised
+
+            if newest is not None:
+                data, receive_time = newest
+                array_sizes = (
+                    data.soc.size,
+                    data.cell_voltage.size,
+                    data.temperature.size,
+                )
+                if array_sizes != frame_buffer.array_sizes:
+                    frame_buffer = resize_frame_buffer(buffer, frame_buffer, array_sizes)
+                    print_ok(
+                        f"{worker_prefix} Frame array sizes changed to {array_sizes}, shared memory: {frame_buffer.name}"
+                    )
+                    # nothing of the previous geometry can be reused
+                    pack_stats = None
+                pack_stats = compute_pack_stats(
+                    data,
+                    geometry,
+                    pack_stats,
+                    changed_fields,
+                )
+                changed_fields = set()
+                frame_buffer.publish(
+                    data, receive_time, pack_stats, alarm_engine, header
+                )
+                new_frame_event.set()
+
+        header["frames_received"] = reader.frames_received
+        header["frames_dropped"] = reader.frames_dropped
+        header["queue_full_events"] = reader.queue_full_events
+        header["frames_rejected"] = reader.frames_rejected
+        header["resyncs"] = reader.resyncs
+        header["reconnects"] = reader.reconnects
+        header["rediscoveries"] = reader.rediscoveries
+        last_latency = scheduler.last_latency()
+        if last_latency is not None:
+            header["command_latency"] = last_latency
+
+    link_runner.stop()
+    command_thread.join()
+    if recorder is not None:
+        recorder.stop()
+    if frame_buffer is not buffer:
+        frame_buffer.close()
+    del header
+    buffer.close()
+
+
+def record_alarm_latency(header, latency):
+    """Appends an alarm latency to the history in the header"""
+    count = int(header["alarm_latency_count"])
+    header["alarm_latency"][count % ALARM_LATENCY_HISTORY] = latency
+    header["alarm_latency_count"] = count + 1
+
+
+def resize_frame_buffer(buffer, frame_buffer, array_sizes):
+    """Moves the slots to a new buffer for frames of array_sizes and names it in the header of buffer, returns the new buffer"""
+    if array_sizes == buffer.array_sizes:
+        resized = buffer
+        name = b""
+    else:
+        # the worker owns the new buffer, the GUI attaches to it by name
+        resized = SharedFrameBuffer(array_sizes, buffer.rule_count)
+        name = resized.name.encode("ascii")
+    buffer.header["frame_sizes"] = array_sizes
+    buffer.header["frame_buffer"] = name
+    # a reader that still holds the previous buffer keeps its mapping
+    if frame_buffer is not buffer:
+        frame_buffer.close()
+    return resized
+
+
+def forward_commands(commands, scheduler, exit_event):
+    """Submits the commands sent by the GUI process to the write scheduler"""
+    while not exit_event.is_set():
+        try:
+            message, priority, coalesce_key = commands.get(timeout=WORKER_POLL_SEC)
+        except queue.Empty:
+            continue
+        scheduler.submit(message, priority, coalesce_key)
+
+
+class WorkerProcess:
+    """GUI side of the worker process. It stands in for the reader and the write scheduler of the in-process pipeline"""
+
+    def __init__(
+        self,
+        port,
+        geometry=DEFAULT_PACK_GEOMETRY,
+        record_directory=None,
+        alarm_rules=None,
+    ):
+        self.geometry = geometry
+        # the rules the worker evaluates, the alarm state in the slots is indexed by them
+        self.alarm_rules = list(DEFAULT_RULES if alarm_rules is None else alarm_rules)
+        self.on_frames = None
+        self.connected_event = multiprocessing.Event()
+        self.exit_event = multiprocessing.Event()
+        self.buffer = SharedFrameBuffer(geometry.array_sizes, len(self.alarm_rules))
+        # the buffer holding the slots, another one than buffer after the worker resized it
+        self.frame_buffer = self.buffer
+        self._new_frame_event = multiprocessing.Event()
+        self._commands = multiprocessing.Queue()
+        self._frame = np.zeros(1, dtype=self.buffer.slot_dtype)
+        self._sequence = 0
+        self._alarm_latency_count = 0
+        self._process = multiprocessing.Process(
+            target=worker_main,
+            args=(
+                port,
+                self.buffer.name,
+                geometry,
+                record_directory,
+                self.connected_event,
+                self.exit_event,
+                self._new_frame_event,
+                self._commands,
+                alarm_rules,
+            ),
+            daemon=True,
+        )
+        self._wakeup_thread = threading.Thread(
+            target=self._forward_wakeups, daemon=True
+        )
+
+    def start(self):
+        """Starts the worker process, do it before the GUI creates its Tk root"""
+        self._process.start()
+        self._wakeup_thread.start()
+
+    def stop(self):
+        """Stops the worker process and releases the shared memory"""
+        self.exit_event.set()
+        self._process.join(WORKER_JOIN_TIMEOUT_SEC)
+        if self._process.is_alive():
+            print_error("WORKER: Did not exit, terminating it")
+            self._process.terminate()
+            self._process.join()
+        self._wakeup_thread.join()
+        if self.frame_buffer is not self.buffer:
+            self.frame_buffer.close()
+        self.buffer.close()
+
+    def latest(self):
+        """Returns (decoded frame, receive time, pack statistics) of the newest frame or None if there is no new one since the last call"""
+        for _ in range(READ_RETRIES):
+            sequence = int(self.buffer.header["sequence"])
+            if sequence == self._sequence:
+                return None
+            if not self._follow_frame_buffer():
+                return None
+            if self.frame_buffer.read(self._frame, sequence):
+                break
+        else:
+            return None
+        self._sequence = sequence
+        # the returned frame is a view of the local copy, it is valid until the next call
+        record = self._frame["record"][0]
+        data = record_to_frame(record)
+        pack_stats = pack_stats_from_array(self._frame["stats"][0], data, self.geometry)
+        return data, float(record["receive_time"]), pack_stats
+
+    def active(self, name=None):
+        """Returns the active alarms of the newest frame like AlarmMonitor.active, the worker evaluates the rules on every frame"""
+        slot = self._frame[0]
+        alarms = []
+        for rule, active, channel_count, raised_time in zip(
+            self.alarm_rules,
+            slot["alarm_active"],
+            slot["alarm_channels"].tolist(),
+            slot["alarm_raised_time"].tolist(),
+        ):
+            channels = np.flatnonzero(active[:channel_count])
+            if len(channels):
+                alarms.append((rule, channels, channel_count, raised_time))
+        return alarms
+
+    def update_metrics(self, metrics):
+        """Copies the worker counters and the alarm latencies since the last call into the metrics of the GUI"""
+        header = self.buffer.header
+        for name in METRICS_COUNTERS:
+            metrics.counters[name] = int(header[name])
+        count = int(header["alarm_latency_count"])
+        first = max(self._alarm_latency_count, count - ALARM_LATENCY_HISTORY)
+        for index in range(first, count):
+            metrics.observe(
+                "alarm", float(header["alarm_latency"][index % ALARM_LATENCY_HISTORY])
+            )
+        self._alarm_latency_count = count
+
+    def submit(self, message, priority=PRIORITY_NORMAL, coalesce_key=None):
+        """Sends a command to the write scheduler of the worker"""
+        self._commands.put((message, priority, coalesce_key))
+
+    def last_latency(self):
+        """Returns the latency of the last command sent by the worker or None"""
+        latency = float(self.buffer.header["command_latency"])
+        return None if np.isnan(latency) else latency
+
+    @property
+    def frames_received(self):
+        """Frames received by the worker"""
+        return int(self.buffer.header["frames_received"])
+
+    @property
+    def frames_dropped(self):
+        """Frames dropped by the worker reader"""
+        return int(self.buffer.header["frames_dropped"])
+
+    @property
+    def queue_full_events(self):
+        """Times the worker read queue was full"""
+        return int(self.buffer.header["queue_full_events"])
+
+    @property
+    def frames_rejected(self):
+        """Corrupt frames dropped by the worker reader"""
+        return int(self.buffer.header["frames_rejected"])
+
+    @property
+    def resyncs(self):
+        """Frame resynchronizations of the worker reader"""
+        return int(self.buffer.header["resyncs"])
+
+    @property
+    def reconnects(self):
+        """Serial port reconnects of the worker"""
+        return int(self.buffer.header["reconnects"])
+
+    @property
+    def rediscoveries(self):
+        """Times the worker found its USB serial adapter at a new device path"""
+        return int(self.buffer.header["rediscoveries"])
+
+    @property
+    def frames_decoded(self):
+        """Frames decoded by the worker"""
+        return int(self.buffer.header["frames_decoded"])
+
+    @property
+    def decode_errors(self):
+        """Frames the worker failed to decode"""
+        return int(self.buffer.header["json_errors"]) + int(
+            self.buffer.header["binary_errors"]
+        )
+
+    def _follow_frame_buffer(self):
+        """Attaches to the buffer the worker moved the slots to, returns False if it is not available"""
+        name = self.buffer.header["frame_buffer"].item().decode("ascii")
+        if name == ("" if self.frame_buffer is self.buffer else self.frame_buffer.name):
+            return True
+        if name:
+            array_sizes = tuple(self.buffer.header["frame_sizes"].tolist())
+            try:
+                frame_buffer = SharedFrameBuffer(
+                    array_sizes, len(self.alarm_rules), name=name
+                )
+            # the worker resized it again meanwhile
+            except FileNotFoundError:
+                return False
+        else:
+            frame_buffer = self.buffer
+        if self.frame_buffer is not self.buffer:
+            self.frame_buffer.close()
+        self.frame_buffer = frame_buffer
+        self._frame = np.zeros(1, dtype=frame_buffer.slot_dtype)
+        return True
+
+    def _forward_wakeups(self):
+        """Turns new frame notifications of the worker into GUI wakeups"""
+        while not self.exit_event.is_set():
+            if not self._new_frame_event.wait(WORKER_POLL_SEC):
+                continue
+            # cleared before notifying, a frame published meanwhile sets it again
+            self._new_frame_event.clear()
+            if self.on_frames is not None:
+                self.on_frames()
@@ -0,0 +1,141 @@
+""" Tests of the shared memory double buffer of the worker process, the worker side is driven from the test"""
+import numpy as np
+import pytest
+import worker_process
+from alarms import AlarmEngine
+from mock_bms_hv.mock_bms import MockBms
+from pack_geometry import DEFAULT_PACK_GEOMETRY
+from pack_stats import compute_pack_stats
+from worker_process import READ_RETRIES, SharedFrameBuffer, WorkerProcess
+
+
+class Publisher:
+    """Worker side of a buffer, publishes frames of a mock BMS"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.mock = MockBms(seed=3)
+        self.alarm_engine = AlarmEngine(geometry=DEFAULT_PACK_GEOMETRY)
+        self.receive_time = 100.0
+
+    def publish(self, frame_buffer=None):
+        """Publishes the next frame, returns it"""
+        self.mock.step(0.25)
+        data = self.mock.data()
+        self.receive_time += 0.25
+        self.alarm_engine.evaluate(data, self.receive_time)
+        pack_stats = compute_pack_stats(data, DEFAULT_PACK_GEOMETRY)
+        frame_buffer = self.buffer if frame_buffer is None else frame_buffer
+        frame_buffer.publish(
+            data, self.receive_time, pack_stats, self.alarm_engine, self.buffer.header
+        )
+        return data
+
+
+@pytest.fixture
+def worker():
+    """GUI side of a worker process that is never started, the test publishes the frames"""
+    worker = WorkerProcess(None)
+    yield worker
+    if worker.frame_buffer is not worker.buffer:
+        worker.frame_buffer.close()
+    worker.buffer.close()
+
+
+@pytest.fixture
+def publisher(worker):
+    """Publishes into the buffer of the worker fixture through a mapping of its own"""
+    buffer = SharedFrameBuffer(
+        DEFAULT_PACK_GEOMETRY.array_sizes,
+        len(worker.alarm_rules),
+        name=worker.buffer.name,
+    )
+    publisher = Publisher(buffer)
+    yield publisher
+    buffer.close()
+
+
+def test_newest_frame_is_read_once(worker, publisher):
+    assert worker.latest() is None
+    publisher.publish()
+    sent = publisher.publish()
+    data, receive_time, pack_stats = worker.latest()
+    np.testing.assert_array_equal(data.cell_voltage, sent.cell_voltage)
+    np.testing.assert_array_equal(data.discharge, sent.discharge)
+    assert data.current == pytest.approx(sent.current)
+    assert receive_time == publisher.receive_time
+    assert pack_stats.cell_voltage.maximum == sent.cell_voltage.max()
+    assert worker.latest() is None
+
+
+def test_slot_being_written_is_not_read(worker, publisher):
+    publisher.publish()
+    out = np.zeros(1, dtype=worker.buffer.slot_dtype)
+    worker.buffer.slots["sequence"][1] = 0
+    assert not worker.buffer.read(out, 1)
+    # a sequence the slot does not hold, the worker is two frames ahead
+    assert not worker.buffer.read(out, 3)
+
+
+def test_torn_read_is_retried(worker, publisher, monkeypatch):
+    publisher.publish()
+    copyto = np.copyto
+    overwrites = [1]
+
+    def copy_while_the_worker_writes(out, slot):
+        """np.copyto, the worker overwrites the slot in the middle of the first copy"""
+        copyto(out, slot)
+        if overwrites:
+            overwrites.pop()
+            # two frames later the worker writes to the same slot again
+            publisher.publish()
+            publisher.publish()
+
+    monkeypatch.setattr(worker_process.np, "copyto", copy_while_the_worker_writes)
+    _, receive_time, _ = worker.latest()
+    assert not overwrites
+    assert receive_time == publisher.receive_time
+    assert int(worker.buffer.header["sequence"]) == 3
+
+
+def test_read_gives_up_after_the_retries(worker, publisher, monkeypatch):
+    publisher.publish()
+    copyto = np.copyto
+    copies = []
+
+    def copy_while_the_worker_writes(out, slot):
+        """np.copyto, the worker always overwrites the slot during the copy"""
+        copyto(out, slot)
+        copies.append(1)
+        publisher.publish()
+        publisher.publish()
+
+    monkeypatch.setattr(worker_process.np, "copyto", copy_while_the_worker_writes)
+    assert worker.latest() is None
+    assert len(copies) == READ_RETRIES
+    monkeypatch.undo()
+    # the next call gets the newest frame
+    assert worker.latest()[1] == publisher.receive_time
+
+
+def test_reader_follows_the_slots_to_a_resized_buffer(worker, publisher):
+    publisher.publish()
+    worker.latest()
+    publisher.mock = MockBms(seed=3, ltc_count=2)
+    publisher.mock.step(0.25)
+    sizes = (
+        publisher.mock.data().soc.size,
+        publisher.mock.data().cell_voltage.size,
+        publisher.mock.data().temperature.size,
+    )
+    resized = worker_process.resize_frame_buffer(
+        publisher.buffer, publisher.buffer, sizes
+    )
+    try:
+        sent = publisher.publish(resized)
+        data, _, _ = worker.latest()
+        assert worker.frame_buffer.name == resized.name
+        np.testing.assert_array_equal(data.cell_voltage, sent.cell_voltage)
+    finally:
+        # the reader keeps its own mapping, the owner unlinks it
+        resized.close()